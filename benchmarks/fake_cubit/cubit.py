@@ -0,0 +1,153 @@
+"""
+    Stand-in for the Coreform/Cubit python module, for running the
+    geometry generation script (cubit2snappyHexMesh.py) without Cubit.
+
+    - The geometry is a model of the benchmark STL generators
+      (stl_generators.py), read from the JSON file in the
+      "FAKE_CUBIT_MODEL" environment variable or set with set_model().
+    - Every command is recorded (commandList, and appended to the file in
+      "FAKE_CUBIT_LOG" if set). "export stl" writes the surfaces of the
+      model as synthetic STL files, one solid per surface (the surfaces
+      of a volume are oriented for the volume), the other commands only
+      change the meshed state.
+    - Only the functions used by the geometry generation script are
+      provided.
+"""
+
+import os
+import sys
+import json
+import shlex
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stl_generators
+
+
+#---------------------------------------
+
+modelDict = None
+commandList = []
+exportList = []
+meshedSurfaceSet = set()
+
+
+#---------------------------------------
+
+def set_model(
+        model,
+    ):
+    global modelDict
+    modelDict = model
+    meshedSurfaceSet.clear()
+    return
+
+
+def get_model():
+    global modelDict
+    if modelDict is None:
+        modelFile = os.environ.get("FAKE_CUBIT_MODEL")
+        if modelFile is None:
+            raise RuntimeError("No geometry model, set FAKE_CUBIT_MODEL or call cubit.set_model()")
+        with open(modelFile, "r") as rf:
+            modelDict = json.load(rf)
+    return modelDict
+
+
+def record_command(
+        command,
+    ):
+    commandList.append(command)
+    logFile = os.environ.get("FAKE_CUBIT_LOG")
+    if logFile:
+        with open(logFile, "a") as wf:
+            wf.write(command + "\n")
+    return
+
+
+#---------------------------------------
+
+def export_stl(
+        tokenList,
+    ):
+    ### export stl [ascii|binary] "<file>" surface <id> ... [mesh] [overwrite]
+    stlFormat = "ascii"
+    if tokenList[0] in ["ascii", "binary"]:
+        stlFormat = tokenList.pop(0)
+    stlFile = tokenList.pop(0)
+    if stlFormat == "ascii" and tokenList[0] == "binary":
+        stlFormat = tokenList.pop(0)
+
+    surfaceIdList = []
+    if tokenList and tokenList[0] == "surface":
+        for token in tokenList[1 : ]:
+            if token in ["mesh", "overwrite"]:
+                break
+            surfaceIdList.append(int(token))
+    ### All the surfaces of a volume, the shared ones are turned outwards
+    reversedSurfaceList = []
+    for volumeId, volumeSurfaceList in get_model()["volumes"].items():
+        if sorted(volumeSurfaceList) == sorted(surfaceIdList):
+            reversedSurfaceList = get_model().get("reversed", {}).get(volumeId, [])
+    nTriangle = stl_generators.write_surface_stl_file(stlFile, get_model(), surfaceIdList, stlFormat, reversedSurfaceList)
+    exportList.append({"file" : stlFile, "format" : stlFormat, "surfaces" : surfaceIdList, "n-triangles" : nTriangle})
+    return True
+
+
+def cmd(
+        command,
+    ):
+    record_command(command)
+    tokenList = shlex.split(command)
+    if not tokenList:
+        return True
+
+    if tokenList[ : 2] == ["export", "stl"]:
+        return export_stl(tokenList[2 : ])
+    if tokenList[ : 2] == ["mesh", "surface"]:
+        if tokenList[2 : ] == ["all"]:
+            meshedSurfaceSet.update(get_entities("surface"))
+        else:
+            meshedSurfaceSet.update([int(x) for x in tokenList[2 : ]])
+    return True
+
+
+#---------------------------------------
+
+def get_entities(
+        entityType,
+    ):
+    if entityType == "surface":
+        return tuple(sorted([int(x) for x in get_model()["surfaces"].keys()]))
+    if entityType == "volume":
+        return tuple(sorted([int(x) for x in get_model()["volumes"].keys()]))
+    return ()
+
+
+def get_relatives(
+        sourceType,
+        sourceId,
+        targetType,
+    ):
+    if sourceType == "volume" and targetType == "surface":
+        return tuple(get_model()["volumes"][str(sourceId)])
+    return ()
+
+
+def is_merged(
+        entityType,
+        entityId,
+    ):
+    ### The model is the geometry with the shared topology
+    if entityType == "surface":
+        return entityId in stl_generators.get_merged_surface_list(get_model())
+    return False
+
+
+def is_meshed(
+        entityType,
+        entityId,
+    ):
+    if entityType == "surface":
+        return entityId in meshedSurfaceSet
+    return False
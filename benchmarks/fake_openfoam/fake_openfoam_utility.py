@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+    Stand-in OpenFOAM utilities for the benchmarks, the utility is the
+    name the script is started with (bin/<utility> links to this file).
+
+    - blockMesh : reads the block of system/blockMeshDict and writes a
+      synthetic constant/polyMesh (headers and sizes, the cell count is in
+      the "note" of the owner file as written by OpenFOAM).
+    - snappyHexMesh : reads the snappyHexMeshDict (phases, refinement
+      levels, cell limit), prints the refinement, morph and layer
+      iterations with growing cell counts and step times, and writes the
+      mesh to the time directories or in place (-overwrite).
+    - topoSet : prints one cellSet per action of system/topoSetDict and
+      writes constant/polyMesh/sets.
+    - decomposePar, reconstructParMesh, surfaceFeatureExtract, mpirun :
+      enough to run the parallel and feature extraction stages.
+    - The logs follow the OpenFOAM layout (banner, "Create time", "End").
+      FAKE_OPENFOAM_STEP_TIME (seconds, default 0) is slept at every
+      logged step, to stand in for the meshing work.
+    - FAKE_OPENFOAM_FAIL="<utility>:<n>" fails the first n runs of the
+      utility in a case (count in .fake_openfoam_fail_<utility>), for the
+      retries of the process supervisor.
+    - Every command (mpirun and every rank too) is appended to the file
+      "FAKE_OPENFOAM_LOG" if set, with the rank of a parallel run, e.g.
+      "snappyHexMesh -parallel (rank 1)".
+"""
+
+import os
+import re
+import sys
+import glob
+import time
+import shutil
+import socket
+import subprocess
+
+
+#---------------------------------------
+
+stepTime = float(os.environ.get("FAKE_OPENFOAM_STEP_TIME", "0"))
+rank = os.environ.get("OMPI_COMM_WORLD_RANK")
+
+polyMeshFileList = ["points", "faces", "owner", "neighbour", "boundary"]
+ownerNotePattern = re.compile(r"nCells:\s*(\d+)")
+
+
+#---------------------------------------
+
+def log(
+        line = "",
+    ):
+    ### Only the master rank writes the log
+    if rank in [None, "0"]:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+    return
+
+
+def log_command(
+        utility,
+        argList,
+    ):
+    logFile = os.environ.get("FAKE_OPENFOAM_LOG")
+    if logFile:
+        command = " ".join([utility] + argList)
+        if rank is not None and utility != "mpirun":
+            command += " (rank " + rank + ")"
+        with open(logFile, "a") as wf:
+            wf.write(command + "\n")
+    return
+
+
+def step():
+    if stepTime > 0.0:
+        time.sleep(stepTime)
+    return stepTime
+
+
+def print_banner(
+        utility,
+        argList,
+    ):
+    log("/*---------------------------------------------------------------------------*\\")
+    log("| =========                 |                                                 |")
+    log("| \\\\      /  F ield         | OpenFOAM: The Open Source CFD Toolbox           |")
+    log("|  \\\\    /   O peration     | Version:  " + os.environ.get("WM_PROJECT_VERSION", "fake") + "                                 |")
+    log("|   \\\\  /    A nd           | (stand-in for the benchmarks)                   |")
+    log("|    \\\\/     M anipulation  |                                                 |")
+    log("\\*---------------------------------------------------------------------------*/")
+    log("Build  : fake")
+    log("Exec   : " + " ".join([utility] + argList))
+    log("Date   : " + time.strftime("%b %d %Y"))
+    log("Time   : " + time.strftime("%H:%M:%S"))
+    log("Host   : " + socket.gethostname())
+    log("PID    : " + str(os.getpid()))
+    log("Case   : " + os.getcwd())
+    log("nProcs : " + os.environ.get("OMPI_COMM_WORLD_SIZE", "1"))
+    log()
+    log("Create time")
+    log()
+    return
+
+
+def get_option(
+        argList,
+        option,
+        default = None,
+    ):
+    if option in argList:
+        return argList[argList.index(option) + 1]
+    return default
+
+
+def read_text(
+        filePath,
+    ):
+    with open(filePath, "r") as rf:
+        return rf.read()
+
+
+#---------------------------------------
+### MESH FILES
+#---------------------------------------
+
+def get_mesh_dir(
+        argList,
+        timeName = None,
+    ):
+    caseDir = "."
+    if "-parallel" in argList and rank is not None:
+        caseDir = "processor" + rank
+    if timeName is None:
+        return os.path.join(caseDir, "constant", "polyMesh")
+    return os.path.join(caseDir, timeName, "polyMesh")
+
+
+def write_poly_mesh(
+        meshDir,
+        nCells,
+    ):
+    nPoints = int(nCells * 1.1) + 1
+    nFaces = 3 * nCells + 1
+    os.makedirs(meshDir, exist_ok = True)
+    for name in polyMeshFileList:
+        with open(os.path.join(meshDir, name), "w") as wf:
+            wf.write("FoamFile\n{\n    format      ascii;\n    object      " + name + ";\n")
+            if name == "owner":
+                wf.write(f"    note        \"nPoints:{nPoints}  nCells:{nCells}  nFaces:{nFaces}  nInternalFaces:{nFaces - nCells}\";\n")
+            wf.write("}\n\n0\n(\n)\n")
+    return
+
+
+def read_cell_count(
+        meshDir,
+    ):
+    try:
+        match = ownerNotePattern.search(read_text(os.path.join(meshDir, "owner")))
+    except OSError:
+        return None
+    return int(match.group(1)) if match else None
+
+
+def get_latest_mesh_dir(
+        argList,
+    ):
+    caseDir = os.path.dirname(os.path.dirname(get_mesh_dir(argList)))
+    timeDirList = [x for x in glob.glob(os.path.join(caseDir, "[1-9]*")) if os.path.isdir(os.path.join(x, "polyMesh"))]
+    if timeDirList:
+        return os.path.join(max(timeDirList, key = lambda x : float(os.path.basename(x))), "polyMesh")
+    return get_mesh_dir(argList)
+
+
+#---------------------------------------
+### UTILITIES
+#---------------------------------------
+
+def run_blockMesh(
+        argList,
+    ):
+    dictText = read_text(get_option(argList, "-dict", "system/blockMeshDict"))
+    match = re.search(r"hex\s*\(([\d\s]+)\)\s*\((\d+)\s+(\d+)\s+(\d+)\)", dictText)
+    if match is None:
+        log("--> FOAM FATAL ERROR: no hex block in blockMeshDict")
+        return 1
+    nx, ny, nz = [int(match.group(x)) for x in (2, 3, 4)]
+    nCells = nx * ny * nz
+
+    log("Creating block mesh from \"system/blockMeshDict\"")
+    log("Creating block edges")
+    log("No non-planar block faces defined")
+    log("Creating topology blocks")
+    step()
+    log("Creating topology patches")
+    log()
+    log("Creating block mesh topology")
+    log()
+    log("Creating polyMesh from blockMesh")
+    log("Creating patches")
+    log("Creating cells")
+    log("Creating points with scale 1")
+    log("    Block 0 cell size :")
+    step()
+    log()
+    write_poly_mesh(get_mesh_dir(argList), nCells)
+    log("Writing polyMesh with 0 cellZones")
+    log("----------------")
+    log("Mesh Information")
+    log("----------------")
+    log("  boundingBox: (0 0 0) (1 1 1)")
+    log("  nPoints: " + str((nx + 1) * (ny + 1) * (nz + 1)))
+    log("  nCells: " + str(nCells))
+    log("  nFaces: " + str(3 * nCells + nx * ny + ny * nz + nz * nx))
+    log()
+    log("End")
+    return 0
+
+
+def run_snappyHexMesh(
+        argList,
+    ):
+    dictFile = get_option(argList, "-dict", "system/snappyHexMeshDict")
+    dictText = read_text(dictFile)
+
+    def switch(keyword):
+        match = re.search(r"^\s*" + keyword + r"\s+(\w+)\s*;", dictText, re.M)
+        return match is not None and match.group(1) in ["true", "yes", "on"]
+
+    levelList = [int(x) for x in re.findall(r"level\s*\(\s*\d+\s+(\d+)\s*\)", dictText)]
+    maxLevel = max(levelList + [0])
+    maxGlobalMatch = re.search(r"maxGlobalCells\s+(\d+)\s*;", dictText)
+    maxGlobalCells = int(maxGlobalMatch.group(1)) if maxGlobalMatch else 10**9
+
+    meshDir = get_latest_mesh_dir(argList)
+    nCells = read_cell_count(meshDir)
+    if nCells is None:
+        log("--> FOAM FATAL ERROR: cannot read the mesh in " + meshDir)
+        return 1
+    ### Every rank has its part of the mesh, the log is of the whole mesh
+    nRanks = int(os.environ.get("OMPI_COMM_WORLD_SIZE", "1"))
+    nGlobalCells = nCells * nRanks
+
+    log("Read mesh in = 0.01 s")
+    log()
+    log("Overall mesh bounding box  : (0 0 0) (1 1 1)")
+    log("Relative tolerance         : 1e-06")
+    log()
+    log("Reading refinement surfaces.")
+    log("Read refinement surfaces in = " + str(step()) + " s")
+    log()
+    startTime = time.time()
+    timeDirList = []
+    phaseTime = 0.0
+
+    if switch("castellatedMesh"):
+        log("Refinement phase")
+        log("----------------")
+        log()
+        for iteration in range(maxLevel):
+            ### Cells next to the surface are split into 8
+            nRefined = max(1, nGlobalCells // 10)
+            nGlobalCells = min(maxGlobalCells, nGlobalCells + 7 * nRefined)
+            log("Surface refinement iteration " + str(iteration))
+            log("------------------------------")
+            log()
+            log("Marked for refinement due to surface intersection          : " + str(nRefined) + " cells.")
+            log("Determined cells to refine in = " + str(step()) + " s")
+            log("Selected for refinement : " + str(nRefined) + " cells (out of " + str(nGlobalCells) + ')')
+            log("Refined mesh in = " + str(step()) + " s.")
+            log(f"After refinement surface refinement iteration {iteration} : cells:{nGlobalCells}  faces:{3 * nGlobalCells}  points:{int(1.1 * nGlobalCells)}")
+            log()
+        log("Splitting mesh at surface intersections")
+        log("---------------------------------------")
+        step()
+        phaseTime = time.time() - startTime
+        log(f"Mesh refined in = {phaseTime : .2f} s.")
+        log()
+        timeDirList.append("1")
+
+    if switch("snap"):
+        snapStartTime = time.time()
+        log("Morphing phase")
+        log("--------------")
+        log()
+        for iteration in range(3):
+            log("Morph iteration " + str(iteration))
+            log("-----------------")
+            log("Calculated surface displacement in = " + str(step()) + " s")
+            log()
+        log("Checking final mesh ...")
+        log("Finished meshing without any errors")
+        log(f"Mesh snapped in = {time.time() - snapStartTime : .2f} s.")
+        log()
+        timeDirList.append(str(len(timeDirList) + 1))
+
+    if switch("addLayers"):
+        layerStartTime = time.time()
+        log("Shrinking and layer addition phase")
+        log("----------------------------------")
+        log()
+        for iteration in range(2):
+            log("Layer addition iteration " + str(iteration))
+            log("--------------------------")
+            log("Determined displacement in = " + str(step()) + " s")
+            log()
+        nGlobalCells += nGlobalCells // 20
+        log(f"Layer mesh : cells:{nGlobalCells}  faces:{3 * nGlobalCells}  points:{int(1.1 * nGlobalCells)}")
+        log(f"Layers added in = {time.time() - layerStartTime : .2f} s.")
+        log()
+        timeDirList.append(str(len(timeDirList) + 1))
+
+    nLocalCells = max(1, nGlobalCells // nRanks)
+    if "-overwrite" in argList:
+        write_poly_mesh(get_mesh_dir(argList), nLocalCells)
+    elif timeDirList:
+        write_poly_mesh(get_mesh_dir(argList, timeDirList[-1]), nLocalCells)
+    log(f"Finished meshing in = {time.time() - startTime : .2f} s.")
+    log("End")
+    return 0
+
+
+def run_topoSet(
+        argList,
+    ):
+    dictText = read_text(get_option(argList, "-dict", "system/topoSetDict"))
+    nCells = read_cell_count(get_latest_mesh_dir(argList)) or 0
+    setsDir = os.path.join(os.path.dirname(get_latest_mesh_dir(argList)), "polyMesh", "sets")
+    os.makedirs(setsDir, exist_ok = True)
+
+    log("Time = 0")
+    log("Reading topoSetDict")
+    log()
+    nameList = re.findall(r"^\s*name\s+(\S+)\s*;", dictText, re.M)
+    for index, name in enumerate(nameList):
+        log("    Applying source surfaceToCell")
+        log("    Adding cells with centre within the surface ...")
+        step()
+        log("    cellSet " + name + " now size " + str(nCells // max(1, len(nameList))))
+        with open(os.path.join(setsDir, name), "w") as wf:
+            wf.write("FoamFile\n{\n    object      " + name + ";\n}\n\n0\n(\n)\n")
+    log()
+    log("End")
+    return 0
+
+
+def run_decomposePar(
+        argList,
+    ):
+    dictText = read_text(get_option(argList, "-dict", "system/decomposeParDict"))
+    nProcs = int(re.search(r"numberOfSubdomains\s+(\d+)\s*;", dictText).group(1))
+    nCells = read_cell_count(get_mesh_dir([])) or 0
+
+    log("Decomposing mesh region0")
+    log()
+    log("Calculating distribution of cells")
+    step()
+    for processor in range(nProcs):
+        processorDir = "processor" + str(processor)
+        if os.path.exists(processorDir):
+            shutil.rmtree(processorDir)
+        write_poly_mesh(os.path.join(processorDir, "constant", "polyMesh"), max(1, nCells // nProcs))
+        log("Processor " + str(processor))
+        log("    Number of cells = " + str(nCells // nProcs))
+    log()
+    log("End")
+    return 0
+
+
+def run_reconstructParMesh(
+        argList,
+    ):
+    processorDirList = sorted(glob.glob("processor[0-9]*"))
+    nCells = 0
+    timeName = None
+    for processorDir in processorDirList:
+        if "-constant" in argList:
+            meshDir = os.path.join(processorDir, "constant", "polyMesh")
+        else:
+            timeDirList = [x for x in glob.glob(os.path.join(processorDir, "[1-9]*")) if os.path.isdir(x)]
+            if not timeDirList:
+                continue
+            meshDir = os.path.join(max(timeDirList, key = lambda x : float(os.path.basename(x))), "polyMesh")
+            timeName = os.path.basename(os.path.dirname(meshDir))
+        nCells += read_cell_count(meshDir) or 0
+        log("Reading mesh of " + processorDir)
+        step()
+
+    log("Writing merged mesh, " + str(nCells) + " cells")
+    write_poly_mesh(get_mesh_dir([], None if "-constant" in argList else timeName), nCells)
+    log()
+    log("End")
+    return 0
+
+
+def run_surfaceFeatureExtract(
+        argList,
+    ):
+    dictText = read_text(get_option(argList, "-dict", "system/surfaceFeatureExtractDict"))
+    for stlFilename in re.findall(r"^(\S+\.stl(?:\.gz)?)\s*$", dictText, re.M):
+        stem = os.path.splitext(stlFilename[ : -3] if stlFilename.endswith(".gz") else stlFilename)[0]
+        log("Surface            : \"" + stlFilename + "\"")
+        step()
+        with open(os.path.join("constant", "triSurface", stem + ".eMesh"), "w") as wf:
+            wf.write("FoamFile\n{\n    object      " + stem + ".eMesh;\n}\n\n0\n(\n)\n\n0\n(\n)\n")
+        log("Writing featureEdgeMesh to \"" + stem + ".eMesh\"")
+    log()
+    log("End")
+    return 0
+
+
+def run_mpirun(
+        argList,
+    ):
+    ### mpirun -np N <utility> <arguments>
+    if len(argList) < 3 or argList[0] != "-np":
+        sys.stderr.write("usage : mpirun -np N command ...\n")
+        return 2
+    nProcs = int(argList[1])
+    processList = []
+    for processRank in range(nProcs):
+        env = dict(os.environ, OMPI_COMM_WORLD_RANK = str(processRank), OMPI_COMM_WORLD_SIZE = str(nProcs))
+        processList.append(subprocess.Popen(argList[2 : ], env = env))
+    return max([x.wait() for x in processList])
+
+
+#---------------------------------------
+
+utilityDict = {
+    "blockMesh" : run_blockMesh,
+    "snappyHexMesh" : run_snappyHexMesh,
+    "topoSet" : run_topoSet,
+    "decomposePar" : run_decomposePar,
+    "reconstructParMesh" : run_reconstructParMesh,
+    "surfaceFeatureExtract" : run_surfaceFeatureExtract,
+}
+
+
+if __name__ == "__main__":
+    utility = os.path.basename(sys.argv[0])
+    argList = sys.argv[1 : ]
+    log_command(utility, argList)
+    if utility == "mpirun":
+        sys.exit(run_mpirun(argList))
+    if utility not in utilityDict:
+        sys.exit("Unknown utility : " + utility)
+    print_banner(utility, argList)
+    failUtility, separator, nFail = os.environ.get("FAKE_OPENFOAM_FAIL", "").partition(":")
+    if failUtility == utility and rank is None:
+        countFile = ".fake_openfoam_fail_" + utility
+        nFailed = int(open(countFile).read()) if os.path.exists(countFile) else 0
+        if nFailed < int(nFail or "1"):
+            with open(countFile, "w") as wf:
+                wf.write(str(nFailed + 1))
+            log("--> FOAM FATAL ERROR : failure " + str(nFailed + 1) + " of " + (nFail or "1") + " (FAKE_OPENFOAM_FAIL)")
+            sys.exit(1)
+    sys.exit(utilityDict[utility](argList))
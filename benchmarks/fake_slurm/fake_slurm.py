@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+    Stand-in SLURM commands, the jobs run on this machine. The command is
+    the name the script is started with (bin/<command> links to this
+    file), put benchmarks/fake_slurm/bin first on the PATH.
+
+    - sbatch [--parsable] <script> : reads the #SBATCH options of the
+      script (--output, --chdir, --time, --ntasks, --job-name), starts the
+      job in the background and prints the job id. The job script runs
+      with bash in the environment of sbatch (SLURM_JOB_ID, SLURM_NTASKS
+      set), its output goes to the --output file.
+    - squeue -h -j <id> -o %T : state of a pending/running job, nothing
+      once it ended ("Invalid job id" for an unknown job).
+    - sacct -n [-X] -P -j <id> -o State[,ExitCode,UserCPU,...] : final
+      state (COMPLETED, FAILED, TIMEOUT, CANCELLED), exit code and usage
+      (CPU times and peak RSS of the job script and its processes).
+    - scancel <id> ... : the job (its process group) is terminated.
+    - srun <command> : SLURM_NTASKS copies of the command, with the rank
+      variables of the stand-in mpirun.
+    - The jobs are kept in FAKE_SLURM_DIR (default <tmp>/fake_slurm-<uid>).
+      FAKE_SLURM_PENDING_TIME (seconds, default 0) is the time a job stays
+      pending. The --time limit is enforced, the memory options are not.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import resource
+import tempfile
+import subprocess
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+#---------------------------------------
+
+stateDir = os.environ.get(
+        "FAKE_SLURM_DIR",
+        os.path.join(tempfile.gettempdir(), "fake_slurm-" + str(os.getuid())),
+    )
+pendingTime = float(os.environ.get("FAKE_SLURM_PENDING_TIME", "0"))
+activeStateList = ["PENDING", "RUNNING"]
+
+sbatchValueOptionList = ["--output", "--chdir", "--time", "--ntasks", "--job-name", "-o", "-D", "-t", "-n", "-J"]
+sbatchShortOptionDict = {"-o" : "--output", "-D" : "--chdir", "-t" : "--time", "-n" : "--ntasks", "-J" : "--job-name"}
+
+
+#---------------------------------------
+
+def get_job_file(
+        jobId,
+    ):
+    return os.path.join(stateDir, str(jobId) + ".json")
+
+
+def read_job(
+        jobId,
+    ):
+    try:
+        with open(get_job_file(jobId), "r") as rf:
+            return json.load(rf)
+    except (OSError, ValueError):
+        return None
+
+
+def write_job(
+        jobDict,
+    ):
+    jobFile = get_job_file(jobDict["job-id"])
+    tmpFile = jobFile + ".tmp-" + str(os.getpid())
+    with open(tmpFile, "w") as wf:
+        json.dump(jobDict, wf, indent = 4)
+    os.replace(tmpFile, jobFile)
+    return
+
+
+def get_next_job_id():
+    os.makedirs(stateDir, exist_ok = True)
+    with open(os.path.join(stateDir, "job_counter"), "a+") as cf:
+        if fcntl is not None:
+            fcntl.flock(cf.fileno(), fcntl.LOCK_EX)
+        cf.seek(0)
+        jobId = int(cf.read().strip() or "1000") + 1
+        cf.seek(0)
+        cf.truncate()
+        cf.write(str(jobId))
+    return jobId
+
+
+def is_process_running(
+        pid,
+    ):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def get_job_state(
+        jobDict,
+    ):
+    ### A job whose runner is gone without an end state failed
+    if jobDict["state"] in activeStateList and jobDict.get("pid") and not is_process_running(jobDict["pid"]):
+        return "FAILED"
+    return jobDict["state"]
+
+
+def parse_time_limit(
+        timeString,
+    ):
+    ### "M", "M:S", "H:M:S" or "D-H[:M[:S]]" --> seconds
+    days = 0
+    if "-" in timeString:
+        dayString, timeString = timeString.split("-", 1)
+        days = int(dayString)
+        fieldList = [int(x) for x in timeString.split(":")] + [0, 0]
+        return days*86400 + fieldList[0]*3600 + fieldList[1]*60 + fieldList[2]
+    fieldList = [int(x) for x in timeString.split(":")]
+    if len(fieldList) == 1:
+        return fieldList[0]*60
+    if len(fieldList) == 2:
+        return fieldList[0]*60 + fieldList[1]
+    return fieldList[0]*3600 + fieldList[1]*60 + fieldList[2]
+
+
+def get_option_dict(
+        argList,
+        valueOptionList,
+    ):
+    ### "--name=value" and "--name value" (for the options known to take
+    ### a value) --> name --> value, the arguments after the options
+    optionDict = {}
+    index = 0
+    while index < len(argList) and argList[index].startswith("-"):
+        name, separator, value = argList[index].partition("=")
+        if not separator and name in valueOptionList and index + 1 < len(argList):
+            index += 1
+            value = argList[index]
+        optionDict[name] = value
+        index += 1
+    return optionDict, argList[index : ]
+
+
+#---------------------------------------
+
+def run_sbatch(
+        argList,
+    ):
+    commandLineOptionDict, scriptArgList = get_option_dict(argList, sbatchValueOptionList)
+    if not scriptArgList:
+        sys.stderr.write("sbatch: error: no batch script\n")
+        return 1
+    scriptFile = os.path.abspath(scriptArgList[0])
+    if not os.path.isfile(scriptFile):
+        sys.stderr.write("sbatch: error: Unable to open file " + scriptFile + "\n")
+        return 1
+
+    scriptOptionList = []
+    with open(scriptFile, "r") as rf:
+        for line in rf.read().splitlines()[1 : ]:
+            if line.startswith("#SBATCH"):
+                scriptOptionList += line[len("#SBATCH") : ].split()
+            elif line.strip() and not line.startswith("#"):
+                break
+    ### Command line options override the ones of the script
+    optionDict = get_option_dict(scriptOptionList, sbatchValueOptionList)[0]
+    optionDict.update(commandLineOptionDict)
+    optionDict = {sbatchShortOptionDict.get(k, k) : v for k, v in optionDict.items()}
+
+    jobId = get_next_job_id()
+    workDir = os.path.abspath(optionDict.get("--chdir", os.getcwd()))
+    outputFile = optionDict.get("--output", "slurm-%j.out").replace("%j", str(jobId))
+    jobDict = {
+        "job-id" : jobId,
+        "name" : optionDict.get("--job-name", os.path.basename(scriptFile)),
+        "script" : scriptFile,
+        "work-dir" : workDir,
+        "output" : os.path.join(workDir, outputFile),
+        "n-tasks" : int(optionDict.get("--ntasks", "1")),
+        "time-limit" : parse_time_limit(optionDict["--time"]) if "--time" in optionDict else None,
+        "state" : "PENDING",
+        "exit-code" : None,
+        "pid" : None,
+        "submit-time" : time.time(),
+    }
+    write_job(jobDict)
+
+    ### The job runs detached in the environment of sbatch
+    subprocess.Popen(
+            [sys.executable, os.path.realpath(__file__), "--run-job", str(jobId)],
+            stdin = subprocess.DEVNULL,
+            stdout = subprocess.DEVNULL,
+            stderr = subprocess.DEVNULL,
+            start_new_session = True,
+        )
+    if "--parsable" in optionDict:
+        print(jobId)
+    else:
+        print("Submitted batch job " + str(jobId))
+    return 0
+
+
+def run_job(
+        jobId,
+    ):
+    jobDict = read_job(jobId)
+    jobDict["pid"] = os.getpid()
+    write_job(jobDict)
+    processDict = {"process" : None}
+
+    def end_job(state, exitCode):
+        ### The job script is the only child of the runner
+        rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        jobDict["state"] = state
+        jobDict["exit-code"] = exitCode
+        jobDict["end-time"] = time.time()
+        jobDict["user-time"] = rusage.ru_utime
+        jobDict["sys-time"] = rusage.ru_stime
+        jobDict["max-rss"] = rusage.ru_maxrss
+        write_job(jobDict)
+        return
+
+    def handle_signal(signalNumber, frame):
+        ### scancel
+        process = processDict["process"]
+        if process is not None:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        end_job("CANCELLED", 128 + signalNumber)
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    time.sleep(pendingTime)
+    jobDict["state"] = "RUNNING"
+    jobDict["start-time"] = time.time()
+    write_job(jobDict)
+
+    env = dict(os.environ, SLURM_JOB_ID = str(jobId), SLURM_NTASKS = str(jobDict["n-tasks"]), SLURM_SUBMIT_DIR = jobDict["work-dir"])
+    with open(jobDict["output"], "ab") as outputFile:
+        processDict["process"] = subprocess.Popen(
+                ["bash", jobDict["script"]],
+                cwd = jobDict["work-dir"],
+                env = env,
+                stdout = outputFile,
+                stderr = subprocess.STDOUT,
+                start_new_session = True,
+            )
+    try:
+        exitCode = processDict["process"].wait(timeout = jobDict["time-limit"])
+    except subprocess.TimeoutExpired:
+        os.killpg(processDict["process"].pid, signal.SIGTERM)
+        processDict["process"].wait()
+        with open(jobDict["output"], "a") as wf:
+            wf.write("slurmstepd: error: *** JOB " + str(jobId) + " CANCELLED DUE TO TIME LIMIT ***\n")
+        end_job("TIMEOUT", 128 + signal.SIGTERM)
+        return 0
+    end_job("COMPLETED" if exitCode == 0 else "FAILED", exitCode)
+    return 0
+
+
+def run_squeue(
+        argList,
+    ):
+    optionDict = get_option_dict(argList, ["-j", "--jobs", "-o", "--format"])[0]
+    jobIdList = [x for x in optionDict.get("-j", optionDict.get("--jobs", "")).split(",") if x]
+    if not jobIdList:
+        jobIdList = sorted([x[ : -len(".json")] for x in os.listdir(stateDir) if x.endswith(".json")]) if os.path.isdir(stateDir) else []
+    elif any([read_job(x) is None for x in jobIdList]):
+        sys.stderr.write("slurm_load_jobs error: Invalid job id specified\n")
+        return 1
+    if "-h" not in argList and "--noheader" not in argList:
+        print("STATE")
+    for jobId in jobIdList:
+        jobDict = read_job(jobId)
+        if jobDict is not None and get_job_state(jobDict) in activeStateList:
+            print(get_job_state(jobDict))
+    return 0
+
+
+def get_slurm_time(
+        seconds,
+    ):
+    ### sacct format, "MM:SS.mmm"
+    return "%02d:%06.3f" % (seconds // 60, seconds % 60)
+
+
+def run_sacct(
+        argList,
+    ):
+    optionDict = get_option_dict(argList, ["-j", "--jobs", "-o", "--format"])[0]
+    fieldList = optionDict.get("-o", optionDict.get("--format", "JobID,State,ExitCode")).split(",")
+    separator = "|" if "-P" in argList else " "
+    for jobId in [x for x in optionDict.get("-j", optionDict.get("--jobs", "")).split(",") if x]:
+        jobDict = read_job(jobId)
+        if jobDict is None:
+            continue
+        exitCode = jobDict["exit-code"]
+        valueDict = {
+            "JobID" : str(jobId),
+            "JobName" : jobDict["name"],
+            "State" : get_job_state(jobDict),
+            "ExitCode" : ("0:0" if exitCode is None else str(exitCode) + ":0"),
+            "UserCPU" : get_slurm_time(jobDict.get("user-time", 0.0)),
+            "SystemCPU" : get_slurm_time(jobDict.get("sys-time", 0.0)),
+            "MaxRSS" : str(jobDict.get("max-rss", 0)) + "K",
+        }
+        print(separator.join([valueDict.get(x, "") for x in fieldList]))
+    return 0
+
+
+def run_scancel(
+        argList,
+    ):
+    for jobId in [x for x in argList if not x.startswith("-")]:
+        jobDict = read_job(jobId)
+        if jobDict is None:
+            sys.stderr.write("scancel: error: Invalid job id " + jobId + "\n")
+            continue
+        if get_job_state(jobDict) not in activeStateList:
+            continue
+        ### The runner of a job just submitted has not written its pid yet
+        waitTime = 0.0
+        while jobDict["pid"] is None and waitTime < 5.0:
+            time.sleep(0.1)
+            waitTime += 0.1
+            jobDict = read_job(jobId)
+        if jobDict["pid"] is None:
+            continue
+        try:
+            os.kill(jobDict["pid"], signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    return 0
+
+
+def run_srun(
+        argList,
+    ):
+    ### srun [-n N] <command> ...
+    nTasks = int(os.environ.get("SLURM_NTASKS", "1"))
+    if argList[ : 1] == ["-n"] and len(argList) > 2:
+        nTasks = int(argList[1])
+        argList = argList[2 : ]
+    processList = []
+    for processRank in range(nTasks):
+        env = dict(os.environ, SLURM_PROCID = str(processRank), OMPI_COMM_WORLD_RANK = str(processRank), OMPI_COMM_WORLD_SIZE = str(nTasks))
+        processList.append(subprocess.Popen(argList, env = env))
+    return max([x.wait() for x in processList])
+
+
+#---------------------------------------
+
+commandDict = {
+    "sbatch" : run_sbatch,
+    "squeue" : run_squeue,
+    "sacct" : run_sacct,
+    "scancel" : run_scancel,
+    "srun" : run_srun,
+}
+
+
+if __name__ == "__main__":
+    command = os.path.basename(sys.argv[0])
+    argList = sys.argv[1 : ]
+    if argList[ : 1] == ["--run-job"]:
+        sys.exit(run_job(argList[1]))
+    if command not in commandDict:
+        sys.exit("Unknown command : " + command)
+    sys.exit(commandDict[command](argList))
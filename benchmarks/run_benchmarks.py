@@ -0,0 +1,451 @@
+"""
+    Benchmarks of the STL and dictionary hot paths of the automation
+    process, offline (no Cubit, no OpenFOAM).
+
+    - The geometry (pipe, sphere or a row of blocks, see stl_generators.py)
+      is exported with the stand-in Cubit module, as the geometry
+      generation script does, at every size (10^4 to 10^8 triangles).
+    - Timed, for every size and STL format :
+        - format     : formatting of the exported files (stl_merge)
+        - merge      : combined BC/block files (stl_merge)
+        - bounds     : triangle count and bounds of the combined BC file
+                       (stl_io) and the domain information (welded surface,
+                       region bounds)
+        - dictionary : blockMesh/snappyHexMesh/... and topoSet dictionaries
+        - pipeline   : (--pipeline) both scripts end to end with the
+                       stand-in Cubit and OpenFOAM utilities
+    - Every benchmark is the best of "--repeat" runs and is compared to the
+      baseline file, it fails (exit code 1) when it is slower than the
+      baseline by more than the tolerance. "--update-baseline" writes the
+      results as the new baselines.
+    - The baselines depend on the machine, they are regenerated on the
+      machine the benchmarks are compared on.
+
+    Usage :
+        python benchmarks/run_benchmarks.py
+        python benchmarks/run_benchmarks.py --sizes 1e4,1e6 --stl-format binary
+        python benchmarks/run_benchmarks.py --sizes 1e8 --work-dir /scratch/bench
+        python benchmarks/run_benchmarks.py --pipeline --update-baseline
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+benchmarkDir = os.path.dirname(os.path.abspath(__file__))
+scriptDir = os.path.join(os.path.dirname(benchmarkDir), "scripts")
+fakeCubitDir = os.path.join(benchmarkDir, "fake_cubit")
+fakeOpenfoamBashrc = os.path.join(benchmarkDir, "fake_openfoam", "bashrc")
+
+sys.path.insert(0, scriptDir)
+sys.path.insert(0, fakeCubitDir)
+sys.path.insert(0, benchmarkDir)
+
+import numpy as np
+
+import stl_io
+import stl_merge
+import tri_surface
+import snappyHexMesh_from_stl
+import stl_generators
+import cubit
+
+
+#---------------------------------------
+
+defaultBaselineFile = os.path.join(benchmarkDir, "baselines.json")
+defaultSizeList = ["1e4", "1e5", "1e6"]
+preFormatPostFix = "_pre_formatted"
+openfoamVersion = "v2412"
+foamFileVersion = "2.0"
+
+
+#---------------------------------------
+### CASES
+#---------------------------------------
+
+def get_case_dir(
+        workDir,
+        shape,
+        nTriangle,
+        stlFormat,
+    ):
+    return os.path.join(workDir, shape + "-" + str(nTriangle) + "-" + stlFormat)
+
+
+def export_case(
+        caseDir,
+        modelDict,
+        stlFormat,
+    ):
+    ### Same files and commands as export_pre_formatted_stl_files, the
+    ### exported files are kept for the next runs with the same work dir
+    exportDir = os.path.join(caseDir, "export")
+    exportInfoFile = os.path.join(caseDir, "export.json")
+    if os.path.exists(exportInfoFile):
+        with open(exportInfoFile, "r") as rf:
+            return json.load(rf)
+
+    if os.path.exists(caseDir):
+        shutil.rmtree(caseDir)
+    os.makedirs(exportDir)
+    cubit.set_model(modelDict)
+    cubit.cmd("mesh surface all")
+
+    bcStlFileList = []
+    for bcName, bcData in modelDict["bc"].items():
+        bcStlFilename = "bc_" + bcName + preFormatPostFix + ".stl"
+        bcStlFileList.append(bcStlFilename)
+        cubit.cmd("export stl " + stlFormat + " \"" + os.path.join(exportDir, bcStlFilename) + "\" surface " + " ".join([str(x) for x in bcData["surface-list"]]) + " mesh overwrite")
+
+    blockStlFileList = []
+    for block, volumeList in modelDict["blocks"].items():
+        surfaceList = []
+        for volume in volumeList:
+            surfaceList.extend(cubit.get_relatives("volume", volume, "surface"))
+        blockStlFilename = "block_" + block + preFormatPostFix + ".stl"
+        blockStlFileList.append(blockStlFilename)
+        cubit.cmd("export stl " + stlFormat + " \"" + os.path.join(exportDir, blockStlFilename) + "\" surface " + " ".join([str(x) for x in surfaceList]) + " mesh overwrite")
+
+    exportInfo = {
+            "export-dir" : exportDir,
+            "bc-stl-file-list" : bcStlFileList,
+            "block-stl-file-list" : blockStlFileList,
+            "n-triangles" : stl_generators.get_boundary_triangle_count(modelDict),
+        }
+    with open(exportInfoFile, "w") as wf:
+        json.dump(exportInfo, wf, indent = 4)
+    return exportInfo
+
+
+def get_task_list(
+        exportInfo,
+        stlFileList,
+        readyDir,
+        stlFormat,
+    ):
+    ### As get_stl_format_task_list of the geometry generation script
+    taskList = []
+    for filename in stlFileList:
+        baseFilename = filename[ : -len(preFormatPostFix + ".stl")]
+        taskList.append({
+                "source" : os.path.join(exportInfo["export-dir"], filename),
+                "target" : os.path.join(readyDir, baseFilename + ".stl"),
+                "solid-name" : baseFilename.split("_", 1)[1],
+                "merge-all-solid-together" : True,
+                "stl-format" : stlFormat,
+            })
+    return taskList
+
+
+def get_domain_info_dict(
+        modelDict,
+        readyDir,
+        stlFormat,
+    ):
+    ### snappyHexInfo.json of the geometry generation script
+    return {
+            "snappyhex-ready-stl-dir" : readyDir,
+            "bc-info" : {x : {"bc-stl-file" : "bc_" + x + ".stl", "type" : y["type"]} for x, y in modelDict["bc"].items()},
+            "bc-stl-file-list" : ["bc_" + x + ".stl" for x in modelDict["bc"]],
+            "block-info" : {x : "block_" + x + ".stl" for x in modelDict["blocks"]},
+            "block-stl-file-list" : ["block_" + x + ".stl" for x in modelDict["blocks"]],
+            "combined-bc-stl-filename" : "combinedBcStl.stl",
+            "combined-block-stl-filename" : "combinedBlockStl.stl",
+            "combined-bc-region-list" : list(modelDict["bc"].keys()),
+            "stl-format" : stlFormat,
+            "trisurface-compression" : "none",
+        }
+
+
+#---------------------------------------
+### BENCHMARKS
+#---------------------------------------
+
+def get_block_mesh_cell_size(
+        domainStlBound,
+    ):
+    ### About 20 background cells along the largest extent
+    extent = max([domainStlBound[x + "-max"] - domainStlBound[x + "-min"] for x in "xyz"])
+    return extent / 20.0
+
+
+def time_function(
+        function,
+        repeat,
+    ):
+    ### Best of "repeat" runs
+    bestTime = None
+    for index in range(repeat):
+        startTime = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - startTime
+        bestTime = elapsed if bestTime is None else min(bestTime, elapsed)
+    return bestTime
+
+
+def run_stl_benchmarks(
+        caseDir,
+        modelDict,
+        exportInfo,
+        stlFormat,
+        repeat,
+    ):
+    readyDir = os.path.join(caseDir, "ready")
+    os.makedirs(readyDir, exist_ok = True)
+    bcTaskList = get_task_list(exportInfo, exportInfo["bc-stl-file-list"], readyDir, stlFormat)
+    blockTaskList = get_task_list(exportInfo, exportInfo["block-stl-file-list"], readyDir, stlFormat)
+    combinedBcStlFile = os.path.join(readyDir, "combinedBcStl.stl")
+    combinedBlockStlFile = os.path.join(readyDir, "combinedBlockStl.stl")
+
+    def merge():
+        stl_merge.merge_formatted_stl_files(bcTaskList, combinedBcStlFile)
+        stl_merge.merge_formatted_stl_files(blockTaskList, combinedBlockStlFile)
+
+    def domain_information():
+        surface = tri_surface.TriSurface.read(combinedBcStlFile)
+        snappyHexMesh_from_stl.get_domain_stl_information_dict(surface)
+
+    resultDict = {}
+    resultDict["format"] = time_function(lambda : stl_merge.format_stl_files(bcTaskList + blockTaskList, 1), repeat)
+    resultDict["merge"] = time_function(merge, repeat)
+    resultDict["bounds"] = time_function(lambda : stl_io.get_stl_information(combinedBcStlFile), repeat)
+    resultDict["domain-information"] = time_function(domain_information, repeat)
+
+    ### Dictionaries from the bounds of the combined file
+    domainInfoDict = get_domain_info_dict(modelDict, readyDir, stlFormat)
+    domainStlBound = stl_io.get_stl_information(combinedBcStlFile)["bound"]
+    blockMeshCellSize = get_block_mesh_cell_size(domainStlBound)
+    systemDir = os.path.join(caseDir, "system")
+    os.makedirs(systemDir, exist_ok = True)
+
+    def dictionary():
+        snappyHexMesh_from_stl.setup_snappyHexMesh_case(
+                openfoamVersion,
+                foamFileVersion,
+                domainInfoDict,
+                systemDir,
+                domainInfoDict["bc-stl-file-list"],
+                domainStlBound,
+                blockMeshCellSize,
+                modelDict["location-in-mesh"],
+                "mm",
+                decomposeSettingDict = {"n-procs" : 4, "method" : "scotch", "counts" : (1, 1, 1)},
+                snappyPhaseList = snappyHexMesh_from_stl.snappyHexMeshPhaseList,
+            )
+        snappyHexMesh_from_stl.create_toposet_dictionary(
+                openfoamVersion,
+                foamFileVersion,
+                domainInfoDict,
+                "system",
+                os.path.join(systemDir, "topoSetDict"),
+                caseDir,
+            )
+
+    resultDict["dictionary"] = time_function(dictionary, repeat)
+    return resultDict, domainStlBound
+
+
+def write_pipeline_input_file(
+        caseDir,
+        modelDict,
+        stlFormat,
+    ):
+    ### Input file of the geometry generation script
+    inputFile = os.path.join(caseDir, "cubit2snappyHex_input_case_" + modelDict["name"] + ".py")
+    str2write = ""
+    str2write += "import os\n"
+    str2write += "scriptLocation = " + repr(scriptDir) + "\n"
+    str2write += "workingDir = " + repr(caseDir) + "\n"
+    str2write += "inputGeometry = " + repr(modelDict["name"] + ".cub") + "\n"
+    str2write += "meshSize = 1.0\n"
+    str2write += "bcDict = " + repr(modelDict["bc"]) + "\n"
+    str2write += "blockDict = " + repr({x : list(y) for x, y in modelDict["blocks"].items()}) + "\n"
+    str2write += "mergeAllSolidTogether = True\n"
+    str2write += "mergeAllBcStlTogether = True\n"
+    str2write += "nStlFormatProcess = 1\n"
+    str2write += "stlFormat = " + repr(stlFormat) + "\n"
+    str2write += "exportDir = workingDir + os.sep + \"export_pre_formatted_stl\"\n"
+    str2write += "scriptPath = scriptLocation + os.sep + \"cubit2snappyHexMesh.py\"\n"
+    str2write += "with open(scriptPath, \"rb\") as source_file:\n"
+    str2write += "    exec(compile(source_file.read(), scriptPath, \"exec\"), globals())\n"
+    with open(inputFile, "w") as wf:
+        wf.write(str2write)
+    return inputFile
+
+
+def run_pipeline_benchmarks(
+        caseDir,
+        modelDict,
+        stlFormat,
+        domainStlBound,
+        repeat,
+    ):
+    ### Geometry generation with the stand-in Cubit, mesh generation with
+    ### the stand-in OpenFOAM utilities, no artifact cache
+    pipelineDir = os.path.join(caseDir, "pipeline")
+    if os.path.exists(pipelineDir):
+        shutil.rmtree(pipelineDir)
+    os.makedirs(pipelineDir)
+    modelFile = os.path.join(pipelineDir, "model.json")
+    with open(modelFile, "w") as wf:
+        json.dump(modelDict, wf)
+    inputFile = write_pipeline_input_file(pipelineDir, modelDict, stlFormat)
+
+    geometryEnv = dict(os.environ, FAKE_CUBIT_MODEL = modelFile, FAKE_CUBIT_LOG = os.path.join(pipelineDir, "cubit_commands.txt"))
+    geometryEnv["PYTHONPATH"] = os.pathsep.join([fakeCubitDir] + [x for x in [os.environ.get("PYTHONPATH")] if x])
+
+    meshEnv = dict(
+            os.environ,
+            working_dir = pipelineDir,
+            input_json_filename = "snappyHexInfo.json",
+            openfoam_version = openfoamVersion,
+            foamfile_version = foamFileVersion,
+            geometry_length_unit = "mm",
+            location_in_mesh = ", ".join([str(x) for x in modelDict["location-in-mesh"]]),
+            blockmesh_size = str(get_block_mesh_cell_size(domainStlBound)),
+            openfoam_bashrc_path = fakeOpenfoamBashrc,
+            artifact_cache_dir = "none",
+            clean_case = "true",
+            n_procs = "1",
+        )
+
+    def run(commandList, env, logName):
+        with open(os.path.join(pipelineDir, logName), "w") as lf:
+            result = subprocess.run(commandList, cwd = pipelineDir, env = env, stdout = lf, stderr = subprocess.STDOUT)
+        if result.returncode != 0:
+            raise RuntimeError(" ".join(commandList) + " failed, see " + os.path.join(pipelineDir, logName))
+
+    resultDict = {}
+    resultDict["pipeline-geometry"] = time_function(lambda : run([sys.executable, inputFile], geometryEnv, "log_geometry.txt"), repeat)
+    resultDict["pipeline-mesh"] = time_function(lambda : run([sys.executable, os.path.join(scriptDir, "snappyHexMesh_from_stl.py")], meshEnv, "log_mesh.txt"), repeat)
+    return resultDict
+
+
+#---------------------------------------
+### BASELINES
+#---------------------------------------
+
+def get_machine_dict():
+    return {
+            "platform" : platform.platform(),
+            "processor" : platform.processor() or platform.machine(),
+            "cpu-count" : os.cpu_count(),
+            "python" : platform.python_version(),
+            "numpy" : np.__version__,
+        }
+
+
+def read_baseline_file(
+        baselineFile,
+    ):
+    if not os.path.exists(baselineFile):
+        return {"machine" : None, "results" : {}}
+    with open(baselineFile, "r") as rf:
+        return json.load(rf)
+
+
+def compare_results(
+        resultDict,
+        baselineDict,
+        tolerance,
+        minDelta,
+    ):
+    ### Returns the report lines and the regressed benchmarks, a benchmark
+    ### regresses if it is slower than the baseline by more than the
+    ### tolerance (relative) and by more than minDelta seconds
+    maxNameLength = max([len(x) for x in resultDict] + [len("Benchmark")])
+    str2print = "-"*40 + "\n"
+    str2print += f"{'Benchmark' : <{maxNameLength}} : {'time [s]' : >10} {'baseline' : >10} {'ratio' : >7}\n"
+    regressionList = []
+    for name, elapsed in resultDict.items():
+        baseline = baselineDict.get(name)
+        if baseline is None:
+            str2print += f"{name : <{maxNameLength}} : {elapsed : >10.4f} {'-' : >10} {'new' : >7}\n"
+            continue
+        ratio = elapsed / baseline if baseline > 0.0 else float("inf")
+        regressed = elapsed > baseline * (1.0 + tolerance) and elapsed - baseline > minDelta
+        str2print += f"{name : <{maxNameLength}} : {elapsed : >10.4f} {baseline : >10.4f} {ratio : >7.2f}" + ("  REGRESSION" if regressed else "") + "\n"
+        if regressed:
+            regressionList.append(name)
+    return str2print, regressionList
+
+
+#---------------------------------------
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description = "Benchmarks of the STL and dictionary hot paths")
+    parser.add_argument("--sizes", default = ",".join(defaultSizeList), help = "triangle counts, e.g. 1e4,1e5,1e6 (up to 1e8)")
+    parser.add_argument("--shape", default = "blocks", choices = ["pipe", "sphere", "blocks"])
+    parser.add_argument("--zones", type = int, default = 4, help = "number of zones of the blocks shape")
+    parser.add_argument("--stl-format", default = "ascii,binary", help = "ascii, binary or both")
+    parser.add_argument("--repeat", type = int, default = 3, help = "runs per benchmark, the best one counts")
+    parser.add_argument("--tolerance", type = float, default = 0.5, help = "allowed slowdown against the baseline (0.5 --> 50 %%)")
+    parser.add_argument("--min-delta", type = float, default = 0.05, help = "slowdowns below this many seconds are noise")
+    parser.add_argument("--baseline-file", default = defaultBaselineFile)
+    parser.add_argument("--update-baseline", action = "store_true", help = "store the results as the baselines")
+    parser.add_argument("--pipeline", action = "store_true", help = "also run both scripts end to end with the stand-ins")
+    parser.add_argument("--work-dir", default = None, help = "kept between runs, the exported STL files are reused")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    sizeList = [int(float(x)) for x in args.sizes.split(",") if x.strip()]
+    stlFormatList = [x.strip() for x in args.stl_format.split(",") if x.strip()]
+
+    workDir = args.work_dir
+    tmpDir = None
+    if workDir is None:
+        tmpDir = tempfile.TemporaryDirectory(prefix = "snappyHexMesh_benchmarks_")
+        workDir = tmpDir.name
+    os.makedirs(workDir, exist_ok = True)
+
+    resultDict = {}
+    try:
+        for nTriangle in sizeList:
+            modelDict = stl_generators.get_model(args.shape, nTriangle, args.zones)
+            for stlFormat in stlFormatList:
+                caseDir = get_case_dir(workDir, args.shape, nTriangle, stlFormat)
+                startTime = time.perf_counter()
+                exportInfo = export_case(caseDir, modelDict, stlFormat)
+                print(f"{args.shape} {stlFormat} {nTriangle:.0e} : {exportInfo['n-triangles']} triangles, exported in {time.perf_counter() - startTime : .2f} s")
+
+                caseResultDict, domainStlBound = run_stl_benchmarks(caseDir, modelDict, exportInfo, stlFormat, args.repeat)
+                if args.pipeline:
+                    caseResultDict.update(run_pipeline_benchmarks(caseDir, modelDict, stlFormat, domainStlBound, args.repeat))
+                for name, elapsed in caseResultDict.items():
+                    resultDict[f"{name}/{args.shape}/{stlFormat}/{nTriangle:.0e}"] = elapsed
+    finally:
+        if tmpDir is not None:
+            tmpDir.cleanup()
+
+    baselineData = read_baseline_file(args.baseline_file)
+    str2print, regressionList = compare_results(resultDict, baselineData["results"], args.tolerance, args.min_delta)
+    print(str2print)
+    if baselineData["machine"] is not None and baselineData["machine"] != get_machine_dict():
+        print("Warning : the baselines were taken on another machine " + json.dumps(baselineData["machine"]))
+
+    if args.update_baseline:
+        baselineData["machine"] = get_machine_dict()
+        baselineData["results"].update(resultDict)
+        baselineData["results"] = dict(sorted(baselineData["results"].items()))
+        with open(args.baseline_file, "w") as wf:
+            json.dump(baselineData, wf, indent = 4)
+        print("Baselines written to " + args.baseline_file)
+        return 0
+
+    if regressionList:
+        print("Regressions : " + ", ".join(regressionList))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
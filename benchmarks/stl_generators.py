@@ -0,0 +1,403 @@
+"""
+    Parametric STL geometries for the benchmarks.
+
+    - A geometry model is a set of surfaces (grid patches : rectangles,
+      cylinders, disks, cube-sphere faces) grouped into volumes, the same
+      description the stand-in Cubit module works on. Shared surfaces
+      between volumes are "merged", as after "merge all" in Cubit.
+    - Models : a pipe (inlet/outlet caps and wall), a sphere and a row of
+      N blocks (one zone per block), each sized to about N triangles in the
+      boundary surfaces.
+    - A shared surface is oriented for the first volume, the model lists
+      the surfaces reversed in every other volume ("reversed"), the export
+      of all the surfaces of a volume is a consistently oriented shell.
+    - Patches are triangulated in row blocks and written in chunks, ASCII
+      or binary, so files of 10^8 triangles are written without holding
+      them in memory. Neighbouring patches compute their common edge
+      points with the same expressions, the surfaces are closed.
+"""
+
+import os
+import math
+import struct
+
+import numpy as np
+
+
+#---------------------------------------
+
+binaryStlHeaderSize = 80
+
+binaryStlRecordDtype = np.dtype([
+        ("normal", "<f4", (3,)),
+        ("vertices", "<f4", (3, 3)),
+        ("attribute", "<u2"),
+    ])
+
+### Triangles generated and written at once
+triangleChunkLength = 1024 * 1024
+
+### Triangles formatted at once in ASCII (about 250 bytes each)
+asciiChunkLength = 64 * 1024
+
+asciiFacetFormat = (
+        "  facet normal %.7e %.7e %.7e\n"
+        "    outer loop\n"
+        "      vertex %.7e %.7e %.7e\n"
+        "      vertex %.7e %.7e %.7e\n"
+        "      vertex %.7e %.7e %.7e\n"
+        "    endloop\n"
+        "  endfacet\n"
+    )
+
+
+#---------------------------------------
+### PATCHES
+#---------------------------------------
+
+def get_patch_points(
+        patchDict,
+        iArray,
+        jArray,
+    ):
+    ### Points of the grid indices (i along "n-u", j along "n-v")
+    nU = patchDict["n-u"]
+    nV = patchDict["n-v"]
+    kind = patchDict["kind"]
+
+    if kind == "rectangle":
+        origin = np.array(patchDict["origin"], dtype = np.float64)
+        uAxis = np.array(patchDict["u"], dtype = np.float64)
+        vAxis = np.array(patchDict["v"], dtype = np.float64)
+        u = (iArray / nU)[..., None]
+        v = (jArray / nV)[..., None]
+        return origin + u * uAxis + v * vAxis
+
+    if kind == "cylinder":
+        ### Periodic in i, the seam points are computed from i % nU
+        angle = 2.0 * math.pi * (iArray % nU) / nU
+        radius = patchDict["radius"]
+        z = patchDict["z-min"] + (patchDict["z-max"] - patchDict["z-min"]) * jArray / nV
+        return np.stack(np.broadcast_arrays(radius * np.cos(angle), radius * np.sin(angle), z), axis = -1)
+
+    if kind == "disk":
+        ### j = 0 is the centre, the triangles there are dropped as
+        ### degenerate, the normals point to -z unless flipped
+        angle = 2.0 * math.pi * (iArray % nU) / nU
+        radius = patchDict["radius"] * jArray / nV
+        return np.stack(np.broadcast_arrays(radius * np.cos(angle), radius * np.sin(angle), patchDict["z"]), axis = -1)
+
+    if kind == "sphere-face":
+        ### Face of the cube [-1, 1]^3 projected on the sphere
+        origin = np.array(patchDict["origin"], dtype = np.float64)
+        uAxis = np.array(patchDict["u"], dtype = np.float64)
+        vAxis = np.array(patchDict["v"], dtype = np.float64)
+        cubePoints = origin + (2.0 * iArray / nU - 1.0)[..., None] * uAxis + (2.0 * jArray / nV - 1.0)[..., None] * vAxis
+        cubePoints /= np.linalg.norm(cubePoints, axis = -1)[..., None]
+        return patchDict["radius"] * cubePoints + np.array(patchDict["centre"], dtype = np.float64)
+
+    raise ValueError("Unknown patch kind : " + str(kind))
+
+
+def get_patch_triangle_count(
+        patchDict,
+    ):
+    nTriangle = 2 * patchDict["n-u"] * patchDict["n-v"]
+    if patchDict["kind"] == "disk":
+        nTriangle -= patchDict["n-u"]
+    return nTriangle
+
+
+def iter_patch_triangles(
+        patchDict,
+        chunkLength = triangleChunkLength,
+    ):
+    ### Yields triangle arrays [n, 3, 3], two triangles per grid cell,
+    ### "flip" reverses the orientation
+    nU = patchDict["n-u"]
+    nV = patchDict["n-v"]
+    nRowChunk = max(1, chunkLength // (2 * nU))
+    iArray = np.arange(nU + 1)
+
+    for jStart in range(0, nV, nRowChunk):
+        jArray = np.arange(jStart, min(jStart + nRowChunk, nV) + 1)
+        pointArray = get_patch_points(patchDict, iArray[None, :], jArray[:, None])
+        p00 = pointArray[ : -1, : -1].reshape(-1, 3)
+        p10 = pointArray[ : -1, 1 : ].reshape(-1, 3)
+        p01 = pointArray[1 : , : -1].reshape(-1, 3)
+        p11 = pointArray[1 : , 1 : ].reshape(-1, 3)
+
+        triangleArray = np.empty((2 * p00.shape[0], 3, 3), dtype = np.float64)
+        triangleArray[0 : : 2] = np.stack([p00, p10, p11], axis = 1)
+        triangleArray[1 : : 2] = np.stack([p00, p11, p01], axis = 1)
+        if patchDict.get("flip", False):
+            triangleArray = triangleArray[:, ::-1]
+
+        ### Collapsed grid cells (disk centre)
+        degenerateMask = (np.all(triangleArray[:, 0] == triangleArray[:, 1], axis = 1)
+                | np.all(triangleArray[:, 1] == triangleArray[:, 2], axis = 1)
+                | np.all(triangleArray[:, 2] == triangleArray[:, 0], axis = 1))
+        if degenerateMask.any():
+            triangleArray = triangleArray[~degenerateMask]
+        yield triangleArray
+    return
+
+
+#---------------------------------------
+### MODELS
+#---------------------------------------
+
+def get_box_patch_list(
+        xMin,
+        xMax,
+        size,
+        nGrid,
+    ):
+    ### Faces of the box [xMin, xMax] x [0, size] x [0, size], outward
+    ### normals (u x v), in the order x-min, x-max, y-min, y-max, z-min, z-max
+    lx = xMax - xMin
+    nX = max(1, int(round(nGrid * lx / size)))
+    return [
+        {"kind" : "rectangle", "origin" : [xMin, 0.0, 0.0], "u" : [0.0, 0.0, size], "v" : [0.0, size, 0.0], "n-u" : nGrid, "n-v" : nGrid},
+        {"kind" : "rectangle", "origin" : [xMax, 0.0, 0.0], "u" : [0.0, size, 0.0], "v" : [0.0, 0.0, size], "n-u" : nGrid, "n-v" : nGrid},
+        {"kind" : "rectangle", "origin" : [xMin, 0.0, 0.0], "u" : [lx, 0.0, 0.0], "v" : [0.0, 0.0, size], "n-u" : nX, "n-v" : nGrid},
+        {"kind" : "rectangle", "origin" : [xMin, size, 0.0], "u" : [0.0, 0.0, size], "v" : [lx, 0.0, 0.0], "n-u" : nGrid, "n-v" : nX},
+        {"kind" : "rectangle", "origin" : [xMin, 0.0, 0.0], "u" : [0.0, size, 0.0], "v" : [lx, 0.0, 0.0], "n-u" : nGrid, "n-v" : nX},
+        {"kind" : "rectangle", "origin" : [xMin, 0.0, size], "u" : [lx, 0.0, 0.0], "v" : [0.0, size, 0.0], "n-u" : nX, "n-v" : nGrid},
+    ]
+
+
+def get_pipe_model(
+        nTriangle,
+        radius = 10.0,
+        length = 100.0,
+    ):
+    ### Surfaces : 1 wall, 2 inlet (z = 0), 3 outlet (z = length)
+    nTheta = max(8, int(math.sqrt(nTriangle / 2.0)))
+    nRadial = max(1, nTheta // 8)
+    nAxial = max(1, int(round((nTriangle - 2 * (2 * nTheta * nRadial - nTheta)) / (2.0 * nTheta))))
+    surfaceDict = {
+        "1" : {"kind" : "cylinder", "radius" : radius, "z-min" : 0.0, "z-max" : length, "n-u" : nTheta, "n-v" : nAxial},
+        "2" : {"kind" : "disk", "radius" : radius, "z" : 0.0, "n-u" : nTheta, "n-v" : nRadial},
+        "3" : {"kind" : "disk", "radius" : radius, "z" : length, "n-u" : nTheta, "n-v" : nRadial, "flip" : True},
+    }
+    return {
+            "name" : "pipe",
+            "surfaces" : surfaceDict,
+            "volumes" : {"1" : [1, 2, 3]},
+            "bc" : {
+                "inlet" : {"type" : "inlet", "surface-list" : [2]},
+                "outlet" : {"type" : "outlet", "surface-list" : [3]},
+                "wall" : {"type" : "wall", "surface-list" : [1]},
+            },
+            "blocks" : {"fluid" : [1]},
+            "location-in-mesh" : [0.0, 0.0, 0.5 * length],
+        }
+
+
+def get_sphere_model(
+        nTriangle,
+        radius = 10.0,
+    ):
+    ### Surfaces : the six cube-sphere faces, one wall
+    nGrid = max(1, int(round(math.sqrt(nTriangle / 12.0))))
+    faceList = [
+        ([1, -1, -1], [0, 1, 0], [0, 0, 1]),
+        ([-1, -1, -1], [0, 0, 1], [0, 1, 0]),
+        ([-1, 1, -1], [0, 0, 1], [1, 0, 0]),
+        ([-1, -1, -1], [1, 0, 0], [0, 0, 1]),
+        ([-1, -1, 1], [1, 0, 0], [0, 1, 0]),
+        ([-1, -1, -1], [0, 1, 0], [1, 0, 0]),
+    ]
+    surfaceDict = {}
+    for index, (origin, uAxis, vAxis) in enumerate(faceList):
+        ### The faces of the cube [-1, 1]^3 are spanned by 2u and 2v
+        surfaceDict[str(index + 1)] = {
+                "kind" : "sphere-face",
+                "origin" : [origin[k] + uAxis[k] + vAxis[k] for k in range(3)],
+                "u" : uAxis,
+                "v" : vAxis,
+                "radius" : radius,
+                "centre" : [0.0, 0.0, 0.0],
+                "n-u" : nGrid,
+                "n-v" : nGrid,
+            }
+    return {
+            "name" : "sphere",
+            "surfaces" : surfaceDict,
+            "volumes" : {"1" : [1, 2, 3, 4, 5, 6]},
+            "bc" : {
+                "wall" : {"type" : "wall", "surface-list" : [1, 2, 3, 4, 5, 6]},
+            },
+            "blocks" : {"fluid" : [1]},
+            "location-in-mesh" : [0.0, 0.0, 0.0],
+        }
+
+
+def get_block_model(
+        nTriangle,
+        nZone = 4,
+        size = 10.0,
+    ):
+    ### nZone cubes along x, one zone per cube, the faces between two cubes
+    ### are shared (merged), inlet at x = 0 and outlet at the far end
+    nBoundaryFace = 2 + 4 * nZone
+    nGrid = max(1, int(round(math.sqrt(nTriangle / (2.0 * nBoundaryFace)))))
+
+    surfaceDict = {}
+    volumeDict = {}
+    reversedDict = {}
+    wallSurfaceList = []
+    sharedSurfaceId = None
+    for zone in range(nZone):
+        patchList = get_box_patch_list(zone * size, (zone + 1) * size, size, nGrid)
+        surfaceIdList = []
+        for index, patchDict in enumerate(patchList):
+            if index == 0 and sharedSurfaceId is not None:
+                surfaceIdList.append(sharedSurfaceId)
+                reversedDict[str(zone + 1)] = [sharedSurfaceId]
+                continue
+            surfaceId = len(surfaceDict) + 1
+            surfaceDict[str(surfaceId)] = patchDict
+            surfaceIdList.append(surfaceId)
+            if index > 1:
+                wallSurfaceList.append(surfaceId)
+        volumeDict[str(zone + 1)] = surfaceIdList
+        sharedSurfaceId = surfaceIdList[1]
+
+    return {
+            "name" : "blocks",
+            "surfaces" : surfaceDict,
+            "volumes" : volumeDict,
+            "reversed" : reversedDict,
+            "bc" : {
+                "inlet" : {"type" : "inlet", "surface-list" : [volumeDict["1"][0]]},
+                "outlet" : {"type" : "outlet", "surface-list" : [volumeDict[str(nZone)][1]]},
+                "wall" : {"type" : "wall", "surface-list" : wallSurfaceList},
+            },
+            "blocks" : {"zone" + str(x + 1) : [x + 1] for x in range(nZone)},
+            "location-in-mesh" : [0.5 * size, 0.5 * size, 0.5 * size],
+        }
+
+
+def get_model(
+        shape,
+        nTriangle,
+        nZone = 4,
+    ):
+    if shape == "pipe":
+        return get_pipe_model(nTriangle)
+    if shape == "sphere":
+        return get_sphere_model(nTriangle)
+    if shape == "blocks":
+        return get_block_model(nTriangle, nZone)
+    raise ValueError("Unknown shape : " + str(shape) + " (pipe, sphere, blocks)")
+
+
+def get_merged_surface_list(
+        modelDict,
+    ):
+    ### Surfaces of more than one volume
+    countDict = {}
+    for surfaceList in modelDict["volumes"].values():
+        for surfaceId in surfaceList:
+            countDict[surfaceId] = countDict.get(surfaceId, 0) + 1
+    return sorted([x for x, count in countDict.items() if count > 1])
+
+
+def get_boundary_triangle_count(
+        modelDict,
+    ):
+    nTriangle = 0
+    for bcData in modelDict["bc"].values():
+        for surfaceId in bcData["surface-list"]:
+            nTriangle += get_patch_triangle_count(modelDict["surfaces"][str(surfaceId)])
+    return nTriangle
+
+
+#---------------------------------------
+### OUTPUT
+#---------------------------------------
+
+def get_triangle_normals(
+        triangleArray,
+    ):
+    normalArray = np.cross(triangleArray[:, 1] - triangleArray[:, 0], triangleArray[:, 2] - triangleArray[:, 0])
+    normLength = np.linalg.norm(normalArray, axis = 1)
+    normLength[normLength == 0.0] = 1.0
+    return normalArray / normLength[:, None]
+
+
+def write_ascii_triangles(
+        stream,
+        triangleArray,
+    ):
+    ### One string formatting call per ASCII chunk
+    dataArray = np.concatenate([get_triangle_normals(triangleArray), triangleArray.reshape(-1, 9)], axis = 1)
+    for start in range(0, dataArray.shape[0], asciiChunkLength):
+        chunkArray = dataArray[start : start + asciiChunkLength]
+        stream.write((asciiFacetFormat * chunkArray.shape[0]) % tuple(chunkArray.ravel().tolist()))
+    return
+
+
+def write_binary_triangles(
+        stream,
+        triangleArray,
+        attribute = 0,
+    ):
+    recordArray = np.zeros(triangleArray.shape[0], dtype = binaryStlRecordDtype)
+    recordArray["normal"] = get_triangle_normals(triangleArray)
+    recordArray["vertices"] = triangleArray
+    recordArray["attribute"] = attribute
+    stream.write(recordArray.tobytes())
+    return
+
+
+def write_stl_file(
+        stlFile,
+        solidList,
+        stlFormat = "ascii",
+    ):
+    ### solidList --> [(solid name, iterator of triangle arrays), ...],
+    ### every solid is a "solid" record in ASCII, binary files have one
+    ### header (the first name) and the triangles of all solids
+    nTriangle = 0
+    if stlFormat == "binary":
+        with open(stlFile, "wb") as wf:
+            headerName = solidList[0][0] if solidList else "solid"
+            wf.write(headerName.encode("ascii", "replace")[ : binaryStlHeaderSize].ljust(binaryStlHeaderSize, b" "))
+            wf.write(struct.pack("<I", 0))
+            for solidName, triangleIterator in solidList:
+                for triangleArray in triangleIterator:
+                    write_binary_triangles(wf, triangleArray)
+                    nTriangle += triangleArray.shape[0]
+            wf.seek(binaryStlHeaderSize)
+            wf.write(struct.pack("<I", nTriangle))
+        return nTriangle
+
+    with open(stlFile, "w", buffering = 1024 * 1024) as wf:
+        for solidName, triangleIterator in solidList:
+            wf.write("solid " + solidName + "\n")
+            for triangleArray in triangleIterator:
+                write_ascii_triangles(wf, triangleArray)
+                nTriangle += triangleArray.shape[0]
+            wf.write("endsolid " + solidName + "\n")
+    return nTriangle
+
+
+def write_surface_stl_file(
+        stlFile,
+        modelDict,
+        surfaceIdList,
+        stlFormat = "ascii",
+        reversedSurfaceList = (),
+    ):
+    ### One solid per surface, as exported by Cubit
+    solidList = []
+    for surfaceId in surfaceIdList:
+        patchDict = modelDict["surfaces"][str(surfaceId)]
+        if surfaceId in reversedSurfaceList:
+            patchDict = dict(patchDict, flip = not patchDict.get("flip", False))
+        solidList.append(("surface_" + str(surfaceId), iter_patch_triangles(patchDict)))
+    os.makedirs(os.path.dirname(os.path.abspath(stlFile)), exist_ok = True)
+    return write_stl_file(stlFile, solidList, stlFormat)
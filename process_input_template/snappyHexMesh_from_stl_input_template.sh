@@ -15,11 +15,115 @@ export foamfile_version="2.0"
 ### options are --> "mm" or "m"
 export geometry_length_unit="mm"
 
-### syntax --> "x-coord, y-coord, z-coord"
+### syntax --> "x-coord, y-coord, z-coord" (checked to be inside the domain STL)
+###         or "auto" (point inside the domain) or "auto:<block name>" (point inside the block)
 export location_in_mesh="0.0, 0.0, 0.0"
 
 export blockmesh_size=2
 
+### compression of the STL files copied to "constant/triSurface"
+###     options are --> "none" or "gzip"
+export trisurface_compression="none"
+
+### cache for the data derived from the STL files (bounds, feature edges, ...)
+###     set the directory to "none" to disable the cache
+export artifact_cache_dir="$HOME/.cache/snappyHexMesh_from_stl"
+export artifact_cache_size_mb=10240
+
+### feature edge extraction
+###     options are --> "native" (python, only the domain STL, runs next to blockMesh)
+###                  or "surfaceFeatureExtract" (OpenFOAM utility, all STL files)
+export feature_extraction="native"
+
+### surface check of the domain and block STL files before meshing
+###     options are --> "off", "report", "strict" (stops on a failed check)
+###                  or "repair" (duplicate/degenerate triangles removed, normals made consistent and outward)
+export surface_check="report"
+
+### leak check of the domain STL on the background mesh, flood filled from the location in mesh
+###     options are --> "off", "report" or "strict" (stops on a leak)
+### refinement --> background cells split per direction for the check (finds smaller holes)
+export leak_check="report"
+export leak_check_refinement=1
+
+### surface refinement level of the BCs and buffer layers between refinement levels
+export surface_refinement_level=3
+export n_cells_between_levels=3
+
+### cell limits (maxGlobalCells/maxLocalCells) of the snappyHexMeshDict
+###     options are --> "auto" (from the estimated mesh and the available memory)
+###                  or "fixed" (3000000/25000000)
+export mesh_limits="auto"
+
+### number of processes for snappyHexMesh, 1 --> serial run
+###     "auto" --> recommended by the mesh estimate (cells and available cores)
+### decomposition method --> "scotch", "hierarchical" or "simple"
+### mpirun command (e.g. "mpirun --bind-to core" or "srun")
+export n_procs=1
+export decompose_method="scotch"
+export mpirun_command="mpirun"
+
+### parallel run only, keep the case decomposed for the solver ("topoSet" runs in parallel)
+### reconstruction of the decomposed mesh --> "no", "yes" or "background" (not waited for)
+export keep_decomposed="false"
+export reconstruct_mesh="no"
+
+### core budget for the stages running at once (feature extraction next to blockMesh, ...)
+###     "auto" --> cores available to the process
+export n_cores="auto"
+
+### "false" --> the case directory is kept, only the stages whose inputs
+###             (files, dictionaries, settings) changed run again
+### "true"  --> the case directory is deleted, every stage runs
+export clean_case="false"
+
+### "false" --> the staging directory of a failed run is removed
+### "true"  --> it is kept for inspection, until the next run
+export keep_staging="false"
+
+### snappyHexMesh phases
+###     "combined"          --> castellation and snapping in one run
+###     "castellate, snap"  --> one run per phase ("castellate", "snap",
+###                             "layers"), the mesh after every phase is
+###                             kept as a checkpoint and a change of a later
+###                             phase restarts from it
+export snappy_phases="combined"
+
+### limits of the OpenFOAM utilities, the utility and its child processes (e.g. mpirun ranks) are
+###     killed at the limit and the stage fails
+###     "none", "<value>" (every utility) or "<utility>=<value>, ..." (e.g. "snappyHexMesh=7200, blockMesh=600")
+### timeout in seconds (wall-clock), memory in MB (resident memory of the utility and its children)
+### retries --> runs again of a failed utility (not after a limit, phased snappyHexMesh runs excepted)
+export utility_timeout="none"
+export utility_memory_limit_mb="none"
+export utility_retries=0
+
+### execution backend of the OpenFOAM utilities --> "local" (parallel runs with mpirun_command), "local-mpi"
+###     or "slurm" (batch job, sbatch/squeue, the case directory is on a filesystem shared with the nodes)
+###     "<backend>" (every utility) or "<utility>=<backend>, ..." (e.g. "snappyHexMesh=slurm", the other utilities run locally)
+### slurm options   --> sbatch options of every job (e.g. "--partition=compute --account=cfd")
+### slurm launcher  --> starts the processes of a parallel run in the job (e.g. "srun" or "mpirun")
+### slurm poll interval --> seconds between two job state queries
+export execution_backend="local"
+export slurm_options=""
+export slurm_launcher="srun"
+export slurm_poll_interval=10
+
+### parameter sweep --> "none" (one case) or a JSON file of the options to vary, e.g.
+###     {"name" : "refinement", "grid" : {"blockmesh_size" : [4, 2], "surface_refinement_level" : [2, 3]}}
+###     every case is meshed in "<working_dir>/sweep_<name>/<case>", the cases share the cores
+###     ("n_cores") and memory ("sweep_memory_mb", "auto" --> usable memory of the machine)
+export sweep_file="none"
+export sweep_memory_mb="auto"
+
+### meshing service --> "none" (one run) or the path of a Unix socket, the process stays up and
+###     runs the jobs submitted with "python mesh_daemon.py <socket> submit --option blockmesh_size=2 ..."
+###     (the options above are the defaults of the jobs), "service_jobs" jobs run at once and share
+###     the cores ("n_cores") and memory ("service_memory_mb", "auto" --> usable memory of the machine)
+export service_socket="none"
+export service_jobs=1
+export service_memory_mb="auto"
+
 #---------------------------------------
 
 ### provide the path to your openfoam bashrc file
@@ -37,11 +141,8 @@ python="path/to/the/python/interpreter"
 ### CASE INPUT - END
 #---------------------------------------
 
-log_file="$working_dir/log_generate_snappyHexMesh_case.txt"
-
-if [[ -f "$log_file" ]]; then
-    rm -f "$log_file"
-fi
+### one log file per run, runs sharing the working directory keep their own
+log_file="$working_dir/log_generate_snappyHexMesh_case_$(date +%Y%m%d-%H%M%S)_$$.txt"
 
 if [[ ! -f "$working_dir/$input_json_filename" ]]; then
     echo "The input json file \"$input_json_filename\" not found in the working directory."
@@ -0,0 +1,339 @@
+"""
+    Content-addressed on-disk cache for data derived from the STL files.
+
+    - Entries are keyed by the content hash of the input files plus the
+      parameters used to derive them (e.g. "includedAngle").
+    - An entry holds JSON data (bounds, surface information) and/or files
+      (.eMesh, welded surface arrays, compressed STL copies).
+    - The cache has a size limit, the least recently used entries are
+      evicted first.
+    - File hashes are memoised by path, size and modification time, an
+      unchanged multi-GB STL file is not hashed again. The files of a
+      directory copy (staging directory of a run) are memoised under the
+      path of the original directory.
+    - A cache object may be shared by the threads of concurrent stages.
+"""
+
+import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+
+#---------------------------------------
+
+hashChunkSize = 16*1024*1024
+entryMetaFilename = "meta.json"
+entryAccessFilename = ".access"
+digestIndexFilename = "digest_index.json"
+
+
+#---------------------------------------
+
+def file_digest(
+        filePath,
+    ):
+    fileHash = hashlib.blake2b(digest_size = 20)
+    with open(filePath, "rb") as rf:
+        while True:
+            chunk = rf.read(hashChunkSize)
+            if not chunk:
+                break
+            fileHash.update(chunk)
+    return fileHash.hexdigest()
+
+
+def path_digest(
+        rootDir,
+        pattern,
+        fileDigestFunction = file_digest,
+    ):
+    ### Content of the files matching a glob pattern (relative to rootDir),
+    ### directories file by file
+    pathHash = hashlib.blake2b(digest_size = 20)
+    for path in sorted(glob.glob(os.path.join(rootDir, pattern))):
+        fileList = [path]
+        if os.path.isdir(path):
+            fileList = []
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                fileList.extend([os.path.join(root, x) for x in sorted(files)])
+        for filePath in fileList:
+            pathHash.update(os.path.relpath(filePath, rootDir).encode())
+            pathHash.update(fileDigestFunction(filePath).encode())
+    return pathHash.hexdigest()
+
+
+def get_directory_size(
+        dirPath,
+    ):
+    totalSize = 0
+    for root, dirs, files in os.walk(dirPath):
+        for filename in files:
+            try:
+                totalSize += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                continue
+    return totalSize
+
+
+#---------------------------------------
+
+class ArtifactCache(object):
+
+    def __init__(
+            self,
+            cacheDir,
+            maxSizeBytes = 10*1024**3,
+        ):
+        self.cacheDir = os.path.abspath(cacheDir)
+        self.entryDir = os.path.join(self.cacheDir, "entries")
+        self.maxSizeBytes = maxSizeBytes
+        os.makedirs(self.entryDir, exist_ok = True)
+        self.digestIndexFile = os.path.join(self.cacheDir, digestIndexFilename)
+        self.digestIndex = self.read_digest_index()
+        self.digestIndexLock = threading.Lock()
+        self.pathAliasList = []
+        return
+
+
+    def add_path_alias(
+            self,
+            aliasDir,
+            indexDir,
+        ):
+        ### The digests of the files in aliasDir (a copy keeping the size
+        ### and modification time) are memoised under indexDir
+        self.pathAliasList.append((os.path.abspath(aliasDir), os.path.abspath(indexDir)))
+        return
+
+
+    def remove_path_alias(
+            self,
+            aliasDir,
+        ):
+        aliasDir = os.path.abspath(aliasDir)
+        self.pathAliasList = [x for x in self.pathAliasList if x[0] != aliasDir]
+        return
+
+
+    def get_index_path(
+            self,
+            filePath,
+        ):
+        for aliasDir, indexDir in self.pathAliasList:
+            if filePath.startswith(aliasDir + os.sep):
+                return indexDir + filePath[len(aliasDir) : ]
+        return filePath
+
+    #---------------------------------------
+    ### KEYS
+    #---------------------------------------
+
+    def read_digest_index(self):
+        try:
+            with open(self.digestIndexFile, "r") as rf:
+                return json.load(rf)
+        except (OSError, ValueError):
+            return {}
+
+
+    def write_digest_index(self):
+        tmpFile = self.digestIndexFile + ".tmp-" + str(os.getpid()) + "-" + str(threading.get_ident())
+        with open(tmpFile, "w") as wf:
+            json.dump(self.digestIndex, wf)
+        os.replace(tmpFile, self.digestIndexFile)
+        return
+
+
+    def get_file_digest(
+            self,
+            filePath,
+        ):
+        filePath = os.path.abspath(filePath)
+        fileStat = os.stat(filePath)
+        fileSignature = [fileStat.st_size, fileStat.st_mtime_ns]
+        indexPath = self.get_index_path(filePath)
+
+        with self.digestIndexLock:
+            indexEntry = self.digestIndex.get(indexPath)
+        if indexEntry is not None and indexEntry["signature"] == fileSignature:
+            return indexEntry["digest"]
+
+        digest = file_digest(filePath)
+        with self.digestIndexLock:
+            self.digestIndex[indexPath] = {"signature" : fileSignature, "digest" : digest}
+            self.write_digest_index()
+        return digest
+
+
+    def make_key(
+            self,
+            kind,
+            fileList,
+            parameterDict = None,
+        ):
+        keyHash = hashlib.blake2b(digest_size = 20)
+        keyHash.update(kind.encode())
+        for filePath in fileList:
+            keyHash.update(self.get_file_digest(filePath).encode())
+        keyHash.update(json.dumps(parameterDict or {}, sort_keys = True).encode())
+        return kind + "-" + keyHash.hexdigest()
+
+    #---------------------------------------
+    ### ENTRIES
+    #---------------------------------------
+
+    def get_entry_path(
+            self,
+            key,
+        ):
+        return os.path.join(self.entryDir, key)
+
+
+    def touch_entry(
+            self,
+            key,
+        ):
+        accessFile = os.path.join(self.get_entry_path(key), entryAccessFilename)
+        with open(accessFile, "a"):
+            pass
+        os.utime(accessFile, None)
+        return
+
+
+    def get_entry(
+            self,
+            key,
+        ):
+        ### Returns the entry metadata, None on a miss
+        metaFile = os.path.join(self.get_entry_path(key), entryMetaFilename)
+        try:
+            with open(metaFile, "r") as rf:
+                entryMeta = json.load(rf)
+        except (OSError, ValueError):
+            return None
+        self.touch_entry(key)
+        return entryMeta
+
+
+    def put_entry(
+            self,
+            key,
+            data = None,
+            fileList = (),
+        ):
+        ### The entry is built in a temporary directory and renamed in
+        ### place, concurrent readers never see a partial entry
+        entryPath = self.get_entry_path(key)
+        tmpEntryPath = entryPath + ".tmp-" + str(os.getpid()) + "-" + str(threading.get_ident()) + "-" + str(time.time_ns())
+        os.makedirs(tmpEntryPath)
+
+        entryFileList = []
+        for filePath in fileList:
+            filename = os.path.basename(filePath)
+            shutil.copy2(filePath, os.path.join(tmpEntryPath, filename))
+            entryFileList.append(filename)
+
+        with open(os.path.join(tmpEntryPath, entryMetaFilename), "w") as wf:
+            json.dump({"key" : key, "data" : data, "files" : entryFileList, "created" : time.time()}, wf, indent = 4)
+        with open(os.path.join(tmpEntryPath, entryAccessFilename), "w"):
+            pass
+
+        try:
+            os.rename(tmpEntryPath, entryPath)
+        except OSError:
+            ### Stored by a concurrent run in the meantime
+            shutil.rmtree(tmpEntryPath, ignore_errors = True)
+
+        self.evict()
+        return
+
+
+    def get_data(
+            self,
+            key,
+        ):
+        entryMeta = self.get_entry(key)
+        if entryMeta is None:
+            return None
+        return entryMeta["data"]
+
+
+    def put_data(
+            self,
+            key,
+            data,
+        ):
+        self.put_entry(key, data = data)
+        return
+
+
+    def get_file_path_list(
+            self,
+            key,
+        ):
+        ### Paths of the cached files, to be read (not modified) in place
+        entryMeta = self.get_entry(key)
+        if entryMeta is None:
+            return None
+        entryPath = self.get_entry_path(key)
+        return [os.path.join(entryPath, filename) for filename in entryMeta["files"]]
+
+
+    def restore_files(
+            self,
+            key,
+            targetDir,
+        ):
+        ### Copies the cached files to the target directory, returns the
+        ### restored paths or None on a miss
+        cachedFileList = self.get_file_path_list(key)
+        if cachedFileList is None:
+            return None
+        os.makedirs(targetDir, exist_ok = True)
+        restoredFileList = []
+        for cachedFile in cachedFileList:
+            targetFile = os.path.join(targetDir, os.path.basename(cachedFile))
+            shutil.copy2(cachedFile, targetFile)
+            restoredFileList.append(targetFile)
+        return restoredFileList
+
+
+    def put_files(
+            self,
+            key,
+            fileList,
+            data = None,
+        ):
+        self.put_entry(key, data = data, fileList = fileList)
+        return
+
+    #---------------------------------------
+    ### EVICTION
+    #---------------------------------------
+
+    def evict(self):
+        entryList = []
+        totalSize = 0
+        for key in os.listdir(self.entryDir):
+            entryPath = self.get_entry_path(key)
+            if ".tmp-" in key or not os.path.isdir(entryPath):
+                continue
+            try:
+                lastAccess = os.path.getmtime(os.path.join(entryPath, entryAccessFilename))
+            except OSError:
+                lastAccess = 0.0
+            entrySize = get_directory_size(entryPath)
+            entryList.append((lastAccess, entrySize, entryPath))
+            totalSize += entrySize
+
+        for lastAccess, entrySize, entryPath in sorted(entryList):
+            if totalSize <= self.maxSizeBytes:
+                break
+            shutil.rmtree(entryPath, ignore_errors = True)
+            totalSize -= entrySize
+        return totalSize
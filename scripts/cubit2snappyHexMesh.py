@@ -11,12 +11,19 @@
 
 import os
 import sys
-import platform
-import shutil
 import json
 
 import cubit
 
+### The input file runs this script through exec(), the helper modules
+### are imported from the script location given in the input file
+if "scriptLocation" in globals() and scriptLocation not in sys.path:
+    sys.path.insert(0, scriptLocation)
+
+import stl_merge
+import workspace
+
+
 def list2string(pList, sep = ", "):
     return str(sep).join([str(x) for x in pList])
 
@@ -26,25 +33,16 @@ def export_pre_formatted_stl_files( \
         bcDict, \
         blockDict, \
         bcSurfaceList = [], \
+        stlFormat = "ascii", \
     ):
     bcStlFileList = []
     blockStlFileList = []
     preFormatPostFix = "_pre_formatted"
-    checkExportDir = os.path.exists(exportDir)
     
     print("External surface list : " + ", ".join([str(x) for x in bcSurfaceList]))
     
-    if not checkExportDir:
-        if platform.system().lower() == "windows":
-            os.system("mkdir \"" + exportDir + "\"")
-        elif platform.system().lower() == "linux":
-            os.system("mkdir -p \"" + exportDir + "\"")
-    else:
-        shutil.rmtree(exportDir)
-        if platform.system().lower() == "windows":
-            os.system("mkdir \"" + exportDir + "\"")
-        elif platform.system().lower() == "linux":
-            os.system("mkdir -p \"" + exportDir + "\"")
+    ### The export directory is the staging directory of the run
+    os.makedirs(exportDir, exist_ok = True)
     
     for bcName, bcData in bcDict.items():
         print("{0:20} : {1}".format(bcName, ", ".join([str(x) for x in bcData["surface-list"]])))
@@ -52,7 +50,7 @@ def export_pre_formatted_stl_files( \
             bcStlFilename = "bc_" + str(bcName) + preFormatPostFix + ".stl"
             bcStlFileList.append(bcStlFilename)
             cmd2cub = ""
-            cmd2cub = "export stl ascii \"" + exportDir + os.sep + bcStlFilename + "\" surface " + list2string(bcData["surface-list"], sep = " ") + " mesh overwrite"
+            cmd2cub = "export stl " + stlFormat + " \"" + exportDir + os.sep + bcStlFilename + "\" surface " + list2string(bcData["surface-list"], sep = " ") + " mesh overwrite"
             print(cmd2cub)
             cubit.cmd(cmd2cub)
         else:
@@ -70,7 +68,7 @@ def export_pre_formatted_stl_files( \
             blockStlFilename = "block_" + str(block) + preFormatPostFix + ".stl"
             blockStlFileList.append(blockStlFilename)
             cmd2cub = ""
-            cmd2cub = "export stl ascii \"" + exportDir + os.sep + blockStlFilename + "\" surface " + list2string(meshedSurfaceList, sep = " ") + " mesh overwrite"
+            cmd2cub = "export stl " + stlFormat + " \"" + exportDir + os.sep + blockStlFilename + "\" surface " + list2string(meshedSurfaceList, sep = " ") + " mesh overwrite"
             print(cmd2cub)
             cubit.cmd(cmd2cub)
         else:
@@ -79,7 +77,7 @@ def export_pre_formatted_stl_files( \
     if bool(bcSurfaceList):
         completeDomainStlFilename = "complete_domain" + ".stl"
         cmd2cub = ""
-        cmd2cub = "export stl ascii \"" + exportDir + os.sep + completeDomainStlFilename + preFormatPostFix + "\"" + list2string(bcSurfaceList, sep = " ") + " mesh overwrite"
+        cmd2cub = "export stl " + stlFormat + " \"" + exportDir + os.sep + completeDomainStlFilename + preFormatPostFix + "\"" + list2string(bcSurfaceList, sep = " ") + " mesh overwrite"
     else:
         print("Complete file for the domain is missing ...")
         return None, None, None, None
@@ -87,28 +85,32 @@ def export_pre_formatted_stl_files( \
     return bcStlFileList, blockStlFileList, completeDomainStlFilename, preFormatPostFix
 
 
-def remove_surface_definition_from_stl_file( \
-        fileSourcePath, \
-        fileTargetPath, \
+def get_stl_definition_name( \
+        filename, \
         preFormatPostFix, \
-        mergeAllSolidTogether = True, \
     ):
-    wspace = " "
-    indent = wspace*4
-    baseFilename = os.path.basename(fileSourcePath)
-    with open(fileSourcePath, "r") as stlf:
-        readStlData = stlf.readlines()
-        
     stripString = preFormatPostFix + ".stl"
     stripLength = len(stripString)
     StlDefiniationName = ""
-    StlDefiniationName = baseFilename[ : (-1 * stripLength)]
-    StlDefiniationName = StlDefiniationName.split("_")[1]
+    StlDefiniationName = filename[ : (-1 * stripLength)]
+    ### Drop the "bc_"/"block_" prefix, the name itself may contain "_"
+    StlDefiniationName = StlDefiniationName.split("_", 1)[1]
+    return StlDefiniationName
+
+
+def print_formatted_stl_file_info( \
+        fileSourcePath, \
+        fileTargetPath, \
+        StlDefiniationName, \
+        solidNameList, \
+    ):
+    wspace = " "
+    indent = wspace*4
     print("\n")
     
     str2print = "-"*40 + "\n"
     str2print += "[*] Source filename : " + "\n"
-    str2print += baseFilename + "\n"
+    str2print += os.path.basename(fileSourcePath) + "\n"
     str2print += "" + "\n"
     str2print += "[*] Target filename : " + "\n"
     str2print += os.path.basename(fileTargetPath) + "\n"
@@ -116,61 +118,67 @@ def remove_surface_definition_from_stl_file( \
     str2print += "[*] STL solid definition name : " + "\n"
     str2print += StlDefiniationName + "\n"
     str2print += "" + "\n"
-    print(str2print)
-    
-    solidDefinitionStartList = []
-    solidDefinitionEndList = []
-    solidNameList = []
-    
-    nSolid = 0
-    searchStringStart = "solid "
-    searchStringStartLen = len(searchStringStart)
-    searchStringEnd = "endsolid "
-    searchStringEndLen = len(searchStringEnd)
-    
-    for index, line in enumerate(readStlData):
-        if line[ : searchStringStartLen] == searchStringStart:
-            solidDefinitionStartList.append(index)
-            nSolid += 1
-            solidNameList.append(line.replace(searchStringStart, ""))
-        elif line[ : searchStringEndLen] == searchStringEnd:
-            solidDefinitionEndList.append(index)
-    solidNameListStr = ""
-    for solidName in solidNameList:
-        solidNameListStr += str(solidName.rstrip("\n")) + ", "
-    ### Removing the last entry of the newline ("\n")
-    solidNameListStr = solidNameListStr.strip("\n")
-    
-    str2print = ""
     str2print += "-"*40 + "\n"
-    str2print += "Number of \"Solid\" definition : " + str(nSolid) + "\n"
-    str2print += "Names of \"Solid\" definition : " + "\n" + indent + solidNameListStr.replace(", ", "\n" + indent) + "\n"
+    str2print += "Number of \"Solid\" definition : " + str(len(solidNameList)) + "\n"
+    str2print += "Names of \"Solid\" definition : " + "\n" + indent + ("\n" + indent).join(solidNameList) + "\n"
     str2print += "" + "\n"
     print(str2print)
+    return
+
+
+def remove_surface_definition_from_stl_file( \
+        fileSourcePath, \
+        fileTargetPath, \
+        preFormatPostFix, \
+        mergeAllSolidTogether = True, \
+    ):
+    StlDefiniationName = get_stl_definition_name( \
+            os.path.basename(fileSourcePath), \
+            preFormatPostFix, \
+        )
     
-    solidDefinitionTotal = []
-    for i in range(nSolid):
-        solidDefinition = None
-        start = solidDefinitionStartList[i]
-        end = solidDefinitionEndList[i] + 1
-        
-        if mergeAllSolidTogether:
-            solidDefinition = readStlData[(start + 1) : (end - 1)]
-        else:
-            solidDefinition = readStlData[start : end]
-        solidDefinitionTotal.extend(solidDefinition)
-        
-        if mergeAllSolidTogether:
-            solidDefinitionTotal.insert(0, ("solid " + StlDefiniationName + "\n"))
-            solidDefinitionTotal.append("endsolid " + StlDefiniationName + "\n")
-    
+    solidNameList = stl_merge.format_stl_file( \
+            fileSourcePath, \
+            fileTargetPath, \
+            StlDefiniationName, \
+            mergeAllSolidTogether, \
+        )
     
-        solidDefinitionTotalStr = "".join([x for x in solidDefinitionTotal])
-        
-        with open(fileTargetPath, "w") as tf:
-            tf.write(solidDefinitionTotalStr)
+    print_formatted_stl_file_info( \
+            fileSourcePath, \
+            fileTargetPath, \
+            StlDefiniationName, \
+            solidNameList, \
+        )
+    return solidNameList
+
+
+def get_stl_format_task_list( \
+        stlFileList, \
+        preFormatPostFix, \
+        exportDir, \
+        snappyHexReadyStlFileDirPath, \
+        mergeAllSolidTogether, \
+        stlFormat = "ascii", \
+    ):
+    formattedStlList = []
+    taskList = []
     
-    return solidDefinitionTotal
+    for filename in stlFileList:
+        stripString = preFormatPostFix + ".stl"
+        stripLength = len(stripString)
+        baseFilename = ""
+        baseFilename = filename[ : (-1 * stripLength)]
+        baseFilename += ".stl"
+        formattedStlList.append(baseFilename)
+        taskList.append({ \
+                "source" : exportDir + os.sep + filename, \
+                "target" : snappyHexReadyStlFileDirPath + os.sep + baseFilename, \
+                "solid-name" : get_stl_definition_name(filename, preFormatPostFix), \
+                "merge-all-solid-together" : mergeAllSolidTogether, \
+                "stl-format" : stlFormat, \
+            })
+    return formattedStlList, taskList
 
 
 def format_exported_stl_file( \
@@ -182,91 +190,89 @@ def format_exported_stl_file( \
         snappyHexReadyStlFileDirPath, \
         mergeAllSolidTogether = True, \
         mergeAllBcStlTogether = True, \
+        nStlFormatProcess = 0, \
+        stlFormat = "ascii", \
     ):
-    stlDataAsList = []
-    stlDataAsListTotal = []
-    formattedBcStlList = []
-    formattedBlockStlList = []
     combinedBcStlFilename = "combinedBcStl" + ".stl"
     combinedBlockStlFilename = "combinedBlockStl" + ".stl"
+    combinedBcStlFile = snappyHexReadyStlFileDirPath + os.sep + combinedBcStlFilename
+    combinedBlockStlFile = snappyHexReadyStlFileDirPath + os.sep + combinedBlockStlFilename
     
-    if not os.path.exists(snappyHexReadyStlFileDirPath):
-        if platform.system().lower() == "windows":
-            os.system("mkdir \"" + snappyHexReadyStlFileDirPath + "\"")
-        elif platform.system().lower() == "linux":
-            os.system("mkdir -p \"" + snappyHexReadyStlFileDirPath + "\"")
-    else:
-        shutil.rmtree(snappyHexReadyStlFileDirPath)
-        if platform.system().lower() == "windows":
-            os.system("mkdir \"" + snappyHexReadyStlFileDirPath + "\"")
-        elif platform.system().lower() == "linux":
-            os.system("mkdir -p \"" + snappyHexReadyStlFileDirPath + "\"")
+    os.makedirs(snappyHexReadyStlFileDirPath, exist_ok = True)
     
-    for filename in bcStlFileList:
-        stripString = preFormatPostFix + ".stl"
-        stripLength = len(stripString)
-        baseFilename = ""
-        baseFilename = filename[ : (-1 * stripLength)]
-        baseFilename += ".stl"
-        print("\n")
-        print(filename)
-        print(baseFilename)
-        formattedBcStlList.append(baseFilename)
-        fileSourcePath = exportDir + os.sep + filename
-        fileTargetPath = snappyHexReadyStlFileDirPath + os.sep + baseFilename
-        
-        stlDataAsList = remove_surface_definition_from_stl_file( \
-                                fileSourcePath, \
-                                fileTargetPath, \
-                                preFormatPostFix, \
-                                mergeAllSolidTogether, \
-                            )
-    
-    for filename in blockStlFileList:
-        stripString = preFormatPostFix + ".stl"
-        stripLength = len(stripString)
-        baseFilename = ""
-        baseFilename = filename[ : (-1 * stripLength)]
-        baseFilename += ".stl"
-        print("\n")
-        print(filename)
-        print(baseFilename)
-        formattedBlockStlList.append(baseFilename)
-        fileSourcePath = exportDir + os.sep + filename
-        fileTargetPath = snappyHexReadyStlFileDirPath + os.sep + baseFilename
-        
-        stlDataAsList = remove_surface_definition_from_stl_file( \
-                                fileSourcePath, \
-                                fileTargetPath, \
-                                preFormatPostFix, \
-                                mergeAllSolidTogether, \
-                            )
-        stlDataAsListTotal.extend(stlDataAsList)
+    formattedBcStlList, bcTaskList = get_stl_format_task_list( \
+            bcStlFileList, \
+            preFormatPostFix, \
+            exportDir, \
+            snappyHexReadyStlFileDirPath, \
+            mergeAllSolidTogether, \
+            stlFormat, \
+        )
+    formattedBlockStlList, blockTaskList = get_stl_format_task_list( \
+            blockStlFileList, \
+            preFormatPostFix, \
+            exportDir, \
+            snappyHexReadyStlFileDirPath, \
+            mergeAllSolidTogether, \
+            stlFormat, \
+        )
     
     completeDomainStlFilename = completeDomainStlFilename.rstrip(preFormatPostFix + ".stl")
     completeDomainStlFilename += ".stl"
+    
     if mergeAllBcStlTogether:
         str2print = "\n"
         str2print += "Merging all STL files which represent BCs" + "\n"
         str2print += "-----------------------------------------" + "\n"
         print(str2print)
+    
+    ### Serial run with merging writes the combined files while formatting,
+    ### otherwise all files are formatted at once in a process pool and
+    ### the formatted files are concatenated afterwards. Binary combined
+    ### files keep the region of every triangle in its attribute field.
+    if mergeAllBcStlTogether and nStlFormatProcess == 1:
+        bcSolidNameList = stl_merge.format_and_merge_stl_files( \
+                bcTaskList, \
+                combinedBcStlFile, \
+                nStlFormatProcess, \
+            )
+        blockSolidNameList = stl_merge.format_and_merge_stl_files( \
+                blockTaskList, \
+                combinedBlockStlFile, \
+                nStlFormatProcess, \
+            )
+    else:
+        solidNameListAll = stl_merge.format_stl_files( \
+                bcTaskList + blockTaskList, \
+                nStlFormatProcess, \
+            )
+        bcSolidNameList = solidNameListAll[ : len(bcTaskList)]
+        blockSolidNameList = solidNameListAll[len(bcTaskList) : ]
         
-        os.chdir(snappyHexReadyStlFileDirPath)
-        
-        if platform.system().lower() == "windows":
-            os.system("type " + list2string(formattedBcStlList, sep = " ") + " > " + combinedBcStlFilename)
-            os.system("type " + list2string(formattedBlockStlList, sep = " ") + " > " + combinedBlockStlFilename)
-        elif platform.system().lower() == "linux":
-            os.system("cat " + list2string(formattedBcStlList, sep = " ") + " > " + combinedBcStlFilename)
-            os.system("cat " + list2string(formattedBlockStlList, sep = " ") + " > " + combinedBlockStlFilename)
-        
-        os.chdir(workingDir)
-        
+        if mergeAllBcStlTogether:
+            stl_merge.merge_formatted_stl_files( \
+                    bcTaskList, \
+                    combinedBcStlFile, \
+                )
+            stl_merge.merge_formatted_stl_files( \
+                    blockTaskList, \
+                    combinedBlockStlFile, \
+                )
+    
+    for taskDict, solidNameList in zip(bcTaskList + blockTaskList, bcSolidNameList + blockSolidNameList):
+        print_formatted_stl_file_info( \
+                taskDict["source"], \
+                taskDict["target"], \
+                taskDict["solid-name"], \
+                solidNameList, \
+            )
+    
     return ( \
             formattedBcStlList, \
             formattedBlockStlList, \
             combinedBcStlFilename, \
             combinedBlockStlFilename, \
+            [taskDict["solid-name"] for taskDict in bcTaskList], \
         )
 
 def write_crash_report( \
@@ -295,14 +301,27 @@ def write_crash_report( \
 
 #--------------------------------------- 
 
+### Defaults for the inputs missing in older input files
+if "nStlFormatProcess" not in globals():
+    nStlFormatProcess = 0
+if "stlFormat" not in globals():
+    stlFormat = "ascii"
+
+#--------------------------------------- 
+
+### The JSON file of the previous run stays until the new one is published
+### with the export directory
 removeFileList = [ \
-    workingDir + os.sep + "snappyHexInfo.json", \
     workingDir + os.sep + "crash_report.txt", \
 ]
 
-for item in removeFileList:
-    if os.path.exists(item):
-        os.remove(item)
+### The files of the previous run are removed under the workspace lock,
+### a mesh generation run reading them holds it shared
+workspaceLockFile = workspace.get_lock_file(workingDir)
+with workspace.locked(workspaceLockFile):
+    for item in removeFileList:
+        if os.path.exists(item):
+            os.remove(item)
 
 #---------------------------------------
 fileExtension = inputGeometry.split(".")[-1]
@@ -403,66 +422,84 @@ cubit.cmd("mesh surface all")
 
 #--------------------------------------- 
 
-( \
-    bcStlFileList, \
-    blockStlFileList, \
-    completeDomainStlFilename, \
-    preFormatPostFix, \
-) = export_pre_formatted_stl_files( \
-        exportDir, \
-        bcDict, \
-        blockDict, \
-        bcSurfaceList, \
+### The STL files are exported and formatted in a staging directory of the
+### run, published to the export directory at the end
+runId = workspace.get_run_id()
+try:
+    stagingExportDir = workspace.create_staging_directory(exportDir.rstrip(os.sep), runId)
+
+    ( \
+        bcStlFileList, \
+        blockStlFileList, \
+        completeDomainStlFilename, \
+        preFormatPostFix, \
+    ) = export_pre_formatted_stl_files( \
+            stagingExportDir, \
+            bcDict, \
+            blockDict, \
+            bcSurfaceList, \
+            stlFormat, \
+        )
+
+    snappyHexReadyStlFileDir = "snappyHexMesh_ready_stl_files"
+
+    ( \
+        formattedBcStlList, \
+        formattedBlockStlList, \
+        combinedBcStlFilename, \
+        combinedBlockStlFilename, \
+        combinedBcRegionList, \
+    ) = format_exported_stl_file( \
+        bcStlFileList, \
+        blockStlFileList, \
+        completeDomainStlFilename, \
+        preFormatPostFix, \
+        stagingExportDir, \
+        stagingExportDir + os.sep + snappyHexReadyStlFileDir, \
+        mergeAllSolidTogether, \
+        mergeAllBcStlTogether, \
+        nStlFormatProcess, \
+        stlFormat, \
     )
 
-snappyHexReadyStlFileDir = "snappyHexMesh_ready_stl_files"
-
-resultDict = {}
-resultDict["snappyhex-ready-stl-dir"] = exportDir.rstrip(os.sep) + os.sep + snappyHexReadyStlFileDir
-
-( \
-    formattedBcStlList, \
-    formattedBlockStlList, \
-    combinedBcStlFilename, \
-    combinedBlockStlFilename, \
-) = format_exported_stl_file( \
-    bcStlFileList, \
-    blockStlFileList, \
-    completeDomainStlFilename, \
-    preFormatPostFix, \
-    exportDir, \
-    resultDict["snappyhex-ready-stl-dir"], \
-    mergeAllSolidTogether, \
-    mergeAllBcStlTogether, \
-)
-
-bcInfoDict = {}
-blockInfoDict = {}
-
-for bcName, bcData in bcDict.items():
-    bcInfoDict[bcName] = {
-        "bc-stl-file" : "bc_" + bcName + ".stl",
-        "type" : bcData["type"]
-    }
-
-for block, volumeList in blockDict.items():
-    blockInfoDict[block] = "block_" + block + ".stl"
-
-resultDict = {}
-resultDict["snappyhex-ready-stl-dir"] = exportDir.rstrip(os.sep) + os.sep + snappyHexReadyStlFileDir
-resultDict["bc-info"] = bcInfoDict
-resultDict["bc-stl-file-list"] = formattedBcStlList
-resultDict["block-info"] = blockInfoDict
-resultDict["block-stl-file-list"] = formattedBlockStlList
-resultDict["combined-bc-stl-filename"] = combinedBcStlFilename
-resultDict["combined-block-stl-filename"] = combinedBlockStlFilename
-# resultDict[""] = ""
-
-snappyHexInfoFilename = "snappyHexInfo.json"
-snappyHexInfoFile = workingDir + os.sep + snappyHexInfoFilename
-
-with open(snappyHexInfoFile, "w") as ojf:
-    json.dump(resultDict, ojf, indent = indent)
+    bcInfoDict = {}
+    blockInfoDict = {}
+
+    for bcName, bcData in bcDict.items():
+        bcInfoDict[bcName] = {
+            "bc-stl-file" : "bc_" + bcName + ".stl",
+            "type" : bcData["type"]
+        }
+
+    for block, volumeList in blockDict.items():
+        blockInfoDict[block] = "block_" + block + ".stl"
+
+    resultDict = {}
+    resultDict["snappyhex-ready-stl-dir"] = exportDir.rstrip(os.sep) + os.sep + snappyHexReadyStlFileDir
+    resultDict["bc-info"] = bcInfoDict
+    resultDict["bc-stl-file-list"] = formattedBcStlList
+    resultDict["block-info"] = blockInfoDict
+    resultDict["block-stl-file-list"] = formattedBlockStlList
+    resultDict["combined-bc-stl-filename"] = combinedBcStlFilename
+    resultDict["combined-block-stl-filename"] = combinedBlockStlFilename
+    resultDict["combined-bc-region-list"] = combinedBcRegionList
+    resultDict["stl-format"] = stlFormat
+    # resultDict[""] = ""
+
+    snappyHexInfoFilename = "snappyHexInfo.json"
+    snappyHexInfoFile = workingDir + os.sep + snappyHexInfoFilename
+
+    ### Export directory and JSON file published together (one exclusive
+    ### lock section)
+    workspace.publish_directory( \
+            stagingExportDir, \
+            exportDir.rstrip(os.sep), \
+            workspaceLockFile, \
+            {snappyHexInfoFile : json.dumps(resultDict, indent = indent)}, \
+        )
+finally:
+    ### A failed run removes its staging directory
+    workspace.release_staging_directory(exportDir.rstrip(os.sep), runId)
 
 #---------------------------------------
 
@@ -0,0 +1,519 @@
+"""
+    Execution backends of the OpenFOAM utilities, where a utility runs.
+
+    - local     : on this machine, under the process supervisor. A parallel
+                  run (more than one process) goes to the local MPI backend.
+    - local-mpi : "<mpirun_command> -np N <utility>" on this machine, under
+                  the process supervisor.
+    - slurm     : batch job of the SLURM scheduler. The job script
+                  (slurm_<log>.sh in the case directory) is submitted with
+                  sbatch, the OpenFOAM environment of the run is exported
+                  to the job, and the job is polled with squeue (sacct for
+                  its final state). The output of the job is read as it is
+                  written and handed to the log file and the progress
+                  monitor like the output of a local run. The time/memory
+                  limits of the utility are the --time/--mem-per-cpu of the
+                  job, a cancelled case (or Ctrl-C) cancels its jobs
+                  (scancel). A batch job takes no cores of the local budget.
+    - The backend of a utility is looked up by its log name like the
+      utility limits : "<backend>" (all utilities) or
+      "<utility>=<backend>, ...", the utilities not listed run locally.
+    - The case directory is on a filesystem shared with the compute nodes.
+    - The SLURM commands are found on the PATH, the stand-ins of
+      benchmarks/fake_slurm run the jobs on this machine.
+"""
+
+import os
+import math
+import time
+import shlex
+import signal
+import threading
+import subprocess
+
+import openfoam_env
+import resource_usage
+import process_supervisor
+
+
+#---------------------------------------
+
+backendNameList = ["local", "local-mpi", "slurm"]
+
+sbatchCommand = "sbatch"
+squeueCommand = "squeue"
+sacctCommand = "sacct"
+scancelCommand = "scancel"
+
+### Final states of a job ended by the scheduler
+slurmReasonDict = {
+    "TIMEOUT" : "timeout",
+    "DEADLINE" : "timeout",
+    "OUT_OF_MEMORY" : "memory-limit",
+    "CANCELLED" : "cancelled",
+    "PREEMPTED" : "cancelled",
+}
+### The exit code file of a finished job may show up late on the shared
+### filesystem, not waited for longer than this
+exitFileTimeout = 30.0
+
+### Submitted jobs --> tag of the case (cancelled together)
+slurmJobDict = {}
+slurmJobLock = threading.Lock()
+
+
+#---------------------------------------
+
+def parse_backend_string(
+        backendString,
+    ):
+    ### "<backend>" or "<utility>=<backend>, ..." --> utility --> backend
+    ### ("*" for all utilities)
+    backendDict = {}
+    for item in str(backendString or "local").split(","):
+        if not item.strip():
+            continue
+        name, separator, backendName = item.rpartition("=")
+        backendName = backendName.strip().lower()
+        if backendName not in backendNameList:
+            raise ValueError("Unknown execution backend : " + backendName)
+        backendDict[name.strip() or "*"] = backendName
+    return backendDict
+
+
+def parse_slurm_time(
+        timeString,
+    ):
+    ### "[DD-][HH:]MM:SS[.mmm]" --> seconds
+    days = 0.0
+    if "-" in timeString:
+        dayString, timeString = timeString.split("-", 1)
+        days = float(dayString)
+    seconds = 0.0
+    for field in timeString.split(":"):
+        seconds = seconds*60 + float(field)
+    return days*86400 + seconds
+
+
+def parse_slurm_memory(
+        memoryString,
+    ):
+    ### "123456K", "1.5G", ... --> bytes
+    scaleDict = {"K" : 1024, "M" : 1024**2, "G" : 1024**3, "T" : 1024**4}
+    if memoryString[-1 : ].upper() in scaleDict:
+        return int(float(memoryString[ : -1]) * scaleDict[memoryString[-1].upper()])
+    return int(float(memoryString))
+
+
+def cancel_slurm_jobs(
+        tag = None,
+    ):
+    ### Jobs of a case (all jobs if None), called by the process supervisor
+    with slurmJobLock:
+        jobIdList = [k for k, v in slurmJobDict.items() if tag is None or v["tag"] == tag]
+        for jobId in jobIdList:
+            slurmJobDict[jobId]["cancelled"] = True
+    for jobId in jobIdList:
+        try:
+            subprocess.run([scancelCommand, jobId], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+        except OSError:
+            pass
+    return len(jobIdList)
+
+
+#---------------------------------------
+
+class LocalBackend(object):
+    ### The utility as a process of this machine
+    name = "local"
+    isBatch = False
+
+    def __init__(
+            self,
+            mpiBackend = None,
+        ):
+        self.mpiBackend = mpiBackend
+        return
+
+
+    def get_command_list(
+            self,
+            utilityCommand,
+            nProcs,
+        ):
+        return openfoam_env.get_command_list(utilityCommand)
+
+
+    def get_backend(
+            self,
+            nProcs,
+        ):
+        if nProcs > 1 and self.mpiBackend is not None:
+            return self.mpiBackend
+        return self
+
+
+    def describe(
+            self,
+            utilityCommand,
+            nProcs,
+        ):
+        backend = self.get_backend(nProcs)
+        return "\"" + shlex.join(backend.get_command_list(utilityCommand, nProcs)) + "\""
+
+
+    def run(
+            self,
+            utilityCommand,
+            nProcs,
+            logName,
+            caseDir,
+            openfoamEnv,
+            logFile,
+            lineFunction,
+            timeout = None,
+            memoryLimit = None,
+        ):
+        ### Returns {"return-code", "usage", "reason"}, see
+        ### process_supervisor.ProcessSupervisor.run
+        backend = self.get_backend(nProcs)
+        return process_supervisor.get_supervisor().run(
+                backend.get_command_list(utilityCommand, nProcs),
+                caseDir,
+                openfoamEnv,
+                logFile,
+                lineFunction,
+                timeout,
+                memoryLimit,
+            )
+
+
+class LocalMpiBackend(LocalBackend):
+    ### The utility started by mpirun on this machine
+    name = "local-mpi"
+
+    def __init__(
+            self,
+            mpirunCommand = "mpirun",
+        ):
+        LocalBackend.__init__(self)
+        self.mpirunCommand = mpirunCommand
+        return
+
+
+    def get_command_list(
+            self,
+            utilityCommand,
+            nProcs,
+        ):
+        return shlex.split(self.mpirunCommand) + ["-np", str(nProcs)] + openfoam_env.get_command_list(utilityCommand)
+
+
+#---------------------------------------
+
+class SlurmBackend(object):
+    ### The utility as a batch job of the SLURM scheduler
+    name = "slurm"
+    isBatch = True
+
+    def __init__(
+            self,
+            sbatchOptions = "",
+            launcherCommand = "srun",
+            pollInterval = 10.0,
+        ):
+        ### sbatchOptions   --> options of every job, e.g.
+        ###                     "--partition=compute --account=cfd"
+        ### launcherCommand --> starts the processes of a parallel run in
+        ###                     the job (srun, mpirun)
+        ### pollInterval    --> seconds between two squeue calls
+        self.sbatchOptionList = shlex.split(sbatchOptions or "")
+        self.launcherCommand = launcherCommand
+        self.pollInterval = pollInterval
+        return
+
+
+    def describe(
+            self,
+            utilityCommand,
+            nProcs,
+        ):
+        return "\"" + shlex.join(openfoam_env.get_command_list(utilityCommand)) + "\" as a SLURM job (" + str(nProcs) + " task(s))"
+
+
+    def get_job_script(
+            self,
+            utilityCommand,
+            nProcs,
+            logName,
+            caseDir,
+            outputFile,
+            exitFile,
+            timeout = None,
+            memoryLimit = None,
+        ):
+        commandList = openfoam_env.get_command_list(utilityCommand)
+        if nProcs > 1:
+            commandList = shlex.split(self.launcherCommand) + commandList
+        optionList = [
+            "--job-name=" + logName,
+            "--chdir=" + caseDir,
+            "--output=" + outputFile,
+            "--ntasks=" + str(nProcs),
+            "--export=ALL",
+        ]
+        if timeout is not None:
+            optionList.append("--time=" + str(max(int(math.ceil(timeout / 60.0)), 1)))
+        if memoryLimit is not None:
+            optionList.append("--mem-per-cpu=" + str(max(int(math.ceil(memoryLimit / 1024**2 / nProcs)), 1)) + "M")
+        optionList += self.sbatchOptionList
+
+        str2print =  "#!/bin/bash\n"
+        for option in optionList:
+            str2print += "#SBATCH " + option + "\n"
+        str2print += "\n"
+        str2print += "### " + logName + ", run in the OpenFOAM environment of the submission\n"
+        str2print += shlex.join(commandList) + "\n"
+        str2print += "returnCode=$?\n"
+        str2print += "echo $returnCode > " + shlex.quote(exitFile + ".tmp") + " && mv " + shlex.quote(exitFile + ".tmp") + " " + shlex.quote(exitFile) + "\n"
+        str2print += "exit $returnCode\n"
+        return str2print
+
+
+    def submit_job(
+            self,
+            scriptFile,
+            caseDir,
+            openfoamEnv,
+            logFile,
+        ):
+        ### Job id, None if sbatch failed (its output is written to the log)
+        try:
+            result = subprocess.run(
+                    [sbatchCommand, "--parsable", scriptFile],
+                    cwd = caseDir,
+                    env = openfoamEnv,
+                    stdout = subprocess.PIPE,
+                    stderr = subprocess.STDOUT,
+                )
+        except OSError as e:
+            logFile.write((str(e) + "\n").encode())
+            return None
+        if result.returncode != 0:
+            logFile.write(result.stdout)
+            return None
+        ### "<job id>[;<cluster>]"
+        return result.stdout.decode().strip().split(";")[0]
+
+
+    def get_job_state(
+            self,
+            jobId,
+        ):
+        ### State while the job is in the queue, None once it left it. A
+        ### failing squeue (e.g. a busy controller) is asked again later.
+        try:
+            result = subprocess.run(
+                    [squeueCommand, "-h", "-j", jobId, "-o", "%T"],
+                    stdout = subprocess.PIPE,
+                    stderr = subprocess.PIPE,
+                )
+        except OSError:
+            return "UNKNOWN"
+        if result.returncode != 0:
+            if b"Invalid job id" in result.stderr:
+                return None
+            return "UNKNOWN"
+        stateList = result.stdout.decode().split()
+        return stateList[0] if stateList else None
+
+
+    def get_final_state(
+            self,
+            jobId,
+        ):
+        ### State of the finished job (sacct), None if unknown
+        try:
+            result = subprocess.run(
+                    [sacctCommand, "-n", "-X", "-P", "-j", jobId, "-o", "State"],
+                    stdout = subprocess.PIPE,
+                    stderr = subprocess.DEVNULL,
+                )
+        except OSError:
+            return None
+        stateList = result.stdout.decode().split()
+        ### e.g. "CANCELLED by 1000"
+        return stateList[0] if result.returncode == 0 and stateList else None
+
+
+    def get_job_usage(
+            self,
+            jobId,
+        ):
+        ### CPU times of the job and peak RSS of its steps (sacct), in the
+        ### form of resource_usage.wait_process, None if unknown
+        try:
+            result = subprocess.run(
+                    [sacctCommand, "-n", "-P", "-j", jobId, "-o", "UserCPU,SystemCPU,MaxRSS"],
+                    stdout = subprocess.PIPE,
+                    stderr = subprocess.DEVNULL,
+                )
+        except OSError:
+            return None
+        lineList = [x.split("|") for x in result.stdout.decode().splitlines() if x.strip()]
+        if result.returncode != 0 or not lineList:
+            return None
+        try:
+            ### The first line is the allocation, the steps after it
+            usageDict = {
+                    "user-time" : parse_slurm_time(lineList[0][0]),
+                    "sys-time" : parse_slurm_time(lineList[0][1]),
+                    "max-rss" : max([parse_slurm_memory(x[2]) for x in lineList if len(x) > 2 and x[2]] + [0]),
+                }
+        except (ValueError, IndexError):
+            return None
+        for name in resource_usage.ioCounterList:
+            usageDict[name] = None
+        return usageDict
+
+
+    def read_job_output(
+            self,
+            outputFile,
+            offset,
+            pending,
+            logFile,
+            lineFunction,
+        ):
+        ### New lines of the job output, returns the offset and the part of
+        ### the last line not written yet
+        try:
+            with open(outputFile, "rb") as rf:
+                rf.seek(offset)
+                data = rf.read()
+        except FileNotFoundError:
+            return offset, pending
+        offset += len(data)
+        lineList = (pending + data).split(b"\n")
+        for line in lineList[ : -1]:
+            logFile.write(line + b"\n")
+            if lineFunction is not None and lineFunction((line + b"\n").decode(errors = "replace")):
+                logFile.flush()
+        return offset, lineList[-1]
+
+
+    def run(
+            self,
+            utilityCommand,
+            nProcs,
+            logName,
+            caseDir,
+            openfoamEnv,
+            logFile,
+            lineFunction,
+            timeout = None,
+            memoryLimit = None,
+        ):
+        ### Waits for the job, returns {"return-code", "usage", "reason"}
+        ### like a local run (the usage reported by sacct, no I/O)
+        supervisor = process_supervisor.get_supervisor()
+        supervisor.add_cancel_function(cancel_slurm_jobs)
+        tag = process_supervisor.processTag.get()
+        if supervisor.is_cancelled(tag):
+            return {"return-code" : -signal.SIGTERM, "usage" : None, "reason" : "cancelled"}
+
+        caseDir = os.path.abspath(caseDir)
+        scriptFile = caseDir + os.sep + "slurm_" + logName + ".sh"
+        outputFile = caseDir + os.sep + "slurm_" + logName + ".out"
+        exitFile = caseDir + os.sep + "slurm_" + logName + ".exit"
+        for path in [outputFile, exitFile]:
+            if os.path.exists(path):
+                os.remove(path)
+        with open(scriptFile, "w") as wf:
+            wf.write(self.get_job_script(utilityCommand, nProcs, logName, caseDir, outputFile, exitFile, timeout, memoryLimit))
+
+        jobId = self.submit_job(scriptFile, caseDir, openfoamEnv, logFile)
+        if jobId is None:
+            print("Warning : the SLURM job of \"" + logName + "\" was not submitted, see log_" + logName + ".log")
+            return {"return-code" : 1, "usage" : None, "reason" : None}
+        with slurmJobLock:
+            slurmJobDict[jobId] = {"tag" : tag, "cancelled" : False}
+        ### Cancelled between the check and the submission
+        if supervisor.is_cancelled(tag):
+            cancel_slurm_jobs(tag)
+        print("SLURM job " + jobId + " submitted (" + os.path.basename(scriptFile) + ")")
+
+        try:
+            offset, pending = 0, b""
+            lastState = None
+            while True:
+                state = self.get_job_state(jobId)
+                offset, pending = self.read_job_output(outputFile, offset, pending, logFile, lineFunction)
+                if state is None:
+                    break
+                if state != lastState and state != "UNKNOWN":
+                    print("SLURM job " + jobId + " : " + state)
+                    lastState = state
+                time.sleep(self.pollInterval)
+
+            finalState = self.get_final_state(jobId)
+            usageDict = self.get_job_usage(jobId)
+            reason = slurmReasonDict.get(finalState)
+            waitTime = 0.0
+            while not os.path.exists(exitFile) and reason is None and waitTime < exitFileTimeout:
+                time.sleep(1.0)
+                waitTime += 1.0
+            offset, pending = self.read_job_output(outputFile, offset, pending, logFile, lineFunction)
+            if pending:
+                logFile.write(pending + b"\n")
+        finally:
+            with slurmJobLock:
+                jobDict = slurmJobDict.pop(jobId)
+
+        if jobDict["cancelled"]:
+            reason = "cancelled"
+        returnCode = 1
+        if reason is not None:
+            returnCode = -signal.SIGTERM
+        elif os.path.exists(exitFile):
+            with open(exitFile, "r") as rf:
+                returnCode = int(rf.read().strip() or 1)
+        print("SLURM job " + jobId + " : " + str(finalState or "finished") + " (exit code " + str(returnCode) + ")")
+        return {"return-code" : returnCode, "usage" : usageDict, "reason" : reason}
+
+
+#---------------------------------------
+
+class ExecutionBackends(object):
+    ### Backend of every utility of a run
+
+    def __init__(
+            self,
+            backendString = "local",
+            mpirunCommand = "mpirun",
+            slurmOptions = "",
+            slurmLauncher = "srun",
+            slurmPollInterval = 10.0,
+        ):
+        self.backendDict = parse_backend_string(backendString)
+        mpiBackend = LocalMpiBackend(mpirunCommand)
+        self.backendObjectDict = {
+            "local" : LocalBackend(mpiBackend),
+            "local-mpi" : mpiBackend,
+            "slurm" : SlurmBackend(slurmOptions, slurmLauncher, float(slurmPollInterval)),
+        }
+        return
+
+
+    def get_backend(
+            self,
+            logName,
+        ):
+        ### e.g. "snappyHexMesh_castellate" --> exact name, "snappyHexMesh",
+        ### "*", local
+        backendName = "local"
+        for name in [logName, logName.split("_")[0], "*"]:
+            if name in self.backendDict:
+                backendName = self.backendDict[name]
+                break
+        return self.backendObjectDict[backendName]
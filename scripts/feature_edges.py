@@ -0,0 +1,137 @@
+"""
+    Feature edge extraction for the snappyHexMesh automation process.
+
+    Replaces the "surfaceFeatureExtract" utility for the surfaces
+    referenced in the snappyHexMeshDict, using the same rules as its
+    "extractFromSurface" method -
+
+    - Edges whose adjacent face normals differ by more than
+      (180 - includedAngle) degrees.
+    - Edges between two regions (BCs) of the surface.
+    - Open edges (one face) and non-manifold edges (more than two faces).
+
+    The feature edges are written as an OpenFOAM ".eMesh" file.
+"""
+
+import io
+
+import numpy as np
+
+
+#---------------------------------------
+
+def classify_feature_edges(
+        surface,
+        includedAngle = 150,
+        regionEdges = True,
+        openEdges = True,
+        nonManifoldEdges = True,
+    ):
+    adjacencyDict = surface.edge_face_adjacency()
+    edges = adjacencyDict["edges"]
+    edgeFaceCount = adjacencyDict["edge-face-count"]
+    edgeFaceOffsets = adjacencyDict["edge-face-offsets"]
+    edgeFaces = adjacencyDict["edge-faces"]
+
+    manifoldEdgeIndex = np.nonzero(edgeFaceCount == 2)[0]
+    face0 = edgeFaces[edgeFaceOffsets[manifoldEdgeIndex]]
+    face1 = edgeFaces[edgeFaceOffsets[manifoldEdgeIndex] + 1]
+
+    faceNormals = surface.face_normals()
+    minCos = np.cos(np.radians(180.0 - includedAngle))
+    normalCos = np.einsum("ij,ij->i", faceNormals[face0], faceNormals[face1])
+
+    regionIndexArray = surface.region_index_array()
+
+    isAngleEdge = np.zeros(edges.shape[0], dtype = bool)
+    isAngleEdge[manifoldEdgeIndex] = normalCos < minCos
+    isRegionEdge = np.zeros(edges.shape[0], dtype = bool)
+    if regionEdges:
+        isRegionEdge[manifoldEdgeIndex] = regionIndexArray[face0] != regionIndexArray[face1]
+    isOpenEdge = edgeFaceCount == 1
+    isNonManifoldEdge = edgeFaceCount > 2
+
+    isFeatureEdge = isAngleEdge | isRegionEdge
+    if openEdges:
+        isFeatureEdge |= isOpenEdge
+    if nonManifoldEdges:
+        isFeatureEdge |= isNonManifoldEdge
+
+    featureEdgeDict = {
+            "edges" : edges[isFeatureEdge],
+            "n-edges" : int(edges.shape[0]),
+            "n-feature-edges" : int(isFeatureEdge.sum()),
+            "n-angle-edges" : int(isAngleEdge.sum()),
+            "n-region-edges" : int((isRegionEdge & ~isAngleEdge).sum()),
+            "n-open-edges" : int(isOpenEdge.sum()),
+            "n-non-manifold-edges" : int(isNonManifoldEdge.sum()),
+        }
+    return featureEdgeDict
+
+
+def compact_edge_points(
+        points,
+        edges,
+    ):
+    ### Only the points used by the edges, edges renumbered accordingly
+    usedPointIndex, compactEdges = np.unique(edges, return_inverse = True)
+    return points[usedPointIndex], compactEdges.reshape(-1, 2)
+
+
+def write_edge_mesh(
+        eMeshFile,
+        points,
+        edges,
+        foamFileVersion = "2.0",
+    ):
+    objectName = eMeshFile.replace("\\", "/").split("/")[-1]
+
+    pointText = io.StringIO()
+    np.savetxt(pointText, points, fmt = "(%.12g %.12g %.12g)")
+    edgeText = io.StringIO()
+    np.savetxt(edgeText, edges, fmt = "(%d %d)")
+
+    str2write = ""
+    str2write += "FoamFile\n"
+    str2write += "{\n"
+    str2write += "    version     " + foamFileVersion + ";\n"
+    str2write += "    format      ascii;\n"
+    str2write += "    class       featureEdgeMesh;\n"
+    str2write += "    location    \"constant/triSurface\";\n"
+    str2write += "    object      " + objectName + ";\n"
+    str2write += "}\n"
+    str2write += "\n"
+    str2write += "// points:\n"
+    str2write += "\n"
+    str2write += str(points.shape[0]) + "\n"
+    str2write += "(\n"
+    str2write += pointText.getvalue()
+    str2write += ")\n"
+    str2write += "\n"
+    str2write += "// edges:\n"
+    str2write += "\n"
+    str2write += str(edges.shape[0]) + "\n"
+    str2write += "(\n"
+    str2write += edgeText.getvalue()
+    str2write += ")\n"
+    str2write += "\n"
+
+    with open(eMeshFile, "w") as wf:
+        wf.write(str2write)
+    return
+
+
+def extract_feature_edges(
+        surface,
+        eMeshFile,
+        includedAngle = 150,
+        foamFileVersion = "2.0",
+    ):
+    featureEdgeDict = classify_feature_edges(surface, includedAngle)
+    points, edges = compact_edge_points(
+            np.asarray(surface.points),
+            featureEdgeDict.pop("edges"),
+        )
+    write_edge_mesh(eMeshFile, points, edges, foamFileVersion)
+    featureEdgeDict["n-points"] = int(points.shape[0])
+    return featureEdgeDict
@@ -0,0 +1,210 @@
+"""
+    Leak pre-check of the domain STL on the background (blockMesh) lattice.
+
+    - The domain surface is rasterised onto the lattice, or a refined
+      version of it, with an exact triangle/box overlap test (separating
+      axis test, vectorised over the (triangle, cell) pairs).
+    - The free cells are flood filled from the cell holding the
+      locationInMesh point. If the fill reaches the lattice boundary, the
+      surface leaks, as the snappyHexMesh castellation would.
+    - The fill keeps the direction every cell was reached from, the path
+      from the locationInMesh point to the boundary is traced back and the
+      cell where it leaves the surface gives the leak location.
+"""
+
+import numpy as np
+
+import surface_bvh
+
+
+#---------------------------------------
+
+### (triangle, cell) pairs tested at once
+overlapChunkSize = 4*1024*1024
+
+### Flood fill directions, the index is stored per cell
+fillDirectionArray = np.array([
+        [1, 0, 0],
+        [-1, 0, 0],
+        [0, 1, 0],
+        [0, -1, 0],
+        [0, 0, 1],
+        [0, 0, -1],
+    ])
+seedDirection = len(fillDirectionArray)
+
+
+#---------------------------------------
+### RASTERISATION
+#---------------------------------------
+
+def get_triangle_box_overlap(
+        triangles,
+        boxCenters,
+        halfSize,
+    ):
+    ### Separating axis test (Akenine-Moller), the box axes are covered by
+    ### the candidate cells being taken from the triangle bounding box
+    v = triangles - boxCenters[:, None, :]
+    edges = [v[:, 1] - v[:, 0], v[:, 2] - v[:, 1], v[:, 0] - v[:, 2]]
+    overlap = np.ones(triangles.shape[0], dtype = bool)
+
+    for unitAxis in np.eye(3):
+        for edge in edges:
+            axis = np.cross(unitAxis, edge)
+            projection = np.einsum("ijk,ik->ij", v, axis)
+            radius = np.abs(axis) @ halfSize
+            overlap &= (projection.min(axis = 1) <= radius) & (projection.max(axis = 1) >= -radius)
+
+    normals = np.cross(edges[0], edges[1])
+    distance = np.einsum("ij,ij->i", normals, v[:, 0])
+    overlap &= np.abs(distance) <= np.abs(normals) @ halfSize
+    return overlap
+
+
+def rasterise_surface(
+        surface,
+        origin,
+        cellSize,
+        latticeShape,
+    ):
+    ### Boolean lattice, True for the cells touched by the surface
+    latticeShape = np.asarray(latticeShape, dtype = np.int64)
+    occupied = np.zeros(int(np.prod(latticeShape)), dtype = bool)
+    triangles = np.asarray(surface.triangles(), dtype = np.float64)
+    if triangles.shape[0] == 0:
+        return occupied.reshape(latticeShape)
+
+    cellMin = np.clip(np.floor((triangles.min(axis = 1) - origin) / cellSize).astype(np.int64), 0, latticeShape - 1)
+    cellMax = np.clip(np.floor((triangles.max(axis = 1) - origin) / cellSize).astype(np.int64), 0, latticeShape - 1)
+    cellRange = cellMax - cellMin + 1
+    pairCount = np.prod(cellRange, axis = 1)
+    pairOffsets = np.concatenate([[0], np.cumsum(pairCount)])
+
+    halfSize = 0.5 * np.asarray(cellSize, dtype = np.float64)
+    chunkStart = 0
+    while chunkStart < triangles.shape[0]:
+        chunkEnd = int(np.searchsorted(pairOffsets, pairOffsets[chunkStart] + overlapChunkSize, side = "right")) - 1
+        chunkEnd = min(max(chunkEnd, chunkStart + 1), triangles.shape[0])
+        chunk = np.arange(chunkStart, chunkEnd)
+
+        ### Every cell of the triangle bounding box
+        pairTriangle = np.repeat(chunk, pairCount[chunk])
+        localIndex = np.arange(pairTriangle.shape[0]) - np.repeat(pairOffsets[chunk] - pairOffsets[chunkStart], pairCount[chunk])
+        pairRange = cellRange[pairTriangle]
+        pairCell = np.stack([
+                localIndex // (pairRange[:, 1] * pairRange[:, 2]),
+                (localIndex // pairRange[:, 2]) % pairRange[:, 1],
+                localIndex % pairRange[:, 2],
+            ], axis = 1) + cellMin[pairTriangle]
+
+        boxCenters = origin + (pairCell + 0.5) * cellSize
+        overlap = get_triangle_box_overlap(triangles[pairTriangle], boxCenters, halfSize)
+        occupied[np.ravel_multi_index(pairCell[overlap].T, latticeShape)] = True
+        chunkStart = chunkEnd
+    return occupied.reshape(latticeShape)
+
+
+#---------------------------------------
+### FLOOD FILL
+#---------------------------------------
+
+def flood_fill(
+        blocked,
+        seedCell,
+    ):
+    ### Breadth first fill of the free cells, one whole front at a time.
+    ### Returns the direction every cell was reached from (flat array, -1
+    ### if not reached) and the first boundary cell reached, None if the fill
+    ### stays inside.
+    latticeShape = np.array(blocked.shape, dtype = np.int64)
+    strides = np.array([latticeShape[1] * latticeShape[2], latticeShape[2], 1], dtype = np.int64)
+    blocked = blocked.reshape(-1)
+    reachedFrom = np.full(blocked.shape[0], -1, dtype = np.int8)
+
+    seedIndex = int(np.ravel_multi_index(seedCell, latticeShape))
+    reachedFrom[seedIndex] = seedDirection
+    front = np.array([seedIndex], dtype = np.int64)
+
+    while front.shape[0] > 0:
+        frontCell = np.stack(np.unravel_index(front, latticeShape), axis = 1)
+        onBoundary = np.any((frontCell == 0) | (frontCell == latticeShape - 1), axis = 1)
+        if np.any(onBoundary):
+            return reachedFrom, tuple(frontCell[np.argmax(onBoundary)])
+
+        nextFrontList = []
+        for direction, step in enumerate(fillDirectionArray):
+            ### No wrap around, the boundary cells are never expanded
+            neighbour = front + step @ strides
+            isNew = ~blocked[neighbour] & (reachedFrom[neighbour] < 0)
+            neighbour = neighbour[isNew]
+            reachedFrom[neighbour] = direction
+            nextFrontList.append(neighbour)
+        front = np.concatenate(nextFrontList)
+    return reachedFrom, None
+
+
+def trace_fill_path(
+        reachedFrom,
+        latticeShape,
+        endCell,
+    ):
+    ### Cells from the seed to the end cell
+    cellPath = [np.array(endCell)]
+    while True:
+        direction = reachedFrom[np.ravel_multi_index(cellPath[-1], latticeShape)]
+        if direction == seedDirection:
+            break
+        cellPath.append(cellPath[-1] - fillDirectionArray[direction])
+    return np.array(cellPath[ : : -1])
+
+
+#---------------------------------------
+
+def check_leak(
+        surface,
+        latticeBound,
+        latticeShape,
+        locationInMesh,
+        refinement = 1,
+    ):
+    latticeShape = np.maximum(np.asarray(latticeShape, dtype = np.int64), 1) * refinement
+    origin = np.array([latticeBound["x-min"], latticeBound["y-min"], latticeBound["z-min"]], dtype = np.float64)
+    extent = np.array([latticeBound["x-max"], latticeBound["y-max"], latticeBound["z-max"]], dtype = np.float64) - origin
+    cellSize = extent / latticeShape
+
+    leakDict = {
+            "lattice" : [int(x) for x in latticeShape],
+            "cell-size" : [float(x) for x in cellSize],
+            "leak" : False,
+        }
+
+    blocked = rasterise_surface(surface, origin, cellSize, latticeShape)
+    leakDict["n-cells"] = int(blocked.size)
+    leakDict["n-surface-cells"] = int(blocked.sum())
+
+    seedCell = np.floor((np.asarray(locationInMesh, dtype = np.float64) - origin) / cellSize).astype(np.int64)
+    if np.any(seedCell < 0) or np.any(seedCell >= latticeShape):
+        leakDict["status"] = "locationInMesh outside the background mesh"
+        return leakDict
+    if blocked[tuple(seedCell)]:
+        leakDict["status"] = "locationInMesh in a cell cut by the surface"
+        return leakDict
+
+    reachedFrom, escapeCell = flood_fill(blocked, seedCell)
+    leakDict["n-filled-cells"] = int((reachedFrom >= 0).sum())
+    if escapeCell is None:
+        leakDict["status"] = "closed"
+        return leakDict
+
+    ### The leak is where the fill path leaves the surface
+    cellPath = trace_fill_path(reachedFrom, latticeShape, escapeCell)
+    pathPoints = origin + (cellPath + 0.5) * cellSize
+    isInside = surface_bvh.SurfaceBvh(surface).contains_points(pathPoints)
+    leakIndex = int(np.argmin(isInside)) if not np.all(isInside) else len(pathPoints) - 1
+
+    leakDict["leak"] = True
+    leakDict["status"] = "leak"
+    leakDict["leak-point"] = [float(x) for x in pathPoints[leakIndex]]
+    leakDict["leak-path"] = [[float(x) for x in point] for point in pathPoints]
+    return leakDict
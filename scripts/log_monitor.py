@@ -0,0 +1,177 @@
+"""
+    Live monitor of the output of the OpenFOAM utilities.
+
+    - The output is read line by line as the utility writes it, written to
+      the log file and parsed on the way.
+    - snappyHexMesh lines of interest:
+        - "<step> iteration <n>" (refinement, morph/snapping, layer
+          iterations)
+        - "... : cells:<n> faces:<n> points:<n>" (cell count)
+        - "<step> in = <t> s" (time of every step, the totals per step
+          show where the time goes)
+        - "Mesh refined/snapped in", "Layers added in", "Finished meshing
+          in" (end of the phases)
+    - The metrics (events, cell counts, step times) are written to a JSON
+      file during the run. The metrics file of the previous run of the same
+      utility gives the progress of the current run and an estimate of the
+      remaining time.
+"""
+
+import os
+import re
+import json
+import time
+
+
+#---------------------------------------
+
+iterationPattern = re.compile(r"^([A-Za-z][A-Za-z ]*?) iteration (\d+)$")
+stepTimePattern = re.compile(r"^([A-Za-z][A-Za-z ]*?) in = ([0-9.eE+-]+) s")
+cellCountPattern = re.compile(r"cells:(\d+)")
+
+### Steps ending a snappyHexMesh phase
+phaseStepList = [
+    "Mesh refined",
+    "Mesh snapped",
+    "Layers added",
+    "Finished meshing",
+]
+
+
+#---------------------------------------
+
+class LogMonitor(object):
+
+    def __init__(
+            self,
+            name,
+            metricsFile = None,
+            printProgress = True,
+        ):
+        ### The previous metrics file, if complete, is the reference of the
+        ### progress estimate
+        self.name = name
+        self.metricsFile = metricsFile
+        self.printProgress = printProgress
+        self.referenceDict = self.read_reference()
+        self.startTime = time.time()
+        self.metricsDict = {
+                "name" : name,
+                "start-time" : self.startTime,
+                "elapsed" : 0.0,
+                "return-code" : None,
+                "n-cells" : None,
+                "events" : [],
+                "cells" : [],
+                "step-times" : {},
+                "phase-times" : {},
+            }
+        return
+
+
+    def read_reference(self):
+        if self.metricsFile is None:
+            return None
+        try:
+            with open(self.metricsFile, "r") as rf:
+                referenceDict = json.load(rf)
+        except (OSError, ValueError):
+            return None
+        if referenceDict.get("return-code") != 0 or not referenceDict.get("events"):
+            return None
+        return referenceDict
+
+
+    def write_metrics(self):
+        if self.metricsFile is None:
+            return
+        tmpFile = self.metricsFile + ".tmp-" + str(os.getpid())
+        with open(tmpFile, "w") as wf:
+            json.dump(self.metricsDict, wf, indent = 4)
+        os.replace(tmpFile, self.metricsFile)
+        return
+
+    #---------------------------------------
+
+    def add_line(
+            self,
+            line,
+        ):
+        ### Returns the event of the line, None if the line is no event
+        elapsed = time.time() - self.startTime
+        line = line.strip()
+        event = None
+
+        cellCountMatch = cellCountPattern.search(line)
+        if cellCountMatch:
+            self.metricsDict["n-cells"] = int(cellCountMatch.group(1))
+            self.metricsDict["cells"].append({"elapsed" : elapsed, "n-cells" : self.metricsDict["n-cells"]})
+
+        iterationMatch = iterationPattern.match(line)
+        if iterationMatch:
+            event = {"event" : iterationMatch.group(1) + " iteration " + iterationMatch.group(2)}
+
+        stepTimeMatch = stepTimePattern.match(line)
+        if stepTimeMatch:
+            step = stepTimeMatch.group(1)
+            try:
+                stepTime = float(stepTimeMatch.group(2))
+            except ValueError:
+                stepTime = 0.0
+            stepTimeDict = self.metricsDict["step-times"]
+            stepTimeDict[step] = stepTimeDict.get(step, 0.0) + stepTime
+            if step in phaseStepList:
+                self.metricsDict["phase-times"][step] = stepTime
+                event = {"event" : step}
+
+        if event is None:
+            return None
+        event["elapsed"] = elapsed
+        event["n-cells"] = self.metricsDict["n-cells"]
+        self.metricsDict["events"].append(event)
+        self.metricsDict["elapsed"] = elapsed
+        self.write_metrics()
+        if self.printProgress:
+            print(self.get_progress_string(event))
+        return event
+
+
+    def get_remaining_time(
+            self,
+            event,
+        ):
+        ### From the time of the same event in the reference run, None if
+        ### there is no reference or the event is not in it
+        if self.referenceDict is None:
+            return None
+        referenceTotal = self.referenceDict["elapsed"]
+        for referenceEvent in self.referenceDict["events"]:
+            if referenceEvent["event"] == event["event"]:
+                if referenceEvent["elapsed"] <= 0.0:
+                    return None
+                return max(event["elapsed"] * (referenceTotal / referenceEvent["elapsed"] - 1.0), 0.0)
+        return None
+
+
+    def get_progress_string(
+            self,
+            event,
+        ):
+        str2print = self.name + " : " + event["event"]
+        if event["n-cells"] is not None:
+            str2print += ", " + str(event["n-cells"]) + " cells"
+        str2print += f", {event['elapsed'] : .1f} s"
+        remainingTime = self.get_remaining_time(event)
+        if remainingTime is not None:
+            str2print += f", ETA {remainingTime : .0f} s"
+        return str2print
+
+
+    def finish(
+            self,
+            returnCode,
+        ):
+        self.metricsDict["elapsed"] = time.time() - self.startTime
+        self.metricsDict["return-code"] = returnCode
+        self.write_metrics()
+        return self.metricsDict
@@ -0,0 +1,150 @@
+"""
+    Checkpoints of the mesh between the snappyHexMesh phases (castellation,
+    snapping, layer addition).
+
+    - Every phase is keyed by the key of the phase before it and the
+      entries of the phase dictionary the phase reads (e.g. "snapControls"
+      for snapping), the first phase also by the background mesh and the
+      surface files. A key only depends on files known before the run, the
+      keys of all phases are known up front.
+    - A checkpoint is a copy of the mesh directories (constant/polyMesh, or
+      the ones of the processor directories) after the phase. Only the
+      latest checkpoint of every phase is kept.
+    - The run restarts from the last phase whose checkpoint matches, e.g.
+      a change of the snapControls restarts from the castellated mesh.
+"""
+
+import os
+import glob
+import json
+import shutil
+import hashlib
+
+import artifact_cache
+
+
+#---------------------------------------
+
+checkpointInfoFilename = "checkpoint.json"
+
+### snappyHexMeshDict entries read by every phase
+phaseEntryDict = {
+    "castellate" : ["geometry", "castellatedMeshControls", "mergeTolerance"],
+    "snap" : ["snapControls", "meshQualityControls"],
+    "layers" : ["addLayersControls", "meshQualityControls"],
+}
+
+
+#---------------------------------------
+
+def get_dictionary_entries(
+        dictFile,
+        keywordList,
+    ):
+    ### Text of the top level entries of an OpenFOAM dictionary
+    entryDict = {}
+    keyword = None
+    depth = 0
+    with open(dictFile, "r") as rf:
+        for line in rf:
+            strippedLine = line.strip()
+            if depth == 0 and keyword is None:
+                if not strippedLine or strippedLine.startswith("//"):
+                    continue
+                keyword = strippedLine.split()[0].rstrip(";")
+                entryDict[keyword] = ""
+            entryDict[keyword] += line
+            depth += line.count("{") - line.count("}")
+            if depth == 0 and strippedLine.endswith((";", "}")):
+                keyword = None
+    return {x : entryDict[x] for x in keywordList if x in entryDict}
+
+
+def get_checkpoint_key(
+        previousKey,
+        rootDir,
+        patternList,
+        parameterDict = None,
+        fileDigestFunction = artifact_cache.file_digest,
+    ):
+    keyDict = {
+            "previous" : previousKey,
+            "files" : {x : artifact_cache.path_digest(rootDir, x, fileDigestFunction) for x in patternList},
+            "parameters" : parameterDict or {},
+        }
+    keyString = json.dumps(keyDict, sort_keys = True, default = str)
+    return hashlib.blake2b(keyString.encode(), digest_size = 20).hexdigest()
+
+
+def get_checkpoint_path(
+        checkpointDir,
+        phase,
+        key,
+    ):
+    return os.path.join(checkpointDir, phase + "-" + key)
+
+
+def has_checkpoint(
+        checkpointDir,
+        phase,
+        key,
+    ):
+    checkpointPath = get_checkpoint_path(checkpointDir, phase, key)
+    return os.path.exists(os.path.join(checkpointPath, checkpointInfoFilename))
+
+
+#---------------------------------------
+
+def save_checkpoint(
+        checkpointDir,
+        phase,
+        key,
+        rootDir,
+        meshPatternList,
+    ):
+    ### Written next to the final location and renamed, an interrupted
+    ### copy is never taken for a checkpoint
+    checkpointPath = get_checkpoint_path(checkpointDir, phase, key)
+    tmpPath = checkpointPath + ".tmp-" + str(os.getpid())
+    if os.path.exists(tmpPath):
+        shutil.rmtree(tmpPath)
+
+    meshPathList = []
+    for pattern in meshPatternList:
+        for path in sorted(glob.glob(os.path.join(rootDir, pattern))):
+            relPath = os.path.relpath(path, rootDir)
+            shutil.copytree(path, os.path.join(tmpPath, relPath))
+            meshPathList.append(relPath)
+
+    os.makedirs(tmpPath, exist_ok = True)
+    with open(os.path.join(tmpPath, checkpointInfoFilename), "w") as wf:
+        json.dump({"phase" : phase, "key" : key, "mesh" : meshPathList}, wf, indent = 4)
+
+    if os.path.exists(checkpointPath):
+        shutil.rmtree(checkpointPath)
+    os.replace(tmpPath, checkpointPath)
+
+    ### Older checkpoints of the phase
+    for path in glob.glob(os.path.join(checkpointDir, phase + "-*")):
+        if path != checkpointPath:
+            shutil.rmtree(path, ignore_errors = True)
+    return checkpointPath
+
+
+def restore_checkpoint(
+        checkpointDir,
+        phase,
+        key,
+        rootDir,
+        meshPatternList,
+    ):
+    checkpointPath = get_checkpoint_path(checkpointDir, phase, key)
+    with open(os.path.join(checkpointPath, checkpointInfoFilename), "r") as rf:
+        checkpointInfoDict = json.load(rf)
+
+    for pattern in meshPatternList:
+        for path in glob.glob(os.path.join(rootDir, pattern)):
+            shutil.rmtree(path)
+    for relPath in checkpointInfoDict["mesh"]:
+        shutil.copytree(os.path.join(checkpointPath, relPath), os.path.join(rootDir, relPath))
+    return checkpointPath
@@ -0,0 +1,494 @@
+"""
+    Long-running service of the snappyHexMesh process, meshing jobs
+    submitted over a Unix socket.
+
+    - The service keeps the Python modules, the artifact caches (digests of
+      the STL files, derived surface data) and the OpenFOAM environments
+      loaded between the jobs (MeshingSession).
+    - Protocol : one JSON object per line, every request gets one JSON
+      response line ("watch" streams several).
+        - {"action" : "submit", "options" : {...}, "priority" : 0}
+          options of the input script (e.g. "working_dir",
+          "input_json_filename", "blockmesh_size"), the missing ones are the
+          ones of the service. A higher priority runs first, the same
+          priority in the order of submission.
+        - {"action" : "status", "job" : "<id>"}
+        - {"action" : "list"}
+        - {"action" : "watch", "job" : "<id>"} --> the output lines of the
+          job ({"job" : ..., "output" : ...}) as it runs, then its status
+        - {"action" : "cancel", "job" : "<id>"} (a running job is stopped,
+          its utilities are killed)
+        - {"action" : "shutdown"} (the running jobs finish, the queued
+          ones are cancelled)
+    - The jobs run at once up to the job count of the service and share
+      its cores and memory (resource pool, as the cases of a sweep). The
+      output of a job goes to its log file in its working directory
+      (log_mesh_<id>.txt), the result has the status, times, cells and
+      peak memory of the run.
+    - Client : python mesh_daemon.py <socket> submit|status|list|watch|cancel|shutdown
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import socket
+import argparse
+import itertools
+import threading
+import contextvars
+import socketserver
+
+import artifact_cache
+import openfoam_env
+import mesh_sweep
+import process_supervisor
+
+
+#---------------------------------------
+
+jobLogPrefix = "log_mesh_"
+watchPollInterval = 0.2
+
+### Job states after which nothing changes
+finalStatusList = ["ok", "failed", "cancelled"]
+
+
+#---------------------------------------
+
+class MeshingSession(object):
+    ### Objects kept between the jobs, shared by the running jobs
+
+    def __init__(self):
+        self.artifactCacheDict = {}
+        self.openfoamEnvDict = {}
+        self.sessionLock = threading.Lock()
+        return
+
+
+    def get_artifact_cache(
+            self,
+            cacheDir,
+            maxSizeBytes,
+        ):
+        key = (os.path.abspath(cacheDir), maxSizeBytes)
+        with self.sessionLock:
+            if key not in self.artifactCacheDict:
+                self.artifactCacheDict[key] = artifact_cache.ArtifactCache(cacheDir, maxSizeBytes)
+            return self.artifactCacheDict[key]
+
+
+    def get_openfoam_environment(
+            self,
+            bashrcPath,
+            artifactCache = None,
+        ):
+        ### Sourced again if the bashrc file changed
+        if not os.path.isfile(bashrcPath):
+            raise RuntimeError("OpenFOAM bashrc not found : " + os.path.abspath(bashrcPath))
+        bashrcStat = os.stat(bashrcPath)
+        key = (os.path.abspath(bashrcPath), bashrcStat.st_size, bashrcStat.st_mtime_ns)
+        with self.sessionLock:
+            openfoamEnv = self.openfoamEnvDict.get(key)
+        if openfoamEnv is None:
+            openfoamEnv = openfoam_env.get_openfoam_environment(bashrcPath, artifactCache)
+            with self.sessionLock:
+                self.openfoamEnvDict[key] = openfoamEnv
+        return openfoamEnv
+
+
+#---------------------------------------
+
+class MeshDaemon(object):
+
+    def __init__(
+            self,
+            socketPath,
+            optionDict,
+            get_process_input,
+            snappyHexMesh_from_stl,
+            nJobs = 1,
+            resourcePool = None,
+        ):
+        ### optionDict --> options of the service, defaults of the jobs
+        self.socketPath = os.path.abspath(socketPath)
+        self.optionDict = dict(optionDict)
+        self.get_process_input = get_process_input
+        self.snappyHexMesh_from_stl = snappyHexMesh_from_stl
+        self.nJobs = max(int(nJobs), 1)
+        self.resourcePool = resourcePool
+        self.session = MeshingSession()
+
+        self.jobDict = {}
+        self.jobHeap = []
+        self.jobCounter = itertools.count(1)
+        self.jobCondition = threading.Condition()
+        self.stopping = False
+        self.server = None
+        return
+
+    #---------------------------------------
+    ### JOBS
+    #---------------------------------------
+
+    def submit(
+            self,
+            optionDict,
+            priority = 0,
+        ):
+        ### The options are checked before the job is queued
+        jobOptionDict = dict(self.optionDict)
+        jobOptionDict.update({x : mesh_sweep.get_option_string(y) for x, y in optionDict.items()})
+        try:
+            processInputDict = self.get_process_input(jobOptionDict)
+        except KeyError as e:
+            raise ValueError("Missing option : " + str(e))
+        except (TypeError, ValueError) as e:
+            raise ValueError("Invalid option : " + str(e))
+        if not os.path.isfile(processInputDict["snappyHexInfoFile"]):
+            raise ValueError("Input file not found : " + processInputDict["snappyHexInfoFile"])
+        processInputDict["resourcePool"] = self.resourcePool
+        processInputDict["nCores"] = self.resourcePool.nCores
+        processInputDict["session"] = self.session
+
+        with self.jobCondition:
+            if self.stopping:
+                raise ValueError("The service is shutting down")
+            sequence = next(self.jobCounter)
+            jobId = "job_" + str(sequence).zfill(4)
+            self.jobDict[jobId] = {
+                    "job" : jobId,
+                    "status" : "queued",
+                    "priority" : int(priority),
+                    "options" : optionDict,
+                    "working-dir" : processInputDict["workingDir"],
+                    "log-file" : processInputDict["workingDir"] + os.sep + jobLogPrefix + jobId + ".txt",
+                    "submit-time" : time.time(),
+                    "start-time" : None,
+                    "wall-time" : None,
+                    "error" : None,
+                    "result" : None,
+                    "process-input" : processInputDict,
+                }
+            heapq.heappush(self.jobHeap, (-int(priority), sequence, jobId))
+            self.jobCondition.notify_all()
+        return jobId
+
+
+    def get_job(
+            self,
+            jobId,
+        ):
+        ### Copy of the job without the internal arguments
+        with self.jobCondition:
+            if jobId not in self.jobDict:
+                raise ValueError("Unknown job : " + str(jobId))
+            jobDict = dict(self.jobDict[jobId])
+            if jobDict["status"] == "queued":
+                jobDict["queue-position"] = [x[2] for x in sorted(self.jobHeap)].index(jobId)
+        jobDict.pop("process-input")
+        return jobDict
+
+
+    def cancel(
+            self,
+            jobId,
+        ):
+        with self.jobCondition:
+            if jobId not in self.jobDict:
+                raise ValueError("Unknown job : " + str(jobId))
+            jobDict = self.jobDict[jobId]
+            if jobDict["status"] in finalStatusList:
+                raise ValueError("Job " + jobId + " is " + jobDict["status"])
+            if jobDict["status"] == "queued":
+                jobDict["status"] = "cancelled"
+                self.jobHeap = [x for x in self.jobHeap if x[2] != jobId]
+                heapq.heapify(self.jobHeap)
+            else:
+                ### The running utilities are killed, the job stops at the
+                ### failed stage
+                jobDict["cancel-requested"] = True
+                process_supervisor.get_supervisor().cancel(jobId)
+            self.jobCondition.notify_all()
+        return self.get_job(jobId)
+
+
+    def run_jobs(self):
+        ### Worker thread, runs the jobs of the queue one by one
+        while True:
+            with self.jobCondition:
+                while not self.jobHeap and not self.stopping:
+                    self.jobCondition.wait()
+                if self.stopping:
+                    return
+                priority, sequence, jobId = heapq.heappop(self.jobHeap)
+                jobDict = self.jobDict[jobId]
+                jobDict["status"] = "running"
+                jobDict["start-time"] = time.time()
+
+            resultDict = contextvars.copy_context().run(
+                    mesh_sweep.run_case,
+                    jobId,
+                    jobDict["process-input"],
+                    self.snappyHexMesh_from_stl,
+                    jobDict["log-file"],
+                )
+            resultDict.update(mesh_sweep.get_case_metrics(
+                    jobDict["working-dir"] + os.sep + "snappyHexMesh_caseDir",
+                    resultDict["start-time"],
+                ))
+            process_supervisor.get_supervisor().forget(jobId)
+            with self.jobCondition:
+                jobDict["status"] = "cancelled" if jobDict.get("cancel-requested") else resultDict["status"]
+                jobDict["error"] = resultDict["error"]
+                jobDict["wall-time"] = resultDict["wall-time"]
+                jobDict["result"] = {x : resultDict[x] for x in ["n-cells", "snappyHexMesh-time", "max-rss"]}
+                self.jobCondition.notify_all()
+            print(jobId + " : " + jobDict["status"] + f", {resultDict['wall-time'] : .1f} s")
+        return
+
+
+    def watch(
+            self,
+            jobId,
+            send,
+        ):
+        ### Sends the output of the job as it is written, then its status
+        self.get_job(jobId)
+        position = 0
+        while True:
+            status = self.get_job(jobId)["status"]
+            logFile = self.jobDict[jobId]["log-file"]
+            if os.path.exists(logFile) and status != "queued":
+                with open(logFile, "r") as rf:
+                    rf.seek(position)
+                    while True:
+                        line = rf.readline()
+                        if not line.endswith("\n"):
+                            break
+                        send({"job" : jobId, "output" : line.rstrip("\n")})
+                        position = rf.tell()
+            if status in finalStatusList:
+                break
+            with self.jobCondition:
+                self.jobCondition.wait(watchPollInterval)
+        send(self.get_job(jobId))
+        return
+
+    #---------------------------------------
+    ### SERVICE
+    #---------------------------------------
+
+    def handle_request(
+            self,
+            requestDict,
+            send,
+        ):
+        action = requestDict.get("action")
+        if action == "submit":
+            jobId = self.submit(requestDict.get("options", {}), requestDict.get("priority", 0))
+            send(self.get_job(jobId))
+        elif action == "status":
+            send(self.get_job(requestDict.get("job")))
+        elif action == "list":
+            with self.jobCondition:
+                jobIdList = sorted(self.jobDict.keys())
+            send({"jobs" : [self.get_job(x) for x in jobIdList]})
+        elif action == "watch":
+            self.watch(requestDict.get("job"), send)
+        elif action == "cancel":
+            send(self.cancel(requestDict.get("job")))
+        elif action == "shutdown":
+            send({"shutdown" : True})
+            threading.Thread(target = self.shutdown).start()
+        else:
+            raise ValueError("Unknown action : " + str(action))
+        return
+
+
+    def shutdown(self):
+        ### The queued jobs are cancelled, the running ones finish
+        with self.jobCondition:
+            self.stopping = True
+            for priority, sequence, jobId in self.jobHeap:
+                self.jobDict[jobId]["status"] = "cancelled"
+            self.jobHeap = []
+            self.jobCondition.notify_all()
+        if self.server is not None:
+            self.server.shutdown()
+        return
+
+
+    def serve(self):
+        if os.path.exists(self.socketPath):
+            if is_socket_listening(self.socketPath):
+                sys.exit("A service is already listening on " + self.socketPath)
+            os.remove(self.socketPath)
+
+        daemon = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+                def send(responseDict):
+                    self.wfile.write((json.dumps(responseDict, default = str) + "\n").encode())
+                    self.wfile.flush()
+
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    try:
+                        daemon.handle_request(json.loads(line), send)
+                    except (ValueError, TypeError) as e:
+                        send({"error" : str(e)})
+                    except OSError:
+                        return
+                return
+
+        class ServiceServer(socketserver.ThreadingUnixStreamServer):
+            daemon_threads = True
+
+        self.server = ServiceServer(self.socketPath, RequestHandler)
+        workerList = [threading.Thread(target = self.run_jobs) for x in range(self.nJobs)]
+        for worker in workerList:
+            worker.start()
+
+        str2print = "-"*40 + "\n"
+        str2print += "Meshing service --> " + self.socketPath + "\n"
+        str2print += str(self.nJobs) + " jobs at once, " + str(self.resourcePool.nCores) + " cores, "
+        str2print += ("no memory limit" if self.resourcePool.memory is None else f"{self.resourcePool.memory / 1024**3 : .1f} GB") + "\n"
+        str2print += "-"*40 + "\n"
+        print(str2print)
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            self.shutdown()
+        finally:
+            self.server.server_close()
+            os.remove(self.socketPath)
+            for worker in workerList:
+                worker.join()
+        print("Meshing service stopped")
+        return
+
+
+#---------------------------------------
+
+def is_socket_listening(
+        socketPath,
+    ):
+    clientSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        clientSocket.connect(socketPath)
+    except OSError:
+        return False
+    finally:
+        clientSocket.close()
+    return True
+
+
+def run_daemon(
+        socketPath,
+        optionDict,
+        get_process_input,
+        snappyHexMesh_from_stl,
+        nJobs = 1,
+        memoryMb = "auto",
+    ):
+    ### The output of every job goes to its log file (context of the job)
+    resourcePool = mesh_sweep.get_resource_pool(optionDict.get("n_cores", "auto"), memoryMb)
+    daemon = MeshDaemon(
+            socketPath,
+            optionDict,
+            get_process_input,
+            snappyHexMesh_from_stl,
+            nJobs,
+            resourcePool,
+        )
+    stdout = sys.stdout
+    sys.stdout = mesh_sweep.CaseOutput(stdout)
+    try:
+        daemon.serve()
+    finally:
+        sys.stdout = stdout
+    return daemon
+
+
+#---------------------------------------
+### CLIENT
+#---------------------------------------
+
+def send_request(
+        socketPath,
+        requestDict,
+    ):
+    ### Yields the response lines of a request
+    clientSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    clientSocket.connect(socketPath)
+    try:
+        clientSocket.sendall((json.dumps(requestDict) + "\n").encode())
+        clientSocket.shutdown(socket.SHUT_WR)
+        with clientSocket.makefile("r") as rf:
+            for line in rf:
+                yield json.loads(line)
+    finally:
+        clientSocket.close()
+    return
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description = "Client of the meshing service")
+    parser.add_argument("socket", help = "socket of the service (service_socket)")
+    subparsers = parser.add_subparsers(dest = "action", required = True)
+    submitParser = subparsers.add_parser("submit", help = "submit a job")
+    submitParser.add_argument("--option", action = "append", default = [], metavar = "NAME=VALUE", help = "option of the input script, repeatable")
+    submitParser.add_argument("--priority", type = int, default = 0)
+    submitParser.add_argument("--watch", action = "store_true", help = "stream the output until the job ends")
+    for action in ["status", "watch", "cancel"]:
+        subparsers.add_parser(action).add_argument("job")
+    subparsers.add_parser("list")
+    subparsers.add_parser("shutdown")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    requestDict = {"action" : args.action}
+    if args.action == "submit":
+        optionDict = {}
+        for option in args.option:
+            name, separator, value = option.partition("=")
+            optionDict[name.strip()] = value.strip()
+        ### Paths of the client, the service may run elsewhere
+        if "working_dir" in optionDict:
+            optionDict["working_dir"] = os.path.abspath(optionDict["working_dir"])
+        requestDict["options"] = optionDict
+        requestDict["priority"] = args.priority
+    elif args.action in ["status", "watch", "cancel"]:
+        requestDict["job"] = args.job
+
+    responseList = []
+    for responseDict in send_request(args.socket, requestDict):
+        if "output" in responseDict:
+            print(responseDict["output"])
+            continue
+        responseList.append(responseDict)
+        print(json.dumps(responseDict, indent = 4, default = str))
+    if args.action == "submit" and args.watch and responseList and "job" in responseList[-1]:
+        for responseDict in send_request(args.socket, {"action" : "watch", "job" : responseList[-1]["job"]}):
+            if "output" in responseDict:
+                print(responseDict["output"])
+            else:
+                responseList.append(responseDict)
+                print(json.dumps(responseDict, indent = 4, default = str))
+    ### Rejected request or failed job
+    if responseList:
+        lastResponseDict = responseList[-1]
+        if ("job" not in lastResponseDict and "error" in lastResponseDict) or lastResponseDict.get("status") == "failed":
+            sys.exit(1)
+    return
+
+
+if __name__ == "__main__":
+    main()
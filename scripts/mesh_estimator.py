@@ -0,0 +1,184 @@
+"""
+    Cell count and memory estimate of the snappyHexMesh run.
+
+    - The final cell count is predicted from the background lattice, the
+      enclosed volume of the domain STL, the surface area of every region
+      and the refinement settings ("level (n n)", "nCellsBetweenLevels").
+      Cells at level "l" or finer fill a band around the surface whose
+      thickness is the surface cell plus "nCellsBetweenLevels" layers of
+      every level from "l" up.
+    - The memory available (/proc/meminfo) and the cores the process may
+      run on (CPU affinity) give the cell limits ("maxGlobalCells",
+      "maxLocalCells") that keep the run in memory, the recommended number
+      of processes and their split along the axes.
+"""
+
+import os
+
+
+#---------------------------------------
+
+### Peak memory of snappyHexMesh per cell (castellation + snapping)
+snappyBytesPerCell = 1536
+
+### Share of the available memory given to the meshing run
+memoryUsableFraction = 0.8
+
+### Cells per process below which more processes do not pay off
+targetCellsPerProcess = 200000
+
+### Lower bound of the cell limits, snappyHexMesh stops refining at them
+minimumCellLimit = 100000
+
+### Significant digits of the cell limits from the available memory, small
+### changes of the free memory leave the snappyHexMeshDict unchanged
+cellLimitDigits = 2
+
+
+#---------------------------------------
+### RESOURCES
+#---------------------------------------
+
+def get_available_memory():
+    ### Bytes, None if unknown
+    try:
+        with open("/proc/meminfo", "r") as rf:
+            for line in rf:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def get_available_cores():
+    ### Cores this process may run on (affinity, e.g. a batch allocation)
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+#---------------------------------------
+### ESTIMATE
+#---------------------------------------
+
+def estimate_cell_count(
+        latticeBound,
+        latticeShape,
+        domainVolume,
+        regionAreaDict,
+        regionLevelDict,
+        nCellsBetweenLevels = 3,
+    ):
+    latticeVolume = 1.0
+    for axis in ["x", "y", "z"]:
+        latticeVolume *= latticeBound[axis + "-max"] - latticeBound[axis + "-min"]
+    nBackgroundCell = 1
+    for nCell in latticeShape:
+        nBackgroundCell *= max(int(nCell), 1)
+    cellVolume = latticeVolume / nBackgroundCell
+    cellSize = cellVolume**(1.0 / 3.0)
+
+    domainVolume = min(abs(domainVolume), latticeVolume)
+    maxLevel = max(list(regionLevelDict.values()) + [0])
+
+    ### Volume of the cells at level "l" or finer
+    bandVolumeList = [domainVolume]
+    for level in range(1, maxLevel + 1):
+        bandVolume = 0.0
+        for region, area in regionAreaDict.items():
+            regionLevel = regionLevelDict.get(region, 0)
+            if regionLevel < level:
+                continue
+            bandThickness = cellSize / 2**regionLevel
+            bandThickness += nCellsBetweenLevels * sum([cellSize / 2**k for k in range(level, regionLevel + 1)])
+            bandVolume += area * bandThickness
+        bandVolumeList.append(min(bandVolume, bandVolumeList[-1]))
+    bandVolumeList.append(0.0)
+
+    levelCellList = []
+    for level in range(maxLevel + 1):
+        levelVolume = bandVolumeList[level] - bandVolumeList[level + 1]
+        levelCellList.append(int(levelVolume / (cellVolume / 8**level)))
+
+    return {
+            "n-background-cells" : nBackgroundCell,
+            "n-background-cells-inside" : int(domainVolume / cellVolume),
+            "background-cell-size" : cellSize,
+            "level-cells" : levelCellList,
+            "n-cells" : sum(levelCellList),
+        }
+
+
+def round_cell_limit(
+        nCell,
+    ):
+    ### Rounded down to "cellLimitDigits" significant digits
+    nCell = int(nCell)
+    scale = 10**max(len(str(nCell)) - cellLimitDigits, 0)
+    return (nCell // scale) * scale
+
+
+def get_decomposition_counts(
+        nProcs,
+        latticeShape,
+    ):
+    ### Prime factors of the process count, largest first, given to the
+    ### axis with the most cells per part
+    factorList = []
+    remainder = nProcs
+    factor = 2
+    while factor * factor <= remainder:
+        while remainder % factor == 0:
+            factorList.append(factor)
+            remainder //= factor
+        factor += 1
+    if remainder > 1:
+        factorList.append(remainder)
+
+    nPart = [1, 1, 1]
+    for factor in sorted(factorList, reverse = True):
+        axis = max(range(3), key = lambda i: latticeShape[i] / nPart[i])
+        nPart[axis] *= factor
+    return nPart
+
+
+def get_mesh_settings(
+        cellEstimateDict,
+        latticeShape,
+        nProcs = 1,
+        memoryAvailable = None,
+        nCoreAvailable = None,
+    ):
+    ### Cell limits for a run on "nProcs" processes sharing the memory of
+    ### this machine, and the recommended process count
+    if memoryAvailable is None:
+        memoryAvailable = get_available_memory()
+    if nCoreAvailable is None:
+        nCoreAvailable = get_available_cores()
+
+    nCellEstimate = cellEstimateDict["n-cells"]
+    estimatedMemory = nCellEstimate * snappyBytesPerCell
+
+    nProcsRecommended = max(1, min(nCoreAvailable, -(-nCellEstimate // targetCellsPerProcess)))
+
+    if memoryAvailable is None:
+        maxGlobalCells = max(2 * nCellEstimate, minimumCellLimit)
+    else:
+        maxGlobalCells = max(round_cell_limit(memoryAvailable * memoryUsableFraction / snappyBytesPerCell), minimumCellLimit)
+    maxLocalCells = max(round_cell_limit(maxGlobalCells // max(nProcs, 1)), minimumCellLimit)
+
+    return {
+            "n-cells" : nCellEstimate,
+            "estimated-memory" : estimatedMemory,
+            "available-memory" : memoryAvailable,
+            "fits-memory" : memoryAvailable is None or estimatedMemory <= memoryAvailable * memoryUsableFraction,
+            "n-cores" : nCoreAvailable,
+            "n-procs-recommended" : nProcsRecommended,
+            "decomposition-recommended" : get_decomposition_counts(nProcsRecommended, latticeShape),
+            "max-global-cells" : maxGlobalCells,
+            "max-local-cells" : maxLocalCells,
+        }
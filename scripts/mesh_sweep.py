@@ -0,0 +1,396 @@
+"""
+    Parameter sweep of the snappyHexMesh process, several cases of the same
+    geometry meshed at once.
+
+    - The sweep file (JSON) gives the process input options to vary, with
+      the names of the input script (e.g. "blockmesh_size"):
+        - "grid"  : option --> list of values, every combination is a case
+        - "cases" : list of cases (option --> value), combined with the grid
+        - "base"  : options of every case (optional)
+        - "name"  : name of the sweep (optional, "sweep")
+        - "parallel-cases" : cases running at once (optional)
+      The other options are the ones of the input script.
+    - Every case has its own working directory
+      (<working_dir>/sweep_<name>/<case>), the geometry (JSON and STL files)
+      is shared.
+    - The cases share one budget of cores and memory (resource pool of the
+      stage scheduler), a snappyHexMesh run starts when its cores and its
+      estimated memory are free.
+    - The output of every case goes to its own log file next to the case
+      directory (the case of the running thread, context variable), a
+      failed case does not stop the others.
+    - The summary (status, wall time, cells, snappyHexMesh time and peak
+      memory of the OpenFOAM utilities of every case) is printed and
+      written to sweep_summary.json.
+"""
+
+import os
+import sys
+import json
+import time
+import itertools
+import contextvars
+import concurrent.futures
+
+import mesh_estimator
+import stage_scheduler
+import process_supervisor
+
+
+#---------------------------------------
+
+sweepSummaryFilename = "sweep_summary.json"
+sweepCaseFilename = "sweep_case.json"
+
+### Process input options a sweep can vary
+sweepOptionList = [
+    "openfoam_version",
+    "foamfile_version",
+    "openfoam_bashrc_path",
+    "geometry_length_unit",
+    "location_in_mesh",
+    "blockmesh_size",
+    "trisurface_compression",
+    "artifact_cache_dir",
+    "artifact_cache_size_mb",
+    "feature_extraction",
+    "surface_check",
+    "leak_check",
+    "leak_check_refinement",
+    "surface_refinement_level",
+    "n_cells_between_levels",
+    "mesh_limits",
+    "n_procs",
+    "decompose_method",
+    "mpirun_command",
+    "keep_decomposed",
+    "reconstruct_mesh",
+    "clean_case",
+    "keep_staging",
+    "snappy_phases",
+    "utility_timeout",
+    "utility_memory_limit_mb",
+    "utility_retries",
+    "execution_backend",
+    "slurm_options",
+    "slurm_launcher",
+    "slurm_poll_interval",
+]
+
+### Output stream of the case running in the current context
+caseOutput = contextvars.ContextVar("caseOutput", default = None)
+
+
+#---------------------------------------
+
+class CaseOutput(object):
+    ### sys.stdout of the sweep, written to the log file of the case of the
+    ### current context, to the terminal outside of a case
+
+    def __init__(
+            self,
+            stream,
+        ):
+        self.stream = stream
+        return
+
+
+    def get_stream(self):
+        stream = caseOutput.get()
+        return self.stream if stream is None else stream
+
+
+    def write(
+            self,
+            text,
+        ):
+        return self.get_stream().write(text)
+
+
+    def flush(self):
+        self.get_stream().flush()
+        return
+
+
+    def __getattr__(
+            self,
+            name,
+        ):
+        return getattr(self.stream, name)
+
+
+#---------------------------------------
+
+def get_option_string(
+        value,
+    ):
+    ### Sweep values as the strings of the input script
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple)):
+        return ", ".join([str(x) for x in value])
+    return str(value)
+
+
+def get_sweep_cases(
+        sweepDict,
+    ):
+    ### List of (case name, options of the case)
+    gridDict = sweepDict.get("grid", {})
+    caseList = sweepDict.get("cases", [{}])
+    baseDict = sweepDict.get("base", {})
+
+    unknownOptionList = []
+    for optionDict in [baseDict, gridDict] + list(caseList):
+        unknownOptionList += [x for x in optionDict if x not in sweepOptionList]
+    if unknownOptionList:
+        sys.exit("Unknown sweep options : " + ", ".join(sorted(set(unknownOptionList))))
+    for option, valueList in gridDict.items():
+        if not isinstance(valueList, list) or not valueList:
+            sys.exit("Sweep grid option \"" + option + "\" needs a list of values")
+
+    gridOptionList = list(gridDict.keys())
+    sweepCaseList = []
+    for caseDict in caseList:
+        for valueTuple in itertools.product(*[gridDict[x] for x in gridOptionList]):
+            optionDict = dict(baseDict)
+            optionDict.update(caseDict)
+            optionDict.update(dict(zip(gridOptionList, valueTuple)))
+            caseName = "case_" + str(len(sweepCaseList)).zfill(3)
+            sweepCaseList.append((caseName, {x : get_option_string(y) for x, y in optionDict.items()}))
+    return sweepCaseList
+
+
+def get_resource_pool(
+        nCores,
+        sweepMemoryMb,
+    ):
+    ### nCores        --> "auto" or the number of cores of the sweep
+    ### sweepMemoryMb --> "auto" (usable memory of the machine), "none" (no
+    ###                   memory budget) or the memory of the sweep in MB
+    if nCores == "auto":
+        nCores = mesh_estimator.get_available_cores()
+    if sweepMemoryMb == "auto":
+        memory = mesh_estimator.get_available_memory()
+        if memory is not None:
+            memory = int(memory * mesh_estimator.memoryUsableFraction)
+    elif sweepMemoryMb.lower() == "none":
+        memory = None
+    else:
+        memory = int(float(sweepMemoryMb) * 1024**2)
+    return stage_scheduler.ResourcePool(int(nCores), memory)
+
+
+#---------------------------------------
+
+def run_case(
+        caseName,
+        processInputDict,
+        snappyHexMesh_from_stl,
+        logFile,
+    ):
+    ### Runs in a context of its own, the output goes to the log file and
+    ### the utilities are tagged with the case (cancelled together)
+    resultDict = {
+            "case" : caseName,
+            "status" : "ok",
+            "error" : None,
+            "start-time" : time.time(),
+        }
+    with open(logFile, "w", buffering = 1) as wf:
+        caseOutput.set(wf)
+        process_supervisor.processTag.set(caseName)
+        try:
+            snappyHexMesh_from_stl(**processInputDict)
+        except SystemExit as e:
+            if e.code not in [None, 0]:
+                resultDict["status"] = "failed"
+                resultDict["error"] = str(e.code)
+        except Exception as e:
+            resultDict["status"] = "failed"
+            resultDict["error"] = type(e).__name__ + " : " + str(e)
+        if resultDict["error"]:
+            wf.write("\n" + resultDict["error"] + "\n")
+    resultDict["wall-time"] = time.time() - resultDict["start-time"]
+    return resultDict
+
+
+def get_case_metrics(
+        caseDir,
+        startTime,
+    ):
+    ### Results of the case run from its report and the snappyHexMesh
+    ### metrics, the files of an earlier run are not used
+    metricsDict = {
+            "n-cells" : None,
+            "snappyHexMesh-time" : None,
+            "max-rss" : None,
+        }
+    try:
+        with open(caseDir + os.sep + "run_report.json", "r") as rf:
+            reportDict = json.load(rf)
+    except (OSError, ValueError):
+        reportDict = None
+    if reportDict is not None and reportDict["start-time"] >= startTime:
+        snappyRecordList = [x for x in reportDict["stages"] if x["name"].startswith("snappyHexMesh")]
+        if snappyRecordList:
+            metricsDict["snappyHexMesh-time"] = sum([x["wall-time"] for x in snappyRecordList])
+        ### Peak of the utilities of the case, the Python stages measure the
+        ### whole sweep process
+        utilityRssList = [x["max-rss"] for x in reportDict["stages"] if x["kind"] == "utility" and x["max-rss"] is not None]
+        if utilityRssList:
+            metricsDict["max-rss"] = max(utilityRssList)
+
+    snappyMetricsList = []
+    for filename in sorted(os.listdir(caseDir)) if os.path.isdir(caseDir) else []:
+        if filename.startswith("metrics_snappyHexMesh") and filename.endswith(".json"):
+            try:
+                with open(caseDir + os.sep + filename, "r") as rf:
+                    snappyMetricsList.append(json.load(rf))
+            except (OSError, ValueError):
+                continue
+    snappyMetricsList = [x for x in snappyMetricsList if x["start-time"] >= startTime and x["n-cells"] is not None]
+    if snappyMetricsList:
+        ### Cells after the last phase
+        metricsDict["n-cells"] = max(snappyMetricsList, key = lambda x : x["start-time"])["n-cells"]
+    return metricsDict
+
+
+def get_summary_table(
+        summaryList,
+        optionList,
+    ):
+    mb = 1024**2
+    columnList = ["case"] + optionList + ["status", "wall [sec]", "cells", "snappy [sec]", "RSS [MB]"]
+    rowList = []
+    for resultDict in summaryList:
+        row = [resultDict["case"]]
+        row += [resultDict["options"].get(x, "-") for x in optionList]
+        row.append(resultDict["status"])
+        row.append(f"{resultDict['wall-time'] : .1f}")
+        row.append("-" if resultDict["n-cells"] is None else str(resultDict["n-cells"]))
+        row.append("-" if resultDict["snappyHexMesh-time"] is None else f"{resultDict['snappyHexMesh-time'] : .1f}")
+        row.append("-" if resultDict["max-rss"] is None else f"{resultDict['max-rss'] / mb : .1f}")
+        rowList.append(row)
+    widthList = [max([len(str(x[i])) for x in [columnList] + rowList]) for i in range(len(columnList))]
+
+    str2print = ""
+    for row in [columnList] + rowList:
+        str2print += " | ".join([f"{str(x) : <{widthList[i]}}" for i, x in enumerate(row)]) + "\n"
+        if row is columnList:
+            str2print += "-+-".join(["-"*x for x in widthList]) + "\n"
+    return str2print
+
+
+#---------------------------------------
+
+def run_sweep(
+        sweepFile,
+        optionDict,
+        get_process_input,
+        snappyHexMesh_from_stl,
+        sweepMemoryMb = "auto",
+    ):
+    ### optionDict             --> process input options of the input script
+    ### get_process_input      --> arguments of snappyHexMesh_from_stl from
+    ###                            the options
+    ### snappyHexMesh_from_stl --> process of one case
+    sweepStartTime = time.time()
+    with open(sweepFile, "r") as rf:
+        sweepDict = json.load(rf)
+    sweepName = sweepDict.get("name", "sweep")
+    sweepCaseList = get_sweep_cases(sweepDict)
+    resourcePool = get_resource_pool(optionDict.get("n_cores", "auto"), sweepMemoryMb)
+    nParallelCase = int(sweepDict.get("parallel-cases", min(len(sweepCaseList), resourcePool.nCores)))
+
+    workingDir = optionDict["working_dir"]
+    snappyHexInfoFile = workingDir + os.sep + optionDict["input_json_filename"]
+    sweepDir = workingDir + os.sep + "sweep_" + sweepName
+    os.makedirs(sweepDir, exist_ok = True)
+
+    str2print = "-"*40 + "\n"
+    str2print += "Sweep \"" + sweepName + "\" : " + str(len(sweepCaseList)) + " cases, " + str(nParallelCase) + " at once\n"
+    str2print += "Resource pool : " + str(resourcePool.nCores) + " cores, "
+    str2print += ("no memory limit" if resourcePool.memory is None else f"{resourcePool.memory / 1024**3 : .1f} GB") + "\n"
+    str2print += "-"*40 + "\n"
+    print(str2print)
+
+    ### The case directory and the settings of every case
+    caseRunList = []
+    for caseName, caseOptionDict in sweepCaseList:
+        caseWorkingDir = sweepDir + os.sep + caseName
+        os.makedirs(caseWorkingDir, exist_ok = True)
+        with open(caseWorkingDir + os.sep + sweepCaseFilename, "w") as wf:
+            json.dump({"case" : caseName, "options" : caseOptionDict}, wf, indent = 4)
+
+        caseInputDict = dict(optionDict)
+        caseInputDict.update(caseOptionDict)
+        caseInputDict["working_dir"] = caseWorkingDir
+        try:
+            processInputDict = get_process_input(caseInputDict)
+        except ValueError as e:
+            sys.exit("Invalid option of the case " + caseName + " : " + str(e))
+        processInputDict["snappyHexInfoFile"] = snappyHexInfoFile
+        processInputDict["nCores"] = resourcePool.nCores
+        processInputDict["resourcePool"] = resourcePool
+        caseRunList.append((caseName, caseOptionDict, caseWorkingDir, processInputDict))
+
+    summaryList = []
+    stdout = sys.stdout
+    sys.stdout = CaseOutput(stdout)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers = max(nParallelCase, 1)) as executor:
+            futureDict = {}
+            for caseName, caseOptionDict, caseWorkingDir, processInputDict in caseRunList:
+                logFile = sweepDir + os.sep + caseName + ".log"
+                future = executor.submit(
+                        contextvars.copy_context().run,
+                        run_case,
+                        caseName,
+                        processInputDict,
+                        snappyHexMesh_from_stl,
+                        logFile,
+                    )
+                futureDict[future] = (caseName, caseOptionDict, caseWorkingDir, logFile)
+            for future in concurrent.futures.as_completed(futureDict):
+                caseName, caseOptionDict, caseWorkingDir, logFile = futureDict[future]
+                resultDict = future.result()
+                resultDict["options"] = caseOptionDict
+                resultDict["log-file"] = logFile
+                resultDict.update(get_case_metrics(caseWorkingDir + os.sep + "snappyHexMesh_caseDir", resultDict["start-time"]))
+                summaryList.append(resultDict)
+                stdout.write(caseName + " : " + resultDict["status"] + f", {resultDict['wall-time'] : .1f} s\n")
+                stdout.flush()
+    finally:
+        sys.stdout = stdout
+    summaryList.sort(key = lambda x : x["case"])
+
+    sweepOptionNameList = []
+    for caseName, caseOptionDict in sweepCaseList:
+        sweepOptionNameList += [x for x in caseOptionDict if x not in sweepOptionNameList]
+    summaryDict = {
+            "name" : sweepName,
+            "sweep-file" : os.path.abspath(sweepFile),
+            "wall-time" : time.time() - sweepStartTime,
+            "n-cores" : resourcePool.nCores,
+            "memory" : resourcePool.memory,
+            "cases" : summaryList,
+        }
+    summaryFile = sweepDir + os.sep + sweepSummaryFilename
+    tmpFile = summaryFile + ".tmp-" + str(os.getpid())
+    with open(tmpFile, "w") as wf:
+        json.dump(summaryDict, wf, indent = 4)
+    os.replace(tmpFile, summaryFile)
+
+    str2print = "\n" + "-"*40 + "\n"
+    str2print += "Sweep summary (" + f"{summaryDict['wall-time'] : .1f}" + " s)\n"
+    str2print += "-"*40 + "\n"
+    str2print += get_summary_table(summaryList, sweepOptionNameList)
+    str2print += "-"*40 + "\n"
+    str2print += "Summary --> " + summaryFile + "\n"
+    print(str2print)
+
+    nFailedCase = len([x for x in summaryList if x["status"] != "ok"])
+    if nFailedCase:
+        sys.exit(str(nFailedCase) + " of " + str(len(summaryList)) + " sweep cases failed")
+    return summaryDict
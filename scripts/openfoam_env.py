@@ -0,0 +1,101 @@
+"""
+    Environment of the OpenFOAM utilities.
+
+    - The OpenFOAM bashrc is sourced once, the environment it leaves
+      ("env -0") is captured and every utility is started with it, without
+      a shell. The changes made by the bashrc are applied on top of the
+      environment of this process.
+    - The changes are kept in the artifact cache, keyed by the bashrc path,
+      size and modification time and the search paths of this process, the
+      bashrc is not sourced again on the next run.
+    - Commands are split into argument lists, paths are never seen by a
+      shell.
+"""
+
+import os
+import shlex
+import subprocess
+
+
+#---------------------------------------
+
+### Variables set by the capturing shell itself
+shellVariableList = ["_", "SHLVL", "PWD", "OLDPWD"]
+
+### Variables of this process the bashrc builds on
+inheritedVariableList = ["PATH", "LD_LIBRARY_PATH", "MPI_ROOT"]
+
+### Variables naming the OpenFOAM installation (fingerprints)
+foamVariablePrefixList = ["WM_", "FOAM_"]
+
+
+#---------------------------------------
+
+def capture_environment(
+        bashrcPath,
+    ):
+    ### The bashrc path is an argument of the shell, not part of the script.
+    ### A failing bashrc stops the shell before "env".
+    result = subprocess.run(
+            ["bash", "-c", ". \"$1\" > /dev/null || exit $?; env -0", "bash", bashrcPath],
+            stdout = subprocess.PIPE,
+            stderr = subprocess.PIPE,
+        )
+    if result.returncode != 0:
+        raise RuntimeError("Sourcing \"" + bashrcPath + "\" failed (exit code " + str(result.returncode) + ") : " + result.stderr.decode(errors = "replace"))
+
+    environmentDict = {}
+    for item in result.stdout.split(b"\0"):
+        name, separator, value = item.decode(errors = "surrogateescape").partition("=")
+        if separator and name not in shellVariableList:
+            environmentDict[name] = value
+    return environmentDict
+
+
+def get_openfoam_environment(
+        bashrcPath,
+        artifactCache = None,
+    ):
+    bashrcPath = os.path.abspath(bashrcPath)
+    if not os.path.isfile(bashrcPath):
+        raise RuntimeError("OpenFOAM bashrc not found : " + bashrcPath)
+
+    cacheKey = None
+    environmentChangeDict = None
+    if artifactCache is not None:
+        bashrcStat = os.stat(bashrcPath)
+        cacheKey = artifactCache.make_key(
+                "openfoam-environment",
+                [],
+                {
+                    "bashrc" : bashrcPath,
+                    "size" : bashrcStat.st_size,
+                    "mtime-ns" : bashrcStat.st_mtime_ns,
+                    "inherited" : {x : os.environ.get(x) for x in inheritedVariableList},
+                },
+            )
+        environmentChangeDict = artifactCache.get_data(cacheKey)
+
+    if environmentChangeDict is None:
+        capturedDict = capture_environment(bashrcPath)
+        environmentChangeDict = {k : v for k, v in capturedDict.items() if os.environ.get(k) != v}
+        if cacheKey is not None:
+            artifactCache.put_data(cacheKey, environmentChangeDict)
+
+    openfoamEnv = dict(os.environ)
+    openfoamEnv.update(environmentChangeDict)
+    return openfoamEnv
+
+
+def get_environment_signature(
+        openfoamEnv,
+    ):
+    return {k : v for k, v in sorted(openfoamEnv.items()) if k.startswith(tuple(foamVariablePrefixList))}
+
+
+def get_command_list(
+        utilityCommand,
+    ):
+    if isinstance(utilityCommand, str):
+        return shlex.split(utilityCommand)
+    return list(utilityCommand)
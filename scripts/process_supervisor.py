@@ -0,0 +1,417 @@
+"""
+    Supervisor of the OpenFOAM utilities, every utility of the process (all
+    the stages, cases of a sweep and jobs of the service) runs under one
+    asyncio event loop.
+
+    - The event loop runs in a thread of its own, the stage threads submit
+      a utility and wait for its result. The output is read line by line
+      by the loop and handed to the caller (log file, progress monitor) in
+      the context of the caller.
+    - Every utility runs in a process group of its own, a limit or a
+      cancellation kills the whole group (e.g. mpirun and its ranks) :
+      SIGTERM, SIGKILL after a grace period.
+    - Limits per run : wall-clock time and resident memory of the process
+      group (sum over /proc, checked every pollInterval).
+    - The end of a utility is seen through a pidfd (a thread waits for it
+      where pidfds are missing), its resource usage is read before it is
+      reaped (resource_usage.wait_process).
+    - The runs are tagged with the case of the context (processTag), a
+      case (e.g. a job of the service) is cancelled as a whole, with the
+      work registered outside of the supervisor (add_cancel_function, e.g.
+      the batch jobs of execution_backend).
+    - UtilityLimits holds the limits and retries of a run per utility,
+      given as "<value>" (all utilities) or "<utility>=<value>, ...".
+"""
+
+import os
+import sys
+import time
+import atexit
+import signal
+import asyncio
+import threading
+import contextvars
+import subprocess
+
+import resource_usage
+
+
+#---------------------------------------
+
+pollInterval = 1.0
+killGracePeriod = 5.0
+### Output still buffered after a killed group (pipe kept open by an
+### orphan), not waited for longer than this
+outputDrainTimeout = 5.0
+retryDelay = 2.0
+
+### Case of the running context, runs with the same tag are cancelled
+### together
+processTag = contextvars.ContextVar("processTag", default = None)
+
+pageSize = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+#---------------------------------------
+
+def get_group_memory(
+        processGroupId,
+    ):
+    ### Resident memory of the processes of a group, bytes
+    totalRss = 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open("/proc/" + pid + "/stat", "r") as rf:
+                statFieldList = rf.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        ### Fields after the command name : state, ppid, pgrp, ..., rss
+        if int(statFieldList[2]) == processGroupId:
+            totalRss += int(statFieldList[21]) * pageSize
+    return totalRss
+
+
+def kill_group(
+        processGroupId,
+        signalNumber,
+    ):
+    try:
+        os.killpg(processGroupId, signalNumber)
+    except (ProcessLookupError, PermissionError):
+        pass
+    return
+
+
+#---------------------------------------
+
+class ProcessSupervisor(object):
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.runDict = {}
+        self.cancelledTagSet = set()
+        self.cancelFunctionList = []
+        self.runLock = threading.Lock()
+        self.runCounter = 0
+        self.thread = threading.Thread(target = self.run_loop, name = "process-supervisor", daemon = True)
+        self.thread.start()
+        return
+
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        return
+
+    #---------------------------------------
+
+    async def read_output(
+            self,
+            reader,
+            logFile,
+            lineFunction,
+            context,
+        ):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if logFile is not None:
+                logFile.write(line)
+            if lineFunction is not None and context.run(lineFunction, line.decode(errors = "replace")) and logFile is not None:
+                logFile.flush()
+        return
+
+
+    async def wait_exit(
+            self,
+            process,
+        ):
+        ### Return code and resource usage, the process is reaped. The
+        ### members of the group left behind by the utility are killed
+        ### before, while the group id is still taken by the exited process
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError):
+            return await self.loop.run_in_executor(None, resource_usage.wait_process, process)
+        exitEvent = asyncio.Event()
+        self.loop.add_reader(pidfd, exitEvent.set)
+        try:
+            await exitEvent.wait()
+        finally:
+            self.loop.remove_reader(pidfd)
+            os.close(pidfd)
+        kill_group(process.pid, signal.SIGKILL)
+        return resource_usage.wait_process(process)
+
+
+    async def watch_limits(
+            self,
+            process,
+            timeout,
+            memoryLimit,
+            cancelEvent,
+        ):
+        ### Returns the reason to stop the process
+        startTime = time.time()
+        while True:
+            waitTime = pollInterval
+            if timeout is not None:
+                waitTime = min(waitTime, max(startTime + timeout - time.time(), 0.0))
+            try:
+                await asyncio.wait_for(cancelEvent.wait(), waitTime)
+                return "cancelled"
+            except asyncio.TimeoutError:
+                pass
+            if timeout is not None and time.time() - startTime >= timeout:
+                return "timeout"
+            if memoryLimit is not None:
+                if get_group_memory(process.pid) > memoryLimit:
+                    return "memory-limit"
+        return None
+
+
+    async def supervise(
+            self,
+            runId,
+            commandList,
+            cwd,
+            env,
+            logFile,
+            lineFunction,
+            timeout,
+            memoryLimit,
+            context,
+        ):
+        runDict = self.runDict[runId]
+        try:
+            process = subprocess.Popen(
+                    commandList,
+                    cwd = cwd,
+                    env = env,
+                    stdout = subprocess.PIPE,
+                    stderr = subprocess.STDOUT,
+                    start_new_session = True,
+                )
+        except OSError as e:
+            if logFile is not None:
+                logFile.write((str(e) + "\n").encode())
+            return {"return-code" : 127, "usage" : None, "reason" : None}
+        runDict["pid"] = process.pid
+
+        reader = asyncio.StreamReader(limit = 2**24)
+        transport, protocol = await self.loop.connect_read_pipe(
+                lambda : asyncio.StreamReaderProtocol(reader),
+                process.stdout,
+            )
+        readTask = self.loop.create_task(self.read_output(reader, logFile, lineFunction, context))
+        exitTask = self.loop.create_task(self.wait_exit(process))
+        watchTask = self.loop.create_task(self.watch_limits(process, timeout, memoryLimit, runDict["cancel-event"]))
+
+        reason = None
+        await asyncio.wait([exitTask, watchTask], return_when = asyncio.FIRST_COMPLETED)
+        if not exitTask.done():
+            reason = watchTask.result()
+            kill_group(process.pid, signal.SIGTERM)
+            done, pending = await asyncio.wait([exitTask], timeout = killGracePeriod)
+            if pending:
+                kill_group(process.pid, signal.SIGKILL)
+        else:
+            watchTask.cancel()
+        returnCode, usageDict = await exitTask
+
+        done, pending = await asyncio.wait([readTask], timeout = outputDrainTimeout)
+        for task in pending:
+            task.cancel()
+        transport.close()
+        return {"return-code" : returnCode, "usage" : usageDict, "reason" : reason}
+
+    #---------------------------------------
+
+    def run(
+            self,
+            commandList,
+            cwd = None,
+            env = None,
+            logFile = None,
+            lineFunction = None,
+            timeout = None,
+            memoryLimit = None,
+        ):
+        ### Called from any thread, waits for the utility. logFile -->
+        ### binary file the output is written to, lineFunction --> called
+        ### with every line (context of the caller), the log file is flushed
+        ### if it returns a true value.
+        ### Returns {"return-code", "usage", "reason"}, reason --> None,
+        ### "timeout", "memory-limit" or "cancelled"
+        tag = processTag.get()
+        with self.runLock:
+            if self.is_cancelled(tag):
+                return {"return-code" : -signal.SIGTERM, "usage" : None, "reason" : "cancelled"}
+            self.runCounter += 1
+            runId = self.runCounter
+            ### The event is set from other threads through the loop
+            self.runDict[runId] = {"tag" : tag, "pid" : None, "cancel-event" : asyncio.Event()}
+
+        future = asyncio.run_coroutine_threadsafe(
+                self.supervise(runId, commandList, cwd, env, logFile, lineFunction, timeout, memoryLimit, contextvars.copy_context()),
+                self.loop,
+            )
+        try:
+            return future.result()
+        finally:
+            with self.runLock:
+                self.runDict.pop(runId)
+
+
+    def is_cancelled(
+            self,
+            tag,
+        ):
+        return tag is not None and tag in self.cancelledTagSet
+
+
+    def add_cancel_function(
+            self,
+            cancelFunction,
+        ):
+        ### Called with the tag on cancel() (None at exit), for the work
+        ### running outside of the supervisor (e.g. batch jobs)
+        with self.runLock:
+            if cancelFunction not in self.cancelFunctionList:
+                self.cancelFunctionList.append(cancelFunction)
+        return
+
+
+    def cancel(
+            self,
+            tag = None,
+        ):
+        ### The runs of a tag (all runs if None), the later runs of the tag
+        ### are cancelled at once until forget()
+        with self.runLock:
+            if tag is not None:
+                self.cancelledTagSet.add(tag)
+            eventList = [x["cancel-event"] for x in self.runDict.values() if tag is None or x["tag"] == tag]
+            cancelFunctionList = list(self.cancelFunctionList)
+        for cancelEvent in eventList:
+            self.loop.call_soon_threadsafe(cancelEvent.set)
+        for cancelFunction in cancelFunctionList:
+            cancelFunction(tag)
+        return len(eventList)
+
+
+    def forget(
+            self,
+            tag,
+        ):
+        with self.runLock:
+            self.cancelledTagSet.discard(tag)
+        return
+
+
+    def kill_all(self):
+        ### At exit, without the event loop
+        with self.runLock:
+            pidList = [x["pid"] for x in self.runDict.values() if x["pid"] is not None]
+            cancelFunctionList = list(self.cancelFunctionList)
+        for pid in pidList:
+            kill_group(pid, signal.SIGKILL)
+        for cancelFunction in cancelFunctionList:
+            cancelFunction(None)
+        return
+
+
+#---------------------------------------
+
+supervisor = None
+supervisorLock = threading.Lock()
+
+
+def get_supervisor():
+    ### One supervisor (event loop) per process, started on first use
+    global supervisor
+    with supervisorLock:
+        if supervisor is None:
+            supervisor = ProcessSupervisor()
+            atexit.register(supervisor.kill_all)
+        return supervisor
+
+
+def install_signal_handlers():
+    ### Ctrl-C/SIGTERM cancel the running utilities (their process groups
+    ### do not get the signal of the terminal), main thread only
+    def handle_signal(signalNumber, frame):
+        if supervisor is not None:
+            supervisor.cancel()
+        if signalNumber == signal.SIGINT:
+            raise KeyboardInterrupt
+        sys.exit(128 + signalNumber)
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+    return
+
+
+#---------------------------------------
+
+def parse_limit_string(
+        limitString,
+        scale = 1.0,
+    ):
+    ### "none", "<value>" or "<utility>=<value>, ..." --> utility --> value
+    ### ("*" for all utilities)
+    limitDict = {}
+    if limitString is None or str(limitString).strip().lower() in ["", "none"]:
+        return limitDict
+    for item in str(limitString).split(","):
+        if not item.strip():
+            continue
+        name, separator, value = item.rpartition("=")
+        limitDict[name.strip() or "*"] = float(value) * scale
+    return limitDict
+
+
+class UtilityLimits(object):
+    ### Limits and retries of the utilities of a run, looked up by the log
+    ### name of the run (e.g. "snappyHexMesh_castellate" --> exact name,
+    ### "snappyHexMesh", "*")
+
+    def __init__(
+            self,
+            timeoutString = "none",
+            memoryLimitMbString = "none",
+            retries = 0,
+        ):
+        self.timeoutDict = parse_limit_string(timeoutString)
+        self.memoryLimitDict = parse_limit_string(memoryLimitMbString, 1024**2)
+        self.retries = max(int(retries), 0)
+        return
+
+
+    def get_limit(
+            self,
+            limitDict,
+            logName,
+        ):
+        for name in [logName, logName.split("_")[0], "*"]:
+            if name in limitDict:
+                return limitDict[name]
+        return None
+
+
+    def get_timeout(
+            self,
+            logName,
+        ):
+        return self.get_limit(self.timeoutDict, logName)
+
+
+    def get_memory_limit(
+            self,
+            logName,
+        ):
+        memoryLimit = self.get_limit(self.memoryLimitDict, logName)
+        return None if memoryLimit is None else int(memoryLimit)
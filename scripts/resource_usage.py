@@ -0,0 +1,199 @@
+"""
+    Resource accounting of the stages of the snappyHexMesh process.
+
+    - Utilities (child processes) : the child is waited for without being
+      reaped, its I/O counters (/proc/<pid>/io, including the children it
+      reaped, e.g. the ranks of mpirun) are read, then it is reaped with
+      os.wait4 for its CPU times and peak resident set size. The peak of a
+      child is at least the size of this process when it was started (the
+      forked image counts before the exec), it matters for small utilities
+      only.
+    - Python stages : CPU times and I/O counters of the running thread
+      (RUSAGE_THREAD, /proc/thread-self/io) before and after the stage, the
+      peak resident set size is the one of this process so far.
+    - Every record has the wall time, user/sys CPU time, peak RSS and the
+      bytes read/written (storage and all reads/writes), the records and
+      the run information are written to a JSON report.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import resource
+import threading
+import contextlib
+
+
+#---------------------------------------
+
+### /proc/<pid>/io counters kept, storage and read/write calls
+ioCounterList = ["read_bytes", "write_bytes", "rchar", "wchar"]
+
+
+#---------------------------------------
+
+def read_proc_io(
+        ioFile,
+    ):
+    ### Counters of a /proc/.../io file, None if not readable
+    ioDict = {}
+    try:
+        with open(ioFile, "r") as rf:
+            for line in rf:
+                name, separator, value = line.partition(":")
+                if name in ioCounterList:
+                    ioDict[name] = int(value)
+    except (OSError, ValueError):
+        return None
+    return ioDict
+
+
+def wait_process(
+        process,
+    ):
+    ### Waits for a subprocess.Popen process, returns the return code and
+    ### its resource usage
+    try:
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        ioDict = read_proc_io("/proc/" + str(process.pid) + "/io")
+    except (OSError, AttributeError):
+        ioDict = None
+    pid, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    usageDict = {
+            "user-time" : rusage.ru_utime,
+            "sys-time" : rusage.ru_stime,
+            "max-rss" : rusage.ru_maxrss * 1024,
+        }
+    for name in ioCounterList:
+        usageDict[name] = None if ioDict is None else ioDict.get(name)
+    return process.returncode, usageDict
+
+
+def get_thread_usage():
+    rusage = resource.getrusage(getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF))
+    usageDict = {
+            "user-time" : rusage.ru_utime,
+            "sys-time" : rusage.ru_stime,
+        }
+    ioDict = read_proc_io("/proc/thread-self/io")
+    for name in ioCounterList:
+        usageDict[name] = None if ioDict is None else ioDict.get(name)
+    return usageDict
+
+
+#---------------------------------------
+
+class ResourceRecorder(object):
+
+    def __init__(self):
+        self.startTime = time.time()
+        self.recordList = []
+        self.recordLock = threading.Lock()
+        return
+
+
+    def add_record(
+            self,
+            name,
+            kind,
+            wallTime,
+            usageDict,
+            returnCode = None,
+        ):
+        record = {
+                "name" : name,
+                "kind" : kind,
+                "wall-time" : wallTime,
+                "return-code" : returnCode,
+            }
+        record.update(usageDict)
+        with self.recordLock:
+            self.recordList.append(record)
+        return record
+
+
+    @contextlib.contextmanager
+    def measure(
+            self,
+            name,
+        ):
+        ### Python stage, in the calling thread
+        startTime = time.time()
+        startUsageDict = get_thread_usage()
+        try:
+            yield
+        finally:
+            usageDict = {}
+            for key, value in get_thread_usage().items():
+                startValue = startUsageDict[key]
+                usageDict[key] = None if value is None or startValue is None else value - startValue
+            usageDict["max-rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            self.add_record(name, "python", time.time() - startTime, usageDict)
+        return
+
+
+    def measure_function(
+            self,
+            name,
+            function,
+        ):
+        def measured_function(*args, **kwargs):
+            with self.measure(name):
+                return function(*args, **kwargs)
+        return measured_function
+
+    #---------------------------------------
+
+    def get_report_dict(
+            self,
+            infoDict = None,
+        ):
+        with self.recordLock:
+            recordList = list(self.recordList)
+        return {
+                "host" : socket.gethostname(),
+                "python" : sys.version.split()[0],
+                "start-time" : self.startTime,
+                "wall-time" : time.time() - self.startTime,
+                "info" : infoDict or {},
+                "stages" : recordList,
+                "total" : {
+                    "user-time" : sum([x["user-time"] for x in recordList]),
+                    "sys-time" : sum([x["sys-time"] for x in recordList]),
+                    "max-rss" : max([x["max-rss"] for x in recordList] + [0]),
+                    "read_bytes" : sum([x["read_bytes"] or 0 for x in recordList]),
+                    "write_bytes" : sum([x["write_bytes"] or 0 for x in recordList]),
+                },
+            }
+
+
+    def write_report(
+            self,
+            reportFile,
+            infoDict = None,
+        ):
+        tmpFile = reportFile + ".tmp-" + str(os.getpid())
+        with open(tmpFile, "w") as wf:
+            json.dump(self.get_report_dict(infoDict), wf, indent = 4)
+        os.replace(tmpFile, reportFile)
+        return
+
+
+    def get_report(self):
+        mb = 1024**2
+        with self.recordLock:
+            recordList = list(self.recordList)
+        maxNameLength = max([len(x["name"]) for x in recordList] + [len("Stage")])
+
+        str2print = ""
+        str2print += f"{'Stage' : <{maxNameLength}} : {'wall' : >9} {'user' : >9} {'sys' : >9} {'RSS' : >9} {'read' : >9} {'write' : >9}\n"
+        str2print += f"{'' : <{maxNameLength}}   {'[sec]' : >9} {'[sec]' : >9} {'[sec]' : >9} {'[MB]' : >9} {'[MB]' : >9} {'[MB]' : >9}\n"
+        for record in recordList:
+            readMb = "-" if record["rchar"] is None else f"{record['rchar'] / mb : .1f}"
+            writeMb = "-" if record["wchar"] is None else f"{record['wchar'] / mb : .1f}"
+            str2print += f"{record['name'] : <{maxNameLength}} : {record['wall-time'] : >9.3f} {record['user-time'] : >9.3f} {record['sys-time'] : >9.3f} {record['max-rss'] / mb : >9.1f} {readMb : >9} {writeMb : >9}\n"
+        return str2print
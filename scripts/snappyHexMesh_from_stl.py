@@ -13,6 +13,44 @@ import json
 import subprocess
 import shutil
 import time
+import gzip
+import tempfile
+
+import stl_io
+import tri_surface
+import artifact_cache
+import feature_edges
+import surface_check
+import surface_bvh
+import leak_check
+import mesh_estimator
+import stage_scheduler
+import openfoam_env
+import log_monitor
+import resource_usage
+import mesh_checkpoint
+import workspace
+import process_supervisor
+import execution_backend
+
+
+#---------------------------------------
+
+featureIncludedAngle = 150
+triSurfaceCompressLevel = 1
+stageFingerprintFilename = ".stage_fingerprints.json"
+snappyHexMeshCheckpointDirname = "snappyHexMesh_checkpoints"
+
+### snappyHexMesh phases, in their order
+snappyHexMeshPhaseList = ["castellate", "snap", "layers"]
+
+### snappyHexMeshDict settings used when they are not estimated
+defaultMeshSettingDict = {
+    "max-local-cells" : 3000000,
+    "max-global-cells" : 25000000,
+    "surface-refinement-level" : 3,
+    "n-cells-between-levels" : 3,
+}
 
 
 #---------------------------------------
@@ -54,6 +92,38 @@ def get_openfoam_dictionary_hline():
 
 
 
+#---------------------------------------
+
+def get_trisurface_filename(
+        domainInfoDict,
+        stlFilename,
+    ):
+    if domainInfoDict.get("trisurface-compression", "none") == "gzip":
+        return stlFilename + ".gz"
+    return stlFilename
+
+
+def get_stl_file_stem(
+        stlFilename,
+    ):
+    if stlFilename.endswith(".gz"):
+        stlFilename = stlFilename[ : -len(".gz")]
+    return os.path.splitext(stlFilename)[0]
+
+
+def get_domain_region_dict(
+        domainInfoDict,
+    ):
+    ### Region name in the domain STL file --> BC name
+    ###     ASCII  --> solid names are the BC names
+    ###     binary --> OpenFOAM names the attribute regions "patch0", "patch1", ...
+    bcList = list(domainInfoDict["bc-info"].keys())
+    if domainInfoDict.get("stl-format", "ascii") == "binary":
+        regionList = domainInfoDict.get("combined-bc-region-list", bcList)
+        return {"patch" + str(index) : bc for index, bc in enumerate(regionList)}
+    return {bc : bc for bc in bcList}
+
+
 #---------------------------------------
 
 def empty_populated_directory(
@@ -84,16 +154,44 @@ def empty_populated_directory(
     return
 
 
+def copy_compressed_stl_file(
+        sourceFile,
+        targetFile,
+        artifactCache = None,
+    ):
+    cacheKey = None
+    if artifactCache is not None:
+        cacheKey = artifactCache.make_key("trisurface-gzip", [sourceFile], {"compress-level" : triSurfaceCompressLevel})
+        if artifactCache.restore_files(cacheKey, os.path.dirname(targetFile)) is not None:
+            print("Compressed copy restored from the cache : " + os.path.basename(targetFile))
+            return
+    
+    ### No timestamp in the gzip header, the same STL file always gives
+    ### the same compressed file (and the same content hash)
+    with open(sourceFile, "rb") as sf, open(targetFile, "wb") as tf:
+        with gzip.GzipFile(fileobj = tf, mode = "wb", compresslevel = triSurfaceCompressLevel, mtime = 0) as gf:
+            shutil.copyfileobj(sf, gf, 16*1024*1024)
+    
+    if cacheKey is not None:
+        artifactCache.put_files(cacheKey, [targetFile])
+    return
+
+
 def populate_triSurface_directory(
         domainInfoDict,
         caseDir,
         triSurfaceDir,
+        artifactCache = None,
     ):
     stlSourceDir = domainInfoDict["snappyhex-ready-stl-dir"]
     
+    ### The feature edges are kept for the stages that are up to date
     if os.path.exists(triSurfaceDir):
-        shutil.rmtree(triSurfaceDir)
-    os.system("mkdir -p " + triSurfaceDir)
+        empty_populated_directory(
+                triSurfaceDir,
+                [".eMesh"],
+            )
+    os.makedirs(triSurfaceDir, exist_ok = True)
     
     stlFileList = []
     stlFileList.append(domainInfoDict["combined-bc-stl-filename"])
@@ -107,11 +205,25 @@ def populate_triSurface_directory(
     str2print += "Copying required files to \"triSurface\" directory!\n"
     print(str2print)
     
+    triSurfaceFileList = []
     for stlFile in stlFileList:
         sourceFile = stlSourceDir + os.sep + stlFile 
-        targetFile = triSurfaceDir + os.sep + stlFile 
-        shutil.copy2(sourceFile, targetFile)
-    return stlFileList
+        targetFile = triSurfaceDir + os.sep + get_trisurface_filename(domainInfoDict, stlFile)
+        if targetFile.endswith(".gz"):
+            copy_compressed_stl_file(
+                    sourceFile,
+                    targetFile,
+                    artifactCache,
+                )
+        else:
+            shutil.copy2(sourceFile, targetFile)
+        triSurfaceFileList.append(os.path.basename(targetFile))
+        
+        ### Region names of the combined binary STL file
+        sidecarFile = stl_io.get_region_sidecar_file(sourceFile)
+        if os.path.exists(sidecarFile):
+            shutil.copy2(sidecarFile, stl_io.get_region_sidecar_file(targetFile))
+    return triSurfaceFileList
 
 
 def create_snappyHex_case_directory(caseDir):
@@ -121,17 +233,18 @@ def create_snappyHex_case_directory(caseDir):
             "system"
         ]
     for dir in dirList:
-        os.system("mkdir -p " + caseDir + os.sep + dir)
+        os.makedirs(caseDir + os.sep + dir, exist_ok = True)
     return
 
 
 def initiate_snappyHex_case_directory(
         domainInfoDict,
         caseDir,
+        cleanCase = True,
     ):
     excludeFileList = []
     
-    if os.path.exists(caseDir):
+    if cleanCase and os.path.exists(caseDir):
         empty_populated_directory(
                 caseDir,
                 excludeFileList,
@@ -141,25 +254,460 @@ def initiate_snappyHex_case_directory(
     return
 
 
+def extract_surface_features(
+        rPath,
+        openfoamEnv,
+        openfoamVersion,
+        foamFileVersion,
+        stlFilename,
+        artifactCache = None,
+        includedAngle = featureIncludedAngle,
+        resourceRecorder = None,
+        utilityLimits = None,
+        executionBackends = None,
+    ):
+    ### "surfaceFeatureExtract" for a single STL file, with its own
+    ### dictionary and log file so several files can run at once
+    triSurfaceDir = rPath + os.sep + "constant" + os.sep + "triSurface"
+    featureEdgeMeshDir = rPath + os.sep + "constant" + os.sep + "extendedFeatureEdgeMesh"
+    stlFileStem = get_stl_file_stem(stlFilename)
+    
+    ### Feature edges of an unchanged STL file are restored from the cache
+    cacheKey = None
+    if artifactCache is not None:
+        cacheKey = artifactCache.make_key(
+                "surfaceFeatureExtract",
+                [triSurfaceDir + os.sep + stlFilename],
+                {"includedAngle" : includedAngle, "openfoam-version" : openfoamVersion},
+            )
+        cachedFileList = artifactCache.get_file_path_list(cacheKey)
+        if cachedFileList is not None:
+            for cachedFile in cachedFileList:
+                if cachedFile.endswith(".eMesh"):
+                    shutil.copy2(cachedFile, triSurfaceDir)
+                else:
+                    os.makedirs(featureEdgeMeshDir, exist_ok = True)
+                    shutil.copy2(cachedFile, featureEdgeMeshDir)
+            print("-"*40 + "\n" + "Feature edges restored from the cache : " + stlFileStem + ".eMesh" + "\n")
+            return
+    
+    location = "system"
+    dictName = "surfaceFeatureExtractDict." + stlFileStem
+    surfaceFeatureExtractDictFile = rPath + os.sep + "system" + os.sep + dictName
+    create_surface_feature_extract_dictionary(
+            openfoamVersion,
+            foamFileVersion,
+            location,
+            surfaceFeatureExtractDictFile,
+            [stlFilename],
+            includedAngle,
+        )
+    
+    run_openfoam_utility(
+            openfoamEnv,
+            rPath,
+            "surfaceFeatureExtract -dict system/" + dictName,
+            "surfaceFeatureExtract_" + stlFileStem,
+            resourceRecorder,
+            utilityLimits,
+            executionBackends,
+        )
+    
+    if cacheKey is not None:
+        featureFileList = [
+                triSurfaceDir + os.sep + stlFileStem + ".eMesh",
+                featureEdgeMeshDir + os.sep + stlFileStem + ".extendedFeatureEdgeMesh",
+            ]
+        featureFileList = [x for x in featureFileList if os.path.exists(x)]
+        if featureFileList and featureFileList[0].endswith(".eMesh"):
+            artifactCache.put_files(cacheKey, featureFileList)
+    return
+
+
 def prepareSTL(
         rPath,
-        openfoamEnvSourceCommand
+        openfoamEnv,
+        openfoamVersion,
+        foamFileVersion,
+        stlFileList,
+        artifactCache = None,
+        includedAngle = featureIncludedAngle,
     ):
     str2print = "-"*40 + "\n"
     str2print += "Extracting edge features ...\n"
     print(str2print)
-    # commandString = "/bin/bash"
-    result = subprocess.run(
-            openfoamEnvSourceCommand + " && " + "surfaceFeatureExtract > log_surfaceFeatureExtract.log",
-            cwd = rPath,
-            shell = True,
-        )
+    
+    for stlFilename in stlFileList:
+        extract_surface_features(
+                rPath,
+                openfoamEnv,
+                openfoamVersion,
+                foamFileVersion,
+                stlFilename,
+                artifactCache,
+                includedAngle,
+            )
     return
 
 
+def extract_native_surface_features(
+        rPath,
+        stlFilename,
+        foamFileVersion,
+        artifactCache = None,
+        includedAngle = featureIncludedAngle,
+    ):
+    triSurfaceDir = rPath + os.sep + "constant" + os.sep + "triSurface"
+    stlFile = triSurfaceDir + os.sep + stlFilename
+    eMeshFile = triSurfaceDir + os.sep + get_stl_file_stem(stlFilename) + ".eMesh"
+    
+    cacheKey = None
+    if artifactCache is not None:
+        cacheKey = artifactCache.make_key(
+                "native-feature-edges",
+                [stlFile],
+                {"includedAngle" : includedAngle, "foamfile-version" : foamFileVersion},
+            )
+        if artifactCache.restore_files(cacheKey, triSurfaceDir) is not None:
+            print("-"*40 + "\n" + "Feature edges restored from the cache : " + os.path.basename(eMeshFile) + "\n")
+            return artifactCache.get_data(cacheKey)
+    
+    surface = read_tri_surface(stlFile, artifactCache)
+    featureEdgeDict = feature_edges.extract_feature_edges(
+            surface,
+            eMeshFile,
+            includedAngle,
+            foamFileVersion,
+        )
+    
+    str2print = "-"*40 + "\n"
+    str2print += "Feature edges : " + os.path.basename(eMeshFile) + "\n"
+    str2print += f"{'Edges' : <22}: {featureEdgeDict['n-edges']}\n"
+    str2print += f"{'Feature edges' : <22}: {featureEdgeDict['n-feature-edges']}\n"
+    str2print += f"{'  - angle' : <22}: {featureEdgeDict['n-angle-edges']}\n"
+    str2print += f"{'  - region' : <22}: {featureEdgeDict['n-region-edges']}\n"
+    str2print += f"{'  - open' : <22}: {featureEdgeDict['n-open-edges']}\n"
+    str2print += f"{'  - non-manifold' : <22}: {featureEdgeDict['n-non-manifold-edges']}\n"
+    print(str2print)
+    
+    if cacheKey is not None:
+        artifactCache.put_files(cacheKey, [eMeshFile], data = featureEdgeDict)
+    return featureEdgeDict
+
+
+def read_tri_surface(
+        stlFile,
+        artifactCache = None,
+    ):
+    ### Welded surfaces are cached as raw arrays and read back memory mapped
+    if artifactCache is None:
+        return tri_surface.TriSurface.read(stlFile)
+    
+    cacheKey = artifactCache.make_key("welded-surface", [stlFile], {"merge-tolerance" : 0.0})
+    cachedFileList = artifactCache.get_file_path_list(cacheKey)
+    if cachedFileList is not None:
+        return tri_surface.TriSurface.load(os.path.dirname(cachedFileList[0]))
+    
+    surface = tri_surface.TriSurface.read(stlFile)
+    with tempfile.TemporaryDirectory() as tmpDir:
+        artifactCache.put_files(cacheKey, surface.save(tmpDir))
+    return surface
+
+
+def check_triSurface_file(
+        stlFile,
+        surfaceCheck,
+        stlFormat,
+        artifactCache = None,
+    ):
+    ### surfaceCheck --> "report", "strict" (same as "report", the caller
+    ### stops on failure) or "repair" (the file is rewritten)
+    cacheKey = None
+    checkDict = None
+    if artifactCache is not None:
+        cacheKey = artifactCache.make_key("surface-check", [stlFile])
+        checkDict = artifactCache.get_data(cacheKey)
+    
+    if checkDict is None:
+        surface = read_tri_surface(stlFile, artifactCache)
+        checkDict = surface_check.check_surface(surface)
+        if cacheKey is not None:
+            artifactCache.put_data(cacheKey, checkDict)
+    
+    repairDict = None
+    if surfaceCheck == "repair" and not checkDict["valid"]:
+        surface = read_tri_surface(stlFile, artifactCache)
+        repairedSurface, repairDict = surface_check.repair_surface(surface)
+        if sum(repairDict.values()) > 0:
+            repairedSurface.write_stl(stlFile, binary = stlFormat == "binary")
+            checkDict = surface_check.check_surface(repairedSurface)
+    
+    print(surface_check.get_surface_check_report(os.path.basename(stlFile), checkDict, repairDict))
+    return checkDict
+
+
+def check_triSurface_files(
+        domainInfoDict,
+        triSurfaceDir,
+        surfaceCheck = "report",
+        artifactCache = None,
+    ):
+    ### The domain STL and the block STL files have to be closed and
+    ### outward oriented, the single BC files are open by definition
+    if surfaceCheck == "off":
+        return {}
+    
+    stlFilenameList = [domainInfoDict["combined-bc-stl-filename"]]
+    stlFilenameList.extend(list(domainInfoDict["block-info"].values()))
+    
+    surfaceCheckDict = {}
+    for stlFilename in stlFilenameList:
+        triSurfaceFilename = get_trisurface_filename(domainInfoDict, stlFilename)
+        surfaceCheckDict[triSurfaceFilename] = check_triSurface_file(
+                triSurfaceDir + os.sep + triSurfaceFilename,
+                surfaceCheck,
+                domainInfoDict.get("stl-format", "ascii"),
+                artifactCache,
+            )
+    
+    failedList = [k for k, v in surfaceCheckDict.items() if not v["valid"]]
+    if surfaceCheck == "strict" and len(failedList) > 0:
+        sys.exit("Surface check failed (surface_check = strict) : " + ", ".join(failedList))
+    return surfaceCheckDict
+
+
+def get_location_in_mesh(
+        loactionInMesh,
+        domainInfoDict,
+        triSurfaceDir,
+        blockMeshCellSize,
+        artifactCache = None,
+    ):
+    ### loactionInMesh --> [x, y, z]       checked to be inside the domain STL
+    ###                    "auto"          deepest sampled point of the domain
+    ###                    "auto:<block>"  deepest sampled point of the block
+    domainStlFile = triSurfaceDir + os.sep + get_trisurface_filename(domainInfoDict, domainInfoDict["combined-bc-stl-filename"])
+    surfaceFileList = [domainStlFile]
+    
+    if isinstance(loactionInMesh, str):
+        blockName = loactionInMesh.partition(":")[2].strip()
+        if blockName:
+            if blockName not in domainInfoDict["block-info"]:
+                sys.exit("Unknown block for locationInMesh : " + blockName)
+            surfaceFileList.append(triSurfaceDir + os.sep + get_trisurface_filename(domainInfoDict, domainInfoDict["block-info"][blockName]))
+        
+        cacheKey = None
+        locationDict = None
+        if artifactCache is not None:
+            cacheKey = artifactCache.make_key("location-in-mesh", surfaceFileList, {"block" : blockName})
+            locationDict = artifactCache.get_data(cacheKey)
+        
+        if locationDict is None:
+            surfaceList = [read_tri_surface(stlFile, artifactCache) for stlFile in surfaceFileList]
+            point, distance = surface_bvh.find_inside_point(
+                    [surface_bvh.SurfaceBvh(surface) for surface in surfaceList],
+                    surfaceList[-1].bounds(),
+                )
+            if point is None:
+                sys.exit("No point found inside " + " and ".join([os.path.basename(x) for x in surfaceFileList]))
+            locationDict = {"point" : [float(x) for x in point], "distance" : distance}
+            if cacheKey is not None:
+                artifactCache.put_data(cacheKey, locationDict)
+        
+        str2print = "-"*40 + "\n"
+        str2print += "Location in mesh (" + loactionInMesh + ") --> " + str(locationDict["point"]) + "\n"
+        str2print += "Distance to the surface  : " + str(locationDict["distance"]) + "\n"
+        print(str2print)
+        return locationDict["point"]
+    
+    domainSurface = read_tri_surface(domainStlFile, artifactCache)
+    domainBvh = surface_bvh.SurfaceBvh(domainSurface)
+    isInside = bool(domainBvh.contains_points(loactionInMesh)[0])
+    distance = float(domainBvh.nearest_distance(loactionInMesh)[0][0])
+    
+    str2print = "-"*40 + "\n"
+    str2print += "Location in mesh         : " + str(list(loactionInMesh)) + "\n"
+    str2print += "Inside the domain STL    : " + str(isInside) + "\n"
+    str2print += "Distance to the surface  : " + str(distance) + "\n"
+    if distance < blockMeshCellSize:
+        str2print += "Warning : closer to the surface than the background cell size (" + str(blockMeshCellSize) + ")\n"
+    print(str2print)
+    
+    if not isInside:
+        ### The parity test is only meaningful for a closed surface
+        if domainSurface.is_closed():
+            sys.exit("locationInMesh " + str(list(loactionInMesh)) + " is outside the domain STL")
+        print("Warning : the domain STL is not closed, locationInMesh is not rejected")
+    return loactionInMesh
+
+
+def check_domain_leak(
+        domainInfoDict,
+        caseDir,
+        domainStlBound,
+        blockMeshCellSize,
+        lengthUnit,
+        loactionInMesh,
+        leakCheck = "report",
+        leakCheckRefinement = 1,
+        artifactCache = None,
+    ):
+    ### leakCheck --> "off", "report" or "strict" (stops on a leak)
+    if leakCheck == "off":
+        return None
+    
+    triSurfaceDir = caseDir + os.sep + "constant" + os.sep + "triSurface"
+    domainStlFile = triSurfaceDir + os.sep + get_trisurface_filename(domainInfoDict, domainInfoDict["combined-bc-stl-filename"])
+    bBox, nodeSpacing = get_block_mesh_lattice(
+            domainStlBound,
+            blockMeshCellSize,
+            lengthUnit,
+        )
+    latticeShape = [nodeSpacing["x"], nodeSpacing["y"], nodeSpacing["z"]]
+    
+    cacheKey = None
+    leakDict = None
+    if artifactCache is not None:
+        cacheKey = artifactCache.make_key(
+                "leak-check",
+                [domainStlFile],
+                {
+                    "bound" : bBox,
+                    "lattice" : latticeShape,
+                    "refinement" : leakCheckRefinement,
+                    "location-in-mesh" : list(loactionInMesh),
+                },
+            )
+        leakDict = artifactCache.get_data(cacheKey)
+    
+    if leakDict is None:
+        leakDict = leak_check.check_leak(
+                read_tri_surface(domainStlFile, artifactCache),
+                bBox,
+                latticeShape,
+                loactionInMesh,
+                leakCheckRefinement,
+            )
+        if cacheKey is not None:
+            artifactCache.put_data(cacheKey, leakDict)
+    
+    str2print = "-"*40 + "\n"
+    str2print += "Leak check : " + os.path.basename(domainStlFile) + "\n"
+    str2print += f"{'Lattice' : <22}: {leakDict['lattice']} (refinement {leakCheckRefinement})\n"
+    str2print += f"{'Surface cells' : <22}: {leakDict['n-surface-cells']} / {leakDict['n-cells']}\n"
+    if "n-filled-cells" in leakDict:
+        str2print += f"{'Filled cells' : <22}: {leakDict['n-filled-cells']}\n"
+    str2print += f"{'Status' : <22}: {leakDict['status']}\n"
+    
+    if leakDict["leak"]:
+        ### Fill path from locationInMesh to the background mesh boundary
+        leakPathFile = caseDir + os.sep + "leak_path.csv"
+        with open(leakPathFile, "w") as wf:
+            wf.write("x,y,z\n")
+            for point in leakDict["leak-path"]:
+                wf.write(",".join([str(x) for x in point]) + "\n")
+        str2print += f"{'Leak location' : <22}: {leakDict['leak-point']}\n"
+        str2print += f"{'Leak path' : <22}: {leakPathFile}\n"
+    print(str2print)
+    
+    if leakCheck == "strict" and leakDict["leak"]:
+        sys.exit("Leak check failed (leak_check = strict), the domain leaks near " + str(leakDict["leak-point"]))
+    return leakDict
+
+
+def estimate_mesh_settings(
+        domainInfoDict,
+        triSurfaceDir,
+        domainStlBound,
+        blockMeshCellSize,
+        lengthUnit,
+        surfaceRefinementLevel = 3,
+        nCellsBetweenLevels = 3,
+        meshLimits = "auto",
+        nProcs = 1,
+        artifactCache = None,
+        memoryAvailable = None,
+        nCoreAvailable = None,
+    ):
+    ### meshLimits --> "auto" (cell limits from the available memory) or
+    ###                "fixed" (default cell limits), the estimate is
+    ###                printed in both cases
+    ### memoryAvailable/nCoreAvailable --> budget of the run, the machine
+    ###                                    if None
+    domainStlFile = triSurfaceDir + os.sep + get_trisurface_filename(domainInfoDict, domainInfoDict["combined-bc-stl-filename"])
+    domainSurface = read_tri_surface(domainStlFile, artifactCache)
+    bBox, nodeSpacing = get_block_mesh_lattice(
+            domainStlBound,
+            blockMeshCellSize,
+            lengthUnit,
+        )
+    latticeShape = [nodeSpacing["x"], nodeSpacing["y"], nodeSpacing["z"]]
+    
+    cellEstimateDict = mesh_estimator.estimate_cell_count(
+            bBox,
+            latticeShape,
+            domainSurface.volume(),
+            domainSurface.region_areas(),
+            {region : surfaceRefinementLevel for region in domainSurface.regionNames},
+            nCellsBetweenLevels,
+        )
+    estimateDict = mesh_estimator.get_mesh_settings(
+            cellEstimateDict,
+            latticeShape,
+            nProcs,
+            memoryAvailable,
+            nCoreAvailable,
+        )
+    
+    meshSettingDict = dict(defaultMeshSettingDict)
+    meshSettingDict["surface-refinement-level"] = surfaceRefinementLevel
+    meshSettingDict["n-cells-between-levels"] = nCellsBetweenLevels
+    if meshLimits == "auto":
+        meshSettingDict["max-global-cells"] = estimateDict["max-global-cells"]
+        meshSettingDict["max-local-cells"] = estimateDict["max-local-cells"]
+    meshSettingDict["estimate"] = estimateDict
+    
+    gb = 1024**3
+    str2print = "-"*40 + "\n"
+    str2print += "Mesh estimate\n"
+    str2print += f"{'Background cells' : <26}: {cellEstimateDict['n-background-cells']} ({cellEstimateDict['n-background-cells-inside']} inside the domain)\n"
+    str2print += f"{'Cells per level' : <26}: {cellEstimateDict['level-cells']}\n"
+    str2print += f"{'Estimated cells' : <26}: {estimateDict['n-cells']}\n"
+    str2print += f"{'Estimated memory' : <26}: {estimateDict['estimated-memory'] / gb : .2f} GB\n"
+    if estimateDict["available-memory"] is not None:
+        str2print += f"{'Available memory' : <26}: {estimateDict['available-memory'] / gb : .2f} GB\n"
+    str2print += f"{'Available cores' : <26}: {estimateDict['n-cores']}\n"
+    str2print += f"{'Recommended processes' : <26}: {estimateDict['n-procs-recommended']} {tuple(estimateDict['decomposition-recommended'])}\n"
+    str2print += f"{'maxGlobalCells' : <26}: {meshSettingDict['max-global-cells']}\n"
+    str2print += f"{'maxLocalCells' : <26}: {meshSettingDict['max-local-cells']}\n"
+    if not estimateDict["fits-memory"]:
+        str2print += "Warning : the estimated mesh does not fit in the available memory, snappyHexMesh stops refining at maxGlobalCells\n"
+    print(str2print)
+    return meshSettingDict
+
+
+def get_domain_stl_information_dict(
+        surface,
+    ):
+    regionInfoDict = {}
+    for regionName in surface.regionNames:
+        regionSurface = surface.region(regionName)
+        regionInfoDict[regionName] = {
+                "n-triangles" : regionSurface.n_faces(),
+                "bound" : regionSurface.bounds(),
+            }
+    return {
+            "bound" : surface.bounds(),
+            "n-triangles" : surface.n_faces(),
+            "n-points" : surface.n_points(),
+            "region-info" : regionInfoDict,
+        }
+
+
 def extract_domain_stl_information(
         domainStlFile,
         triSurfaceDir,
+        artifactCache = None,
     ):
     wspace = " "
     indentLength = 4
@@ -173,59 +721,47 @@ def extract_domain_stl_information(
     str2print += "Domain STL file          : " + domainStlFilename + "\n"
     print(str2print)
     
-    with open(workingStlFile, "r") as rf:
-        domainStlFileData = rf.readlines()
+    domainStlInfoDict = None
+    if artifactCache is not None:
+        cacheKey = artifactCache.make_key("domain-stl-information", [workingStlFile])
+        domainStlInfoDict = artifactCache.get_data(cacheKey)
     
-    vertexList = []
+    if domainStlInfoDict is None:
+        domainSurface = read_tri_surface(workingStlFile, artifactCache)
+        domainStlInfoDict = get_domain_stl_information_dict(domainSurface)
+        if artifactCache is not None:
+            artifactCache.put_data(cacheKey, domainStlInfoDict)
+    else:
+        print("Domain STL information restored from the cache")
     
-    for index, line in enumerate(domainStlFileData):
-        if "vertex" in line:
-            lineSegment = [x for x in line.split()]
-            vertexList.append(
-                    (
-                        float(lineSegment[1]),
-                        float(lineSegment[2]),
-                        float(lineSegment[3]),
-                    )
-                )
+    domainStlBound = domainStlInfoDict["bound"]
+    
+    str2print = "-"*40 + "\n"
+    str2print += "Number of triangles      : " + str(domainStlInfoDict["n-triangles"]) + "\n"
+    str2print += "Number of points         : " + str(domainStlInfoDict["n-points"]) + "\n"
+    str2print += "Region extents           :\n"
+    for regionName, regionInfo in domainStlInfoDict["region-info"].items():
+        regionBound = regionInfo["bound"]
+        if regionBound is None:
+            continue
+        str2print += indent + f"{regionName} ({regionInfo['n-triangles']} triangles)\n"
+        str2print += indent * 2 + f"x : {regionBound['x-min']} --> {regionBound['x-max']}\n"
+        str2print += indent * 2 + f"y : {regionBound['y-min']} --> {regionBound['y-max']}\n"
+        str2print += indent * 2 + f"z : {regionBound['z-min']} --> {regionBound['z-max']}\n"
+    print(str2print)
     
-    vextexXcoordinateList = [i[0] for i in vertexList]
-    vextexYcoordinateList = [i[1] for i in vertexList]
-    vextexZcoordinateList = [i[2] for i in vertexList]
-    
-    domainStlBound = {
-            "x-min" : min(vextexXcoordinateList),
-            "x-max" : max(vextexXcoordinateList),
-            "y-min" : min(vextexYcoordinateList),
-            "y-max" : max(vextexYcoordinateList),
-            "z-min" : min(vextexZcoordinateList ),
-            "z-max" : max(vextexZcoordinateList),
-        }
-            
     return domainStlBound
 
 
 #---------------------------------------
 
 
-def create_block_mesh_dict(
-        openfoamVersion,
-        foamFileVersion,
-        location,
-        blockMeshDictFile,
+def get_block_mesh_lattice(
         domainStlBound,
         blockMeshCellSize,
         lengthUnit,
     ):
-    openfaomHeaderString = get_openfom_dictionary_header(openfoamVersion)
-    
-    dictName = "blockMeshDict"
-    foamFileInfo = get_foamfile_info(
-            foamFileVersion,
-            location,
-            dictName,
-        )
-    
+    ### Bounding box and number of cells of the background mesh
     domainExtend = {
         "x-range" : domainStlBound["x-max"] - domainStlBound["x-min"],
         "y-range" : domainStlBound["y-max"] - domainStlBound["y-min"],
@@ -233,9 +769,9 @@ def create_block_mesh_dict(
     }
     
     nodeSpacing = {
-        "x" : int(domainExtend["x-range"] / blockMeshCellSize),
-        "y" : int(domainExtend["y-range"] / blockMeshCellSize),
-        "z" : int(domainExtend["z-range"] / blockMeshCellSize),
+        "x" : max(1, int(domainExtend["x-range"] / blockMeshCellSize)),
+        "y" : max(1, int(domainExtend["y-range"] / blockMeshCellSize)),
+        "z" : max(1, int(domainExtend["z-range"] / blockMeshCellSize)),
     }
     
     if lengthUnit == "mm":
@@ -259,6 +795,33 @@ def create_block_mesh_dict(
         "z-max" : domainStlBound["z-max"] + tolerance,
     }
     
+    return bBox, nodeSpacing
+
+
+def create_block_mesh_dict(
+        openfoamVersion,
+        foamFileVersion,
+        location,
+        blockMeshDictFile,
+        domainStlBound,
+        blockMeshCellSize,
+        lengthUnit,
+    ):
+    openfaomHeaderString = get_openfom_dictionary_header(openfoamVersion)
+    
+    dictName = "blockMeshDict"
+    foamFileInfo = get_foamfile_info(
+            foamFileVersion,
+            location,
+            dictName,
+        )
+    
+    bBox, nodeSpacing = get_block_mesh_lattice(
+            domainStlBound,
+            blockMeshCellSize,
+            lengthUnit,
+        )
+    
     wspace = " "
     indent = wspace * 4
     str2write = ""
@@ -356,12 +919,68 @@ def create_control_dictionary(
     return
 
 
+def create_decompose_par_dictionary(
+        openfoamVersion,
+        foamFileVersion,
+        location,
+        decomposeParDictFile,
+        nProcs,
+        decomposeMethod = "scotch",
+        decompositionCounts = (1, 1, 1),
+    ):
+    openfaomHeaderString = get_openfom_dictionary_header(openfoamVersion)
+    
+    dictName = "decomposeParDict"
+    foamFileInfo = get_foamfile_info(
+            foamFileVersion,
+            location,
+            dictName,
+        )
+    
+    nx, ny, nz = decompositionCounts
+    
+    wspace = " "
+    indent = wspace * 4
+    str2write = ""
+    str2write += openfaomHeaderString + "\n"
+    str2write += foamFileInfo + "\n"
+    str2write += get_openfoam_dictionary_hline() + "\n"
+    str2write += "\n"
+    str2write += "numberOfSubdomains    " + str(nProcs) + ";\n"
+    str2write += "method                " + decomposeMethod + ";\n"
+    str2write += "\n"
+    str2write += "simpleCoeffs\n"
+    str2write += "{\n"
+    str2write += indent + f"n        ({nx} {ny} {nz});\n"
+    str2write += indent + "delta    0.001;\n"
+    str2write += "}\n"
+    str2write += "\n"
+    str2write += "hierarchicalCoeffs\n"
+    str2write += "{\n"
+    str2write += indent + f"n        ({nx} {ny} {nz});\n"
+    str2write += indent + "delta    0.001;\n"
+    str2write += indent + "order    xyz;\n"
+    str2write += "}\n"
+    str2write += "\n"
+    str2write += get_openfoam_dictionary_hline() + "\n"
+    str2write += "// Comments/Notes\n"
+    str2write += "// \n"
+    str2write += "// \n"
+    str2write += get_openfoam_dictionary_hline() + "\n"
+    str2write += "\n"
+    
+    with open(decomposeParDictFile, "w") as wf:
+        wf.write(str2write)
+    return
+
+
 def create_surface_feature_extract_dictionary(
         openfoamVersion,
         foamFileVersion,
         location,
         surfaceFeatureExtractDictFile,
         stlFileList,
+        includedAngle = featureIncludedAngle,
     ):
     openfaomHeaderString = get_openfom_dictionary_header(openfoamVersion)
     
@@ -385,7 +1004,7 @@ def create_surface_feature_extract_dictionary(
         str2write += indent + "extractionMethod            extractFromSurface;\n"
         str2write += indent + "extractFromSurfaceCoeffs\n"
         str2write += indent + "{\n"
-        str2write += indent + indent + "includedAngle    150;\n"
+        str2write += indent + indent + f"includedAngle    {includedAngle};\n"
         str2write += indent + "}\n"
         str2write += indent
         str2write += indent + "subsetFeature\n"
@@ -539,9 +1158,19 @@ def create_snappyHexMesh_dictionary(
         snappyHexMeshDictFile,
         domainInfoDict,
         loactionInMesh,
+        meshSettingDict = None,
+        phaseList = None,
     ):
+    ### phaseList --> phases switched on ("castellate", "snap", "layers"),
+    ###               castellation and snapping by default
     openfaomHeaderString = get_openfom_dictionary_header(openfoamVersion)
     
+    if meshSettingDict is None:
+        meshSettingDict = defaultMeshSettingDict
+    surfaceLevel = meshSettingDict["surface-refinement-level"]
+    if phaseList is None:
+        phaseList = ["castellate", "snap"]
+    
     dictName = "snappyHexMeshDict"
     foamFileInfo = get_foamfile_info(
             foamFileVersion,
@@ -549,8 +1178,9 @@ def create_snappyHexMesh_dictionary(
             dictName,
         )
     
-    domainStlFilename = domainInfoDict["combined-bc-stl-filename"]
+    domainStlFilename = get_trisurface_filename(domainInfoDict, domainInfoDict["combined-bc-stl-filename"])
     bcList = list(domainInfoDict["bc-info"].keys())
+    domainRegionDict = get_domain_region_dict(domainInfoDict)
     
     wspace = " "
     indent = wspace * 2
@@ -558,9 +1188,9 @@ def create_snappyHexMesh_dictionary(
     str2write += openfaomHeaderString + "\n"
     str2write += foamFileInfo + "\n"
     str2write += get_openfoam_dictionary_hline() + "\n"
-    str2write += "castellatedMesh    true;\n"
-    str2write += "snap               true;\n"
-    str2write += "addLayers          false;\n"
+    str2write += "castellatedMesh    " + str("castellate" in phaseList).lower() + ";\n"
+    str2write += "snap               " + str("snap" in phaseList).lower() + ";\n"
+    str2write += "addLayers          " + str("layers" in phaseList).lower() + ";\n"
     str2write += "\n"
     str2write += "geometry\n"
     str2write += "{\n"
@@ -572,8 +1202,9 @@ def create_snappyHexMesh_dictionary(
     str2write += (2 * indent) + "{\n"
     
     maxKeyLength = max([len(x) for x in bcList])
-    for bc in bcList:
-        str2write += (3 * indent) + f"{bc:{maxKeyLength + 4}} {{ name {bc}; }}\n"
+    maxRegionLength = max([len(x) for x in domainRegionDict.keys()])
+    for region, bc in domainRegionDict.items():
+        str2write += (3 * indent) + f"{region:{maxRegionLength + 4}} {{ name {bc}; }}\n"
         
     str2write += (2 * indent) + "}\n"
     str2write += (1 * indent) + "}\n"
@@ -599,10 +1230,10 @@ def create_snappyHexMesh_dictionary(
     str2write += "\n"
     str2write += "castellatedMeshControls\n"
     str2write += "{\n"
-    str2write += (1 * indent) + "maxLocalCells                 3000000;\n"
-    str2write += (1 * indent) + "maxGlobalCells                25000000;\n"
+    str2write += (1 * indent) + "maxLocalCells                 " + str(meshSettingDict["max-local-cells"]) + ";\n"
+    str2write += (1 * indent) + "maxGlobalCells                " + str(meshSettingDict["max-global-cells"]) + ";\n"
     str2write += (1 * indent) + "minRefinementCells            0;\n"
-    str2write += (1 * indent) + "nCellsBetweenLevels           3;\n"
+    str2write += (1 * indent) + "nCellsBetweenLevels           " + str(meshSettingDict["n-cells-between-levels"]) + ";\n"
     str2write += (1 * indent) + "maxLoadUnbalance              0.1;\n"
     str2write += (1 * indent) + "allowFreeStandingZoneFaces    true;\n"
     str2write += (1 * indent) + "gapLevelIncrement             2;\n"
@@ -612,7 +1243,7 @@ def create_snappyHexMesh_dictionary(
     str2write += (1 * indent) + "features\n"
     str2write += (1 * indent) + "(\n"
     str2write += (2 * indent) + "{\n"
-    str2write += (3 * indent) + "file     \"" + domainStlFilename.replace(".stl", ".eMesh") + "\";\n"
+    str2write += (3 * indent) + "file     \"" + get_stl_file_stem(domainStlFilename) + ".eMesh" + "\";\n"
     str2write += (3 * indent) + "level    0;\n"
     str2write += (2 * indent) + "}\n"
     str2write += (1 * indent) + ");\n"
@@ -627,7 +1258,7 @@ def create_snappyHexMesh_dictionary(
     str2write += (3 * indent) + "{\n"
     
     for bc in bcList:
-        str2write += (4 * indent) + f"{bc:{maxKeyLength + 4}} {{ level (3 3); patchInfo {{ type {bc}; }} }}\n"
+        str2write += (4 * indent) + f"{bc:{maxKeyLength + 4}} {{ level ({surfaceLevel} {surfaceLevel}); patchInfo {{ type {bc}; }} }}\n"
     
     str2write += (3 * indent) + "}\n"
     str2write += (2 * indent) + "}\n"
@@ -729,7 +1360,8 @@ def create_toposet_dictionary(
     
     for block in blockList:
         blockVarName = block + "STL"
-        blockStlPath = "\"" + caseDir + os.sep + "constant" + os.sep + "triSurface" + os.sep + "block_" + block + ".stl" + "\";\n"
+        blockStlFilename = get_trisurface_filename(domainInfoDict, domainInfoDict["block-info"][block])
+        blockStlPath = "\"$FOAM_CASE/constant/triSurface/" + blockStlFilename + "\";\n"
         str2write += f"{blockVarName}{indent}{blockStlPath}" + "\n"
     
     str2write += "\n"
@@ -785,6 +1417,9 @@ def setup_snappyHexMesh_case(
         blockMeshCellSize,
         loactionInMesh,
         lengthUnit,
+        meshSettingDict = None,
+        decomposeSettingDict = None,
+        snappyPhaseList = None,
     ):
     
     location = "system"
@@ -808,16 +1443,6 @@ def setup_snappyHexMesh_case(
             controlDictFile,
         )
     
-    location = "system"
-    surfaceFeatureExtractDictFile = caseSystemPath + os.sep + "surfaceFeatureExtractDict"
-    create_surface_feature_extract_dictionary(
-            openfoamVersion,
-            foamFileVersion,
-            location,
-            surfaceFeatureExtractDictFile,
-            stlFileList,
-        )
-    
     ### CASE/system/fvSchemes
     
     location = "system"
@@ -852,10 +1477,504 @@ def setup_snappyHexMesh_case(
             snappyHexMeshDictFile,
             domainInfoDict,
             loactionInMesh,
+            meshSettingDict,
         )
+    
+    ### CASE/system/snappyHexMeshDict.<phase> (phased run only)
+    
+    for phase in snappyPhaseList or []:
+        create_snappyHexMesh_dictionary(
+                openfoamVersion,
+                foamFileVersion,
+                location,
+                snappyHexMeshDictFile + "." + phase,
+                domainInfoDict,
+                loactionInMesh,
+                meshSettingDict,
+                [phase],
+            )
+    
+    ### CASE/system/decomposeParDict (parallel run only)
+    
+    if decomposeSettingDict is not None and decomposeSettingDict["n-procs"] > 1:
+        location = "system"
+        decomposeParDictFile = caseSystemPath + os.sep + "decomposeParDict"
+        create_decompose_par_dictionary(
+                openfoamVersion,
+                foamFileVersion,
+                location,
+                decomposeParDictFile,
+                decomposeSettingDict["n-procs"],
+                decomposeSettingDict["method"],
+                decomposeSettingDict["counts"],
+            )
     return
 
 
+def run_openfoam_utility(
+        openfoamEnv,
+        caseDir,
+        utilityCommand,
+        logName,
+        resourceRecorder = None,
+        utilityLimits = None,
+        executionBackends = None,
+        nProcs = 1,
+    ):
+    ### Returns the completed process and the elapsed time. The output is
+    ### written to the log file as it comes and parsed for the progress
+    ### (metrics_<logName>.json). The utility runs on the backend of
+    ### executionBackends (local if None, mpirun/srun added for nProcs > 1),
+    ### with the time/memory limits of utilityLimits (result.reason -->
+    ### None, "timeout", "memory-limit" or "cancelled").
+    if executionBackends is None:
+        executionBackends = execution_backend.ExecutionBackends()
+    backend = executionBackends.get_backend(logName)
+    print("\n")
+    print("-"*40)
+    print("Running " + backend.describe(utilityCommand, nProcs) + " ... ... ...")
+    startTime = time.time()
+    monitor = log_monitor.LogMonitor(
+            logName,
+            caseDir + os.sep + "metrics_" + logName + ".json",
+        )
+    timeout = None if utilityLimits is None else utilityLimits.get_timeout(logName)
+    memoryLimit = None if utilityLimits is None else utilityLimits.get_memory_limit(logName)
+    with open(caseDir + os.sep + "log_" + logName + ".log", "wb") as logFile:
+        runDict = backend.run(
+                utilityCommand,
+                nProcs,
+                logName,
+                caseDir,
+                openfoamEnv,
+                logFile,
+                lambda line : monitor.add_line(line) is not None,
+                timeout,
+                memoryLimit,
+            )
+    result = subprocess.CompletedProcess(utilityCommand, runDict["return-code"])
+    result.reason = runDict["reason"]
+    if resourceRecorder is not None and runDict["usage"] is not None:
+        resourceRecorder.add_record(logName, "utility", time.time() - startTime, runDict["usage"], result.returncode)
+    monitor.finish(result.returncode)
+    elapsedTime = time.time() - startTime
+    if result.reason is not None:
+        print("Warning : \"" + utilityCommand + "\" stopped (" + result.reason + "), see log_" + logName + ".log")
+    elif result.returncode != 0:
+        print("Warning : \"" + utilityCommand + "\" exited with code " + str(result.returncode) + ", see log_" + logName + ".log")
+    return result, elapsedTime
+
+
+def run_openfoam_stage(
+        openfoamEnv,
+        caseDir,
+        utilityCommand,
+        logName,
+        resourceRecorder = None,
+        utilityLimits = None,
+        executionBackends = None,
+        nProcs = 1,
+        retryable = True,
+    ):
+    ### A failing utility fails the stage, its fingerprint is not stored.
+    ### A retryable stage (the utility starts from the same files again)
+    ### runs up to utilityLimits.retries more times if the utility fails,
+    ### not after a limit or a cancellation. A utility writing the mesh in
+    ### place (-overwrite) is never retried, the mesh it starts from is
+    ### changed.
+    if "-overwrite" in openfoam_env.get_command_list(utilityCommand):
+        retryable = False
+    nRetry = 0 if utilityLimits is None or not retryable else utilityLimits.retries
+    for attempt in range(nRetry + 1):
+        result, elapsedTime = run_openfoam_utility(
+                openfoamEnv,
+                caseDir,
+                utilityCommand,
+                logName,
+                resourceRecorder,
+                utilityLimits,
+                executionBackends,
+                nProcs,
+            )
+        if result.returncode == 0 or result.reason is not None or attempt == nRetry:
+            break
+        print("Retrying \"" + utilityCommand + "\" (" + str(attempt + 1) + "/" + str(nRetry) + ") ... ... ...")
+        time.sleep(process_supervisor.retryDelay * (attempt + 1))
+    if result.reason is not None:
+        raise RuntimeError("\"" + utilityCommand + "\" stopped (" + result.reason + "), see log_" + logName + ".log")
+    if result.returncode != 0:
+        raise RuntimeError("\"" + utilityCommand + "\" failed (exit code " + str(result.returncode) + "), see log_" + logName + ".log")
+    return result, elapsedTime
+
+
+def run_snappyHexMesh_phases(
+        openfoamEnv,
+        caseDir,
+        snappyHexMeshCommand,
+        phaseList,
+        meshPatternList,
+        inputPatternList,
+        fileDigestFunction = artifact_cache.file_digest,
+        resourceRecorder = None,
+        utilityLimits = None,
+        executionBackends = None,
+        nProcs = 1,
+    ):
+    ### Every phase runs on the mesh in place (-overwrite) with its own
+    ### dictionary, from the last phase with a matching checkpoint. A
+    ### failed phase is not retried, the mesh in place is changed.
+    checkpointDir = caseDir + os.sep + snappyHexMeshCheckpointDirname
+    phaseKey = mesh_checkpoint.get_checkpoint_key(
+            None,
+            caseDir,
+            meshPatternList + inputPatternList,
+            {"command" : snappyHexMeshCommand},
+            fileDigestFunction,
+        )
+    phaseKeyList = []
+    for phase in phaseList:
+        phaseEntryDict = mesh_checkpoint.get_dictionary_entries(
+                caseDir + os.sep + "system" + os.sep + "snappyHexMeshDict." + phase,
+                mesh_checkpoint.phaseEntryDict[phase],
+            )
+        phaseKey = mesh_checkpoint.get_checkpoint_key(
+                phaseKey,
+                caseDir,
+                [],
+                {"phase" : phase, "dictionary" : phaseEntryDict},
+                fileDigestFunction,
+            )
+        phaseKeyList.append(phaseKey)
+    
+    startIndex = 0
+    for index in range(len(phaseList) - 1, -1, -1):
+        if mesh_checkpoint.has_checkpoint(checkpointDir, phaseList[index], phaseKeyList[index]):
+            mesh_checkpoint.restore_checkpoint(
+                    checkpointDir,
+                    phaseList[index],
+                    phaseKeyList[index],
+                    caseDir,
+                    meshPatternList,
+                )
+            print("-"*40 + "\n" + "snappyHexMesh mesh restored from the \"" + phaseList[index] + "\" checkpoint\n")
+            startIndex = index + 1
+            break
+    
+    for phase, phaseKey in zip(phaseList[startIndex : ], phaseKeyList[startIndex : ]):
+        run_openfoam_stage(
+                openfoamEnv,
+                caseDir,
+                snappyHexMeshCommand + " -dict system/snappyHexMeshDict." + phase + " -overwrite",
+                "snappyHexMesh_" + phase,
+                resourceRecorder,
+                utilityLimits,
+                executionBackends,
+                nProcs,
+                False,
+            )
+        mesh_checkpoint.save_checkpoint(
+                checkpointDir,
+                phase,
+                phaseKey,
+                caseDir,
+                meshPatternList,
+            )
+    return
+
+
+def get_snappyHexMesh_stage_function(
+        openfoamEnv,
+        caseDir,
+        snappyHexMeshCommand,
+        snappyPhaseList,
+        meshPattern,
+        inputPatternList,
+        fileDigestFunction,
+        resourceRecorder = None,
+        utilityLimits = None,
+        executionBackends = None,
+        nProcs = 1,
+    ):
+    ### Stage function and arguments, one run or one run per phase
+    if snappyPhaseList:
+        return run_snappyHexMesh_phases, (
+                openfoamEnv,
+                caseDir,
+                snappyHexMeshCommand,
+                snappyPhaseList,
+                [meshPattern],
+                inputPatternList,
+                fileDigestFunction,
+                resourceRecorder,
+                utilityLimits,
+                executionBackends,
+                nProcs,
+            )
+    return run_openfoam_stage, (openfoamEnv, caseDir, snappyHexMeshCommand, "snappyHexMesh", resourceRecorder, utilityLimits, executionBackends, nProcs)
+
+
+def start_openfoam_utility(
+        openfoamEnv,
+        caseDir,
+        utilityCommand,
+        logName,
+    ):
+    ### Started in its own session, it is not waited for and keeps running
+    ### after this script exits
+    print("\n")
+    print("-"*40)
+    print("Starting \"" + utilityCommand + "\" in the background ... ... ...")
+    with open(caseDir + os.sep + "log_" + logName + ".log", "wb") as logFile:
+        process = subprocess.Popen(
+                openfoam_env.get_command_list(utilityCommand),
+                cwd = caseDir,
+                env = openfoamEnv,
+                stdout = logFile,
+                stderr = subprocess.STDOUT,
+                start_new_session = True,
+            )
+    print("PID : " + str(process.pid) + ", log : log_" + logName + ".log")
+    return process
+
+
+def get_meshing_stage_scheduler(
+        caseDir,
+        openfoamEnv,
+        openfoamVersion,
+        foamFileVersion,
+        domainInfoDict,
+        stlFileList,
+        featureExtraction = "native",
+        nProcs = 1,
+        keepDecomposed = False,
+        reconstructMesh = "no",
+        nCores = 1,
+        artifactCache = None,
+        snappyPhaseList = None,
+        resourceRecorder = None,
+        resourcePool = None,
+        snappyHexMeshMemory = 0,
+        utilityLimits = None,
+        executionBackends = None,
+    ):
+    ### Stages from the written dictionaries to the zoned mesh. Paths are
+    ### relative to the case directory, the stage fingerprints are kept in
+    ### the case and the stages that are up to date are skipped.
+    ### snappyPhaseList     --> None (one snappyHexMesh run) or the phases
+    ###                         run one by one on the mesh in place, from
+    ###                         the last matching checkpoint
+    ### resourcePool        --> cores/memory shared with other cases, the
+    ###                         core budget is nCores if None
+    ### snappyHexMeshMemory --> bytes taken from the pool by snappyHexMesh
+    ### utilityLimits       --> time/memory limits and retries of the
+    ###                         utilities (process_supervisor.UtilityLimits)
+    ### executionBackends   --> where the utilities run
+    ###                         (execution_backend.ExecutionBackends), local
+    ###                         if None. A utility run as a batch job takes
+    ###                         no cores/memory of the budget.
+    fileDigestFunction = artifact_cache.file_digest if artifactCache is None else artifactCache.get_file_digest
+    scheduler = stage_scheduler.StageScheduler(
+            nCores,
+            caseDir,
+            caseDir + os.sep + stageFingerprintFilename,
+            fileDigestFunction,
+            resourcePool,
+        )
+    triSurfaceFileList = ["constant/triSurface/" + x for x in stlFileList]
+    domainStlFilename = get_trisurface_filename(domainInfoDict, domainInfoDict["combined-bc-stl-filename"])
+    domainFeatureFile = "constant/triSurface/" + get_stl_file_stem(domainStlFilename) + ".eMesh"
+    if executionBackends is None:
+        executionBackends = execution_backend.ExecutionBackends()
+    
+    ### A utility run as a batch job takes no cores/memory of the budget
+    def get_stage_cores(logName, nCores):
+        return 0 if executionBackends.get_backend(logName).isBatch else nCores
+    if executionBackends.get_backend("snappyHexMesh").isBatch:
+        snappyHexMeshMemory = 0
+    
+    openfoamParameterDict = {"environment" : openfoam_env.get_environment_signature(openfoamEnv)}
+    
+    scheduler.add_stage(
+            "blockMesh",
+            run_openfoam_stage,
+            args = (openfoamEnv, caseDir, "blockMesh", "blockMesh", resourceRecorder, utilityLimits, executionBackends),
+            nCores = get_stage_cores("blockMesh", 1),
+            inputs = ["system/blockMeshDict"],
+            outputs = ["constant/polyMesh"],
+            parameters = dict(openfoamParameterDict, command = "blockMesh"),
+        )
+    
+    ### Feature extraction does not depend on "blockMesh", nor do the
+    ### files on each other
+    if featureExtraction == "native":
+        scheduler.add_stage(
+                "featureEdges",
+                extract_native_surface_features if resourceRecorder is None else resourceRecorder.measure_function("featureEdges", extract_native_surface_features),
+                args = (caseDir, domainStlFilename, foamFileVersion, artifactCache),
+                inputs = ["constant/triSurface/" + domainStlFilename],
+                outputs = [domainFeatureFile],
+                parameters = {"included-angle" : featureIncludedAngle},
+            )
+    else:
+        for stlFilename in stlFileList:
+            stageName = "surfaceFeatureExtract:" + get_stl_file_stem(stlFilename)
+            scheduler.add_stage(
+                    stageName,
+                    extract_surface_features,
+                    args = (caseDir, openfoamEnv, openfoamVersion, foamFileVersion, stlFilename, artifactCache),
+                    kwargs = {"resourceRecorder" : resourceRecorder, "utilityLimits" : utilityLimits, "executionBackends" : executionBackends},
+                    nCores = get_stage_cores("surfaceFeatureExtract_" + get_stl_file_stem(stlFilename), 1),
+                    inputs = ["constant/triSurface/" + stlFilename],
+                    outputs = ["constant/triSurface/" + get_stl_file_stem(stlFilename) + ".eMesh"],
+                    parameters = dict(openfoamParameterDict, openfoamVersion = openfoamVersion, includedAngle = featureIncludedAngle),
+                    updates = ["constant/extendedFeatureEdgeMesh/" + get_stl_file_stem(stlFilename) + ".extendedFeatureEdgeMesh"],
+                )
+    
+    ### Mesh of every snappyHexMesh iteration, in the time directories
+    timeDirPattern = "[1-9]*"
+    snappyHexMeshInputList = ["system/snappyHexMeshDict", domainFeatureFile] + triSurfaceFileList
+    snappyHexMeshInputList += ["system/snappyHexMeshDict." + x for x in snappyPhaseList or []]
+    snappyHexMeshParameterDict = dict(openfoamParameterDict, phases = snappyPhaseList)
+    
+    if nProcs > 1:
+        scheduler.add_stage(
+                "decomposePar",
+                run_openfoam_stage,
+                args = (openfoamEnv, caseDir, "decomposePar", "decomposePar", resourceRecorder, utilityLimits, executionBackends),
+                nCores = get_stage_cores("decomposePar", 1),
+                dependsOn = ["blockMesh"],
+                inputs = ["system/decomposeParDict"],
+                outputs = ["processor*"],
+                parameters = dict(openfoamParameterDict, command = "decomposePar"),
+            )
+        
+        ### The decomposed mesh is written to constant/polyMesh of the
+        ### processor directories, where the solver reads it. It replaces
+        ### the "decomposePar" mesh, which is decomposed again when
+        ### "snappyHexMesh" has to run again.
+        ### The phases always run on the mesh in place.
+        snappyHexMeshCommand = "snappyHexMesh -parallel"
+        snappyHexMeshOutputList = ["processor*/" + timeDirPattern]
+        snappyHexMeshModifyList = []
+        if keepDecomposed and not snappyPhaseList:
+            snappyHexMeshCommand += " -overwrite"
+        if keepDecomposed or snappyPhaseList:
+            snappyHexMeshOutputList = []
+            snappyHexMeshModifyList = ["decomposePar"]
+        snappyHexMeshFunction, snappyHexMeshArgs = get_snappyHexMesh_stage_function(
+                openfoamEnv,
+                caseDir,
+                snappyHexMeshCommand,
+                snappyPhaseList,
+                "processor*/constant/polyMesh",
+                [domainFeatureFile] + triSurfaceFileList,
+                fileDigestFunction,
+                resourceRecorder,
+                utilityLimits,
+                executionBackends,
+                nProcs,
+            )
+        scheduler.add_stage(
+                "snappyHexMesh",
+                snappyHexMeshFunction,
+                args = snappyHexMeshArgs,
+                dependsOn = ["decomposePar"],
+                inputs = snappyHexMeshInputList,
+                outputs = snappyHexMeshOutputList,
+                nCores = get_stage_cores("snappyHexMesh", nProcs),
+                memory = snappyHexMeshMemory,
+                parameters = dict(snappyHexMeshParameterDict, command = snappyHexMeshCommand, nProcs = nProcs),
+                modifies = snappyHexMeshModifyList,
+            )
+        topoSetDependency = "snappyHexMesh"
+        
+        ### The phased mesh is in constant/polyMesh of the processor
+        ### directories, it replaces the "blockMesh" mesh
+        if not keepDecomposed:
+            reconstructParMeshCommand = "reconstructParMesh -latestTime"
+            reconstructParMeshOutputList = [timeDirPattern]
+            reconstructParMeshModifyList = []
+            if snappyPhaseList:
+                reconstructParMeshCommand = "reconstructParMesh -constant"
+                reconstructParMeshOutputList = []
+                reconstructParMeshModifyList = ["blockMesh"]
+            scheduler.add_stage(
+                    "reconstructParMesh",
+                    run_openfoam_stage,
+                    args = (openfoamEnv, caseDir, reconstructParMeshCommand, "reconstructParMesh", resourceRecorder, utilityLimits, executionBackends),
+                    nCores = get_stage_cores("reconstructParMesh", 1),
+                    dependsOn = ["snappyHexMesh"],
+                    outputs = reconstructParMeshOutputList,
+                    parameters = dict(openfoamParameterDict, command = reconstructParMeshCommand),
+                    modifies = reconstructParMeshModifyList,
+                )
+            topoSetDependency = "reconstructParMesh"
+    else:
+        ### The phases replace the "blockMesh" mesh in place
+        snappyHexMeshFunction, snappyHexMeshArgs = get_snappyHexMesh_stage_function(
+                openfoamEnv,
+                caseDir,
+                "snappyHexMesh",
+                snappyPhaseList,
+                "constant/polyMesh",
+                [domainFeatureFile] + triSurfaceFileList,
+                fileDigestFunction,
+                resourceRecorder,
+                utilityLimits,
+                executionBackends,
+            )
+        scheduler.add_stage(
+                "snappyHexMesh",
+                snappyHexMeshFunction,
+                args = snappyHexMeshArgs,
+                dependsOn = ["blockMesh"],
+                inputs = snappyHexMeshInputList,
+                outputs = [] if snappyPhaseList else [timeDirPattern],
+                nCores = get_stage_cores("snappyHexMesh", 1),
+                memory = snappyHexMeshMemory,
+                parameters = dict(snappyHexMeshParameterDict, command = "snappyHexMesh"),
+                modifies = ["blockMesh"] if snappyPhaseList else [],
+            )
+        topoSetDependency = "snappyHexMesh"
+    
+    ### "topoSet" adds the zones to the snappyHexMesh mesh in place, it can
+    ### run again on the same mesh
+    if nProcs > 1 and keepDecomposed:
+        scheduler.add_stage(
+                "topoSet",
+                run_openfoam_stage,
+                args = (openfoamEnv, caseDir, "topoSet -parallel", "topoSet", resourceRecorder, utilityLimits, executionBackends, nProcs),
+                dependsOn = [topoSetDependency],
+                inputs = ["system/topoSetDict"] + triSurfaceFileList,
+                nCores = get_stage_cores("topoSet", nProcs),
+                parameters = dict(openfoamParameterDict, command = "topoSet -parallel", nProcs = nProcs),
+                updates = ["processor*/constant/polyMesh", "processor*/" + timeDirPattern + "/polyMesh"],
+            )
+        ### The reconstructed mesh replaces the "blockMesh" mesh
+        if reconstructMesh == "yes":
+            scheduler.add_stage(
+                    "reconstructParMesh",
+                    run_openfoam_stage,
+                    args = (openfoamEnv, caseDir, "reconstructParMesh -constant", "reconstructParMesh", resourceRecorder, utilityLimits, executionBackends),
+                    nCores = get_stage_cores("reconstructParMesh", 1),
+                    dependsOn = ["topoSet"],
+                    parameters = dict(openfoamParameterDict, command = "reconstructParMesh -constant"),
+                    modifies = ["blockMesh"],
+                )
+    else:
+        scheduler.add_stage(
+                "topoSet",
+                run_openfoam_stage,
+                args = (openfoamEnv, caseDir, "topoSet", "topoSet", resourceRecorder, utilityLimits, executionBackends),
+                nCores = get_stage_cores("topoSet", 1),
+                dependsOn = [topoSetDependency],
+                inputs = ["system/topoSetDict"] + triSurfaceFileList,
+                parameters = dict(openfoamParameterDict, command = "topoSet"),
+                updates = ["constant/polyMesh", timeDirPattern + "/polyMesh"],
+            )
+    return scheduler
+
+
 #---------------------------------------
 #    MAIN FUNCTION
 #---------------------------------------
@@ -869,120 +1988,369 @@ def snappyHexMesh_from_stl(
         blockMeshCellSize,
         loactionInMesh,
         lengthUnit,
+        triSurfaceCompression = "none",
+        artifactCacheDir = None,
+        artifactCacheSizeMb = 10240,
+        featureExtraction = "native",
+        surfaceCheck = "report",
+        leakCheck = "report",
+        leakCheckRefinement = 1,
+        surfaceRefinementLevel = 3,
+        nCellsBetweenLevels = 3,
+        meshLimits = "auto",
+        nProcs = 1,
+        decomposeMethod = "scotch",
+        mpirunCommand = "mpirun",
+        keepDecomposed = False,
+        reconstructMesh = "no",
+        nCores = "auto",
+        cleanCase = False,
+        snappyPhases = "combined",
+        utilityTimeout = "none",
+        utilityMemoryLimitMb = "none",
+        utilityRetries = 0,
+        executionBackend = "local",
+        slurmOptions = "",
+        slurmLauncher = "srun",
+        slurmPollInterval = 10.0,
+        keepStaging = False,
+        resourcePool = None,
+        session = None,
     ):
-    openfoamEnvSourceCommand = ". " + openFoamBashrcPath
+    ### keepDecomposed  --> parallel run only, the mesh stays in the
+    ###                     processor directories (constant/polyMesh) and
+    ###                     "topoSet" runs in parallel
+    ### reconstructMesh --> with keepDecomposed, "no", "yes" or "background"
+    ### cleanCase       --> delete the case directory, every stage runs
+    ### snappyPhases    --> "combined" (one snappyHexMesh run) or the phases
+    ###                     run one by one with checkpoints, e.g.
+    ###                     "castellate, snap"
+    ### utilityTimeout/utilityMemoryLimitMb
+    ###                 --> wall-clock [s]/memory [MB] limits of the
+    ###                     utilities, "none", "<value>" (all) or
+    ###                     "<utility>=<value>, ...", the process group of
+    ###                     the utility is killed at the limit
+    ### utilityRetries  --> runs again of a failed utility (not after a
+    ###                     limit), the phased snappyHexMesh runs excepted
+    ### executionBackend --> where the utilities run, "local", "local-mpi"
+    ###                     or "slurm" (all) or "<utility>=<backend>, ...",
+    ###                     e.g. "snappyHexMesh=slurm"
+    ### slurmOptions/slurmLauncher/slurmPollInterval
+    ###                 --> sbatch options of every job, launcher of the
+    ###                     parallel runs in a job, seconds between polls
+    ### keepStaging     --> the staging directory of a failed run is kept
+    ###                     for inspection (until the next run)
+    ### resourcePool    --> cores/memory shared with other cases running at
+    ###                     once (sweep), the cores and memory of the
+    ###                     machine if None
+    ### session         --> artifact caches and OpenFOAM environments kept
+    ###                     between the runs of a long-running process
+    ###                     (mesh_daemon.MeshingSession), created for the
+    ###                     run if None
+    snappyPhaseList = None
+    if snappyPhases != "combined":
+        snappyPhaseList = [x.strip() for x in snappyPhases.split(",") if x.strip()]
+        unknownPhaseList = [x for x in snappyPhaseList if x not in snappyHexMeshPhaseList]
+        if unknownPhaseList or not snappyPhaseList:
+            sys.exit("Unknown snappyHexMesh phases : " + snappyPhases + " (" + ", ".join(snappyHexMeshPhaseList) + ")")
+        snappyPhaseList = [x for x in snappyHexMeshPhaseList if x in snappyPhaseList]
     snappyHexSetupDirname = "snappyHexMesh_caseDir"
-    caseDir = workingDir + os.sep + snappyHexSetupDirname
-    caseSystemPath = caseDir + os.sep + "system"          
-    
-    with open(snappyHexInfoFile, "r") as shif:
-        domainInfoDict = json.load(shif)
-        print("\n" + "-"*40)
-        print("snappyHexMesh process input loaded!")
-    
-    ### Clean old log files
-    subprocess.run(
-            "rm -f " + "*.log",
-            cwd = workingDir, 
-            shell = True
-        )
+    publishedCaseDir = workingDir + os.sep + snappyHexSetupDirname
     
-    ### Clean old snappyHex case directory
-    subprocess.run(
-            "rm -fr " + caseDir,
-            cwd = workingDir, 
-            shell = True
-        )
+    artifactCache = None
+    if artifactCacheDir and session is not None:
+        artifactCache = session.get_artifact_cache(
+                artifactCacheDir,
+                int(artifactCacheSizeMb * 1024**2),
+            )
+    elif artifactCacheDir:
+        artifactCache = artifact_cache.ArtifactCache(
+                artifactCacheDir,
+                int(artifactCacheSizeMb * 1024**2),
+            )
     
-    initiate_snappyHex_case_directory(
-            domainInfoDict,
-            caseDir,
-        )
+    ### Wall/CPU time, peak memory and I/O of every stage (run_report.json)
+    resourceRecorder = resource_usage.ResourceRecorder()
     
-    triSurfaceDir = caseDir + os.sep + "constant" + os.sep + "triSurface"
-    stlFileList = populate_triSurface_directory(
-            domainInfoDict,
-            caseDir,
-            triSurfaceDir,
-        )
+    try:
+        utilityLimits = process_supervisor.UtilityLimits(
+                utilityTimeout,
+                utilityMemoryLimitMb,
+                utilityRetries,
+            )
+    except ValueError:
+        sys.exit("Invalid utility limits : " + str(utilityTimeout) + " / " + str(utilityMemoryLimitMb))
+    
+    try:
+        executionBackends = execution_backend.ExecutionBackends(
+                executionBackend,
+                mpirunCommand,
+                slurmOptions,
+                slurmLauncher,
+                slurmPollInterval,
+            )
+    except ValueError as e:
+        sys.exit(str(e) + " (" + ", ".join(execution_backend.backendNameList) + ")")
+    
+    ### OpenFOAM environment, the bashrc is sourced once
+    with resourceRecorder.measure("openfoamEnvironment"):
+        try:
+            if session is None:
+                openfoamEnv = openfoam_env.get_openfoam_environment(
+                        openFoamBashrcPath,
+                        artifactCache,
+                    )
+            else:
+                openfoamEnv = session.get_openfoam_environment(
+                        openFoamBashrcPath,
+                        artifactCache,
+                    )
+        except RuntimeError as e:
+            sys.exit("Error : " + str(e))
+    
+    ### The run builds the case in a staging directory of its own (a copy
+    ### of the published case, empty with cleanCase, only the stages whose
+    ### inputs changed run again) and publishes it at the end. The
+    ### geometry (JSON and STL files) and the published case are read under
+    ### the shared workspace locks.
+    runId = workspace.get_run_id()
+    caseLockFile = workspace.get_lock_file(workingDir)
+    inputLockFile = workspace.get_lock_file(os.path.dirname(os.path.abspath(snappyHexInfoFile)))
+    try:
+        with workspace.locked(inputLockFile, shared = True), workspace.locked(caseLockFile, shared = True):
+            if not os.path.isfile(snappyHexInfoFile):
+                sys.exit("Error : snappyHexMesh input not found : " + snappyHexInfoFile + " (geometry not exported yet)")
+            with open(snappyHexInfoFile, "r") as shif:
+                domainInfoDict = json.load(shif)
+                print("\n" + "-"*40)
+                print("snappyHexMesh process input loaded!")
+            domainInfoDict["trisurface-compression"] = triSurfaceCompression
+        
+            ### The mesh and surface files of the published case are hard linked,
+            ### the stages remove or unshare them before writing
+            with resourceRecorder.measure("stageCase"):
+                caseDir = workspace.create_staging_directory(
+                        publishedCaseDir,
+                        runId,
+                        not cleanCase,
+                        [
+                            snappyHexMeshCheckpointDirname,
+                            "constant/polyMesh",
+                            "constant/triSurface",
+                            "constant/extendedFeatureEdgeMesh",
+                            "processor*",
+                            "[1-9]*",
+                        ],
+                    )
+            print("Case staging directory --> " + caseDir)
+            if artifactCache is not None:
+                artifactCache.add_path_alias(caseDir, publishedCaseDir)
+        
+            initiate_snappyHex_case_directory(
+                    domainInfoDict,
+                    caseDir,
+                    cleanCase,
+                )
+        
+            with resourceRecorder.measure("populateTriSurface"):
+                triSurfaceDir = caseDir + os.sep + "constant" + os.sep + "triSurface"
+                stlFileList = populate_triSurface_directory(
+                        domainInfoDict,
+                        caseDir,
+                        triSurfaceDir,
+                        artifactCache,
+                    )
+        caseSystemPath = caseDir + os.sep + "system"
+    
+        with resourceRecorder.measure("surfaceCheck"):
+            check_triSurface_files(
+                    domainInfoDict,
+                    triSurfaceDir,
+                    surfaceCheck,
+                    artifactCache,
+                )
     
-    domainStlFile = domainInfoDict["snappyhex-ready-stl-dir"] + os.sep + domainInfoDict["combined-bc-stl-filename"]
-    domainStlBound = extract_domain_stl_information(
-            domainStlFile,
-            triSurfaceDir,
-        )
+        with resourceRecorder.measure("domainInformation"):
+            domainStlFile = triSurfaceDir + os.sep + get_trisurface_filename(domainInfoDict, domainInfoDict["combined-bc-stl-filename"])
+            domainStlBound = extract_domain_stl_information(
+                    domainStlFile,
+                    triSurfaceDir,
+                    artifactCache,
+                )
     
-    setup_snappyHexMesh_case(
-            openfoamVersion,
-            foamFileVersion,
-            domainInfoDict,
-            caseSystemPath,
-            stlFileList,
-            domainStlBound,
-            blockMeshCellSize,
-            loactionInMesh,
-            lengthUnit,
-        )
+        with resourceRecorder.measure("locationInMesh"):
+            loactionInMesh = get_location_in_mesh(
+                    loactionInMesh,
+                    domainInfoDict,
+                    triSurfaceDir,
+                    blockMeshCellSize,
+                    artifactCache,
+                )
     
-    prepareSTL(
-            caseDir,
-            openfoamEnvSourceCommand,
-        )
+        with resourceRecorder.measure("leakCheck"):
+            check_domain_leak(
+                    domainInfoDict,
+                    caseDir,
+                    domainStlBound,
+                    blockMeshCellSize,
+                    lengthUnit,
+                    loactionInMesh,
+                    leakCheck,
+                    leakCheckRefinement,
+                    artifactCache,
+                )
     
-    location = "system"
-    topoSetDictFile = caseSystemPath + os.sep + "topoSetDict"
-    create_toposet_dictionary(
-            openfoamVersion,
-            foamFileVersion,
-            domainInfoDict,
-            location,
-            topoSetDictFile,
-            caseDir,
-        )
+        with resourceRecorder.measure("meshEstimate"):
+            meshSettingDict = estimate_mesh_settings(
+                    domainInfoDict,
+                    triSurfaceDir,
+                    domainStlBound,
+                    blockMeshCellSize,
+                    lengthUnit,
+                    surfaceRefinementLevel,
+                    nCellsBetweenLevels,
+                    meshLimits,
+                    1 if nProcs == "auto" else nProcs,
+                    artifactCache,
+                    None if resourcePool is None else resourcePool.memory,
+                    None if resourcePool is None else resourcePool.nCores,
+                )
     
-    ### RUN - blockMesh
-    print("\n")
-    print("-"*40)
-    print("Running \"blockMesh\" ... ... ...")
-    blockMeshStartTime = time.time()
-    result = subprocess.run(
-            openfoamEnvSourceCommand + " && " + "blockMesh > log_blockMesh.log",
-            cwd = caseDir,
-            shell = True,
-        )
-    blockMeshFinishTime = time.time()
+        ### "auto" --> recommended process count of the mesh estimate
+        if nProcs == "auto":
+            nProcs = meshSettingDict["estimate"]["n-procs-recommended"]
+            meshSettingDict["max-local-cells"] = max(
+                    mesh_estimator.round_cell_limit(meshSettingDict["max-global-cells"] // nProcs),
+                    mesh_estimator.minimumCellLimit,
+                )
+        bBox, nodeSpacing = get_block_mesh_lattice(
+                domainStlBound,
+                blockMeshCellSize,
+                lengthUnit,
+            )
+        decomposeSettingDict = {
+            "n-procs" : nProcs,
+            "method" : decomposeMethod,
+            "counts" : mesh_estimator.get_decomposition_counts(
+                    nProcs,
+                    [nodeSpacing["x"], nodeSpacing["y"], nodeSpacing["z"]],
+                ),
+        }
     
-    ### RUN - snappyHexMesh
-    print("\n")
-    print("-"*40)
-    print("Running \"snappyHexMesh\" ... ... ...")
-    snappyHexMeshStartTime = time.time()
-    result = subprocess.run(
-            openfoamEnvSourceCommand + " && " + "snappyHexMesh > log_snappyHexMesh.log",
-            cwd = caseDir,
-            shell = True,
-        )
-    snappyHexMeshFinishTime = time.time()
+        with resourceRecorder.measure("dictionaries"):
+            setup_snappyHexMesh_case(
+                    openfoamVersion,
+                    foamFileVersion,
+                    domainInfoDict,
+                    caseSystemPath,
+                    stlFileList,
+                    domainStlBound,
+                    blockMeshCellSize,
+                    loactionInMesh,
+                    lengthUnit,
+                    meshSettingDict,
+                    decomposeSettingDict,
+                    snappyPhaseList,
+                )
     
-    ### RUN - topoSet
-    print("\n")
-    print("-"*40)
-    print("Running \"topoSet\" ... ... ...")
-    topoSetStartTime = time.time()
-    result = subprocess.run(
-            openfoamEnvSourceCommand + " && " + "topoSet > log_topoSet.log",
-            cwd = caseDir,
-            shell = True,
-        )
-    topoSetFinishTime = time.time()
+            location = "system"
+            topoSetDictFile = caseSystemPath + os.sep + "topoSetDict"
+            create_toposet_dictionary(
+                    openfoamVersion,
+                    foamFileVersion,
+                    domainInfoDict,
+                    location,
+                    topoSetDictFile,
+                    caseDir,
+                )
+    
+        ### RUN - feature extraction, blockMesh, snappyHexMesh, topoSet
+        ### (independent stages run at once within the core budget)
+        if nCores == "auto":
+            nCores = mesh_estimator.get_available_cores() if resourcePool is None else resourcePool.nCores
+        ### snappyHexMesh stops refining at maxGlobalCells
+        snappyHexMeshMemory = min(
+                meshSettingDict["estimate"]["n-cells"],
+                meshSettingDict["max-global-cells"],
+            ) * mesh_estimator.snappyBytesPerCell
+        scheduler = get_meshing_stage_scheduler(
+                caseDir,
+                openfoamEnv,
+                openfoamVersion,
+                foamFileVersion,
+                domainInfoDict,
+                stlFileList,
+                featureExtraction,
+                nProcs,
+                keepDecomposed,
+                reconstructMesh,
+                nCores,
+                artifactCache,
+                snappyPhaseList,
+                resourceRecorder,
+                resourcePool,
+                snappyHexMeshMemory,
+                utilityLimits,
+                executionBackends,
+            )
+        runReportFile = caseDir + os.sep + "run_report.json"
+        runInfoDict = {
+            "openfoam" : openfoam_env.get_environment_signature(openfoamEnv),
+            "n-procs" : nProcs,
+            "n-cores" : nCores,
+            "snappy-phases" : snappyPhaseList,
+            "execution-backend" : executionBackend,
+        }
+        try:
+            scheduler.run()
+        except RuntimeError as e:
+            print(scheduler.get_report())
+            runInfoDict["stage-status"] = {x : scheduler.stageDict[x]["status"] for x in scheduler.stageDict}
+            resourceRecorder.write_report(runReportFile, runInfoDict)
+            if keepStaging:
+                sys.exit("Error : " + str(e) + "\nThe case is not published, see " + caseDir)
+            sys.exit("Error : " + str(e) + "\nThe case is not published (keep_staging keeps its staging directory)")
+        runInfoDict["stage-status"] = {x : scheduler.stageDict[x]["status"] for x in scheduler.stageDict}
+        resourceRecorder.write_report(runReportFile, runInfoDict)
+    
+        ### The finished case replaces the published one
+        caseDir = workspace.publish_directory(
+                caseDir,
+                publishedCaseDir,
+                caseLockFile,
+            )
+        runReportFile = caseDir + os.sep + "run_report.json"
+        print("Case published --> " + caseDir)
+    
+        ### Optional reconstruction of the decomposed mesh (with the zones)
+        if nProcs > 1 and keepDecomposed and reconstructMesh == "background":
+            start_openfoam_utility(
+                    openfoamEnv,
+                    caseDir,
+                    "reconstructParMesh -constant",
+                    "reconstructParMesh",
+                )
+    finally:
+        ### The staging directory is not an alias of the published case
+        ### once the run is over, a failed run removes it (unless kept)
+        if artifactCache is not None:
+            artifactCache.remove_path_alias(workspace.get_staging_directory(publishedCaseDir, runId))
+        workspace.release_staging_directory(
+                publishedCaseDir,
+                runId,
+                keepStaging,
+            )
     
     
     str2print =  "\n\n" + "-"*40 + "\n"
     str2print += "Execution time \n"
     str2print += "-"*40 + "\n"
-    str2print += f"blockMesh     : {blockMeshFinishTime - blockMeshStartTime : >10.4} [sec]\n"
-    str2print += f"snappyHexMesh : {snappyHexMeshFinishTime - snappyHexMeshStartTime : >10.4} [sec]\n"
-    str2print += f"topotSet      : {topoSetFinishTime - topoSetStartTime : >10.4} [sec]\n"
+    str2print += scheduler.get_report()
+    str2print += "\n"
+    str2print += "-"*40 + "\n"
+    str2print += "Resource usage (" + runReportFile + ")\n"
+    str2print += "-"*40 + "\n"
+    str2print += resourceRecorder.get_report()
     str2print += "\n"
     str2print += "-"*40 + "\n"
     str2print += "\n"
@@ -993,6 +2361,78 @@ def snappyHexMesh_from_stl(
 
 #---------------------------------------
 
+def get_process_input(
+        optionDict,
+    ):
+    ### Arguments of snappyHexMesh_from_stl from the process input options
+    ### (environment variables of the input script, or a sweep case),
+    ### ValueError for an invalid option
+    wspace = ""
+    workingDir = optionDict["working_dir"]
+    loactionInMeshStr = optionDict["location_in_mesh"]
+    if loactionInMeshStr.strip().startswith("auto"):
+        loactionInMesh = loactionInMeshStr.strip()
+    else:
+        try:
+            loactionInMesh = [float(x) for x in loactionInMeshStr.replace(wspace, "").split(",")]
+        except ValueError:
+            loactionInMesh = []
+        if len(loactionInMesh) != 3:
+            raise ValueError("location_in_mesh : " + loactionInMeshStr + " (\"auto\" or \"x, y, z\")")
+    artifactCacheDir = optionDict.get(
+            "artifact_cache_dir",
+            os.path.join(os.path.expanduser("~"), ".cache", "snappyHexMesh_from_stl"),
+        )
+    if artifactCacheDir.lower() == "none":
+        artifactCacheDir = None
+    nProcs = optionDict.get("n_procs", "1")
+    if nProcs != "auto":
+        nProcs = int(nProcs)
+    nCores = optionDict.get("n_cores", "auto")
+    if nCores != "auto":
+        nCores = int(nCores)
+    
+    processInputDict = {
+            "openfoamVersion" : optionDict["openfoam_version"],
+            "foamFileVersion" : optionDict["foamfile_version"],
+            "openFoamBashrcPath" : optionDict["openfoam_bashrc_path"],
+            "workingDir" : workingDir,
+            "snappyHexInfoFile" : workingDir + os.sep + optionDict["input_json_filename"],
+            "blockMeshCellSize" : float(optionDict["blockmesh_size"]),
+            "loactionInMesh" : loactionInMesh,
+            "lengthUnit" : optionDict["geometry_length_unit"],
+            "triSurfaceCompression" : optionDict.get("trisurface_compression", "none"),
+            "artifactCacheDir" : artifactCacheDir,
+            "artifactCacheSizeMb" : float(optionDict.get("artifact_cache_size_mb", "10240")),
+            "featureExtraction" : optionDict.get("feature_extraction", "native"),
+            "surfaceCheck" : optionDict.get("surface_check", "report"),
+            "leakCheck" : optionDict.get("leak_check", "report"),
+            "leakCheckRefinement" : int(optionDict.get("leak_check_refinement", "1")),
+            "surfaceRefinementLevel" : int(optionDict.get("surface_refinement_level", "3")),
+            "nCellsBetweenLevels" : int(optionDict.get("n_cells_between_levels", "3")),
+            "meshLimits" : optionDict.get("mesh_limits", "auto"),
+            "nProcs" : nProcs,
+            "decomposeMethod" : optionDict.get("decompose_method", "scotch"),
+            "mpirunCommand" : optionDict.get("mpirun_command", "mpirun"),
+            "keepDecomposed" : optionDict.get("keep_decomposed", "false").lower() in ["true", "yes", "1"],
+            "reconstructMesh" : optionDict.get("reconstruct_mesh", "no"),
+            "nCores" : nCores,
+            "cleanCase" : optionDict.get("clean_case", "false").lower() in ["true", "yes", "1"],
+            "snappyPhases" : optionDict.get("snappy_phases", "combined"),
+            "utilityTimeout" : optionDict.get("utility_timeout", "none"),
+            "utilityMemoryLimitMb" : optionDict.get("utility_memory_limit_mb", "none"),
+            "utilityRetries" : int(optionDict.get("utility_retries", "0")),
+            "executionBackend" : optionDict.get("execution_backend", "local"),
+            "slurmOptions" : optionDict.get("slurm_options", ""),
+            "slurmLauncher" : optionDict.get("slurm_launcher", "srun"),
+            "slurmPollInterval" : float(optionDict.get("slurm_poll_interval", "10")),
+            "keepStaging" : optionDict.get("keep_staging", "false").lower() in ["true", "yes", "1"],
+        }
+    return processInputDict
+
+
+#---------------------------------------
+
 if __name__ == "__main__":
 #     workingDir = ""
 #     openfoamVersion = "v2412"
@@ -1003,31 +2443,45 @@ if __name__ == "__main__":
 #     loactionInMesh = (0.0, 0.0, 0.0)
 #     snappyHexInfoFilename = "snappyHexInfo.json"
 #     snappyHexInfoFile = workingDir+ os.sep + snappyHexInfoFilename 
-    wspace = ""
-    workingDir = os.environ["working_dir"]
-    openfoamVersion = os.environ["openfoam_version"]
-    foamFileVersion = os.environ["foamfile_version"]
-    openFoamBashrcPath = os.environ["openfoam_bashrc_path"]
-    lengthUnit = os.environ["geometry_length_unit"]
-    blockMeshCellSize = float(os.environ["blockmesh_size"])
-    loactionInMeshStr = os.environ["location_in_mesh"]
-    loactionInMesh = [float(x) for x in loactionInMeshStr.replace(wspace, "").split(",")]
-    snappyHexInfoFilename = os.environ["input_json_filename"]
-    snappyHexInfoFile = workingDir+ os.sep + snappyHexInfoFilename 
+    ### Ctrl-C/SIGTERM stop the running utilities too
+    process_supervisor.install_signal_handlers()
+    
+    serviceSocket = os.environ.get("service_socket", "none")
+    if serviceSocket.lower() != "none":
+        ### Long-running service, the jobs are submitted over the socket
+        import mesh_daemon
+        mesh_daemon.run_daemon(
+                serviceSocket,
+                dict(os.environ),
+                get_process_input,
+                snappyHexMesh_from_stl,
+                int(os.environ.get("service_jobs", "1")),
+                os.environ.get("service_memory_mb", "auto"),
+            )
+        sys.exit()
+    
+    sweepFile = os.environ.get("sweep_file", "none")
+    if sweepFile.lower() != "none":
+        ### Parameter sweep, the cases share the cores/memory of the machine
+        import mesh_sweep
+        mesh_sweep.run_sweep(
+                sweepFile,
+                dict(os.environ),
+                get_process_input,
+                snappyHexMesh_from_stl,
+                os.environ.get("sweep_memory_mb", "auto"),
+            )
+        sys.exit()
+    
+    try:
+        processInputDict = get_process_input(os.environ)
+    except ValueError as e:
+        sys.exit("Invalid option : " + str(e))
     
     print("-"*40)
-    print("Location in mesh --> " + str(loactionInMesh))
+    print("Location in mesh --> " + str(processInputDict["loactionInMesh"]))
     
-    snappyHexMesh_from_stl(
-            openfoamVersion, 
-            foamFileVersion,
-            openFoamBashrcPath,
-            workingDir,
-            snappyHexInfoFile,
-            blockMeshCellSize,
-            loactionInMesh,
-            lengthUnit,
-        )
+    snappyHexMesh_from_stl(**processInputDict)
 #---------------------------------------
 
 
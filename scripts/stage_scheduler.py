@@ -0,0 +1,490 @@
+"""
+    Dependency graph scheduler for the stages of the snappyHexMesh process.
+
+    - A stage is a function with the stages it depends on, the files it
+      reads ("inputs") and writes ("outputs") and the cores it occupies.
+      A stage reading the output of another stage depends on it, without
+      it being listed.
+    - Stages whose dependencies are done run concurrently (threads, the
+      OpenFOAM utilities are separate processes), as long as their cores
+      and memory fit in the budget. A stage wider than the budget runs
+      alone. The budget (resource pool) can be shared by the schedulers of
+      several cases running at once, e.g. a parameter sweep.
+    - Stages run in a copy of the context (contextvars) of the thread
+      calling run().
+    - After the run, the report gives the start/finish time of every stage
+      and the critical path, the chain of stages that set the wall-clock
+      time.
+    - With a fingerprint file, every stage is fingerprinted by its
+      parameters and the content of its inputs not produced by another
+      stage. A stage whose fingerprint is unchanged, whose outputs exist
+      and none of whose dependencies ran is skipped. The outputs of a stage
+      are deleted before it runs again.
+    - A stage changing the outputs of another stage in place ("modifies")
+      is recorded as the modifier of that stage. The modified stage is up
+      to date only if its modifier is going to be skipped too, otherwise
+      both run again.
+    - The files a stage changes in place (outputs of the stages it
+      modifies, "updates") are unshared before it runs, the hard links of
+      a staging directory to the published one are broken
+      (workspace.unshare_files).
+"""
+
+import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+import threading
+import contextvars
+import concurrent.futures
+
+import artifact_cache
+import workspace
+
+
+### Seconds between the checks of a shared resource pool, when a stage
+### waits for resources used by another scheduler
+poolPollInterval = 0.2
+
+
+#---------------------------------------
+
+class ResourcePool(object):
+
+    def __init__(
+            self,
+            nCores = 1,
+            memory = None,
+        ):
+        ### memory --> bytes, None for no memory budget
+        self.nCores = max(int(nCores), 1)
+        self.memory = memory
+        self.nCoreUsed = 0
+        self.memoryUsed = 0
+        self.condition = threading.Condition()
+        return
+
+
+    def get_request(
+            self,
+            nCores,
+            memory,
+        ):
+        ### A request wider than the pool takes the whole pool
+        nCores = min(nCores, self.nCores)
+        if self.memory is not None:
+            memory = min(memory, self.memory)
+        return nCores, memory
+
+
+    def try_acquire(
+            self,
+            nCores,
+            memory = 0,
+        ):
+        nCores, memory = self.get_request(nCores, memory)
+        with self.condition:
+            if self.nCoreUsed + nCores > self.nCores:
+                return False
+            if self.memory is not None and self.memoryUsed + memory > self.memory:
+                return False
+            self.nCoreUsed += nCores
+            self.memoryUsed += memory
+        return True
+
+
+    def release(
+            self,
+            nCores,
+            memory = 0,
+        ):
+        nCores, memory = self.get_request(nCores, memory)
+        with self.condition:
+            self.nCoreUsed -= nCores
+            self.memoryUsed -= memory
+            self.condition.notify_all()
+        return
+
+
+    def wait(
+            self,
+            timeout = None,
+        ):
+        ### Until resources are released (or the timeout)
+        with self.condition:
+            self.condition.wait(timeout)
+        return
+
+
+#---------------------------------------
+
+class StageScheduler(object):
+
+    def __init__(
+            self,
+            nCores = 1,
+            rootDir = ".",
+            fingerprintFile = None,
+            fileDigestFunction = artifact_cache.file_digest,
+            resourcePool = None,
+        ):
+        ### Input and output paths (glob patterns) are relative to rootDir.
+        ### Without a resource pool, the budget is nCores (no memory
+        ### budget) and is not shared.
+        if resourcePool is None:
+            resourcePool = ResourcePool(nCores)
+        self.resourcePool = resourcePool
+        self.nCores = self.resourcePool.nCores
+        self.rootDir = rootDir
+        self.fingerprintFile = fingerprintFile
+        self.fileDigestFunction = fileDigestFunction
+        self.stageDict = {}
+        return
+
+
+    def add_stage(
+            self,
+            name,
+            function,
+            args = (),
+            kwargs = None,
+            dependsOn = (),
+            inputs = (),
+            outputs = (),
+            nCores = 1,
+            parameters = None,
+            modifies = (),
+            memory = 0,
+            updates = (),
+        ):
+        ### memory --> bytes the stage is expected to use at most
+        ### updates --> files the stage changes in place without changing
+        ###             their stage (e.g. zones added to a mesh)
+        ### nCores --> 0 for a stage running elsewhere (e.g. a batch job),
+        ###            it takes no cores of the budget
+        if name in self.stageDict:
+            raise ValueError("Stage defined twice : " + name)
+        self.stageDict[name] = {
+                "function" : function,
+                "args" : tuple(args),
+                "kwargs" : dict(kwargs or {}),
+                "depends-on" : list(dependsOn),
+                "inputs" : list(inputs),
+                "outputs" : list(outputs),
+                "n-cores" : max(int(nCores), 0),
+                "memory" : max(int(memory), 0),
+                "parameters" : dict(parameters or {}),
+                "modifies" : list(modifies),
+                "updates" : list(updates),
+                "fingerprint" : None,
+                "status" : "pending",
+                "result" : None,
+                "start-time" : None,
+                "finish-time" : None,
+            }
+        return
+
+    #---------------------------------------
+
+    def get_dependencies(
+            self,
+            name,
+        ):
+        ### Listed dependencies and the producers of the stage inputs
+        stage = self.stageDict[name]
+        dependencyList = list(stage["depends-on"])
+        for otherName, otherStage in self.stageDict.items():
+            if otherName == name or otherName in dependencyList:
+                continue
+            if set(stage["inputs"]) & set(otherStage["outputs"]):
+                dependencyList.append(otherName)
+        for dependency in dependencyList:
+            if dependency not in self.stageDict:
+                raise ValueError("Stage \"" + name + "\" depends on an unknown stage : " + dependency)
+        return dependencyList
+
+
+    def get_stage_order(self):
+        ### Topological order, declaration order among independent stages
+        dependencyDict = {name : self.get_dependencies(name) for name in self.stageDict}
+        stageOrder = []
+        doneSet = set()
+        while len(stageOrder) < len(self.stageDict):
+            readyList = [
+                    name for name in self.stageDict
+                    if name not in doneSet and all([x in doneSet for x in dependencyDict[name]])
+                ]
+            if not readyList:
+                remainingList = [x for x in self.stageDict if x not in doneSet]
+                raise ValueError("Stage dependency cycle : " + ", ".join(remainingList))
+            for name in readyList:
+                stageOrder.append(name)
+                doneSet.add(name)
+        return stageOrder
+
+    #---------------------------------------
+    ### FINGERPRINTS
+    #---------------------------------------
+
+    def read_fingerprints(self):
+        ### Fingerprint of every stage and the modifier of every stage
+        ### whose outputs were changed in place
+        if self.fingerprintFile is None:
+            return {}, {}
+        try:
+            with open(self.fingerprintFile, "r") as rf:
+                fileDict = json.load(rf)
+        except (OSError, ValueError):
+            return {}, {}
+        ### File written before the modifiers were recorded, the modified
+        ### stages have no fingerprint
+        if "fingerprints" not in fileDict:
+            return fileDict, {}
+        return fileDict["fingerprints"], fileDict.get("modified-by", {})
+
+
+    def write_fingerprints(self):
+        fileDict = {
+                "fingerprints" : self.fingerprintDict,
+                "modified-by" : self.modifiedByDict,
+            }
+        tmpFile = self.fingerprintFile + ".tmp-" + str(os.getpid())
+        with open(tmpFile, "w") as wf:
+            json.dump(fileDict, wf, indent = 4, sort_keys = True)
+        os.replace(tmpFile, self.fingerprintFile)
+        return
+
+
+    def get_path_list(
+            self,
+            pattern,
+        ):
+        return sorted(glob.glob(os.path.join(self.rootDir, pattern)))
+
+
+    def get_stage_fingerprint(
+            self,
+            name,
+        ):
+        ### Inputs produced by another stage are covered by the dependency
+        stage = self.stageDict[name]
+        producedSet = set()
+        for otherName, otherStage in self.stageDict.items():
+            if otherName != name:
+                producedSet.update(otherStage["outputs"])
+        
+        fingerprintDict = {
+                "parameters" : stage["parameters"],
+                "inputs" : {x : artifact_cache.path_digest(self.rootDir, x, self.fileDigestFunction) for x in stage["inputs"] if x not in producedSet},
+            }
+        fingerprintString = json.dumps(fingerprintDict, sort_keys = True, default = str)
+        return hashlib.blake2b(fingerprintString.encode(), digest_size = 20).hexdigest()
+
+
+    def is_stage_up_to_date(
+            self,
+            name,
+            assumedSet = frozenset(),
+        ):
+        ### A pending dependency is up to date if it is going to be skipped.
+        ### A modified stage and its modifier are skipped together, the
+        ### stages of assumedSet are taken as skipped (the modified stage
+        ### is a dependency of its modifier).
+        stage = self.stageDict[name]
+        if self.fingerprintFile is None:
+            return False
+        if stage["fingerprint"] is None:
+            stage["fingerprint"] = self.get_stage_fingerprint(name)
+        if self.fingerprintDict.get(name) != stage["fingerprint"]:
+            return False
+        if not all([self.get_path_list(x) for x in stage["outputs"]]):
+            return False
+        
+        assumedSet = assumedSet | {name}
+        checkList = list(self.dependencyDict[name])
+        modifierName = self.modifiedByDict.get(name)
+        if modifierName is not None:
+            if modifierName not in self.stageDict or name not in self.stageDict[modifierName]["modifies"]:
+                return False
+            checkList.append(modifierName)
+        for otherName in checkList:
+            status = self.stageDict[otherName]["status"]
+            if otherName in assumedSet or status == "skipped":
+                continue
+            if status != "pending" or not self.is_stage_up_to_date(otherName, assumedSet):
+                return False
+        return True
+
+
+    def remove_stage_outputs(
+            self,
+            name,
+        ):
+        for pattern in self.stageDict[name]["outputs"]:
+            for path in self.get_path_list(pattern):
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        return
+
+
+    def unshare_stage_files(
+            self,
+            name,
+        ):
+        stage = self.stageDict[name]
+        patternList = list(stage["updates"])
+        for modifiedName in stage["modifies"]:
+            if modifiedName in self.stageDict:
+                patternList += self.stageDict[modifiedName]["outputs"]
+        workspace.unshare_files(self.rootDir, patternList)
+        return
+
+    #---------------------------------------
+
+    def run(self):
+        ### Returns the result of every stage (None if skipped). A failing
+        ### stage stops the launch of new stages, the running ones are
+        ### waited for and the error is raised again.
+        stageOrder = self.get_stage_order()
+        self.dependencyDict = {name : self.get_dependencies(name) for name in stageOrder}
+        self.fingerprintDict, self.modifiedByDict = self.read_fingerprints()
+        self.startTime = time.time()
+
+        runningDict = {}
+        failure = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers = max(len(stageOrder), 1)) as executor:
+            while True:
+                waitingForPool = False
+                for name in stageOrder:
+                    if failure is not None:
+                        break
+                    stage = self.stageDict[name]
+                    if stage["status"] != "pending":
+                        continue
+                    if not all([self.stageDict[x]["status"] in ["done", "skipped"] for x in self.dependencyDict[name]]):
+                        continue
+                    
+                    ### Stages are in topological order, a skipped stage
+                    ### is seen by the stages after it in the same pass
+                    if self.is_stage_up_to_date(name):
+                        stage["status"] = "skipped"
+                        continue
+                    
+                    if not self.resourcePool.try_acquire(stage["n-cores"], stage["memory"]):
+                        waitingForPool = True
+                        continue
+                    ### The modified stages are recorded before the
+                    ### modifier runs, they run again if it fails
+                    if self.fingerprintFile is not None:
+                        self.fingerprintDict.pop(name, None)
+                        self.modifiedByDict.pop(name, None)
+                        for modifiedName in stage["modifies"]:
+                            self.modifiedByDict[modifiedName] = name
+                        self.write_fingerprints()
+                    self.remove_stage_outputs(name)
+                    self.unshare_stage_files(name)
+                    
+                    stage["status"] = "running"
+                    stage["start-time"] = time.time() - self.startTime
+                    future = executor.submit(contextvars.copy_context().run, stage["function"], *stage["args"], **stage["kwargs"])
+                    runningDict[future] = name
+
+                ### Resources held by the stages of another scheduler are
+                ### released without a stage of this one finishing
+                if not runningDict:
+                    if not waitingForPool:
+                        break
+                    self.resourcePool.wait(poolPollInterval)
+                    continue
+
+                doneFutureSet, pendingFutureSet = concurrent.futures.wait(
+                        list(runningDict.keys()),
+                        timeout = poolPollInterval if waitingForPool else None,
+                        return_when = concurrent.futures.FIRST_COMPLETED,
+                    )
+                for future in doneFutureSet:
+                    name = runningDict.pop(future)
+                    stage = self.stageDict[name]
+                    stage["finish-time"] = time.time() - self.startTime
+                    self.resourcePool.release(stage["n-cores"], stage["memory"])
+                    try:
+                        stage["result"] = future.result()
+                        stage["status"] = "done"
+                        if self.fingerprintFile is not None:
+                            self.fingerprintDict[name] = stage["fingerprint"]
+                            self.write_fingerprints()
+                    except Exception as e:
+                        stage["status"] = "failed"
+                        if failure is None:
+                            failure = e
+
+        self.finishTime = time.time()
+        if failure is not None:
+            raise failure
+        return {name : self.stageDict[name]["result"] for name in stageOrder}
+
+    #---------------------------------------
+
+    def get_stage_duration(
+            self,
+            name,
+        ):
+        stage = self.stageDict[name]
+        if stage["start-time"] is None or stage["finish-time"] is None:
+            return 0.0
+        return stage["finish-time"] - stage["start-time"]
+
+
+    def get_critical_path(self):
+        ### Longest chain of dependent stages by duration
+        pathFinishDict = {}
+        pathPreviousDict = {}
+        for name in self.get_stage_order():
+            previous = None
+            previousFinish = 0.0
+            for dependency in self.get_dependencies(name):
+                if pathFinishDict[dependency] > previousFinish:
+                    previous = dependency
+                    previousFinish = pathFinishDict[dependency]
+            pathFinishDict[name] = previousFinish + self.get_stage_duration(name)
+            pathPreviousDict[name] = previous
+
+        if not pathFinishDict or max(pathFinishDict.values()) <= 0.0:
+            return [], 0.0
+        name = max(pathFinishDict, key = lambda x: pathFinishDict[x])
+        criticalPathLength = pathFinishDict[name]
+        criticalPath = []
+        while name is not None:
+            criticalPath.insert(0, name)
+            name = pathPreviousDict[name]
+        return criticalPath, criticalPathLength
+
+
+    def get_report(self):
+        stageOrder = self.get_stage_order()
+        maxNameLength = max([len(x) for x in stageOrder] + [len("Stage time sum")])
+        criticalPath, criticalPathLength = self.get_critical_path()
+
+        str2print = ""
+        str2print += f"{'Stage' : <{maxNameLength}} : {'start' : >10} {'finish' : >10} {'time' : >10} [sec]\n"
+        for name in stageOrder:
+            stage = self.stageDict[name]
+            if stage["status"] == "skipped":
+                str2print += f"{name : <{maxNameLength}} : skipped (up to date)\n"
+                continue
+            if stage["start-time"] is None:
+                str2print += f"{name : <{maxNameLength}} : {stage['status']}\n"
+                continue
+            str2print += f"{name : <{maxNameLength}} : {stage['start-time'] : >10.4} {stage['finish-time'] : >10.4} {self.get_stage_duration(name) : >10.4}"
+            str2print += "\n" if stage["status"] == "done" else " (" + stage["status"] + ")\n"
+        str2print += "\n"
+        str2print += f"{'Wall time' : <{maxNameLength}} : {self.finishTime - self.startTime : >10.4} [sec]\n"
+        str2print += f"{'Stage time sum' : <{maxNameLength}} : {sum([self.get_stage_duration(x) for x in stageOrder]) : >10.4} [sec]\n"
+        str2print += f"{'Critical path' : <{maxNameLength}} : {criticalPathLength : >10.4} [sec]\n"
+        if criticalPath:
+            str2print += " --> ".join(criticalPath) + "\n"
+        return str2print
@@ -0,0 +1,324 @@
+"""
+    STL file input for the snappyHexMesh automation process.
+
+    - Reads binary STL files zero-copy through a numpy memory map.
+    - Reads ASCII STL files in chunks, parsing all the vertex records of
+      a chunk in one vectorized step.
+    - Computes the triangle count, the bounds and the per-solid extents
+      with array reductions.
+    - Splits binary STL files into regions by the triangle attribute, with
+      the region names from the sidecar JSON file written while merging.
+"""
+
+import os
+import re
+import gzip
+import json
+
+import numpy as np
+
+
+#---------------------------------------
+
+binaryStlHeaderSize = 80
+binaryStlCountSize = 4
+binaryStlDataOffset = binaryStlHeaderSize + binaryStlCountSize
+
+### 50 bytes per triangle record
+binaryStlRecordDtype = np.dtype([
+        ("normal", "<f4", (3,)),
+        ("vertices", "<f4", (3, 3)),
+        ("attribute", "<u2"),
+    ])
+
+### Size of the text blocks parsed at once for ASCII STL files
+asciiStlChunkSize = 64 * 1024 * 1024
+
+### Number of binary triangle records reduced at once
+binaryStlChunkLength = 4 * 1024 * 1024
+
+regionSidecarPostFix = ".regions.json"
+
+asciiSolidPattern = re.compile(rb"^[ \t]*solid\b[ \t]*([^\r\n]*)", re.M)
+asciiVertexPattern = re.compile(rb"^[ \t]*vertex[ \t]+([^\r\n]+)", re.M)
+
+
+#---------------------------------------
+
+def open_stl_file(
+        stlFile,
+    ):
+    if stlFile.endswith(".gz"):
+        return gzip.open(stlFile, "rb")
+    return open(stlFile, "rb")
+
+
+def is_binary_stl(
+        stlFile,
+    ):
+    with open_stl_file(stlFile) as sf:
+        leadingBytes = sf.read(512)
+
+    if len(leadingBytes) >= binaryStlDataOffset and not stlFile.endswith(".gz"):
+        nTriangle = int(np.frombuffer(leadingBytes, dtype = "<u4", count = 1, offset = binaryStlHeaderSize)[0])
+        if os.path.getsize(stlFile) == binaryStlDataOffset + nTriangle * binaryStlRecordDtype.itemsize:
+            return True
+
+    ### Some exporters start the binary header with "solid" as well,
+    ### so a text file is only assumed if facet records follow
+    if leadingBytes.lstrip().startswith(b"solid"):
+        if b"facet" in leadingBytes or b"endsolid" in leadingBytes:
+            return False
+        if len(leadingBytes) < binaryStlDataOffset:
+            return False
+    return True
+
+
+def get_bound_dict(
+        minCoordinate,
+        maxCoordinate,
+    ):
+    return {
+            "x-min" : float(minCoordinate[0]),
+            "x-max" : float(maxCoordinate[0]),
+            "y-min" : float(minCoordinate[1]),
+            "y-max" : float(maxCoordinate[1]),
+            "z-min" : float(minCoordinate[2]),
+            "z-max" : float(maxCoordinate[2]),
+        }
+
+
+def merge_bound_dict(
+        boundDict,
+        otherBoundDict,
+    ):
+    if boundDict is None:
+        return dict(otherBoundDict)
+    if otherBoundDict is None:
+        return dict(boundDict)
+    mergedBoundDict = {}
+    for key in boundDict.keys():
+        if key.endswith("min"):
+            mergedBoundDict[key] = min(boundDict[key], otherBoundDict[key])
+        else:
+            mergedBoundDict[key] = max(boundDict[key], otherBoundDict[key])
+    return mergedBoundDict
+
+
+#---------------------------------------
+### BINARY STL
+#---------------------------------------
+
+def read_binary_stl(
+        stlFile,
+    ):
+    if stlFile.endswith(".gz"):
+        with gzip.open(stlFile, "rb") as sf:
+            stlData = sf.read()
+        header = stlData[ : binaryStlHeaderSize]
+        nTriangle = int(np.frombuffer(stlData, dtype = "<u4", count = 1, offset = binaryStlHeaderSize)[0])
+        records = np.frombuffer(
+                stlData,
+                dtype = binaryStlRecordDtype,
+                count = nTriangle,
+                offset = binaryStlDataOffset,
+            )
+        return header, records
+
+    with open(stlFile, "rb") as sf:
+        header = sf.read(binaryStlHeaderSize)
+        nTriangle = int(np.frombuffer(sf.read(binaryStlCountSize), dtype = "<u4")[0])
+
+    if nTriangle == 0:
+        return header, np.empty(0, dtype = binaryStlRecordDtype)
+
+    records = np.memmap(
+            stlFile,
+            dtype = binaryStlRecordDtype,
+            mode = "r",
+            offset = binaryStlDataOffset,
+            shape = (nTriangle,),
+        )
+    return header, records
+
+
+def get_region_sidecar_file(
+        stlFile,
+    ):
+    if stlFile.endswith(".gz"):
+        stlFile = stlFile[ : -len(".gz")]
+    return os.path.splitext(stlFile)[0] + regionSidecarPostFix
+
+
+def read_region_sidecar_file(
+        stlFile,
+    ):
+    ### Returns the region names by attribute, None without a sidecar file
+    sidecarFile = get_region_sidecar_file(stlFile)
+    if not os.path.exists(sidecarFile):
+        return None
+    with open(sidecarFile, "r") as sf:
+        regionList = json.load(sf)["regions"]
+    regionNameList = [""] * (max([x["attribute"] for x in regionList] + [-1]) + 1)
+    for region in regionList:
+        regionNameList[region["attribute"]] = region["name"]
+    return regionNameList
+
+
+def get_binary_stl_solid_name(
+        header,
+    ):
+    solidName = header.split(b"\0")[0].decode("ascii", errors = "replace").strip()
+    if solidName.startswith("solid"):
+        solidName = solidName[len("solid") : ].strip()
+    return solidName
+
+
+#---------------------------------------
+### ASCII STL
+#---------------------------------------
+
+def parse_ascii_stl_vertices(
+        stlText,
+    ):
+    vertexText = b" ".join(asciiVertexPattern.findall(stlText))
+    if not vertexText:
+        return np.empty((0, 3), dtype = np.float64)
+    return np.array(vertexText.split(), dtype = np.float64).reshape(-1, 3)
+
+
+def iter_ascii_stl_chunks(
+        stlFile,
+        chunkSize = asciiStlChunkSize,
+    ):
+    ### Yields (solid name, vertex array) pairs, a solid definition can
+    ### be split over several consecutive pairs
+    solidName = ""
+    remainder = b""
+    with open_stl_file(stlFile) as sf:
+        while True:
+            chunk = sf.read(chunkSize)
+            if not chunk:
+                stlText = remainder
+                remainder = b""
+            else:
+                stlText = remainder + chunk
+                ### Cut after the last complete facet, the vertices of a
+                ### facet stay in one chunk
+                lastFacetEnd = stlText.rfind(b"endfacet")
+                lastNewline = -1 if lastFacetEnd == -1 else stlText.find(b"\n", lastFacetEnd)
+                if lastNewline == -1:
+                    remainder = stlText
+                    continue
+                remainder = stlText[lastNewline + 1 : ]
+                stlText = stlText[ : lastNewline + 1]
+
+            segmentStart = 0
+            for match in asciiSolidPattern.finditer(stlText):
+                vertexArray = parse_ascii_stl_vertices(stlText[segmentStart : match.start()])
+                if vertexArray.shape[0] > 0:
+                    yield solidName, vertexArray
+                solidName = match.group(1).decode("ascii", errors = "replace").strip()
+                segmentStart = match.end()
+
+            vertexArray = parse_ascii_stl_vertices(stlText[segmentStart : ])
+            if vertexArray.shape[0] > 0:
+                yield solidName, vertexArray
+
+            if not chunk:
+                break
+    return
+
+
+#---------------------------------------
+### TRIANGLES AND INFORMATION
+#---------------------------------------
+
+def iter_stl_triangle_blocks(
+        stlFile,
+        binaryStl = None,
+    ):
+    ### Yields (solid name, triangle array [n, 3, 3]) pairs
+    if binaryStl is None:
+        binaryStl = is_binary_stl(stlFile)
+    if binaryStl:
+        header, records = read_binary_stl(stlFile)
+        solidName = get_binary_stl_solid_name(header)
+        regionNameList = read_region_sidecar_file(stlFile)
+        for start in range(0, records.shape[0], binaryStlChunkLength):
+            recordChunk = records[start : start + binaryStlChunkLength]
+            if regionNameList is None:
+                yield solidName, recordChunk["vertices"]
+                continue
+            attributeArray = recordChunk["attribute"]
+            for attribute in np.unique(attributeArray):
+                if attribute < len(regionNameList):
+                    regionName = regionNameList[attribute]
+                else:
+                    regionName = "patch" + str(attribute)
+                yield regionName, recordChunk["vertices"][attributeArray == attribute]
+    else:
+        for solidName, vertexArray in iter_ascii_stl_chunks(stlFile):
+            yield solidName, vertexArray.reshape(-1, 3, 3)
+    return
+
+
+def get_stl_information(
+        stlFile,
+    ):
+    binaryStl = is_binary_stl(stlFile)
+    solidInfoDict = {}
+    nTriangleTotal = 0
+    stlBound = None
+
+    for solidName, triangleArray in iter_stl_triangle_blocks(stlFile, binaryStl):
+        nTriangle = triangleArray.shape[0]
+        if nTriangle == 0:
+            continue
+        vertexArray = triangleArray.reshape(-1, 3)
+        blockBound = get_bound_dict(
+                vertexArray.min(axis = 0),
+                vertexArray.max(axis = 0),
+            )
+
+        if solidName not in solidInfoDict:
+            solidInfoDict[solidName] = {
+                    "n-triangles" : 0,
+                    "bound" : None,
+                }
+        solidInfoDict[solidName]["n-triangles"] += nTriangle
+        solidInfoDict[solidName]["bound"] = merge_bound_dict(solidInfoDict[solidName]["bound"], blockBound)
+
+        nTriangleTotal += nTriangle
+        stlBound = merge_bound_dict(stlBound, blockBound)
+
+    stlInfoDict = {
+            "format" : "binary" if binaryStl else "ascii",
+            "n-triangles" : nTriangleTotal,
+            "bound" : stlBound,
+            "solid-info" : solidInfoDict,
+        }
+    return stlInfoDict
+
+
+def read_stl_triangles(
+        stlFile,
+    ):
+    ### Returns the triangle array [n, 3, 3], the solid index of every
+    ### triangle and the ordered solid names
+    solidNameList = []
+    triangleBlockList = []
+    solidIndexBlockList = []
+
+    for solidName, triangleArray in iter_stl_triangle_blocks(stlFile):
+        if solidName not in solidNameList:
+            solidNameList.append(solidName)
+        triangleBlockList.append(np.asarray(triangleArray, dtype = np.float64))
+        solidIndexBlockList.append(
+                np.full(triangleArray.shape[0], solidNameList.index(solidName), dtype = np.int32)
+            )
+
+    if not triangleBlockList:
+        return np.empty((0, 3, 3), dtype = np.float64), np.empty(0, dtype = np.int32), solidNameList
+
+    return np.concatenate(triangleBlockList), np.concatenate(solidIndexBlockList), solidNameList
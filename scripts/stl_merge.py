@@ -0,0 +1,355 @@
+"""
+    STL formatting and merging for the geometry generation process.
+
+    - Formats the exported STL files (solid definitions merged/renamed)
+      in a single streaming pass per file, ASCII or binary.
+    - Formats several files at once in a process pool.
+    - Concatenates formatted files in-process with kernel side copies
+      (copy_file_range/sendfile) or large buffered copies, or writes the
+      combined file directly while formatting.
+    - Binary STL files have no solid records, the region of every
+      triangle in a combined binary file is stored in the attribute field
+      (OpenFOAM reads it as the zone/region index) and the region names
+      are written to a sidecar JSON file.
+
+    Only the python standard library is used, the module is imported
+    from the Coreform/Cubit python session.
+"""
+
+import os
+import json
+import struct
+import shutil
+import multiprocessing
+import concurrent.futures
+
+
+#---------------------------------------
+
+bufferSize = 1024*1024
+copyChunkSize = 64*1024*1024
+
+searchStringStart = "solid"
+searchStringEnd = "endsolid"
+
+binaryStlHeaderSize = 80
+binaryStlCountSize = 4
+binaryStlRecordSize = 50
+binaryStlAttributeOffset = 48
+
+### Binary STL records copied at once
+binaryStlChunkLength = 1024*1024
+
+regionSidecarPostFix = ".regions.json"
+
+
+#---------------------------------------
+### FORMATTING
+#---------------------------------------
+
+def format_stl_file( \
+        fileSourcePath, \
+        fileTargetPath, \
+        solidName, \
+        mergeAllSolidTogether = True, \
+        combinedStream = None, \
+    ):
+    ### Single pass from source to target, the "solid"/"endsolid" records
+    ### are dropped while merging and every other line is written once.
+    ### If a combined stream is given, the output is written to it as well.
+    solidNameList = []
+    searchStringStartLen = len(searchStringStart)
+
+    with open(fileSourcePath, "r", buffering = bufferSize) as stlf, \
+            open(fileTargetPath, "w", buffering = bufferSize) as tf:
+        targetStreamList = [tf]
+        if combinedStream is not None:
+            targetStreamList.append(combinedStream)
+
+        if mergeAllSolidTogether:
+            for stream in targetStreamList:
+                stream.write("solid " + solidName + "\n")
+
+        for line in stlf:
+            if line.startswith((searchStringStart, searchStringEnd)):
+                if line.startswith(searchStringStart):
+                    solidNameList.append(line[searchStringStartLen : ].strip())
+                if mergeAllSolidTogether:
+                    continue
+            for stream in targetStreamList:
+                stream.write(line)
+
+        if mergeAllSolidTogether:
+            for stream in targetStreamList:
+                stream.write("endsolid " + solidName + "\n")
+
+    return solidNameList
+
+
+def get_binary_stl_header( \
+        solidName, \
+    ):
+    ### The header is not started with "solid", that would make readers
+    ### guessing the format take the file as ASCII
+    header = solidName.encode("ascii", "replace")[ : binaryStlHeaderSize]
+    return header.ljust(binaryStlHeaderSize, b" ")
+
+
+def read_binary_stl_header( \
+        stream, \
+    ):
+    header = stream.read(binaryStlHeaderSize)
+    nTriangle = struct.unpack("<I", stream.read(binaryStlCountSize))[0]
+    solidName = header.split(b"\0")[0].decode("ascii", "replace").strip()
+    return solidName, nTriangle
+
+
+def set_binary_stl_attribute( \
+        recordData, \
+        attribute, \
+    ):
+    nRecord = len(recordData) // binaryStlRecordSize
+    recordData[binaryStlAttributeOffset : : binaryStlRecordSize] = bytes(bytearray([attribute & 0xff])) * nRecord
+    recordData[binaryStlAttributeOffset + 1 : : binaryStlRecordSize] = bytes(bytearray([(attribute >> 8) & 0xff])) * nRecord
+    return recordData
+
+
+def copy_binary_stl_records( \
+        sourceStream, \
+        targetList, \
+        nTriangle, \
+    ):
+    ### targetList --> [(stream, attribute), ...]
+    nRemaining = nTriangle
+    while nRemaining > 0:
+        nRecord = min(nRemaining, binaryStlChunkLength)
+        recordData = bytearray(sourceStream.read(nRecord * binaryStlRecordSize))
+        if len(recordData) != nRecord * binaryStlRecordSize:
+            raise ValueError("Truncated binary STL file : " + str(sourceStream.name))
+        for stream, attribute in targetList:
+            stream.write(bytes(set_binary_stl_attribute(recordData, attribute)))
+        nRemaining -= nRecord
+    return
+
+
+def format_binary_stl_file( \
+        fileSourcePath, \
+        fileTargetPath, \
+        solidName, \
+        regionIndex = 0, \
+        combinedStream = None, \
+    ):
+    ### Rewrites the header with the solid name and clears the attribute
+    ### field. If a combined stream is given, the records are written to
+    ### it as well, with the region index as attribute.
+    with open(fileSourcePath, "rb", buffering = bufferSize) as sf, \
+            open(fileTargetPath, "wb", buffering = bufferSize) as tf:
+        sourceSolidName, nTriangle = read_binary_stl_header(sf)
+        tf.write(get_binary_stl_header(solidName))
+        tf.write(struct.pack("<I", nTriangle))
+
+        targetList = [(tf, 0)]
+        if combinedStream is not None:
+            targetList.append((combinedStream, regionIndex))
+        copy_binary_stl_records(sf, targetList, nTriangle)
+
+    return [sourceSolidName], nTriangle
+
+
+def format_stl_file_task( \
+        taskDict, \
+    ):
+    if taskDict.get("stl-format", "ascii") == "binary":
+        solidNameList, nTriangle = format_binary_stl_file( \
+                taskDict["source"], \
+                taskDict["target"], \
+                taskDict["solid-name"], \
+            )
+        return solidNameList
+
+    solidNameList = format_stl_file( \
+            taskDict["source"], \
+            taskDict["target"], \
+            taskDict["solid-name"], \
+            taskDict["merge-all-solid-together"], \
+        )
+    return solidNameList
+
+
+def get_process_pool_context():
+    ### Forked workers do not need to re-import the calling script, which
+    ### is executed through exec() inside the Cubit session
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return None
+
+
+def format_stl_files( \
+        taskList, \
+        nProcess = 0, \
+    ):
+    ### Returns the solid name list of every task, in the task order
+    if nProcess <= 0:
+        nProcess = os.cpu_count() or 1
+    nProcess = min(nProcess, len(taskList))
+    poolContext = get_process_pool_context()
+
+    if nProcess > 1 and poolContext is not None:
+        try:
+            with concurrent.futures.ProcessPoolExecutor( \
+                    max_workers = nProcess, \
+                    mp_context = poolContext, \
+                ) as executor:
+                return list(executor.map(format_stl_file_task, taskList))
+        except (OSError, concurrent.futures.process.BrokenProcessPool) as e:
+            print("Process pool not available (" + str(e) + "), formatting serially ...")
+
+    return [format_stl_file_task(taskDict) for taskDict in taskList]
+
+
+#---------------------------------------
+### MERGING
+#---------------------------------------
+
+def copy_file_content( \
+        sourceStream, \
+        targetStream, \
+    ):
+    targetStream.flush()
+    sourceFd = sourceStream.fileno()
+    targetFd = targetStream.fileno()
+
+    if hasattr(os, "copy_file_range"):
+        try:
+            while os.copy_file_range(sourceFd, targetFd, copyChunkSize) > 0:
+                pass
+            return
+        except OSError:
+            pass
+
+    if hasattr(os, "sendfile"):
+        try:
+            offset = os.lseek(sourceFd, 0, os.SEEK_CUR)
+            while True:
+                nSent = os.sendfile(targetFd, sourceFd, offset, copyChunkSize)
+                if nSent == 0:
+                    break
+                offset += nSent
+            os.lseek(sourceFd, offset, os.SEEK_SET)
+            return
+        except OSError:
+            pass
+
+    shutil.copyfileobj(sourceStream, targetStream, copyChunkSize)
+    return
+
+
+def concatenate_files( \
+        sourceFileList, \
+        targetFile, \
+    ):
+    with open(targetFile, "wb") as tf:
+        for sourceFile in sourceFileList:
+            with open(sourceFile, "rb") as sf:
+                copy_file_content(sf, tf)
+    return
+
+
+def write_region_sidecar_file( \
+        combinedFile, \
+        regionList, \
+    ):
+    sidecarFile = os.path.splitext(combinedFile)[0] + regionSidecarPostFix
+    with open(sidecarFile, "w") as sf:
+        json.dump({"format" : "binary", "regions" : regionList}, sf, indent = 4)
+    return sidecarFile
+
+
+def merge_binary_stl_files( \
+        sourceFileList, \
+        regionNameList, \
+        targetFile, \
+    ):
+    ### Region "i" is stored as attribute "i" of every triangle of the
+    ### "i"-th source file
+    regionList = []
+    nTriangleTotal = 0
+    targetName = os.path.splitext(os.path.basename(targetFile))[0]
+
+    with open(targetFile, "wb", buffering = bufferSize) as tf:
+        tf.write(get_binary_stl_header(targetName))
+        tf.write(struct.pack("<I", 0))
+        for regionIndex, (sourceFile, regionName) in enumerate(zip(sourceFileList, regionNameList)):
+            with open(sourceFile, "rb", buffering = bufferSize) as sf:
+                sourceSolidName, nTriangle = read_binary_stl_header(sf)
+                copy_binary_stl_records(sf, [(tf, regionIndex)], nTriangle)
+            regionList.append({"name" : regionName, "attribute" : regionIndex, "n-triangles" : nTriangle})
+            nTriangleTotal += nTriangle
+        tf.seek(binaryStlHeaderSize)
+        tf.write(struct.pack("<I", nTriangleTotal))
+
+    write_region_sidecar_file(targetFile, regionList)
+    return regionList
+
+
+def format_and_merge_stl_files( \
+        taskList, \
+        combinedFile, \
+        nProcess = 0, \
+    ):
+    ### Serial formatting writes the combined file while formatting, so the
+    ### formatted files are not read back. In parallel the formatted files
+    ### are concatenated afterwards.
+    binaryStl = bool(taskList) and taskList[0].get("stl-format", "ascii") == "binary"
+
+    if nProcess == 1:
+        solidNameListAll = []
+        regionList = []
+        with open(combinedFile, "wb" if binaryStl else "w", buffering = bufferSize) as cf:
+            if binaryStl:
+                cf.write(get_binary_stl_header(os.path.splitext(os.path.basename(combinedFile))[0]))
+                cf.write(struct.pack("<I", 0))
+            for regionIndex, taskDict in enumerate(taskList):
+                if binaryStl:
+                    solidNameList, nTriangle = format_binary_stl_file( \
+                            taskDict["source"], \
+                            taskDict["target"], \
+                            taskDict["solid-name"], \
+                            regionIndex, \
+                            combinedStream = cf, \
+                        )
+                    regionList.append({"name" : taskDict["solid-name"], "attribute" : regionIndex, "n-triangles" : nTriangle})
+                else:
+                    solidNameList = format_stl_file( \
+                            taskDict["source"], \
+                            taskDict["target"], \
+                            taskDict["solid-name"], \
+                            taskDict["merge-all-solid-together"], \
+                            combinedStream = cf, \
+                        )
+                solidNameListAll.append(solidNameList)
+            if binaryStl:
+                cf.seek(binaryStlHeaderSize)
+                cf.write(struct.pack("<I", sum([x["n-triangles"] for x in regionList])))
+        if binaryStl:
+            write_region_sidecar_file(combinedFile, regionList)
+        return solidNameListAll
+
+    solidNameListAll = format_stl_files(taskList, nProcess)
+    merge_formatted_stl_files(taskList, combinedFile)
+    return solidNameListAll
+
+
+def merge_formatted_stl_files( \
+        taskList, \
+        combinedFile, \
+    ):
+    if bool(taskList) and taskList[0].get("stl-format", "ascii") == "binary":
+        merge_binary_stl_files( \
+                [taskDict["target"] for taskDict in taskList], \
+                [taskDict["solid-name"] for taskDict in taskList], \
+                combinedFile, \
+            )
+    else:
+        concatenate_files([taskDict["target"] for taskDict in taskList], combinedFile)
+    return
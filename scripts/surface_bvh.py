@@ -0,0 +1,312 @@
+"""
+    Bounding volume hierarchy over the triangles of a surface.
+
+    - The triangles are sorted along a Morton (Z-order) curve of their
+      centroids and grouped into leaves of a few triangles. The tree is a
+      complete binary tree over the leaves, stored level by level as
+      arrays of box bounds, so it is built without a python loop over the
+      nodes.
+    - Queries walk the tree one level at a time for a whole batch of
+      points: (point, node) pairs whose box can not contribute are dropped
+      and the others are expanded to the two child nodes.
+    - Inside/outside tests count the ray crossings (parity) along three
+      directions and take the majority, a ray grazing an edge or a vertex
+      does not flip the result.
+    - Nearest distance queries prune the pairs with a per point upper
+      bound taken from the farthest corner of the visited boxes.
+    - The clearance of candidate points (automatic locationInMesh) is
+      taken from the first hit along the ray directions, rays only reach
+      the leaves along their path.
+"""
+
+import numpy as np
+
+
+#---------------------------------------
+
+### Points queried at once, bounds the size of the (point, node) pairs.
+### A nearest distance query from deep inside a closed surface reaches
+### most of the leaves, those are done in much smaller batches.
+rayChunkSize = 4096
+nearestChunkSize = 256
+
+### Fixed ray directions, not aligned with the coordinate axes or the
+### usual CAD planes
+rayDirectionArray = np.array([
+        [0.5773, 0.5774, 0.5773],
+        [-0.2672, 0.8018, 0.5345],
+        [0.7071, -0.3162, 0.6325],
+    ])
+rayDirectionArray = rayDirectionArray / np.linalg.norm(rayDirectionArray, axis = 1, keepdims = True)
+
+parallelTolerance = 1e-14
+
+
+#---------------------------------------
+
+def get_morton_codes(
+        coordinateArray,
+    ):
+    ### 21 bits per axis, interleaved into a 63 bit code
+    lowerBound = coordinateArray.min(axis = 0)
+    extent = np.maximum(coordinateArray.max(axis = 0) - lowerBound, 1e-300)
+    gridIndex = ((coordinateArray - lowerBound) / extent * (2**21 - 1)).astype(np.uint64)
+
+    codeArray = np.zeros(coordinateArray.shape[0], dtype = np.uint64)
+    for axis in range(3):
+        x = gridIndex[:, axis]
+        x = (x | (x << np.uint64(32))) & np.uint64(0x1f00000000ffff)
+        x = (x | (x << np.uint64(16))) & np.uint64(0x1f0000ff0000ff)
+        x = (x | (x << np.uint64(8))) & np.uint64(0x100f00f00f00f00f)
+        x = (x | (x << np.uint64(4))) & np.uint64(0x10c30c30c30c30c3)
+        x = (x | (x << np.uint64(2))) & np.uint64(0x1249249249249249)
+        codeArray |= x << np.uint64(axis)
+    return codeArray
+
+
+def get_point_segment_distance(
+        points,
+        segmentStart,
+        segmentEnd,
+    ):
+    segment = segmentEnd - segmentStart
+    segmentLengthSqr = np.einsum("ij,ij->i", segment, segment)
+    t = np.einsum("ij,ij->i", points - segmentStart, segment) / np.where(segmentLengthSqr > 0.0, segmentLengthSqr, 1.0)
+    closestPoints = segmentStart + np.clip(t, 0.0, 1.0)[:, None] * segment
+    return np.linalg.norm(points - closestPoints, axis = 1)
+
+
+def get_point_triangle_distance(
+        points,
+        triangles,
+    ):
+    ### Distance to the plane if the projection falls inside the triangle,
+    ### otherwise distance to the closest edge
+    v0 = triangles[:, 0]
+    v1 = triangles[:, 1]
+    v2 = triangles[:, 2]
+    normals = np.cross(v1 - v0, v2 - v0)
+    normalLengthSqr = np.einsum("ij,ij->i", normals, normals)
+
+    insideProjection = normalLengthSqr > 0.0
+    for a, b in [(v0, v1), (v1, v2), (v2, v0)]:
+        insideProjection &= np.einsum("ij,ij->i", np.cross(b - a, points - a), normals) >= 0.0
+
+    planeDistance = np.abs(np.einsum("ij,ij->i", points - v0, normals)) / np.sqrt(np.where(insideProjection, normalLengthSqr, 1.0))
+    edgeDistance = np.minimum(
+            np.minimum(
+                get_point_segment_distance(points, v0, v1),
+                get_point_segment_distance(points, v1, v2),
+            ),
+            get_point_segment_distance(points, v2, v0),
+        )
+    return np.where(insideProjection, planeDistance, edgeDistance)
+
+
+#---------------------------------------
+
+class SurfaceBvh(object):
+
+    def __init__(
+            self,
+            surface,
+            leafSize = 8,
+        ):
+        triangles = np.asarray(surface.triangles(), dtype = np.float64)
+        nFace = triangles.shape[0]
+        if nFace > 0:
+            self.faceOrder = np.argsort(get_morton_codes(triangles.mean(axis = 1)), kind = "stable")
+        else:
+            self.faceOrder = np.zeros(0, dtype = np.int64)
+        self.triangles = triangles[self.faceOrder]
+        self.leafSize = leafSize
+        self.nFace = nFace
+
+        nLeaf = max(1, -(-nFace // leafSize))
+        nLevel = int(np.ceil(np.log2(nLeaf))) + 1
+        nLeafPadded = 2**(nLevel - 1)
+
+        ### Padded leaves get an empty box (min > max)
+        leafMin = np.full((nLeafPadded, 3), np.inf)
+        leafMax = np.full((nLeafPadded, 3), -np.inf)
+        if nFace > 0:
+            leafStart = np.arange(0, nFace, leafSize)
+            leafMin[ : leafStart.shape[0]] = np.minimum.reduceat(self.triangles.min(axis = 1), leafStart, axis = 0)
+            leafMax[ : leafStart.shape[0]] = np.maximum.reduceat(self.triangles.max(axis = 1), leafStart, axis = 0)
+
+        ### Level 0 is the root, the last level holds the leaves
+        self.levelMin = [leafMin]
+        self.levelMax = [leafMax]
+        while self.levelMin[0].shape[0] > 1:
+            self.levelMin.insert(0, np.minimum(self.levelMin[0][0 : : 2], self.levelMin[0][1 : : 2]))
+            self.levelMax.insert(0, np.maximum(self.levelMax[0][0 : : 2], self.levelMax[0][1 : : 2]))
+        return
+
+    #---------------------------------------
+
+    def get_candidate_pairs(
+            self,
+            queryIndex,
+            keep_pair,
+        ):
+        ### keep_pair(queryIndex, boxMin, boxMax) --> mask of the (query,
+        ### node) pairs to descend into. Returns the (query, triangle)
+        ### pairs of the reached leaves, triangles in the BVH order.
+        nodeIndex = np.zeros(queryIndex.shape[0], dtype = np.int64)
+        nLevel = len(self.levelMin)
+        for level in range(nLevel):
+            keepMask = keep_pair(queryIndex, self.levelMin[level][nodeIndex], self.levelMax[level][nodeIndex])
+            queryIndex = queryIndex[keepMask]
+            nodeIndex = nodeIndex[keepMask]
+            if level < nLevel - 1:
+                queryIndex = np.repeat(queryIndex, 2)
+                nodeIndex = (np.repeat(nodeIndex * 2, 2).reshape(-1, 2) + [0, 1]).reshape(-1)
+
+        leafStart = nodeIndex * self.leafSize
+        leafCount = np.clip(self.nFace - leafStart, 0, self.leafSize)
+        pairQueryIndex = np.repeat(queryIndex, leafCount)
+        pairTriangleIndex = np.repeat(leafStart - (np.cumsum(leafCount) - leafCount), leafCount) + np.arange(leafCount.sum())
+        return pairQueryIndex, pairTriangleIndex
+
+
+    def intersect_rays(
+            self,
+            origins,
+            direction,
+        ):
+        ### Yields the crossings of the rays origin + t*direction, t > 0, as
+        ### (ray index, t) arrays, one batch of rays at a time
+        origins = np.asarray(origins, dtype = np.float64).reshape(-1, 3)
+        inverseDirection = 1.0 / direction
+
+        def keep_pair(queryIndex, boxMin, boxMax):
+            t1 = (boxMin - origins[queryIndex]) * inverseDirection
+            t2 = (boxMax - origins[queryIndex]) * inverseDirection
+            tNear = np.minimum(t1, t2).max(axis = 1)
+            tFar = np.maximum(t1, t2).min(axis = 1)
+            return (tFar >= np.maximum(tNear, 0.0)) & np.all(boxMin <= boxMax, axis = 1)
+
+        for chunkStart in range(0, origins.shape[0], rayChunkSize):
+            queryIndex = np.arange(chunkStart, min(chunkStart + rayChunkSize, origins.shape[0]))
+            pairQueryIndex, pairTriangleIndex = self.get_candidate_pairs(queryIndex, keep_pair)
+
+            ### Moller-Trumbore ray/triangle intersection
+            triangles = self.triangles[pairTriangleIndex]
+            edge1 = triangles[:, 1] - triangles[:, 0]
+            edge2 = triangles[:, 2] - triangles[:, 0]
+            pVector = np.cross(direction, edge2)
+            determinant = np.einsum("ij,ij->i", edge1, pVector)
+            notParallel = np.abs(determinant) > parallelTolerance * np.einsum("ij,ij->i", edge1, edge1)
+            inverseDeterminant = 1.0 / np.where(notParallel, determinant, 1.0)
+            tVector = origins[pairQueryIndex] - triangles[:, 0]
+            u = np.einsum("ij,ij->i", tVector, pVector) * inverseDeterminant
+            qVector = np.cross(tVector, edge1)
+            v = (qVector @ direction) * inverseDeterminant
+            t = np.einsum("ij,ij->i", edge2, qVector) * inverseDeterminant
+            crossing = notParallel & (u >= 0.0) & (v >= 0.0) & (u + v <= 1.0) & (t > 0.0)
+            yield pairQueryIndex[crossing], t[crossing]
+        return
+
+
+    def ray_crossing_count(
+            self,
+            origins,
+            direction,
+        ):
+        origins = np.asarray(origins, dtype = np.float64).reshape(-1, 3)
+        crossingCount = np.zeros(origins.shape[0], dtype = np.int64)
+        for rayIndex, t in self.intersect_rays(origins, direction):
+            crossingCount += np.bincount(rayIndex, minlength = origins.shape[0])
+        return crossingCount
+
+
+    def ray_clearance(
+            self,
+            origins,
+        ):
+        ### Shortest first hit distance along the ray directions, both ways,
+        ### an upper bound of the distance to the surface
+        origins = np.asarray(origins, dtype = np.float64).reshape(-1, 3)
+        clearance = np.full(origins.shape[0], np.inf)
+        for direction in np.concatenate([rayDirectionArray, -rayDirectionArray]):
+            for rayIndex, t in self.intersect_rays(origins, direction):
+                np.minimum.at(clearance, rayIndex, t)
+        return clearance
+
+
+    def contains_points(
+            self,
+            points,
+        ):
+        ### Inside a closed surface --> odd number of crossings, majority of
+        ### the three ray directions
+        points = np.asarray(points, dtype = np.float64).reshape(-1, 3)
+        insideVote = np.zeros(points.shape[0], dtype = np.int64)
+        for direction in rayDirectionArray:
+            insideVote += self.ray_crossing_count(points, direction) % 2
+        return insideVote >= 2
+
+
+    def nearest_distance(
+            self,
+            points,
+        ):
+        ### Distance to the closest triangle and its index (surface face
+        ### order) for every point
+        points = np.asarray(points, dtype = np.float64).reshape(-1, 3)
+        distanceArray = np.full(points.shape[0], np.inf)
+        faceIndexArray = np.full(points.shape[0], -1, dtype = np.int64)
+        upperBound = np.full(points.shape[0], np.inf)
+
+        def keep_pair(queryIndex, boxMin, boxMax):
+            queryPoints = points[queryIndex]
+            nearCorner = np.maximum(np.maximum(boxMin - queryPoints, queryPoints - boxMax), 0.0)
+            farCorner = np.maximum(np.abs(queryPoints - boxMin), np.abs(queryPoints - boxMax))
+            minDistance = np.linalg.norm(nearCorner, axis = 1)
+            ### Every non-empty box holds a triangle closer than its farthest corner
+            np.minimum.at(upperBound, queryIndex, np.linalg.norm(farCorner, axis = 1))
+            return minDistance <= upperBound[queryIndex]
+
+        for chunkStart in range(0, points.shape[0], nearestChunkSize):
+            queryIndex = np.arange(chunkStart, min(chunkStart + nearestChunkSize, points.shape[0]))
+            pairQueryIndex, pairTriangleIndex = self.get_candidate_pairs(queryIndex, keep_pair)
+            if pairQueryIndex.shape[0] == 0:
+                continue
+            pairDistance = get_point_triangle_distance(points[pairQueryIndex], self.triangles[pairTriangleIndex])
+
+            pairOrder = np.lexsort((pairDistance, pairQueryIndex))
+            nearestQueryIndex, firstPair = np.unique(pairQueryIndex[pairOrder], return_index = True)
+            nearestPair = pairOrder[firstPair]
+            distanceArray[nearestQueryIndex] = pairDistance[nearestPair]
+            faceIndexArray[nearestQueryIndex] = self.faceOrder[pairTriangleIndex[nearestPair]]
+        return distanceArray, faceIndexArray
+
+
+#---------------------------------------
+
+def find_inside_point(
+        insideBvhList,
+        bound,
+        nSample = 16,
+    ):
+    ### Samples the bound on a regular grid (cell centres) and returns the
+    ### sample inside all the surfaces that is farthest from all of them,
+    ### with its exact distance to the surfaces. None if no sample is inside.
+    sampleAxisList = []
+    for axis in ["x", "y", "z"]:
+        axisMin = bound[axis + "-min"]
+        axisMax = bound[axis + "-max"]
+        sampleAxisList.append(axisMin + (np.arange(nSample) + 0.5) / nSample * (axisMax - axisMin))
+    samplePoints = np.stack(np.meshgrid(*sampleAxisList, indexing = "ij"), axis = -1).reshape(-1, 3)
+
+    for bvh in insideBvhList:
+        samplePoints = samplePoints[bvh.contains_points(samplePoints)]
+    if samplePoints.shape[0] == 0:
+        return None, 0.0
+
+    clearance = np.full(samplePoints.shape[0], np.inf)
+    for bvh in insideBvhList:
+        clearance = np.minimum(clearance, bvh.ray_clearance(samplePoints))
+    bestPoint = samplePoints[int(np.argmax(clearance))]
+    distance = min([float(bvh.nearest_distance(bestPoint)[0][0]) for bvh in insideBvhList])
+    return bestPoint, distance
@@ -0,0 +1,298 @@
+"""
+    Surface validation and repair for the snappyHexMesh automation process.
+
+    Checks the STL surfaces before meshing, a surface with holes or
+    flipped normals makes snappyHexMesh leak and "topoSet" (with
+    "useSurfaceOrientation") misplace the zones -
+
+    - Open edges (one face) and non-manifold edges (more than two faces).
+    - Duplicate triangles (same three points) and degenerate triangles
+      (repeated point or zero area).
+    - Inconsistent winding, two faces traversing their shared edge in the
+      same direction.
+    - Closed shells with inward pointing normals.
+
+    The repair removes the duplicate/degenerate triangles, propagates a
+    consistent orientation over every shell and turns the closed shells
+    outward. Holes and non-manifold edges are reported, not repaired.
+"""
+
+import numpy as np
+
+import tri_surface
+
+
+#---------------------------------------
+
+### Triangles with an area below this fraction of the squared longest
+### edge are degenerate
+degenerateTolerance = 1e-12
+
+
+#---------------------------------------
+### CHECKS
+#---------------------------------------
+
+def get_degenerate_face_mask(
+        surface,
+    ):
+    faces = surface.faces
+    repeatedPoint = (faces[:, 0] == faces[:, 1]) | (faces[:, 1] == faces[:, 2]) | (faces[:, 2] == faces[:, 0])
+
+    triangles = surface.triangles()
+    edgeVectors = triangles[:, [1, 2, 0]] - triangles
+    longestEdgeSqr = np.einsum("ijk,ijk->ij", edgeVectors, edgeVectors).max(axis = 1)
+    doubleArea = np.linalg.norm(surface.face_normals(normalise = False), axis = 1)
+    zeroArea = doubleArea <= 2.0 * degenerateTolerance * longestEdgeSqr
+    return repeatedPoint | zeroArea
+
+
+def get_duplicate_face_mask(
+        surface,
+    ):
+    ### Every occurrence of a triangle but the first one, whatever the
+    ### point order or the region
+    if surface.n_faces() == 0:
+        return np.zeros(0, dtype = bool)
+    sortedFaces = np.sort(surface.faces, axis = 1).astype(np.int64)
+    nPoint = np.int64(max(surface.n_points(), 1))
+    faceKey = (sortedFaces[:, 0] * nPoint + sortedFaces[:, 1]) * nPoint + sortedFaces[:, 2]
+    uniqueKey, firstIndex = np.unique(faceKey, return_index = True)
+    duplicateMask = np.ones(surface.n_faces(), dtype = bool)
+    duplicateMask[firstIndex] = False
+    return duplicateMask
+
+
+def get_manifold_face_pairs(
+        surface,
+        adjacencyDict,
+    ):
+    ### The two faces of every manifold edge and whether they traverse the
+    ### edge in the same direction (inconsistent winding)
+    faces = surface.faces
+    slotForward = (faces < faces[:, [1, 2, 0]]).reshape(-1)
+
+    manifoldEdgeIndex = np.nonzero(adjacencyDict["edge-face-count"] == 2)[0]
+    firstSlot = adjacencyDict["edge-face-slots"][adjacencyDict["edge-face-offsets"][manifoldEdgeIndex]]
+    secondSlot = adjacencyDict["edge-face-slots"][adjacencyDict["edge-face-offsets"][manifoldEdgeIndex] + 1]
+    return firstSlot // 3, secondSlot // 3, slotForward[firstSlot] == slotForward[secondSlot]
+
+
+def propagate_orientation(
+        nFace,
+        face0,
+        face1,
+        sameDirection,
+    ):
+    ### Breadth first walk over the manifold edges, a whole front of faces
+    ### is advanced at once. Returns the faces to flip for a consistent
+    ### winding (relative to the first face of every shell), the shell
+    ### index of every face and the number of edges left inconsistent
+    ### (non-orientable shells).
+    sourceFaces = np.concatenate([face0, face1])
+    targetFaces = np.concatenate([face1, face0])
+    relation = np.concatenate([sameDirection, sameDirection])
+    linkOrder = np.argsort(sourceFaces, kind = "stable")
+    targetFaces = targetFaces[linkOrder]
+    relation = relation[linkOrder]
+    linkOffsets = np.zeros(nFace + 1, dtype = np.int64)
+    np.cumsum(np.bincount(sourceFaces, minlength = nFace), out = linkOffsets[1 : ])
+
+    flipMask = np.zeros(nFace, dtype = bool)
+    shellIndex = np.full(nFace, -1, dtype = np.int64)
+
+    ### Faces without manifold neighbours are shells on their own
+    isolatedFaces = np.nonzero(np.diff(linkOffsets) == 0)[0]
+    shellIndex[isolatedFaces] = np.arange(isolatedFaces.shape[0])
+    nShell = isolatedFaces.shape[0]
+
+    seedCursor = 0
+    while True:
+        unvisited = np.nonzero(shellIndex[seedCursor : ] < 0)[0]
+        if unvisited.shape[0] == 0:
+            break
+        seedFace = seedCursor + unvisited[0]
+        seedCursor = seedFace + 1
+        shellIndex[seedFace] = nShell
+        front = np.array([seedFace], dtype = np.int64)
+
+        while front.shape[0] > 0:
+            linkCount = linkOffsets[front + 1] - linkOffsets[front]
+            linkStart = np.repeat(linkOffsets[front] - (np.cumsum(linkCount) - linkCount), linkCount)
+            linkIndex = linkStart + np.arange(linkCount.sum())
+            frontSource = np.repeat(front, linkCount)
+            frontTarget = targetFaces[linkIndex]
+
+            newTarget = shellIndex[frontTarget] < 0
+            frontTarget, firstLink = np.unique(frontTarget[newTarget], return_index = True)
+            linkIndex = linkIndex[newTarget][firstLink]
+            frontSource = frontSource[newTarget][firstLink]
+
+            ### Same direction over the shared edge --> opposite flip state
+            flipMask[frontTarget] = flipMask[frontSource] ^ relation[linkIndex]
+            shellIndex[frontTarget] = nShell
+            front = frontTarget
+        nShell += 1
+
+    nConflict = int((flipMask[face0] ^ flipMask[face1] ^ sameDirection).sum())
+    return flipMask, shellIndex, nShell, nConflict
+
+
+def get_shell_volumes(
+        surface,
+        shellIndex,
+        nShell,
+    ):
+    p0 = surface.points[surface.faces[:, 0]]
+    p1 = surface.points[surface.faces[:, 1]]
+    p2 = surface.points[surface.faces[:, 2]]
+    faceVolume = np.einsum("ij,ij->i", p0, np.cross(p1, p2)) / 6.0
+    return np.bincount(shellIndex, weights = faceVolume, minlength = nShell)
+
+
+def get_closed_shell_mask(
+        adjacencyDict,
+        shellIndex,
+        nShell,
+    ):
+    ### Shells without open or non-manifold edges
+    edgeFaceCount = adjacencyDict["edge-face-count"]
+    boundaryFaces = np.repeat(edgeFaceCount != 2, edgeFaceCount)
+    closedShellMask = np.ones(nShell, dtype = bool)
+    closedShellMask[shellIndex[adjacencyDict["edge-faces"][boundaryFaces]]] = False
+    return closedShellMask
+
+
+def check_surface(
+        surface,
+    ):
+    adjacencyDict = surface.edge_face_adjacency()
+    edgeFaceCount = adjacencyDict["edge-face-count"]
+    face0, face1, sameDirection = get_manifold_face_pairs(surface, adjacencyDict)
+    flipMask, shellIndex, nShell, nConflict = propagate_orientation(
+            surface.n_faces(),
+            face0,
+            face1,
+            sameDirection,
+        )
+    closedShellMask = get_closed_shell_mask(adjacencyDict, shellIndex, nShell)
+    shellVolumes = get_shell_volumes(surface, shellIndex, nShell)
+
+    ### Inward shells are only counted when the winding is consistent
+    inconsistentShellMask = np.zeros(nShell, dtype = bool)
+    inconsistentShellMask[shellIndex[face0[sameDirection]]] = True
+
+    checkDict = {
+            "n-faces" : surface.n_faces(),
+            "n-points" : int(np.unique(surface.faces).shape[0]),
+            "n-edges" : int(edgeFaceCount.shape[0]),
+            "n-open-edges" : int((edgeFaceCount == 1).sum()),
+            "n-non-manifold-edges" : int((edgeFaceCount > 2).sum()),
+            "n-duplicate-faces" : int(get_duplicate_face_mask(surface).sum()),
+            "n-degenerate-faces" : int(get_degenerate_face_mask(surface).sum()),
+            "n-inconsistent-edges" : int(sameDirection.sum()),
+            "n-non-orientable-edges" : nConflict,
+            "n-shells" : int(nShell),
+            "n-closed-shells" : int(closedShellMask.sum()),
+            "n-inward-shells" : int((closedShellMask & ~inconsistentShellMask & (shellVolumes < 0.0)).sum()),
+            "volume" : float(shellVolumes.sum()),
+        }
+    checkDict["valid"] = is_surface_valid(checkDict)
+    return checkDict
+
+
+def is_surface_valid(
+        checkDict,
+    ):
+    problemKeyList = [
+            "n-open-edges",
+            "n-non-manifold-edges",
+            "n-duplicate-faces",
+            "n-degenerate-faces",
+            "n-inconsistent-edges",
+            "n-inward-shells",
+        ]
+    return all([checkDict[key] == 0 for key in problemKeyList])
+
+
+#---------------------------------------
+### REPAIR
+#---------------------------------------
+
+def repair_surface(
+        surface,
+    ):
+    ### Returns the repaired surface, same points and regions, and what
+    ### was changed
+    removeMask = get_degenerate_face_mask(surface)
+    nDegenerate = int(removeMask.sum())
+    removeMask |= get_duplicate_face_mask(surface)
+
+    keepMask = ~removeMask
+    regionIndexArray = surface.region_index_array()[keepMask]
+    faces = np.array(surface.faces[keepMask])
+    repairedSurface = tri_surface.TriSurface(
+            surface.points,
+            faces,
+            surface.regionNames,
+            np.searchsorted(regionIndexArray, np.arange(surface.n_regions() + 1)),
+        )
+
+    adjacencyDict = repairedSurface.edge_face_adjacency()
+    face0, face1, sameDirection = get_manifold_face_pairs(repairedSurface, adjacencyDict)
+    flipMask, shellIndex, nShell, nConflict = propagate_orientation(
+            repairedSurface.n_faces(),
+            face0,
+            face1,
+            sameDirection,
+        )
+
+    ### Closed shells are turned outward (positive enclosed volume)
+    orientedFaces = faces.copy()
+    orientedFaces[flipMask] = orientedFaces[flipMask][:, [0, 2, 1]]
+    orientedSurface = tri_surface.TriSurface(surface.points, orientedFaces, surface.regionNames, repairedSurface.regionOffsets)
+    closedShellMask = get_closed_shell_mask(adjacencyDict, shellIndex, nShell)
+    inwardShellMask = closedShellMask & (get_shell_volumes(orientedSurface, shellIndex, nShell) < 0.0)
+    flipMask ^= inwardShellMask[shellIndex]
+
+    faces[flipMask] = faces[flipMask][:, [0, 2, 1]]
+    repairedSurface.faces = faces
+
+    repairDict = {
+            "n-removed-degenerate-faces" : nDegenerate,
+            "n-removed-duplicate-faces" : int(removeMask.sum()) - nDegenerate,
+            "n-flipped-faces" : int(flipMask.sum()),
+            "n-outward-turned-shells" : int(inwardShellMask.sum()),
+        }
+    return repairedSurface, repairDict
+
+
+#---------------------------------------
+### REPORT
+#---------------------------------------
+
+def get_surface_check_report(
+        stlFilename,
+        checkDict,
+        repairDict = None,
+    ):
+    str2print = "-"*40 + "\n"
+    str2print += "Surface check : " + stlFilename + "\n"
+    str2print += f"{'Triangles' : <26}: {checkDict['n-faces']}\n"
+    str2print += f"{'Points' : <26}: {checkDict['n-points']}\n"
+    str2print += f"{'Shells (closed)' : <26}: {checkDict['n-shells']} ({checkDict['n-closed-shells']})\n"
+    str2print += f"{'Open edges' : <26}: {checkDict['n-open-edges']}\n"
+    str2print += f"{'Non-manifold edges' : <26}: {checkDict['n-non-manifold-edges']}\n"
+    str2print += f"{'Duplicate triangles' : <26}: {checkDict['n-duplicate-faces']}\n"
+    str2print += f"{'Degenerate triangles' : <26}: {checkDict['n-degenerate-faces']}\n"
+    str2print += f"{'Inconsistent winding' : <26}: {checkDict['n-inconsistent-edges']} edges\n"
+    str2print += f"{'Inward shells' : <26}: {checkDict['n-inward-shells']}\n"
+    if checkDict["n-non-orientable-edges"] > 0:
+        str2print += f"{'Non-orientable edges' : <26}: {checkDict['n-non-orientable-edges']}\n"
+    if repairDict is not None:
+        str2print += "Repair :\n"
+        str2print += f"{'  - removed degenerate' : <26}: {repairDict['n-removed-degenerate-faces']}\n"
+        str2print += f"{'  - removed duplicate' : <26}: {repairDict['n-removed-duplicate-faces']}\n"
+        str2print += f"{'  - flipped triangles' : <26}: {repairDict['n-flipped-faces']}\n"
+    str2print += f"{'Status' : <26}: {'OK' if checkDict['valid'] else 'FAILED'}\n"
+    return str2print
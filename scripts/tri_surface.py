@@ -0,0 +1,404 @@
+"""
+    Indexed triangle surface for the snappyHexMesh automation process.
+
+    - Points are stored once in a float array, faces as an int32 index
+      array into the points.
+    - Faces are grouped by region (one region per BC/solid), a region is
+      a slice of the face array and is accessed without copies.
+    - Duplicated STL vertices are welded with a sort-based dedup, exact
+      or within a merge tolerance.
+"""
+
+import io
+import gzip
+import json
+import struct
+
+import numpy as np
+
+import stl_io
+
+### Triangles formatted at once in ASCII files
+asciiStlWriteLength = 64 * 1024
+
+### The vertices are written with 17 significant digits so they read back
+### exactly, the normals (float32, not read back) with 9
+asciiFacetFormat = (
+        "  facet normal %.9g %.9g %.9g\n"
+        "    outer loop\n"
+        "      vertex %.17g %.17g %.17g\n"
+        "      vertex %.17g %.17g %.17g\n"
+        "      vertex %.17g %.17g %.17g\n"
+        "    endloop\n"
+        "  endfacet\n"
+    )
+
+
+#---------------------------------------
+
+def weld_vertices(
+        vertexArray,
+        mergeTolerance = 0.0,
+    ):
+    ### Returns the unique points, in first occurrence order, and the
+    ### point index of every input vertex
+    vertexArray = np.asarray(vertexArray)
+    if vertexArray.shape[0] == 0:
+        return vertexArray.reshape(0, 3), np.empty(0, dtype = np.int32)
+
+    if mergeTolerance > 0.0:
+        keyArray = np.floor(vertexArray / mergeTolerance + 0.5).astype(np.int64)
+    else:
+        ### "+ 0.0" turns -0.0 into 0.0, both would be different keys
+        keyArray = np.ascontiguousarray(vertexArray + 0.0)
+    keyView = keyArray.view(np.dtype((np.void, keyArray.dtype.itemsize * 3))).ravel()
+
+    uniqueKey, firstIndex, inverse = np.unique(
+            keyView,
+            return_index = True,
+            return_inverse = True,
+        )
+    firstOccurrenceOrder = np.argsort(firstIndex, kind = "stable")
+    pointIndexMap = np.empty(firstOccurrenceOrder.shape[0], dtype = np.int32)
+    pointIndexMap[firstOccurrenceOrder] = np.arange(firstOccurrenceOrder.shape[0], dtype = np.int32)
+
+    points = vertexArray[firstIndex[firstOccurrenceOrder]]
+    return points, pointIndexMap[inverse.reshape(-1)]
+
+
+def open_output_file(
+        stlFile,
+        binary = True,
+    ):
+    ### ".gz" files are written compressed, without the time stamp in the
+    ### header so the same surface always gives the same file
+    if stlFile.endswith(".gz"):
+        outputStream = gzip.GzipFile(stlFile, "wb", mtime = 0)
+        if binary:
+            return outputStream
+        return io.TextIOWrapper(outputStream)
+    return open(stlFile, "wb" if binary else "w")
+
+
+#---------------------------------------
+
+class TriSurface(object):
+
+    def __init__(
+            self,
+            points,
+            faces,
+            regionNames = None,
+            regionOffsets = None,
+        ):
+        self.points = points
+        self.faces = np.asarray(faces, dtype = np.int32)
+        if regionNames is None:
+            regionNames = ["patch0"]
+        if regionOffsets is None:
+            regionOffsets = [0, self.faces.shape[0]]
+        self.regionNames = list(regionNames)
+        self.regionOffsets = np.asarray(regionOffsets, dtype = np.int64)
+        return
+
+    #---------------------------------------
+
+    @classmethod
+    def from_triangles(
+            cls,
+            triangleArray,
+            regionIndexArray = None,
+            regionNames = None,
+            mergeTolerance = 0.0,
+            dtype = np.float64,
+        ):
+        triangleArray = np.asarray(triangleArray, dtype = dtype)
+        nFace = triangleArray.shape[0]
+        if regionIndexArray is None:
+            regionIndexArray = np.zeros(nFace, dtype = np.int32)
+        if regionNames is None:
+            regionNames = ["patch" + str(i) for i in range(int(regionIndexArray.max(initial = 0)) + 1)]
+
+        points, pointIndex = weld_vertices(triangleArray.reshape(-1, 3), mergeTolerance)
+        faces = pointIndex.reshape(nFace, 3)
+        return cls.from_indexed_faces(points, faces, regionIndexArray, regionNames)
+
+
+    @classmethod
+    def from_indexed_faces(
+            cls,
+            points,
+            faces,
+            regionIndexArray,
+            regionNames,
+        ):
+        ### Groups the faces by region so every region is a slice
+        regionIndexArray = np.asarray(regionIndexArray)
+        if regionIndexArray.shape[0] > 1 and np.any(regionIndexArray[1 : ] < regionIndexArray[ : -1]):
+            faceOrder = np.argsort(regionIndexArray, kind = "stable")
+            faces = faces[faceOrder]
+            regionIndexArray = regionIndexArray[faceOrder]
+        regionOffsets = np.searchsorted(regionIndexArray, np.arange(len(regionNames) + 1))
+        return cls(points, faces, regionNames, regionOffsets)
+
+
+    @classmethod
+    def read(
+            cls,
+            stlFile,
+            mergeTolerance = 0.0,
+            dtype = np.float64,
+        ):
+        ### Welds every block of the STL file on its own, then welds the
+        ### (much smaller) block points together, the full triangle soup
+        ### is never held in memory
+        regionNames = []
+        pointBlockList = []
+        faceBlockList = []
+        regionIndexBlockList = []
+        nPoint = 0
+
+        for solidName, triangleArray in stl_io.iter_stl_triangle_blocks(stlFile):
+            if solidName not in regionNames:
+                regionNames.append(solidName)
+            nFace = triangleArray.shape[0]
+            points, pointIndex = weld_vertices(
+                    np.asarray(triangleArray, dtype = dtype).reshape(-1, 3),
+                    mergeTolerance,
+                )
+            pointBlockList.append(points)
+            faceBlockList.append(pointIndex.reshape(nFace, 3) + nPoint)
+            regionIndexBlockList.append(np.full(nFace, regionNames.index(solidName), dtype = np.int32))
+            nPoint += points.shape[0]
+
+        if not faceBlockList:
+            return cls(np.empty((0, 3), dtype = dtype), np.empty((0, 3), dtype = np.int32), ["patch0"])
+
+        points, pointIndex = weld_vertices(np.concatenate(pointBlockList), mergeTolerance)
+        faces = pointIndex[np.concatenate(faceBlockList)]
+        return cls.from_indexed_faces(
+                points,
+                faces,
+                np.concatenate(regionIndexBlockList),
+                regionNames,
+            )
+
+
+    @classmethod
+    def concatenate(
+            cls,
+            surfaceList,
+            regionNames = None,
+            mergeTolerance = 0.0,
+        ):
+        ### One region per surface, the region names default to the first
+        ### region name of every surface
+        if regionNames is None:
+            regionNames = [surface.regionNames[0] for surface in surfaceList]
+        pointOffsets = np.cumsum([0] + [surface.n_points() for surface in surfaceList])
+        points = np.concatenate([surface.points for surface in surfaceList])
+        faces = np.concatenate([surface.faces + pointOffsets[i] for i, surface in enumerate(surfaceList)])
+        regionIndexArray = np.concatenate([
+                np.full(surface.n_faces(), i, dtype = np.int32) for i, surface in enumerate(surfaceList)
+            ])
+        points, pointIndex = weld_vertices(points, mergeTolerance)
+        return cls.from_indexed_faces(points, pointIndex[faces], regionIndexArray, regionNames)
+
+    #---------------------------------------
+
+    def n_points(self):
+        return self.points.shape[0]
+
+
+    def n_faces(self):
+        return self.faces.shape[0]
+
+
+    def n_regions(self):
+        return len(self.regionNames)
+
+
+    def nbytes(self):
+        return self.points.nbytes + self.faces.nbytes
+
+
+    def region_index_array(self):
+        return np.repeat(
+                np.arange(self.n_regions(), dtype = np.int32),
+                np.diff(self.regionOffsets),
+            )
+
+
+    def region_faces(
+            self,
+            regionName,
+        ):
+        regionIndex = self.regionNames.index(regionName)
+        return self.faces[self.regionOffsets[regionIndex] : self.regionOffsets[regionIndex + 1]]
+
+
+    def region(
+            self,
+            regionName,
+        ):
+        ### Shares the point array and a view of the face array
+        regionFaces = self.region_faces(regionName)
+        return TriSurface(self.points, regionFaces, [regionName])
+
+
+    def edge_face_adjacency(self):
+        ### Unique edges (sorted point pairs) and the faces of every edge
+        ###     "face-edges"        --> edge index of the 3 face edges, [nFace, 3]
+        ###                             (edge j goes from point j to point j+1)
+        ###     "edge-face-offsets" --> faces of edge i are
+        ###     "edge-faces"            edge-faces[offsets[i] : offsets[i + 1]]
+        ###     "edge-face-slots"   --> same layout, face edge slot (3*face + j)
+        nFace = self.n_faces()
+        nPoint = np.int64(max(self.n_points(), 1))
+        faceEdgePoints = self.faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2).astype(np.int64)
+        faceEdgePoints.sort(axis = 1)
+        faceEdgeKey = faceEdgePoints[:, 0] * nPoint + faceEdgePoints[:, 1]
+
+        edgeKey, faceEdgeIndex, edgeFaceCount = np.unique(
+                faceEdgeKey,
+                return_inverse = True,
+                return_counts = True,
+            )
+        faceEdgeIndex = faceEdgeIndex.reshape(-1)
+        edges = np.stack([edgeKey // nPoint, edgeKey % nPoint], axis = 1).astype(np.int32)
+
+        edgeFaceOffsets = np.zeros(edgeKey.shape[0] + 1, dtype = np.int64)
+        np.cumsum(edgeFaceCount, out = edgeFaceOffsets[1 : ])
+        edgeFaceSlots = np.argsort(faceEdgeIndex, kind = "stable")
+        edgeFaces = (edgeFaceSlots // 3).astype(np.int32)
+
+        return {
+                "edges" : edges,
+                "face-edges" : faceEdgeIndex.reshape(nFace, 3),
+                "edge-face-count" : edgeFaceCount,
+                "edge-face-offsets" : edgeFaceOffsets,
+                "edge-faces" : edgeFaces,
+                "edge-face-slots" : edgeFaceSlots,
+            }
+
+
+    def is_closed(self):
+        ### Every edge shared by exactly two faces
+        return bool(np.all(self.edge_face_adjacency()["edge-face-count"] == 2))
+
+
+    def triangles(self):
+        return self.points[self.faces]
+
+
+    def bounds(self):
+        if self.n_faces() == 0:
+            return None
+        usedPoints = self.points[np.unique(self.faces)]
+        return stl_io.get_bound_dict(usedPoints.min(axis = 0), usedPoints.max(axis = 0))
+
+
+    def face_normals(
+            self,
+            normalise = True,
+        ):
+        p0 = self.points[self.faces[:, 0]]
+        normals = np.cross(self.points[self.faces[:, 1]] - p0, self.points[self.faces[:, 2]] - p0)
+        if normalise:
+            magnitude = np.linalg.norm(normals, axis = 1, keepdims = True)
+            normals = normals / np.where(magnitude > 0.0, magnitude, 1.0)
+        return normals
+
+
+    def face_areas(self):
+        return 0.5 * np.linalg.norm(self.face_normals(normalise = False), axis = 1)
+
+
+    def region_areas(self):
+        faceAreas = self.face_areas()
+        return {
+                regionName : float(faceAreas[self.regionOffsets[i] : self.regionOffsets[i + 1]].sum())
+                for i, regionName in enumerate(self.regionNames)
+            }
+
+
+    def volume(self):
+        ### Signed enclosed volume, positive for outward normals of a
+        ### closed surface
+        p0 = self.points[self.faces[:, 0]]
+        p1 = self.points[self.faces[:, 1]]
+        p2 = self.points[self.faces[:, 2]]
+        return float(np.einsum("ij,ij->i", p0, np.cross(p1, p2)).sum() / 6.0)
+
+    #---------------------------------------
+
+    def save(
+            self,
+            dirPath,
+        ):
+        ### Raw arrays plus region metadata, read back memory mapped
+        np.save(dirPath + "/points.npy", np.ascontiguousarray(self.points))
+        np.save(dirPath + "/faces.npy", np.ascontiguousarray(self.faces))
+        with open(dirPath + "/regions.json", "w") as wf:
+            json.dump({"region-names" : self.regionNames, "region-offsets" : self.regionOffsets.tolist()}, wf)
+        return [dirPath + "/" + x for x in ["points.npy", "faces.npy", "regions.json"]]
+
+
+    @classmethod
+    def load(
+            cls,
+            dirPath,
+            mmapMode = "r",
+        ):
+        with open(dirPath + "/regions.json", "r") as rf:
+            regionDict = json.load(rf)
+        return cls(
+                np.load(dirPath + "/points.npy", mmap_mode = mmapMode),
+                np.load(dirPath + "/faces.npy", mmap_mode = mmapMode),
+                regionDict["region-names"],
+                regionDict["region-offsets"],
+            )
+
+    #---------------------------------------
+
+    def write_stl(
+            self,
+            stlFile,
+            binary = True,
+        ):
+        ### Binary files keep the region index in the triangle attribute
+        normals = self.face_normals().astype(np.float32)
+        triangles = self.triangles()
+
+        if binary:
+            records = np.zeros(self.n_faces(), dtype = stl_io.binaryStlRecordDtype)
+            records["normal"] = normals
+            records["vertices"] = triangles
+            records["attribute"] = self.region_index_array()
+            with open_output_file(stlFile, binary = True) as wf:
+                wf.write(self.regionNames[0].encode("ascii", "replace")[ : stl_io.binaryStlHeaderSize].ljust(stl_io.binaryStlHeaderSize, b" "))
+                wf.write(struct.pack("<I", self.n_faces()))
+                wf.write(records.tobytes())
+            if self.n_regions() > 1:
+                regionList = [
+                        {"name" : regionName, "attribute" : i, "n-triangles" : int(self.regionOffsets[i + 1] - self.regionOffsets[i])}
+                        for i, regionName in enumerate(self.regionNames)
+                    ]
+                with open(stl_io.get_region_sidecar_file(stlFile), "w") as sf:
+                    json.dump({"format" : "binary", "regions" : regionList}, sf, indent = 4)
+            return
+
+        ### One facet record [normal, 3 vertices] per row, formatted in
+        ### blocks with the fixed facet format
+        with open_output_file(stlFile, binary = False) as wf:
+            for i, regionName in enumerate(self.regionNames):
+                wf.write("solid " + regionName + "\n")
+                for start in range(int(self.regionOffsets[i]), int(self.regionOffsets[i + 1]), asciiStlWriteLength):
+                    end = min(start + asciiStlWriteLength, int(self.regionOffsets[i + 1]))
+                    recordArray = np.concatenate(
+                            [normals[start : end].astype(np.float64), triangles[start : end].reshape(-1, 9)],
+                            axis = 1,
+                        )
+                    wf.write((asciiFacetFormat * recordArray.shape[0]) % tuple(recordArray.ravel().tolist()))
+                wf.write("endsolid " + regionName + "\n")
+        return
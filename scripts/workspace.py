@@ -0,0 +1,282 @@
+"""
+    Isolation of the runs sharing a working directory.
+
+    - Every run builds its output (export directory, case directory) in a
+      staging directory of its own next to the final location and publishes
+      it with a rename, the published directory is always a complete run.
+    - A published directory is swapped under an exclusive lock of the
+      working directory (advisory, flock), the runs reading it (copy of the
+      previous case, STL files of the geometry) hold a shared lock.
+    - The staging directory starts from the published one, the large files
+      never written in place (mesh, surfaces) are hard linked. A file
+      about to be changed in place is replaced by a copy of its own first
+      (unshare_files), the published file is not changed.
+    - The staging directory is named after the run (process id, run
+      counter, start time). The run holds a lock file of its own
+      (flock) while it runs, a staging directory whose run lock is free
+      is stale and removed by the next run, also after a crash or on
+      another host. The run removes its staging directory when it ends,
+      unless it is kept for inspection (kept until the next run).
+    - Without fcntl (Windows), the locks do nothing, a staging directory
+      is stale once its run lock file is gone.
+"""
+
+import os
+import glob
+import time
+import shutil
+import fnmatch
+import itertools
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+#---------------------------------------
+
+lockFilename = ".workspace.lock"
+stagingTag = ".staging-"
+retiredTag = ".retired-"
+runLockTag = ".run-"
+
+runCounter = itertools.count()
+
+### Open run lock files of the runs of this process
+runLockDict = {}
+runLockDictLock = threading.Lock()
+
+
+#---------------------------------------
+
+def get_run_id():
+    ### Unique for the runs of a host, also for the runs of one process
+    return str(os.getpid()) + "-" + str(next(runCounter)) + "-" + time.strftime("%Y%m%d-%H%M%S")
+
+
+def get_lock_file(
+        workingDir,
+    ):
+    return workingDir + os.sep + lockFilename
+
+
+@contextlib.contextmanager
+def locked(
+        lockFile,
+        shared = False,
+    ):
+    ### Advisory lock, held by the open file (threads of one process
+    ### exclude each other too)
+    if fcntl is None:
+        yield
+        return
+    with open(lockFile, "a") as lf:
+        fcntl.flock(lf.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lf.fileno(), fcntl.LOCK_UN)
+    return
+
+
+#---------------------------------------
+
+def get_staging_directory(
+        targetDir,
+        runId,
+    ):
+    return targetDir + stagingTag + runId
+
+
+def get_run_lock_file(
+        targetDir,
+        runId,
+    ):
+    return targetDir + runLockTag + runId + ".lock"
+
+
+def acquire_run_lock(
+        targetDir,
+        runId,
+    ):
+    ### Held until release_staging_directory (or the end of the process).
+    ### A lock file removed as stale by another run before it was locked
+    ### is created again.
+    lockFile = get_run_lock_file(targetDir, runId)
+    while True:
+        lf = open(lockFile, "a")
+        if fcntl is None:
+            break
+        fcntl.flock(lf.fileno(), fcntl.LOCK_EX)
+        try:
+            if os.stat(lockFile).st_ino == os.fstat(lf.fileno()).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        lf.close()
+    with runLockDictLock:
+        runLockDict[(targetDir, runId)] = lf
+    return
+
+
+def is_run_active(
+        targetDir,
+        runId,
+    ):
+    ### The run lock file exists and is locked
+    try:
+        lf = open(get_run_lock_file(targetDir, runId), "r")
+    except FileNotFoundError:
+        return False
+    with lf:
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(lf.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(lf.fileno(), fcntl.LOCK_UN)
+    return False
+
+
+def remove_stale_directories(
+        targetDir,
+    ):
+    ### Staging/retired directories and run lock files of the runs that
+    ### are over
+    for tag in [stagingTag, retiredTag]:
+        for path in glob.glob(targetDir + tag + "*"):
+            if not is_run_active(targetDir, path[len(targetDir + tag) : ]):
+                shutil.rmtree(path, ignore_errors = True)
+    ### A lock file is removed while it is locked, a run opening it at the
+    ### same time locks a new one
+    for lockFile in glob.glob(targetDir + runLockTag + "*.lock"):
+        try:
+            lf = open(lockFile, "r")
+        except FileNotFoundError:
+            continue
+        with lf:
+            if fcntl is None:
+                continue
+            try:
+                fcntl.flock(lf.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            try:
+                os.remove(lockFile)
+            except FileNotFoundError:
+                pass
+    return
+
+
+def create_staging_directory(
+        targetDir,
+        runId,
+        seed = False,
+        linkPatternList = (),
+    ):
+    ### seed            --> the staging directory starts from a copy of the
+    ###                     published directory (if any)
+    ### linkPatternList --> files of the published one hard linked instead
+    ###                     of copied (glob patterns of the paths relative
+    ###                     to it, a directory covers its files). They are
+    ###                     removed before they are written again, or
+    ###                     unshared before they are changed in place.
+    remove_stale_directories(targetDir)
+    acquire_run_lock(targetDir, runId)
+    stagingDir = get_staging_directory(targetDir, runId)
+    if not seed or not os.path.isdir(targetDir):
+        os.makedirs(stagingDir)
+        return stagingDir
+
+    def copy_file(sourceFile, targetFile):
+        relPath = os.path.relpath(sourceFile, targetDir)
+        if any([fnmatch.fnmatch(relPath, x) or fnmatch.fnmatch(relPath, x + os.sep + "*") for x in linkPatternList]):
+            try:
+                os.link(sourceFile, targetFile)
+                return targetFile
+            except OSError:
+                pass
+        return shutil.copy2(sourceFile, targetFile)
+
+    shutil.copytree(targetDir, stagingDir, symlinks = True, copy_function = copy_file)
+    return stagingDir
+
+
+def release_staging_directory(
+        targetDir,
+        runId,
+        keep = False,
+    ):
+    ### End of the run, its staging directory (if not published) is
+    ### removed unless kept, the run lock is released
+    stagingDir = get_staging_directory(targetDir, runId)
+    if not keep and os.path.exists(stagingDir):
+        shutil.rmtree(stagingDir, ignore_errors = True)
+    with runLockDictLock:
+        lf = runLockDict.pop((targetDir, runId), None)
+    if lf is not None:
+        try:
+            os.remove(get_run_lock_file(targetDir, runId))
+        except FileNotFoundError:
+            pass
+        lf.close()
+    return
+
+
+def unshare_files(
+        rootDir,
+        patternList,
+    ):
+    ### The files under the glob patterns (relative to rootDir) shared with
+    ### another directory (hard links) are replaced by a copy of their own
+    for pattern in patternList:
+        for path in glob.glob(os.path.join(rootDir, pattern)):
+            if os.path.isdir(path):
+                fileList = [os.path.join(x[0], y) for x in os.walk(path) for y in x[2]]
+            else:
+                fileList = [path]
+            for filePath in fileList:
+                if os.path.islink(filePath) or os.stat(filePath).st_nlink < 2:
+                    continue
+                tmpFile = filePath + ".tmp-" + str(os.getpid())
+                shutil.copy2(filePath, tmpFile)
+                os.replace(tmpFile, filePath)
+    return
+
+
+def publish_directory(
+        stagingDir,
+        targetDir,
+        lockFile,
+        fileDict = None,
+    ):
+    ### The published directory is swapped under the exclusive lock, the
+    ### previous one is deleted after
+    ### fileDict --> files published with the directory (path --> text),
+    ###              replaced under the same lock
+    retiredDir = None
+    with locked(lockFile):
+        if os.path.exists(targetDir):
+            retiredDir = targetDir + retiredTag + stagingDir[len(targetDir + stagingTag) : ]
+            os.rename(targetDir, retiredDir)
+        os.rename(stagingDir, targetDir)
+        for filePath, text in (fileDict or {}).items():
+            write_file_atomic(filePath, text)
+    if retiredDir is not None:
+        shutil.rmtree(retiredDir, ignore_errors = True)
+    return targetDir
+
+
+def write_file_atomic(
+        filePath,
+        text,
+    ):
+    tmpFile = filePath + ".tmp-" + str(os.getpid())
+    with open(tmpFile, "w") as wf:
+        wf.write(text)
+    os.replace(tmpFile, filePath)
+    return
@@ -57,6 +57,15 @@ blockDict["exit"] = [2]
 mergeAllSolidTogether = True
 mergeAllBcStlTogether = True
 
+### Number of processes formatting the exported STL files
+###     0 --> all cores, 1 --> serial (combined files written while formatting)
+nStlFormatProcess = 0
+
+### Format of the exported STL files
+###     "ascii" or "binary" (about 5x smaller, the BC regions of the
+###     combined file are kept in the triangle attributes)
+stlFormat = "ascii"
+
 exportDir = workingDir + os.sep + stlExportSubDirName
 
 
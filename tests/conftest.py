@@ -0,0 +1,110 @@
+"""
+    Fixtures of the pipeline tests, the mesh generation script runs with
+    the stand-in OpenFOAM utilities (benchmarks/fake_openfoam) on a small
+    pipe exported with the stand-in Cubit module.
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+packageDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+benchmarkDir = os.path.join(packageDir, "benchmarks")
+sys.path.insert(0, os.path.join(packageDir, "scripts"))
+sys.path.insert(0, benchmarkDir)
+
+import stl_io
+import stl_merge
+import run_benchmarks
+import stl_generators
+
+meshScript = os.path.join(packageDir, "scripts", "snappyHexMesh_from_stl.py")
+stlFormat = "ascii"
+
+
+#---------------------------------------
+
+@pytest.fixture(scope = "session")
+def pipeGeometry(tmp_path_factory):
+    ### Formatted STL files and snappyHexInfo.json content, as written by
+    ### the geometry generation script
+    geometryDir = str(tmp_path_factory.mktemp("geometry"))
+    modelDict = stl_generators.get_model("pipe", 2000)
+    exportInfo = run_benchmarks.export_case(geometryDir, modelDict, stlFormat)
+    readyDir = os.path.join(geometryDir, "ready")
+    os.makedirs(readyDir)
+    bcTaskList = run_benchmarks.get_task_list(exportInfo, exportInfo["bc-stl-file-list"], readyDir, stlFormat)
+    blockTaskList = run_benchmarks.get_task_list(exportInfo, exportInfo["block-stl-file-list"], readyDir, stlFormat)
+    stl_merge.format_stl_files(bcTaskList + blockTaskList, 1)
+    stl_merge.merge_formatted_stl_files(bcTaskList, os.path.join(readyDir, "combinedBcStl.stl"))
+    stl_merge.merge_formatted_stl_files(blockTaskList, os.path.join(readyDir, "combinedBlockStl.stl"))
+    domainStlBound = stl_io.get_stl_information(os.path.join(readyDir, "combinedBcStl.stl"))["bound"]
+    return {
+            "domain-info" : run_benchmarks.get_domain_info_dict(modelDict, readyDir, stlFormat),
+            "location-in-mesh" : modelDict["location-in-mesh"],
+            "blockmesh-size" : run_benchmarks.get_block_mesh_cell_size(domainStlBound),
+        }
+
+
+@pytest.fixture
+def run_pipeline(pipeGeometry):
+    ### Runs the mesh generation script in workingDir with the options
+    ### (process input names) and environment, the OpenFOAM commands are
+    ### appended to <workingDir>/openfoam_commands.txt
+    def run(
+            workingDir,
+            envDict = None,
+            **optionDict
+        ):
+        os.makedirs(workingDir, exist_ok = True)
+        with open(os.path.join(workingDir, "snappyHexInfo.json"), "w") as wf:
+            json.dump(pipeGeometry["domain-info"], wf, indent = 4)
+        env = dict(
+                os.environ,
+                working_dir = workingDir,
+                input_json_filename = "snappyHexInfo.json",
+                openfoam_version = run_benchmarks.openfoamVersion,
+                foamfile_version = run_benchmarks.foamFileVersion,
+                geometry_length_unit = "mm",
+                location_in_mesh = ", ".join([str(x) for x in pipeGeometry["location-in-mesh"]]),
+                blockmesh_size = str(pipeGeometry["blockmesh-size"]),
+                openfoam_bashrc_path = run_benchmarks.fakeOpenfoamBashrc,
+                artifact_cache_dir = "none",
+                FAKE_OPENFOAM_LOG = os.path.join(workingDir, "openfoam_commands.txt"),
+            )
+        env.update(envDict or {})
+        env.update({x : str(y) for x, y in optionDict.items()})
+        return subprocess.run(
+                [sys.executable, meshScript],
+                cwd = workingDir,
+                env = env,
+                stdout = subprocess.PIPE,
+                stderr = subprocess.STDOUT,
+                text = True,
+            )
+    return run
+
+
+def read_command_list(
+        workingDir,
+    ):
+    ### OpenFOAM commands in order, the ranks of a parallel run (in any
+    ### order) are sorted
+    with open(os.path.join(workingDir, "openfoam_commands.txt"), "r") as rf:
+        commandList = rf.read().splitlines()
+    for index, command in enumerate(commandList):
+        if command.startswith("mpirun "):
+            nProcs = int(command.split()[2])
+            commandList[index + 1 : index + 1 + nProcs] = sorted(commandList[index + 1 : index + 1 + nProcs])
+    return commandList
+
+
+def read_cell_count(
+        meshDir,
+    ):
+    ### Cell count of a mesh written by the stand-in utilities
+    with open(os.path.join(meshDir, "owner"), "r") as rf:
+        return int(rf.read().split("nCells:")[1].split()[0])
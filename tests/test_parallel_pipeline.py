@@ -0,0 +1,98 @@
+"""
+    Tests of the parallel run of the mesh generation script : decomposePar,
+    snappyHexMesh (and topoSet) with mpirun, reconstructParMesh, with the
+    stand-in OpenFOAM utilities and mpirun.
+"""
+
+import os
+import glob
+
+from conftest import read_command_list, read_cell_count
+
+
+#---------------------------------------
+
+def get_case_dir(
+        workingDir,
+    ):
+    return os.path.join(workingDir, "snappyHexMesh_caseDir")
+
+
+def get_processor_cell_count(
+        caseDir,
+        meshPath,
+    ):
+    processorDirList = sorted(glob.glob(os.path.join(caseDir, "processor*")))
+    assert [os.path.basename(x) for x in processorDirList] == ["processor0", "processor1"]
+    return sum([read_cell_count(os.path.join(x, meshPath)) for x in processorDirList])
+
+
+def test_reconstructed_parallel_run(tmp_path, run_pipeline):
+    workingDir = str(tmp_path / "case")
+    result = run_pipeline(workingDir, n_procs = 2)
+    assert result.returncode == 0, result.stdout
+
+    assert read_command_list(workingDir) == [
+            "blockMesh",
+            "decomposePar",
+            "mpirun -np 2 snappyHexMesh -parallel",
+            "snappyHexMesh -parallel (rank 0)",
+            "snappyHexMesh -parallel (rank 1)",
+            "reconstructParMesh -latestTime",
+            "topoSet",
+        ]
+    ### The snappyHexMesh mesh of the processors is reconstructed in the
+    ### latest time directory, where topoSet writes the zones
+    caseDir = get_case_dir(workingDir)
+    assert read_cell_count(os.path.join(caseDir, "2", "polyMesh")) == get_processor_cell_count(caseDir, os.path.join("2", "polyMesh"))
+    assert os.listdir(os.path.join(caseDir, "2", "polyMesh", "sets"))
+
+
+def test_decomposed_parallel_run(tmp_path, run_pipeline):
+    workingDir = str(tmp_path / "case")
+    result = run_pipeline(workingDir, n_procs = 2, keep_decomposed = "true")
+    assert result.returncode == 0, result.stdout
+
+    assert read_command_list(workingDir) == [
+            "blockMesh",
+            "decomposePar",
+            "mpirun -np 2 snappyHexMesh -parallel -overwrite",
+            "snappyHexMesh -parallel -overwrite (rank 0)",
+            "snappyHexMesh -parallel -overwrite (rank 1)",
+            "mpirun -np 2 topoSet -parallel",
+            "topoSet -parallel (rank 0)",
+            "topoSet -parallel (rank 1)",
+        ]
+    ### The mesh and the zones stay in the processor directories, the
+    ### blockMesh mesh of the case is not replaced
+    caseDir = get_case_dir(workingDir)
+    assert not glob.glob(os.path.join(caseDir, "[1-9]*"))
+    for processorDir in glob.glob(os.path.join(caseDir, "processor*")):
+        assert os.listdir(os.path.join(processorDir, "constant", "polyMesh", "sets"))
+        assert not glob.glob(os.path.join(processorDir, "[1-9]*"))
+    assert not os.path.exists(os.path.join(caseDir, "constant", "polyMesh", "sets"))
+
+
+def test_decomposed_parallel_run_reconstructed(tmp_path, run_pipeline):
+    workingDir = str(tmp_path / "case")
+    result = run_pipeline(workingDir, n_procs = 2, keep_decomposed = "true", reconstruct_mesh = "yes")
+    assert result.returncode == 0, result.stdout
+
+    commandList = read_command_list(workingDir)
+    assert commandList[ : 2] == ["blockMesh", "decomposePar"]
+    assert commandList.index("mpirun -np 2 snappyHexMesh -parallel -overwrite") < commandList.index("mpirun -np 2 topoSet -parallel")
+    assert commandList[-1] == "reconstructParMesh -constant"
+    ### The decomposed mesh replaces the blockMesh mesh of the case
+    caseDir = get_case_dir(workingDir)
+    assert read_cell_count(os.path.join(caseDir, "constant", "polyMesh")) == get_processor_cell_count(caseDir, os.path.join("constant", "polyMesh"))
+
+
+def test_unchanged_parallel_rerun_is_skipped(tmp_path, run_pipeline):
+    workingDir = str(tmp_path / "case")
+    for keepDecomposed in ["false", "true"]:
+        result = run_pipeline(workingDir, n_procs = 2, keep_decomposed = keepDecomposed)
+        assert result.returncode == 0, result.stdout
+        os.remove(os.path.join(workingDir, "openfoam_commands.txt"))
+        result = run_pipeline(workingDir, n_procs = 2, keep_decomposed = keepDecomposed)
+        assert result.returncode == 0, result.stdout
+        assert not os.path.exists(os.path.join(workingDir, "openfoam_commands.txt"))
@@ -0,0 +1,64 @@
+"""
+    Tests of the process input options (get_process_input), invalid options
+    are rejected before a run or a job of the meshing service is queued.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import mesh_daemon
+import snappyHexMesh_from_stl
+
+
+#---------------------------------------
+
+@pytest.fixture
+def optionDict(tmp_path):
+    (tmp_path / "snappyHexInfo.json").write_text("{}")
+    return {
+            "working_dir" : str(tmp_path),
+            "input_json_filename" : "snappyHexInfo.json",
+            "openfoam_version" : "v2312",
+            "foamfile_version" : "2.0",
+            "openfoam_bashrc_path" : "/opt/openfoam/etc/bashrc",
+            "geometry_length_unit" : "mm",
+            "location_in_mesh" : "1, 2, 3",
+            "blockmesh_size" : "5",
+            "artifact_cache_dir" : "none",
+        }
+
+
+@pytest.mark.parametrize("locationInMesh, expected", [
+        ("1, 2, 3", [1.0, 2.0, 3.0]),
+        ("-1.5,0,2e3", [-1.5, 0.0, 2000.0]),
+        ("auto", "auto"),
+        (" auto-inside ", "auto-inside"),
+    ])
+def test_location_in_mesh(optionDict, locationInMesh, expected):
+    optionDict["location_in_mesh"] = locationInMesh
+    processInputDict = snappyHexMesh_from_stl.get_process_input(optionDict)
+    assert processInputDict["loactionInMesh"] == expected
+
+
+@pytest.mark.parametrize("locationInMesh", ["1,2", "1,2,3,4", "a,b,c", "", "1,,3"])
+def test_invalid_location_in_mesh(optionDict, locationInMesh):
+    optionDict["location_in_mesh"] = locationInMesh
+    with pytest.raises(ValueError, match = "location_in_mesh"):
+        snappyHexMesh_from_stl.get_process_input(optionDict)
+
+
+def test_daemon_rejects_invalid_location_in_mesh(optionDict, tmp_path):
+    daemon = mesh_daemon.MeshDaemon(
+            str(tmp_path / "daemon.sock"),
+            optionDict,
+            snappyHexMesh_from_stl.get_process_input,
+            snappyHexMesh_from_stl.snappyHexMesh_from_stl,
+        )
+    with pytest.raises(ValueError, match = "^Invalid option : location_in_mesh"):
+        daemon.submit({"location_in_mesh" : "1,2"})
+    assert daemon.jobDict == {}
+    assert daemon.jobHeap == []
@@ -0,0 +1,190 @@
+"""
+    Tests of the SLURM execution backend (execution_backend) with the
+    stand-in SLURM commands of benchmarks/fake_slurm, the jobs run on this
+    machine.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import threading
+
+import pytest
+
+from conftest import packageDir, read_command_list
+
+import execution_backend
+import process_supervisor
+
+fakeSlurmBinDir = os.path.join(packageDir, "benchmarks", "fake_slurm", "bin")
+
+
+#---------------------------------------
+
+@pytest.fixture
+def fakeSlurmEnv(tmp_path, monkeypatch):
+    ### The SLURM commands of the backend and of the runs are the stand-ins
+    envDict = {
+            "PATH" : fakeSlurmBinDir + os.pathsep + os.environ["PATH"],
+            "FAKE_SLURM_DIR" : str(tmp_path / "fake_slurm"),
+        }
+    for name, value in envDict.items():
+        monkeypatch.setenv(name, value)
+    return envDict
+
+
+def read_job_list(
+        fakeSlurmDir,
+    ):
+    jobList = []
+    for filename in sorted(os.listdir(fakeSlurmDir)):
+        if filename.endswith(".json"):
+            with open(os.path.join(fakeSlurmDir, filename), "r") as rf:
+                jobList.append(json.load(rf))
+    return jobList
+
+
+def run_backend(
+        caseDir,
+        utilityCommand,
+        sbatchOptions = "",
+        tag = None,
+    ):
+    ### SlurmBackend.run in the context of a case (tag)
+    backend = execution_backend.SlurmBackend(sbatchOptions, "srun", 0.1)
+    os.makedirs(caseDir, exist_ok = True)
+    logFilePath = os.path.join(caseDir, "log_utility.log")
+    with open(logFilePath, "wb") as logFile:
+        process_supervisor.processTag.set(tag)
+        resultDict = backend.run(utilityCommand, 1, "utility", caseDir, dict(os.environ), logFile, None)
+    with open(logFilePath, "rb") as rf:
+        resultDict["log"] = rf.read().decode()
+    return resultDict
+
+
+#---------------------------------------
+### PIPELINE
+#---------------------------------------
+
+def test_snappyHexMesh_as_slurm_job(tmp_path, run_pipeline, fakeSlurmEnv):
+    workingDir = str(tmp_path / "case")
+    result = run_pipeline(
+            workingDir,
+            fakeSlurmEnv,
+            n_procs = 2,
+            execution_backend = "snappyHexMesh=slurm",
+            slurm_poll_interval = "0.1",
+            utility_timeout = "snappyHexMesh=600",
+            utility_memory_limit_mb = "snappyHexMesh=2048",
+        )
+    assert result.returncode == 0, result.stdout
+
+    caseDir = os.path.join(workingDir, "snappyHexMesh_caseDir")
+    with open(os.path.join(caseDir, "slurm_snappyHexMesh.sh"), "r") as rf:
+        scriptLineList = rf.read().splitlines()
+    assert "#SBATCH --ntasks=2" in scriptLineList
+    assert "#SBATCH --time=10" in scriptLineList
+    assert "#SBATCH --mem-per-cpu=1024M" in scriptLineList
+    assert "srun snappyHexMesh -parallel" in scriptLineList
+    with open(os.path.join(caseDir, "slurm_snappyHexMesh.exit"), "r") as rf:
+        assert rf.read().strip() == "0"
+
+    ### Only snappyHexMesh is a job, its ranks are started by srun
+    ### (no mpirun line, the ranks are sorted here)
+    jobList = read_job_list(fakeSlurmEnv["FAKE_SLURM_DIR"])
+    assert [(x["name"], x["n-tasks"], x["state"]) for x in jobList] == [("snappyHexMesh", 2, "COMPLETED")]
+    commandList = read_command_list(workingDir)
+    commandList[2 : 4] = sorted(commandList[2 : 4])
+    assert commandList == [
+            "blockMesh",
+            "decomposePar",
+            "snappyHexMesh -parallel (rank 0)",
+            "snappyHexMesh -parallel (rank 1)",
+            "reconstructParMesh -latestTime",
+            "topoSet",
+        ]
+    ### The job output is the log of the utility
+    with open(os.path.join(caseDir, "log_snappyHexMesh.log"), "r") as rf:
+        assert "Finished meshing" in rf.read()
+
+
+def test_slurm_job_exit_code_fails_stage(tmp_path, run_pipeline, fakeSlurmEnv):
+    workingDir = str(tmp_path / "case")
+    result = run_pipeline(
+            workingDir,
+            dict(fakeSlurmEnv, FAKE_OPENFOAM_FAIL = "snappyHexMesh:1"),
+            execution_backend = "snappyHexMesh=slurm",
+            slurm_poll_interval = "0.1",
+        )
+    assert result.returncode != 0
+    assert "\"snappyHexMesh\" failed (exit code 1)" in result.stdout
+    jobList = read_job_list(fakeSlurmEnv["FAKE_SLURM_DIR"])
+    assert [(x["state"], x["exit-code"]) for x in jobList] == [("FAILED", 1)]
+
+
+#---------------------------------------
+### BACKEND
+#---------------------------------------
+
+def test_slurm_job_exit_code(tmp_path, fakeSlurmEnv):
+    caseDir = str(tmp_path / "case")
+    resultDict = run_backend(caseDir, [sys.executable, "-c", "print('step'); raise SystemExit(3)"])
+    assert resultDict["return-code"] == 3
+    assert resultDict["reason"] is None
+    assert "step" in resultDict["log"]
+    with open(os.path.join(caseDir, "slurm_utility.exit"), "r") as rf:
+        assert rf.read().strip() == "3"
+
+
+def test_failing_sbatch(tmp_path, fakeSlurmEnv, monkeypatch):
+    ### sbatch rejecting the job, its message is in the log
+    binDir = tmp_path / "bin"
+    binDir.mkdir()
+    sbatchFile = binDir / "sbatch"
+    sbatchFile.write_text("#!/bin/sh\necho \"sbatch: error: Batch job submission failed: Invalid partition name specified\"\nexit 1\n")
+    sbatchFile.chmod(0o755)
+    monkeypatch.setenv("PATH", str(binDir) + os.pathsep + os.environ["PATH"])
+
+    resultDict = run_backend(str(tmp_path / "case"), "blockMesh", "--partition=missing")
+    assert resultDict["return-code"] == 1
+    assert "Invalid partition name specified" in resultDict["log"]
+    assert not execution_backend.slurmJobDict
+
+
+def test_cancelled_slurm_job(tmp_path, fakeSlurmEnv):
+    ### cancel_slurm_jobs (process supervisor cancel of the case) scancels
+    ### the jobs of the case only
+    caseDir = str(tmp_path / "case")
+    pidFile = os.path.join(caseDir, "job.pid")
+    command = [sys.executable, "-c", "import os, time; open(" + repr(pidFile) + ", 'w').write(str(os.getpid())); time.sleep(60)"]
+    resultDict = {}
+
+    def run():
+        resultDict.update(run_backend(caseDir, command, tag = "case-1"))
+
+    runThread = threading.Thread(target = run)
+    runThread.start()
+    waitTime = 0.0
+    while not os.path.exists(pidFile) and waitTime < 30.0:
+        time.sleep(0.1)
+        waitTime += 0.1
+    assert os.path.exists(pidFile)
+    assert execution_backend.cancel_slurm_jobs("case-2") == 0
+    assert execution_backend.cancel_slurm_jobs("case-1") == 1
+    runThread.join(30.0)
+    assert not runThread.is_alive()
+
+    assert resultDict["reason"] == "cancelled"
+    assert resultDict["return-code"] == -signal.SIGTERM
+    jobList = read_job_list(fakeSlurmEnv["FAKE_SLURM_DIR"])
+    assert [x["state"] for x in jobList] == ["CANCELLED"]
+    ### The process of the job is gone
+    with open(pidFile, "r") as rf:
+        pid = int(rf.read())
+    waitTime = 0.0
+    while os.path.exists("/proc/" + str(pid)) and waitTime < 10.0:
+        time.sleep(0.1)
+        waitTime += 0.1
+    assert not os.path.exists("/proc/" + str(pid))
@@ -0,0 +1,121 @@
+"""
+    Tests of the stage fingerprints of the scheduler (stage_scheduler),
+    stages changing the outputs of another stage in place ("modifies").
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import stage_scheduler
+
+
+#---------------------------------------
+
+def write_file(
+        filePath,
+        text,
+        mode = "w",
+    ):
+    with open(filePath, mode) as wf:
+        wf.write(text)
+    return
+
+
+def run_case(
+        caseDir,
+        callList,
+        refineLevel = 1,
+        failStage = None,
+    ):
+    ### "mesh" writes the mesh, "refine" changes it in place (like
+    ### snappyHexMesh -overwrite), "zones" reads the refined mesh
+    def mesh():
+        callList.append("mesh")
+        write_file(os.path.join(caseDir, "mesh"), "base\n")
+
+    def refine():
+        callList.append("refine")
+        write_file(os.path.join(caseDir, "mesh"), "refined " + str(refineLevel) + "\n", "a")
+        if failStage == "refine":
+            raise RuntimeError("refine failed")
+
+    def zones():
+        callList.append("zones")
+        write_file(os.path.join(caseDir, "zones"), "zones\n")
+
+    scheduler = stage_scheduler.StageScheduler(
+            1,
+            caseDir,
+            os.path.join(caseDir, ".stage_fingerprints.json"),
+        )
+    scheduler.add_stage("mesh", mesh, inputs = ["meshDict"], outputs = ["mesh"])
+    scheduler.add_stage("refine", refine, dependsOn = ["mesh"], parameters = {"level" : refineLevel}, modifies = ["mesh"])
+    scheduler.add_stage("zones", zones, dependsOn = ["refine"], outputs = ["zones"])
+    scheduler.run()
+    return {x : scheduler.stageDict[x]["status"] for x in scheduler.stageDict}
+
+
+@pytest.fixture
+def caseDir(tmp_path):
+    write_file(str(tmp_path / "meshDict"), "cells 10\n")
+    return str(tmp_path)
+
+
+def test_unchanged_rerun_skips_modified_stage(caseDir):
+    callList = []
+    run_case(caseDir, callList)
+    assert callList == ["mesh", "refine", "zones"]
+
+    callList = []
+    statusDict = run_case(caseDir, callList)
+    assert callList == []
+    assert set(statusDict.values()) == {"skipped"}
+    with open(os.path.join(caseDir, "mesh"), "r") as rf:
+        assert rf.read() == "base\nrefined 1\n"
+
+
+def test_changed_modifier_runs_modified_stage_again(caseDir):
+    run_case(caseDir, [])
+
+    ### The mesh is refined again from the base mesh, not from the
+    ### refined one
+    callList = []
+    run_case(caseDir, callList, refineLevel = 2)
+    assert callList == ["mesh", "refine", "zones"]
+    with open(os.path.join(caseDir, "mesh"), "r") as rf:
+        assert rf.read() == "base\nrefined 2\n"
+
+
+def test_changed_modified_stage_runs_modifier_again(caseDir):
+    run_case(caseDir, [])
+
+    write_file(os.path.join(caseDir, "meshDict"), "cells 20\n")
+    callList = []
+    run_case(caseDir, callList)
+    assert callList == ["mesh", "refine", "zones"]
+
+
+def test_failed_modifier_runs_modified_stage_again(caseDir):
+    run_case(caseDir, [])
+
+    with pytest.raises(RuntimeError):
+        run_case(caseDir, [], refineLevel = 2, failStage = "refine")
+    callList = []
+    run_case(caseDir, callList, refineLevel = 2)
+    assert callList == ["mesh", "refine", "zones"]
+    with open(os.path.join(caseDir, "mesh"), "r") as rf:
+        assert rf.read() == "base\nrefined 2\n"
+
+
+def test_stage_after_modifier_runs_alone(caseDir):
+    run_case(caseDir, [])
+
+    os.remove(os.path.join(caseDir, "zones"))
+    callList = []
+    statusDict = run_case(caseDir, callList)
+    assert callList == ["zones"]
+    assert statusDict["mesh"] == statusDict["refine"] == "skipped"
@@ -0,0 +1,63 @@
+"""
+    Regression tests of the chunked ASCII STL reader (stl_io).
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import stl_io
+
+
+#---------------------------------------
+
+def write_ascii_stl(
+        stlFile,
+        solidDict,
+    ):
+    ### solidDict --> solid name --> triangle array [n, 3, 3]
+    with open(stlFile, "w") as wf:
+        for solidName, triangleArray in solidDict.items():
+            wf.write("solid " + solidName + "\n")
+            for triangle in triangleArray:
+                wf.write("  facet normal 0 0 1\n    outer loop\n")
+                for vertex in triangle:
+                    wf.write("      vertex %.9e %.9e %.9e\n" % tuple(vertex))
+                wf.write("    endloop\n  endfacet\n")
+            wf.write("endsolid " + solidName + "\n")
+    return
+
+
+def read_solids(
+        stlFile,
+        chunkSize,
+    ):
+    solidDict = {}
+    for solidName, vertexArray in stl_io.iter_ascii_stl_chunks(stlFile, chunkSize):
+        assert vertexArray.shape[0] % 3 == 0
+        solidDict.setdefault(solidName, []).append(vertexArray)
+    return {k : np.concatenate(v) for k, v in solidDict.items()}
+
+
+def test_ascii_chunks_hold_whole_facets(tmp_path):
+    rng = np.random.default_rng(0)
+    solidDict = {
+        "inlet" : rng.random((57, 3, 3)),
+        "wall" : rng.random((311, 3, 3)),
+        "outlet" : rng.random((2, 3, 3)),
+    }
+    stlFile = str(tmp_path / "surface.stl")
+    write_ascii_stl(stlFile, solidDict)
+
+    referenceDict = read_solids(stlFile, os.path.getsize(stlFile) + 1)
+    assert sorted(referenceDict) == sorted(solidDict)
+    ### Chunk sizes cutting facets, vertex lines and solid lines
+    for chunkSize in [37, 100, 211, 1000, 4099]:
+        chunkedDict = read_solids(stlFile, chunkSize)
+        assert sorted(chunkedDict) == sorted(referenceDict)
+        for solidName, vertexArray in referenceDict.items():
+            np.testing.assert_array_equal(chunkedDict[solidName], vertexArray)
+            np.testing.assert_allclose(vertexArray.reshape(-1, 3, 3), solidDict[solidName], rtol = 1e-8)
@@ -0,0 +1,56 @@
+"""
+    Regression tests of the STL writer of the indexed triangle surface
+    (tri_surface), the written surface reads back unchanged.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import tri_surface
+
+
+#---------------------------------------
+
+@pytest.fixture
+def surface():
+    ### Random float64 coordinates, the regions span several blocks
+    rng = np.random.default_rng(0)
+    regionIndexArray = np.repeat([0, 1, 2], [57, 311, 2]).astype(np.int32)
+    return tri_surface.TriSurface.from_triangles(
+            rng.random((regionIndexArray.shape[0], 3, 3)) * 1000.0 - 500.0,
+            regionIndexArray,
+            ["inlet", "wall", "outlet"],
+        )
+
+
+@pytest.mark.parametrize("filename", ["surface.stl", "surface.stl.gz"])
+def test_ascii_stl_reads_back_unchanged(tmp_path, monkeypatch, surface, filename):
+    monkeypatch.setattr(tri_surface, "asciiStlWriteLength", 50)
+    stlFile = str(tmp_path / filename)
+    surface.write_stl(stlFile, binary = False)
+
+    readSurface = tri_surface.TriSurface.read(stlFile)
+    assert readSurface.regionNames == surface.regionNames
+    np.testing.assert_array_equal(readSurface.regionOffsets, surface.regionOffsets)
+    np.testing.assert_array_equal(readSurface.triangles(), surface.triangles())
+
+
+def test_ascii_stl_facet_records(tmp_path, surface):
+    stlFile = str(tmp_path / "surface.stl")
+    surface.write_stl(stlFile, binary = False)
+    with open(stlFile, "r") as rf:
+        lineList = rf.read().splitlines()
+
+    assert lineList[0] == "solid inlet"
+    assert lineList[-1] == "endsolid outlet"
+    assert len(lineList) == 2 * surface.n_regions() + 7 * surface.n_faces()
+    ### First facet of the file
+    assert lineList[2] == "    outer loop"
+    assert lineList[6 : 8] == ["    endloop", "  endfacet"]
+    normal = np.array(lineList[1].split()[2 : ], dtype = np.float32)
+    np.testing.assert_array_equal(normal, surface.face_normals()[0].astype(np.float32))
@@ -0,0 +1,117 @@
+"""
+    Tests of the staging directories of the runs (workspace), stale
+    directories are told by the run lock files.
+"""
+
+import os
+import sys
+import time
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import workspace
+
+
+#---------------------------------------
+
+def test_released_staging_directory_is_removed(tmp_path):
+    targetDir = str(tmp_path / "case")
+    runId = workspace.get_run_id()
+    stagingDir = workspace.create_staging_directory(targetDir, runId)
+    assert os.path.isdir(stagingDir)
+    assert os.path.exists(workspace.get_run_lock_file(targetDir, runId))
+
+    workspace.release_staging_directory(targetDir, runId)
+    assert not os.path.exists(stagingDir)
+    assert not os.path.exists(workspace.get_run_lock_file(targetDir, runId))
+
+
+def test_kept_staging_directory_is_removed_by_next_run(tmp_path):
+    targetDir = str(tmp_path / "case")
+    runId = workspace.get_run_id()
+    stagingDir = workspace.create_staging_directory(targetDir, runId)
+    workspace.release_staging_directory(targetDir, runId, keep = True)
+    assert os.path.isdir(stagingDir)
+
+    nextRunId = workspace.get_run_id()
+    workspace.create_staging_directory(targetDir, nextRunId)
+    assert not os.path.exists(stagingDir)
+    workspace.release_staging_directory(targetDir, nextRunId)
+
+
+def test_running_staging_directory_is_kept(tmp_path):
+    ### Run of the same process (e.g. a job of the meshing service)
+    targetDir = str(tmp_path / "case")
+    runId = workspace.get_run_id()
+    stagingDir = workspace.create_staging_directory(targetDir, runId)
+    nextRunId = workspace.get_run_id()
+    workspace.create_staging_directory(targetDir, nextRunId)
+    assert os.path.isdir(stagingDir)
+    workspace.release_staging_directory(targetDir, runId)
+    workspace.release_staging_directory(targetDir, nextRunId)
+
+
+def test_staging_directory_of_ended_process_is_removed(tmp_path):
+    ### The run lock is held by another process, then the process ends
+    ### without releasing it (crash)
+    targetDir = str(tmp_path / "case")
+    runId = "12345-0-20260101-000000"
+    script = "import sys; sys.path.insert(0, sys.argv[1]); import workspace; "
+    script += "workspace.create_staging_directory(sys.argv[2], sys.argv[3]); print('ready', flush = True); sys.stdin.read()"
+    process = subprocess.Popen(
+            [sys.executable, "-c", script, os.path.dirname(workspace.__file__), targetDir, runId],
+            stdin = subprocess.PIPE,
+            stdout = subprocess.PIPE,
+            text = True,
+        )
+    assert process.stdout.readline().strip() == "ready"
+    stagingDir = workspace.get_staging_directory(targetDir, runId)
+
+    nextRunId = workspace.get_run_id()
+    workspace.create_staging_directory(targetDir, nextRunId)
+    assert os.path.isdir(stagingDir)
+    workspace.release_staging_directory(targetDir, nextRunId)
+
+    process.kill()
+    process.wait()
+    nextRunId = workspace.get_run_id()
+    workspace.create_staging_directory(targetDir, nextRunId)
+    assert not os.path.exists(stagingDir)
+    assert not os.path.exists(workspace.get_run_lock_file(targetDir, runId))
+    workspace.release_staging_directory(targetDir, nextRunId)
+
+
+def test_directory_and_file_published_together(tmp_path):
+    ### A reader holding the shared lock sees the previous directory and
+    ### file, then both new ones
+    targetDir = str(tmp_path / "export")
+    infoFile = str(tmp_path / "info.json")
+    lockFile = workspace.get_lock_file(str(tmp_path))
+    os.makedirs(targetDir)
+    with open(os.path.join(targetDir, "surface.stl"), "w") as wf:
+        wf.write("old")
+    workspace.write_file_atomic(infoFile, "old")
+
+    runId = workspace.get_run_id()
+    stagingDir = workspace.create_staging_directory(targetDir, runId)
+    with open(os.path.join(stagingDir, "surface.stl"), "w") as wf:
+        wf.write("new")
+
+    def read_state():
+        with open(os.path.join(targetDir, "surface.stl"), "r") as rf, open(infoFile, "r") as jf:
+            return rf.read(), jf.read()
+
+    publishThread = threading.Thread(
+            target = workspace.publish_directory,
+            args = (stagingDir, targetDir, lockFile, {infoFile : "new"}),
+        )
+    with workspace.locked(lockFile, shared = True):
+        publishThread.start()
+        time.sleep(0.2)
+        assert read_state() == ("old", "old")
+    publishThread.join()
+    with workspace.locked(lockFile, shared = True):
+        assert read_state() == ("new", "new")
+    workspace.release_staging_directory(targetDir, runId)